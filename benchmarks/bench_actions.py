@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Benchmark devlab's orchestration actions against the fake docker engine in
+this directory, so that regressions in how long they take, or in how many
+calls they make to the engine, can be caught without a container engine.
+
+Every repeat creates a synthetic project (see gen_project.py), with a fresh
+engine, and runs the steps in BENCH_STEPS against it in order, timing each
+one and counting the engine calls it made from the fake engine's call log.
+
+Example:
+    ./benchmarks/bench_actions.py --components 20 --repeat 3 --latency 0.01
+    ./benchmarks/bench_actions.py --json baseline.json
+    ./benchmarks/bench_actions.py --compare baseline.json
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from gen_project import GEN_GROUPS_DEF, GEN_RUNTIME_IMAGES_DEF, GEN_SCRIPTS_DEF, generate_config, write_project
+
+BENCH_ROOT = os.path.dirname(os.path.realpath(__file__))
+DEVLAB_BIN = os.path.join(os.path.dirname(BENCH_ROOT), 'devlab')
+FAKE_DOCKER_BIN = os.path.join(BENCH_ROOT, 'fake_docker')
+#The steps of every repeat, in order, with the arguments to run devlab with
+BENCH_STEPS = (
+    ('build', ['build']),
+    ('up', ['up']),
+    ('status', ['status']),
+    ('global-status', ['global-status']),
+    ('up (warm)', ['up']),
+    ('down', ['down']),
+    ('reset', ['reset'])
+)
+BENCH_COMPONENTS_DEF = 10
+BENCH_REPEAT_DEF = 3
+#A step has regressed if its median wall time grew by this ratio compared to
+#the baseline, or if it made any more engine calls
+BENCH_MAX_RATIO_DEF = 1.5
+
+###-- Functions --###
+def read_call_log(path):
+    """
+    Read the calls that the fake engine logged
+
+    Args:
+        path: str, path to the call log
+
+    Returns:
+        list of dicts
+    """
+    calls = []
+    if not os.path.isfile(path):
+        return calls
+    with open(path) as call_log:
+        for line in call_log:
+            if line.strip():
+                calls.append(json.loads(line))
+    return calls
+
+def run_step(args, project_dir, env, log_path):
+    """
+    Run devlab for a step, and time it
+
+    Args:
+        args: list, of the arguments to run devlab with
+        project_dir: str, path to the project
+        env: dict, of the environment to run devlab with
+        log_path: str, path to the file to write devlab's output to
+
+    Returns:
+        dict, with the 'rc', 'wall' time, number of engine 'calls', total
+        'engine_time' of the calls, and the number of calls by 'command'
+    """
+    call_log_path = env['FAKE_DOCKER_CALL_LOG']
+    if os.path.isfile(call_log_path):
+        os.remove(call_log_path)
+    start = time.time()
+    with open(log_path, 'a') as log_file:
+        log_file.write('### devlab {}\n'.format(' '.join(args)))
+        log_file.flush()
+        rc = subprocess.call(
+            [sys.executable, DEVLAB_BIN] + args,
+            cwd=project_dir,
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=log_file,
+            stderr=subprocess.STDOUT
+        )
+    wall = time.time() - start
+    calls = read_call_log(call_log_path)
+    commands = {}
+    for call in calls:
+        commands[call['command']] = commands.get(call['command'], 0) + 1
+    return {
+        'rc': rc,
+        'wall': wall,
+        'calls': len(calls),
+        'engine_time': sum(call['duration'] for call in calls),
+        'commands': commands
+    }
+
+def run_bench(project_args, repeat, latency, work_dir, record_dir=None, progress_out=sys.stderr):
+    """
+    Run the benchmark
+
+    Args:
+        project_args: dict, of the arguments to generate_config for the
+            synthetic projects
+        repeat: int, how many times to run the steps
+        latency: str, the latency of engine calls, as FAKE_DOCKER_LATENCY
+        work_dir: str, path to the directory to create the projects in
+        record_dir: str, path to a directory to write recordings of the
+            engine calls of each step of the first run to, for bench_replay.py
+        progress_out: file, to write progress to
+
+    Returns:
+        dict, of the step names, to lists of the results of run_step
+    """
+    results = dict((step_name, []) for step_name, _ in BENCH_STEPS)
+    for run_num in range(repeat):
+        run_dir = os.path.join(work_dir, 'run{}'.format(run_num))
+        project_dir = os.path.join(run_dir, 'project')
+        write_project(project_dir, generate_config('run{}'.format(run_num), **project_args))
+        env = dict(os.environ)
+        env.update({
+            'DEVLAB_NO_AGENT': '1',
+            'DEVLAB_DOCKER_BIN': FAKE_DOCKER_BIN,
+            'FAKE_DOCKER_STATE': os.path.join(run_dir, 'engine.json'),
+            'FAKE_DOCKER_CALL_LOG': os.path.join(run_dir, 'calls.log'),
+            'FAKE_DOCKER_LATENCY': latency or ''
+        })
+        env.pop('DEVLAB_PROFILE', None)
+        log_path = os.path.join(run_dir, 'devlab.log')
+        for step_name, step_args in BENCH_STEPS:
+            if record_dir and run_num == 0:
+                step_args = ['--record-engine', os.path.join(record_dir, '{}.rec'.format(re.sub('[^a-z0-9]+', '_', step_name).strip('_')))] + step_args
+            result = run_step(step_args, project_dir, env, log_path)
+            progress_out.write('Run {}/{}: {:<14} {:>8.3f}s {:>6} engine calls\n'.format(run_num + 1, repeat, step_name, result['wall'], result['calls']))
+            if result['rc'] != 0:
+                progress_out.write("Step: '{}' failed with rc: {}. See: {}\n".format(step_name, result['rc'], log_path))
+                with open(log_path) as log_file:
+                    progress_out.write(log_file.read())
+                sys.exit(1)
+            results[step_name].append(result)
+    return results
+
+def median(values):
+    """
+    Get the median of a list of values
+
+    Args:
+        values: list of numbers
+
+    Returns:
+        float
+    """
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return float(values[middle])
+    return (values[middle - 1] + values[middle]) / 2.0
+
+def summarize(results):
+    """
+    Summarize the results of the steps
+
+    Args:
+        results: dict, as returned by run_bench
+
+    Returns:
+        dict, of the step names, to dicts of their summary
+    """
+    summary = {}
+    for step_name, _ in BENCH_STEPS:
+        step_results = results[step_name]
+        walls = [result['wall'] for result in step_results]
+        summary[step_name] = {
+            'runs': len(step_results),
+            'wall_min': min(walls),
+            'wall_median': median(walls),
+            'wall_max': max(walls),
+            'calls': median([result['calls'] for result in step_results]),
+            'engine_time': median([result['engine_time'] for result in step_results]),
+            'commands': step_results[-1]['commands']
+        }
+    return summary
+
+def print_summary(summary, show_commands=False):
+    """
+    Print a table of the summary, in the same style as devlab's tables
+
+    Args:
+        summary: dict, as returned by summarize
+        show_commands: bool, whether to also print the engine calls that each
+            step made, by command
+    """
+    header = {
+        'step': 'Step',
+        'runs': 'Runs',
+        'wall_min': 'Min',
+        'wall_median': 'Median',
+        'wall_max': 'Max',
+        'calls': 'Engine calls',
+        'engine_time': 'Engine time'
+    }
+    header_format = "| {step:^14} | {runs:^4} | {wall_min:^9} | {wall_median:^9} | {wall_max:^9} | {calls:^12} | {engine_time:^11} |"
+    row_format = "| {step:14} | {runs:>4} | {wall_min:>9} | {wall_median:>9} | {wall_max:>9} | {calls:>12} | {engine_time:>11} |"
+    table_width = len(header_format.format(**header))
+    table_bar = '{{:-<{}}}'.format(table_width)
+    table = [
+        table_bar.format(''),
+        header_format.format(**header),
+        table_bar.format('')
+    ]
+    for step_name, _ in BENCH_STEPS:
+        step = summary[step_name]
+        table.append(row_format.format(
+            step=step_name,
+            runs=step['runs'],
+            wall_min='{:.3f}s'.format(step['wall_min']),
+            wall_median='{:.3f}s'.format(step['wall_median']),
+            wall_max='{:.3f}s'.format(step['wall_max']),
+            calls='{:g}'.format(step['calls']),
+            engine_time='{:.3f}s'.format(step['engine_time'])
+        ))
+    table.append(table_bar.format(''))
+    print('\n## ACTION BENCHMARKS ##')
+    print('\n'.join(table))
+    if show_commands:
+        for step_name, _ in BENCH_STEPS:
+            commands = summary[step_name]['commands']
+            print('{}: {}'.format(step_name, ', '.join('{}={}'.format(command, commands[command]) for command in sorted(commands, key=lambda cmd: (-commands[cmd], cmd)))))
+
+def compare_summary(summary, baseline, max_ratio=BENCH_MAX_RATIO_DEF):
+    """
+    Compare a summary with a baseline, and print the steps that regressed
+
+    Args:
+        summary: dict, as returned by summarize
+        baseline: dict, as written by --json
+        max_ratio: float, how many times slower the median wall time of a
+            step can get
+
+    Returns:
+        int, the number of steps that regressed
+    """
+    regressed = 0
+    for step_name, _ in BENCH_STEPS:
+        if step_name not in baseline['summary']:
+            continue
+        step = summary[step_name]
+        base_step = baseline['summary'][step_name]
+        if step['calls'] > base_step['calls']:
+            print("REGRESSED: '{}' made {:g} engine calls, up from {:g}".format(step_name, step['calls'], base_step['calls']))
+            regressed += 1
+        if step['wall_median'] > base_step['wall_median'] * max_ratio:
+            print("REGRESSED: '{}' took {:.3f}s, up from {:.3f}s".format(step_name, step['wall_median'], base_step['wall_median']))
+            regressed += 1
+    return regressed
+
+def main():
+    """
+    Parse the arguments and run the benchmark
+    """
+    parser = argparse.ArgumentParser(description='Benchmark devlab actions against a fake docker engine')
+    parser.add_argument('--components', '-n', type=int, default=BENCH_COMPONENTS_DEF, help='Number of components in the synthetic project. DEFAULT: {}'.format(BENCH_COMPONENTS_DEF))
+    parser.add_argument('--runtime-images', '-m', type=int, default=GEN_RUNTIME_IMAGES_DEF, help='Number of runtime images in the synthetic project. DEFAULT: {}'.format(GEN_RUNTIME_IMAGES_DEF))
+    parser.add_argument('--groups', '-g', type=int, default=GEN_GROUPS_DEF, help='Number of ordinal groups the components are spread over. DEFAULT: {}'.format(GEN_GROUPS_DEF))
+    parser.add_argument('--scripts', '-s', type=int, default=GEN_SCRIPTS_DEF, help='Number of scripts each component runs when it is provisioned. DEFAULT: {}'.format(GEN_SCRIPTS_DEF))
+    parser.add_argument('--repeat', '-r', type=int, default=BENCH_REPEAT_DEF, help='How many times to run the steps. DEFAULT: {}'.format(BENCH_REPEAT_DEF))
+    parser.add_argument('--latency', '-L', default='', help='Latency of engine calls, like \'0.01\' or \'default=0.01,run=0.2,build=1\'. See fake_docker for the names of the commands. DEFAULT: none')
+    parser.add_argument('--commands', '-c', action='store_true', help='Also print the engine calls that each step made, by command')
+    parser.add_argument('--json', '-j', default=None, help='Write the results to this file, which can be used with --compare')
+    parser.add_argument('--compare', '-C', default=None, help='Compare the results with a file written by --json, and exit non-zero if any step regressed')
+    parser.add_argument('--max-ratio', type=float, default=BENCH_MAX_RATIO_DEF, help='With --compare, how many times slower a step can get before it has regressed. DEFAULT: {}'.format(BENCH_MAX_RATIO_DEF))
+    parser.add_argument('--record-dir', '-R', default=None, help='Write recordings of the engine calls of each step of the first run to this directory, which can be replayed with bench_replay.py')
+    parser.add_argument('--keep', '-k', action='store_true', help='Keep the projects, engine state and logs of the runs')
+    args = parser.parse_args()
+    project_args = {
+        'components': args.components,
+        'runtime_images': args.runtime_images,
+        'groups': args.groups,
+        'scripts': args.scripts
+    }
+    work_dir = tempfile.mkdtemp(prefix='devlab-bench-')
+    try:
+        if args.record_dir and not os.path.isdir(args.record_dir):
+            os.makedirs(args.record_dir)
+        results = run_bench(project_args, args.repeat, args.latency, work_dir, record_dir=args.record_dir and os.path.abspath(args.record_dir))
+    finally:
+        if args.keep:
+            sys.stderr.write('Kept the runs in: {}\n'.format(work_dir))
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    summary = summarize(results)
+    print_summary(summary, show_commands=args.commands)
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({
+                'settings': dict(project_args, repeat=args.repeat, latency=args.latency),
+                'summary': summary,
+                'results': results
+            }, json_file, indent=4, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare_summary(summary, baseline, max_ratio=args.max_ratio):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks of the pure helper functions that run on every invocation of
+devlab, some of them once per line of output of every command.
+
+Every benchmark runs a helper over a pinned set of inputs, like long build
+log lines with ANSI sequences or a project with hundreds of components, and
+reports how long one call took in nanoseconds, along with the peak memory
+allocated while making it. Results can be saved with --json and a later run,
+on another commit, checked against them with --compare.
+
+Example:
+    ./benchmarks/bench_helpers.py --json before.json
+    ./benchmarks/bench_helpers.py --compare before.json
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from gen_project import generate_config
+
+BENCH_ROOT = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_ROOT))
+
+import devlab_bench #pylint: disable=wrong-import-position
+import devlab_bench.helpers.command #pylint: disable=wrong-import-position
+from devlab_bench.helpers.command import Command #pylint: disable=wrong-import-position
+from devlab_bench.helpers.common import get_components, get_ordinal_sorting, human_keys, script_runner_parse, unnest_list #pylint: disable=wrong-import-position
+from devlab_bench.helpers.docker import parse_docker_image_string, parse_docker_local_ports #pylint: disable=wrong-import-position
+
+HELPERS_REPEAT_DEF = 5
+#Each repeat runs a benchmark for at least this many seconds
+HELPERS_MIN_TIME_DEF = 0.2
+HELPERS_COMPONENTS = 500
+#A benchmark has regressed if its fastest call got this many times slower
+HELPERS_MAX_RATIO_DEF = 1.5
+ANSI_COLORS = ('\033[0;31m', '\033[1;32m', '\033[33m', '\033[0;36m', '\033[1m')
+ANSI_RESET = '\033[0m'
+
+###-- Functions --###
+def calibration_work():
+    """
+    A fixed amount of plain python work, timed next to every benchmark to
+    measure how fast the machine is running at the time, as the speed of
+    shared and virtual machines can drift by a lot between runs
+
+    Returns:
+        int
+    """
+    total = 0
+    for num in range(200):
+        total += len(str(num).swapcase().split('1'))
+    return total
+
+def get_build_log_lines():
+    """
+    Get pinned lines of output, like the ones that builds and provisioning
+    scripts print, as they are read from a pipe
+
+    Returns:
+        list of bytes
+    """
+    lines = [
+        b'',
+        b'\n',
+        b'Step 4/12 : RUN apt-get update && apt-get install -y curl\n',
+        b' ---> Running in 4f6a1b2c3d4e\n',
+        b'Get:1 http://archive.ubuntu.com/ubuntu focal InRelease [265 kB]\n',
+        b'Setting up libcurl4:amd64 (7.68.0-1ubuntu2.18) ...\r\n',
+        '✔ café déjà vu\n'.encode('utf-8')
+    ]
+    for line_num in range(8):
+        color = ANSI_COLORS[line_num % len(ANSI_COLORS)]
+        lines.append('{}#{} [{}/12] RUN make -j8 target_{}{} {}\n'.format(color, line_num, line_num + 1, line_num, ANSI_RESET, 'x' * 80).encode('ascii'))
+    long_line = ''.join('{}[{:04d}] compiling module_{}.c{} '.format(ANSI_COLORS[chunk % len(ANSI_COLORS)], chunk, chunk, ANSI_RESET) for chunk in range(100))
+    lines.append('{}\n'.format(long_line).encode('ascii'))
+    lines.append('{}\n'.format('=' * 4096).encode('ascii'))
+    return lines
+
+def get_benchmarks():
+    """
+    Get the benchmarks, with their pinned inputs
+
+    Returns:
+        list of tuples like: (name, function, list of the args of each call)
+    """
+    config = generate_config('bench_helpers', components=HELPERS_COMPONENTS, runtime_images=20, groups=50, scripts=6)
+    components = sorted(config['components'])
+    ordinals = ['{}:{}|{}'.format(comp_config['ordinal']['group'], comp_config['ordinal']['number'], comp) for comp, comp_config in sorted(config['components'].items())]
+    scripts = []
+    for comp in components[:20]:
+        scripts += config['components'][comp]['scripts']
+    scripts += [
+        'helper_container|registry.example.com:5000/team/tools: /bin/check --all',
+        'running_container|db-devlab: psql -c "SELECT 1"',
+        'host: ./scripts/prepare.sh --fast',
+        '!!./scripts/prepare.sh'
+    ]
+    images = [
+        'ubuntu',
+        'ubuntu:20.04',
+        'library/ubuntu:20.04',
+        'postgres:15',
+        'devlab_helper:latest',
+        'quay.io/org/image:v1.2.3',
+        'localhost:5000/app',
+        'registry.example.com:5000/team/app:1.2.3'
+    ]
+    ports = [
+        '8080:80',
+        '127.0.0.1:8080:80',
+        '8000-8010:8000-8010',
+        '53:53/udp',
+        '127.0.0.1:5432:5432/tcp'
+    ]
+    nested = [list(components[idx:idx + 10]) if idx % 20 else components[idx] for idx in range(0, len(components), 10)]
+    sanitizer = Command('/bin/true')
+    return [
+        ('parse_docker_image_string', parse_docker_image_string, [(image,) for image in images]),
+        ('script_runner_parse', script_runner_parse, [(script,) for script in scripts]),
+        ('human_keys', human_keys, [(ordinal,) for ordinal in ordinals]),
+        ('get_ordinal_sorting[{}]'.format(len(components)), get_ordinal_sorting, [(components, config['components'])]),
+        ('get_components[*]', get_components, [(['*'],)]),
+        ('get_components[globs]', get_components, [(['comp01*', 'comp02?0', 'comp0042'],)]),
+        ('parse_docker_local_ports', parse_docker_local_ports, [(port,) for port in ports]),
+        ('unnest_list[{}]'.format(len(components)), lambda to_unnest: unnest_list(list(to_unnest)), [(nested,)]),
+        ('_sanitize_string', sanitizer._sanitize_string, [(line,) for line in get_build_log_lines()]), #pylint: disable=protected-access
+        ('_sanitize_lines[chunk]', sanitizer._sanitize_lines, [(b''.join(get_build_log_lines()),)]) #pylint: disable=protected-access
+    ]
+
+def time_calls(func, calls, min_time=HELPERS_MIN_TIME_DEF, repeat=HELPERS_REPEAT_DEF):
+    """
+    Time calls to a function, running them enough times for each repeat to
+    take at least min_time
+
+    Args:
+        func: function, to call
+        calls: list of tuples, of the args of each call
+        min_time: float, the minimum number of seconds each repeat takes
+        repeat: int, how many repeats to time
+
+    Returns:
+        list of float, the nanoseconds per call of each repeat
+    """
+    #Like timeit, keep the garbage collector from landing in random repeats
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _time_calls(func, calls, min_time, repeat)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+def _time_calls(func, calls, min_time, repeat):
+    """
+    Time calls to a function, with the garbage collector disabled. See
+    time_calls
+    """
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            for args in calls:
+                func(*args)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / 10.0:
+            break
+        loops *= 10
+    loops = max(1, int(loops * min_time / max(elapsed, 1e-9)))
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            for args in calls:
+                func(*args)
+        timings.append((time.perf_counter() - start) * 1e9 / (loops * len(calls)))
+    return timings
+
+def measure_allocations(func, calls):
+    """
+    Measure the peak memory allocated while making each call
+
+    Args:
+        func: function, to call
+        calls: list of tuples, of the args of each call
+
+    Returns:
+        float, the mean peak bytes per call, or None if this python can't
+        measure it
+    """
+    if not hasattr(tracemalloc, 'reset_peak'):
+        return None
+    tracemalloc.start()
+    try:
+        total = 0
+        for args in calls:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            func(*args)
+            total += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return float(total) / len(calls)
+
+def get_commit():
+    """
+    Get the commit that devlab is checked out at, so that results can be told
+    apart
+
+    Returns:
+        str, or None if it isn't a git checkout
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_ROOT, stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(name_filter=None, min_time=HELPERS_MIN_TIME_DEF, repeat=HELPERS_REPEAT_DEF):
+    """
+    Run the benchmarks
+
+    Args:
+        name_filter: str, only run the benchmarks with this in their names
+        min_time: float, the minimum number of seconds each repeat takes
+        repeat: int, how many repeats to time
+
+    Returns:
+        dict, of the names of the benchmarks, to dicts of their results
+    """
+    results = {}
+    for name, func, calls in get_benchmarks():
+        if name_filter and name_filter not in name:
+            continue
+        timings = sorted(time_calls(func, calls, min_time=min_time, repeat=repeat))
+        results[name] = {
+            'calls': len(calls),
+            'ns_min': timings[0],
+            'ns_median': timings[len(timings) // 2],
+            'alloc_bytes': measure_allocations(func, calls),
+            'calibration_ns': min(time_calls(calibration_work, [()], min_time=min_time, repeat=repeat))
+        }
+        sys.stderr.write('{}: {:.0f}ns\n'.format(name, timings[0]))
+    return results
+
+def get_scaled_baseline(result, base_result):
+    """
+    Get the fastest call of a baseline, scaled by how much faster or slower
+    the machine ran the calibration work than when the baseline was run
+
+    Args:
+        result: dict, of the results of a benchmark
+        base_result: dict, of the results of the same benchmark in the
+            baseline
+
+    Returns:
+        float, of nanoseconds
+    """
+    if result.get('calibration_ns') and base_result.get('calibration_ns'):
+        return base_result['ns_min'] * result['calibration_ns'] / base_result['calibration_ns']
+    return base_result['ns_min']
+
+def print_results(results, baseline=None):
+    """
+    Print a table of the results, in the same style as devlab's tables
+
+    Args:
+        results: dict, as returned by run_benchmarks
+        baseline: dict, of the results of an earlier run to show next to
+            them
+    """
+    header = {
+        'name': 'Helper',
+        'calls': 'Inputs',
+        'ns_min': 'Min ns/call',
+        'ns_median': 'Median ns/call',
+        'alloc': 'Peak B/call',
+        'baseline': 'Baseline min*',
+        'ratio': 'Ratio'
+    }
+    header_format = "| {name:^30} | {calls:^6} | {ns_min:^12} | {ns_median:^14} | {alloc:^11} | {baseline:^12} | {ratio:^6} |"
+    row_format = "| {name:30} | {calls:>6} | {ns_min:>12} | {ns_median:>14} | {alloc:>11} | {baseline:>12} | {ratio:>6} |"
+    table_width = len(header_format.format(**header))
+    table_bar = '{{:-<{}}}'.format(table_width)
+    table = [
+        table_bar.format(''),
+        header_format.format(**header),
+        table_bar.format('')
+    ]
+    for name, result in results.items():
+        base_result = (baseline or {}).get(name, None)
+        table.append(row_format.format(
+            name=name,
+            calls=result['calls'],
+            ns_min='{:,.0f}'.format(result['ns_min']),
+            ns_median='{:,.0f}'.format(result['ns_median']),
+            alloc='-' if result['alloc_bytes'] is None else '{:,.0f}'.format(result['alloc_bytes']),
+            baseline='' if base_result is None else '{:,.0f}'.format(get_scaled_baseline(result, base_result)),
+            ratio='' if base_result is None else '{:.2f}x'.format(result['ns_min'] / get_scaled_baseline(result, base_result))
+        ))
+    table.append(table_bar.format(''))
+    print('\n## HELPER BENCHMARKS ##')
+    print('\n'.join(table))
+    if baseline:
+        print('* Scaled by how fast this machine ran the calibration work, compared to when the baseline was run')
+
+def compare_results(results, baseline, max_ratio=HELPERS_MAX_RATIO_DEF):
+    """
+    Compare results with a baseline, and print the benchmarks that regressed
+
+    Args:
+        results: dict, as returned by run_benchmarks
+        baseline: dict, of the results of the baseline
+        max_ratio: float, how many times slower the fastest call of a
+            benchmark can get, after scaling the baseline by the calibration
+
+    Returns:
+        int, the number of benchmarks that regressed
+    """
+    regressed = 0
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base_ns = get_scaled_baseline(result, baseline[name])
+        if result['ns_min'] > base_ns * max_ratio:
+            print("REGRESSED: '{}' took {:,.0f}ns per call, up from {:,.0f}ns (scaled)".format(name, result['ns_min'], base_ns))
+            regressed += 1
+    return regressed
+
+def main():
+    """
+    Parse the arguments and run the benchmarks
+    """
+    parser = argparse.ArgumentParser(description='Microbenchmarks of devlab\'s pure helper functions')
+    parser.add_argument('--filter', '-f', default=None, help='Only run the benchmarks with this in their names')
+    parser.add_argument('--repeat', '-r', type=int, default=HELPERS_REPEAT_DEF, help='How many times to time each benchmark. DEFAULT: {}'.format(HELPERS_REPEAT_DEF))
+    parser.add_argument('--min-time', '-t', type=float, default=HELPERS_MIN_TIME_DEF, help='The minimum number of seconds each repeat runs for. DEFAULT: {}'.format(HELPERS_MIN_TIME_DEF))
+    parser.add_argument('--json', '-j', default=None, help='Write the results to this file, which can be used with --compare')
+    parser.add_argument('--compare', '-C', default=None, help='Compare the results with a file written by --json, and exit non-zero if any benchmark regressed')
+    parser.add_argument('--max-ratio', type=float, default=HELPERS_MAX_RATIO_DEF, help='With --compare, how many times slower a benchmark can get before it has regressed. DEFAULT: {}'.format(HELPERS_MAX_RATIO_DEF))
+    args = parser.parse_args()
+    #Logging and the terminal are pinned, as they change what the helpers do
+    logging.getLogger().setLevel(logging.INFO)
+    devlab_bench.helpers.command.ISATTY = False
+    devlab_bench.CONFIG = generate_config('bench_helpers', components=HELPERS_COMPONENTS, runtime_images=20, groups=50, scripts=6)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+    results = run_benchmarks(name_filter=args.filter, min_time=args.min_time, repeat=args.repeat)
+    print_results(results, baseline=baseline)
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({
+                'commit': get_commit(),
+                'python': platform.python_version(),
+                'results': results
+            }, json_file, indent=4, sort_keys=True)
+    if baseline and compare_results(results, baseline, max_ratio=args.max_ratio):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
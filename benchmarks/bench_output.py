@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Benchmark how fast Command reads, sanitizes and logs the output of the
+commands it runs, like builds and provisioning scripts that print hundreds of
+thousands of lines.
+
+Every case writes pinned, synthetic output of one line size to a file, and
+times Command running 'cat' on it, both with and without log_output, next to
+the time it takes to read the same output straight from a pipe. The lines
+that Command returns are checked against the lines that are expected, so a
+faster reader that changes what callers get back is caught too. Results can
+be saved with --json and a later run, on another commit, checked against them
+with --compare.
+
+Example:
+    ./benchmarks/bench_output.py --json before.json
+    ./benchmarks/bench_output.py --compare before.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_ROOT = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_ROOT))
+
+import devlab_bench.helpers.command #pylint: disable=wrong-import-position
+from devlab_bench.helpers.command import Command #pylint: disable=wrong-import-position
+
+OUTPUT_REPEAT_DEF = 3
+#Cases are like: (name, bytes per line, lines, whether lines have ANSI sequences, stream)
+OUTPUT_CASES = (
+    ('tiny', 16, 200000, False, 'stdout'),
+    ('build', 120, 100000, True, 'stdout'),
+    ('build-stderr', 120, 100000, True, 'stderr'),
+    ('long', 1024, 20000, True, 'stdout'),
+    ('huge', 16384, 1000, False, 'stdout')
+)
+#A case has regressed if its lines per second dropped by this many times
+OUTPUT_MAX_RATIO_DEF = 1.5
+OUTPUT_LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+ANSI_COLORS = ('\033[0;31m', '\033[1;32m', '\033[33m', '\033[0;36m', '\033[1m')
+ANSI_RESET = '\033[0m'
+ANSI_ESCAPE = re.compile(r'\x1B\[[0-?]*[ -/]*[@-~]')
+
+###-- Functions --###
+def generate_output(path, line_size, lines, ansi=False):
+    """
+    Write pinned, synthetic output to a file. Every so often a line is blank,
+    only whitespace, or ends with a carriage return, and the last line
+    doesn't end with a newline, like the output of real commands
+
+    Args:
+        path: str, path to the file to write
+        line_size: int, about how many bytes each line is
+        lines: int, how many lines to write
+        ansi: bool, whether lines are colored with ANSI sequences
+
+    Returns:
+        list, of the lines that Command is expected to return
+    """
+    expected = []
+    with open(path, 'wb') as out_file:
+        for line_num in range(lines):
+            if line_num % 97 == 0:
+                line = ' \t' if line_num % 2 else ''
+            else:
+                prefix = '[{:06d}] '.format(line_num)
+                line = prefix + ('abcdefghij' * (line_size // 10 + 1))[:max(line_size - len(prefix), 1)]
+                if ansi:
+                    color = ANSI_COLORS[line_num % len(ANSI_COLORS)]
+                    line = '{}{}{} {}'.format(color, line[:line_size // 2], ANSI_RESET, line[line_size // 2:])
+            ending = '\r\n' if line_num % 13 == 0 else '\n'
+            if line_num == lines - 1:
+                ending = ''
+            out_file.write('{}{}'.format(line, ending).encode('ascii'))
+            line = ANSI_ESCAPE.sub('', line.strip())
+            if line:
+                expected.append(line)
+    return expected
+
+def get_logger(log_output):
+    """
+    Get a logger for Command, that formats its messages like devlab does, and
+    writes them to /dev/null
+
+    Args:
+        log_output: bool, whether the output is going to be logged
+
+    Returns:
+        Logger object
+    """
+    logger = logging.getLogger('BenchOutput')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    if not logger.handlers:
+        handler = logging.StreamHandler(open(os.devnull, 'w'))
+        handler.setFormatter(logging.Formatter(OUTPUT_LOG_FORMAT))
+        logger.addHandler(handler)
+    if not log_output:
+        logger.setLevel(logging.WARNING)
+    return logger
+
+def time_raw(path):
+    """
+    Time reading a file through a pipe from 'cat', without Command
+
+    Args:
+        path: str, path to the file
+
+    Returns:
+        float, of seconds
+    """
+    start = time.time()
+    subprocess.run(['cat', path], stdout=subprocess.PIPE, check=True)
+    return time.time() - start
+
+def time_command(path, stream, log_output):
+    """
+    Time Command running 'cat' on a file
+
+    Args:
+        path: str, path to the file
+        stream: str, 'stdout' or 'stderr', of where the output goes
+        log_output: bool, whether Command logs the output
+
+    Returns:
+        tuple where:
+            First Element is the seconds it took
+            Second Element is the list of lines that Command returned
+    """
+    if stream == 'stderr':
+        cmd = Command('/bin/sh', ['-c', 'cat "$0" >&2', path], log_output=log_output, ignore_nonzero_rc=True, logger=get_logger(log_output))
+    else:
+        cmd = Command('/bin/cat', [path], log_output=log_output, logger=get_logger(log_output))
+    start = time.time()
+    cmd.run()
+    return (time.time() - start, getattr(cmd, stream))
+
+def get_commit():
+    """
+    Get the commit that devlab is checked out at, so that results can be told
+    apart
+
+    Returns:
+        str, or None if it isn't a git checkout
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_ROOT, stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(work_dir, name_filter=None, repeat=OUTPUT_REPEAT_DEF):
+    """
+    Run the benchmarks
+
+    Args:
+        work_dir: str, path to the directory to write the output files in
+        name_filter: str, only run the cases with this in their names
+        repeat: int, how many times to time each case
+
+    Returns:
+        dict, of the names of the cases, to dicts of their results
+    """
+    results = {}
+    for name, line_size, lines, ansi, stream in OUTPUT_CASES:
+        if name_filter and name_filter not in name:
+            continue
+        path = os.path.join(work_dir, '{}.out'.format(name))
+        expected = generate_output(path, line_size, lines, ansi=ansi)
+        size = os.path.getsize(path)
+        raw = min(time_raw(path) for _ in range(repeat))
+        for log_output in (False, True):
+            case_name = '{}{}'.format(name, '+log' if log_output else '')
+            walls = []
+            correct = True
+            for _ in range(repeat):
+                wall, got = time_command(path, stream, log_output)
+                walls.append(wall)
+                correct = correct and got == expected
+            walls.sort()
+            results[case_name] = {
+                'line_size': line_size,
+                'lines': len(expected),
+                'bytes': size,
+                'wall_min': walls[0],
+                'wall_median': walls[len(walls) // 2],
+                'lines_per_sec': len(expected) / walls[0],
+                'raw_wall': raw,
+                'correct': correct
+            }
+            sys.stderr.write('{}: {:.3f}s{}\n'.format(case_name, walls[0], '' if correct else ' (WRONG LINES)'))
+        os.remove(path)
+    return results
+
+def print_results(results, baseline=None):
+    """
+    Print a table of the results, in the same style as devlab's tables
+
+    Args:
+        results: dict, as returned by run_benchmarks
+        baseline: dict, of the results of an earlier run to show next to
+            them
+    """
+    header = {
+        'name': 'Case',
+        'line_size': 'B/line',
+        'lines': 'Lines',
+        'wall': 'Min wall',
+        'lines_per_sec': 'Lines/s',
+        'mb_per_sec': 'MB/s',
+        'raw': 'Raw pipe',
+        'correct': 'Lines OK',
+        'baseline': 'Baseline Lines/s',
+        'ratio': 'Ratio'
+    }
+    header_format = "| {name:^18} | {line_size:^6} | {lines:^7} | {wall:^8} | {lines_per_sec:^10} | {mb_per_sec:^7} | {raw:^8} | {correct:^8} | {baseline:^16} | {ratio:^7} |"
+    row_format = "| {name:18} | {line_size:>6} | {lines:>7} | {wall:>8} | {lines_per_sec:>10} | {mb_per_sec:>7} | {raw:>8} | {correct:^8} | {baseline:>16} | {ratio:>7} |"
+    table_width = len(header_format.format(**header))
+    table_bar = '{{:-<{}}}'.format(table_width)
+    table = [
+        table_bar.format(''),
+        header_format.format(**header),
+        table_bar.format('')
+    ]
+    for name, result in results.items():
+        base_result = (baseline or {}).get(name, None)
+        table.append(row_format.format(
+            name=name,
+            line_size=result['line_size'],
+            lines=result['lines'],
+            wall='{:.3f}s'.format(result['wall_min']),
+            lines_per_sec='{:,.0f}'.format(result['lines_per_sec']),
+            mb_per_sec='{:.1f}'.format(result['bytes'] / result['wall_min'] / 1048576),
+            raw='{:.3f}s'.format(result['raw_wall']),
+            correct='yes' if result['correct'] else 'NO',
+            baseline='' if base_result is None else '{:,.0f}'.format(base_result['lines_per_sec']),
+            ratio='' if base_result is None else '{:.2f}x'.format(result['lines_per_sec'] / base_result['lines_per_sec'])
+        ))
+    table.append(table_bar.format(''))
+    print('\n## OUTPUT THROUGHPUT ##')
+    print('\n'.join(table))
+
+def compare_results(results, baseline, max_ratio=OUTPUT_MAX_RATIO_DEF):
+    """
+    Compare results with a baseline, and print the cases that regressed
+
+    Args:
+        results: dict, as returned by run_benchmarks
+        baseline: dict, of the results of the baseline
+        max_ratio: float, how many times fewer lines per second a case can
+            read before it has regressed
+
+    Returns:
+        int, the number of cases that regressed
+    """
+    regressed = 0
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        if result['lines_per_sec'] * max_ratio < baseline[name]['lines_per_sec']:
+            print("REGRESSED: '{}' read {:,.0f} lines/s, down from {:,.0f}".format(name, result['lines_per_sec'], baseline[name]['lines_per_sec']))
+            regressed += 1
+    return regressed
+
+def main():
+    """
+    Parse the arguments and run the benchmarks
+    """
+    parser = argparse.ArgumentParser(description='Benchmark how fast Command processes the output of the commands it runs')
+    parser.add_argument('--filter', '-f', default=None, help='Only run the cases with this in their names')
+    parser.add_argument('--repeat', '-r', type=int, default=OUTPUT_REPEAT_DEF, help='How many times to time each case. DEFAULT: {}'.format(OUTPUT_REPEAT_DEF))
+    parser.add_argument('--json', '-j', default=None, help='Write the results to this file, which can be used with --compare')
+    parser.add_argument('--compare', '-C', default=None, help='Compare the results with a file written by --json, and exit non-zero if any case regressed')
+    parser.add_argument('--max-ratio', type=float, default=OUTPUT_MAX_RATIO_DEF, help='With --compare, how many times fewer lines per second a case can read before it has regressed. DEFAULT: {}'.format(OUTPUT_MAX_RATIO_DEF))
+    args = parser.parse_args()
+    #The terminal is pinned, as it changes how lines are sanitized
+    devlab_bench.helpers.command.ISATTY = False
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+    work_dir = tempfile.mkdtemp(prefix='devlab-output-')
+    try:
+        results = run_benchmarks(work_dir, name_filter=args.filter, repeat=args.repeat)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print_results(results, baseline=baseline)
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({
+                'commit': get_commit(),
+                'python': platform.python_version(),
+                'results': results
+            }, json_file, indent=4, sort_keys=True)
+    failed = [name for name, result in results.items() if not result['correct']]
+    if failed:
+        print("WRONG LINES: Command didn't return the expected lines for: {}".format(', '.join(failed)))
+    if failed or (baseline and compare_results(results, baseline, max_ratio=args.max_ratio)):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
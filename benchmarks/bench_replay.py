@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Benchmark devlab's own overhead by replaying recordings of its engine calls.
+
+A recording is written by running devlab with '--record-engine FILE', on any
+machine, against a real engine or the fake one in this directory (see
+bench_actions.py --record-dir). Every repeat recreates the recorded project
+from the config saved in the recording, in a new directory, and runs the
+recorded command again with '--replay-engine', so no engine is needed. With
+the default 'instant' replay speed, the time it takes is devlab's own
+overhead, which is reported next to the time the engine took when recorded.
+
+Example:
+    devlab --record-engine /tmp/up.rec up
+    ./benchmarks/bench_replay.py /tmp/up.rec --repeat 5
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_ROOT = os.path.dirname(os.path.realpath(__file__))
+DEVLAB_BIN = os.path.join(os.path.dirname(BENCH_ROOT), 'devlab')
+sys.path.insert(0, os.path.dirname(BENCH_ROOT))
+
+from devlab_bench.helpers.recording import PROJ_ROOT_PLACEHOLDER, REPLAY_SPEEDS #pylint: disable=wrong-import-position
+
+REPLAY_REPEAT_DEF = 5
+#Makes sure that nothing is ever run against a real engine
+REPLAY_DOCKER_BIN = '/nonexistent/devlab-replay/docker'
+
+###-- Functions --###
+def load_recording(path):
+    """
+    Load what's needed to replay a recording
+
+    Args:
+        path: str, path to the recording
+
+    Returns:
+        dict, with the recorded 'argv' (without --record-engine), the
+        project's 'config' and 'files', and the number of engine 'calls'
+        and the total 'engine_time' they took
+    """
+    recording = {
+        'argv': [],
+        'config': None,
+        'files': {},
+        'calls': 0,
+        'engine_time': 0.0
+    }
+    with open(path) as rec_file:
+        for line in rec_file:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry['type'] == 'header':
+                recording['argv'] = strip_record_args(entry['argv'])
+            elif entry['type'] == 'config':
+                recording['config'] = entry['config']
+                recording['files'] = entry.get('files', {})
+            elif entry['type'] == 'call':
+                recording['calls'] += 1
+                recording['engine_time'] += entry['duration']
+    return recording
+
+def strip_record_args(argv):
+    """
+    Remove --record-engine from the arguments of a recorded command
+
+    Args:
+        argv: list, of the arguments
+
+    Returns:
+        list
+    """
+    stripped = []
+    skip_next = False
+    for arg in argv:
+        if skip_next:
+            skip_next = False
+        elif arg == '--record-engine':
+            skip_next = True
+        elif not arg.startswith('--record-engine='):
+            stripped.append(arg)
+    return stripped
+
+def replay(rec_path, recording, speed, work_dir, log_path):
+    """
+    Replay a recording once, in a new copy of its project
+
+    Args:
+        rec_path: str, path to the recording
+        recording: dict, as returned by load_recording
+        speed: str, one of REPLAY_SPEEDS
+        work_dir: str, path to the directory to create the project in
+        log_path: str, path to the file to write devlab's output to
+
+    Returns:
+        tuple where:
+            First Element is the return code of devlab
+            Second Element is the wall time it took
+    """
+    project_dir = tempfile.mkdtemp(prefix='project-', dir=work_dir)
+    config = json.loads(json.dumps(recording['config']).replace(PROJ_ROOT_PLACEHOLDER, json.dumps(project_dir)[1:-1]))
+    with open(os.path.join(project_dir, 'DevlabConfig.json'), 'w') as config_file:
+        json.dump(config, config_file, indent=4)
+    for file_path, contents in recording['files'].items():
+        file_path = os.path.join(project_dir, file_path)
+        if not os.path.isdir(os.path.dirname(file_path)):
+            os.makedirs(os.path.dirname(file_path))
+        with open(file_path, 'w') as proj_file:
+            proj_file.write(contents)
+    env = dict(os.environ)
+    env.update({
+        'DEVLAB_NO_AGENT': '1',
+        'DEVLAB_DOCKER_BIN': REPLAY_DOCKER_BIN
+    })
+    env.pop('DEVLAB_PROFILE', None)
+    start = time.time()
+    with open(log_path, 'a') as log_file:
+        rc = subprocess.call(
+            [sys.executable, DEVLAB_BIN, '--replay-engine', os.path.abspath(rec_path), '--replay-speed', speed] + recording['argv'],
+            cwd=project_dir,
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=log_file,
+            stderr=subprocess.STDOUT
+        )
+    return (rc, time.time() - start)
+
+def main():
+    """
+    Parse the arguments and replay the recordings
+    """
+    parser = argparse.ArgumentParser(description='Benchmark devlab\'s own overhead by replaying recordings of its engine calls')
+    parser.add_argument('recordings', nargs='+', help='Files written by devlab --record-engine')
+    parser.add_argument('--repeat', '-r', type=int, default=REPLAY_REPEAT_DEF, help='How many times to replay each recording. DEFAULT: {}'.format(REPLAY_REPEAT_DEF))
+    parser.add_argument('--speed', '-s', choices=REPLAY_SPEEDS, default='instant', help='Whether replayed engine calls take as long as they did when recorded, or no time at all. DEFAULT: instant')
+    parser.add_argument('--keep', '-k', action='store_true', help='Keep the projects and devlab\'s output')
+    args = parser.parse_args()
+    work_dir = tempfile.mkdtemp(prefix='devlab-replay-')
+    log_path = os.path.join(work_dir, 'devlab.log')
+    header = {
+        'recording': 'Recording',
+        'command': 'Command',
+        'calls': 'Engine calls',
+        'engine_time': 'Engine time',
+        'median': 'Replay median',
+        'max': 'Replay max'
+    }
+    header_format = "| {recording:^24} | {command:^20} | {calls:^12} | {engine_time:^11} | {median:^13} | {max:^10} |"
+    row_format = "| {recording:24} | {command:20} | {calls:>12} | {engine_time:>11} | {median:>13} | {max:>10} |"
+    rows = []
+    failed = False
+    try:
+        for rec_path in args.recordings:
+            recording = load_recording(rec_path)
+            if recording['config'] is None:
+                sys.stderr.write("Recording: '{}' doesn't have the project's config, so can't be replayed\n".format(rec_path))
+                failed = True
+                continue
+            walls = []
+            for _ in range(args.repeat):
+                rc, wall = replay(rec_path, recording, args.speed, work_dir, log_path)
+                if rc != 0:
+                    sys.stderr.write("Replaying: '{}' failed with rc: {}. See: {}\n".format(rec_path, rc, log_path))
+                    failed = True
+                    break
+                walls.append(wall)
+            if not walls:
+                continue
+            walls.sort()
+            rows.append({
+                'recording': os.path.basename(rec_path)[:24],
+                'command': ' '.join(recording['argv'])[:20],
+                'calls': recording['calls'],
+                'engine_time': '{:.3f}s'.format(recording['engine_time']),
+                'median': '{:.3f}s'.format(walls[len(walls) // 2]),
+                'max': '{:.3f}s'.format(walls[-1])
+            })
+    finally:
+        if args.keep or failed:
+            sys.stderr.write('Kept the replays in: {}\n'.format(work_dir))
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    table_width = len(header_format.format(**header))
+    table_bar = '{{:-<{}}}'.format(table_width)
+    print('\n## REPLAY ({}) ##'.format(args.speed))
+    print(table_bar.format(''))
+    print(header_format.format(**header))
+    print(table_bar.format(''))
+    for row in rows:
+        print(row_format.format(**row))
+    print(table_bar.format(''))
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
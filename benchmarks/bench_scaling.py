@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+Check how devlab's orchestration logic scales with the size of a project.
+
+For every size, a synthetic project is generated (see gen_project.py), the
+fake docker engine is seeded as if the project was up, and the functions that
+every action leans on are run in this process against it, timing them and
+counting their engine calls. If the time or the engine calls of a function
+grow faster than N^max-exponent between two sizes, then the check fails.
+
+Example:
+    ./benchmarks/bench_scaling.py --sizes 10 100 1000
+    ./benchmarks/bench_scaling.py --sizes 10 100 --plot scaling.png
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+from gen_project import GEN_LAST_MODIFIED, generate_config, write_project
+
+try:
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as pyplot
+    PLOT_SUPPORT = True
+except ImportError:
+    pyplot = None
+    PLOT_SUPPORT = False
+
+BENCH_ROOT = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_ROOT))
+
+import devlab_bench #pylint: disable=wrong-import-position
+import devlab_bench.helpers.docker #pylint: disable=wrong-import-position
+from devlab_bench.actions.status import get_status #pylint: disable=wrong-import-position
+from devlab_bench.helpers.common import get_components, get_config, get_ordinal_sorting, logging_init #pylint: disable=wrong-import-position
+from devlab_bench.helpers.docker import DOCKER_BIN_ENV, get_needed_images, get_project_docker_helper #pylint: disable=wrong-import-position
+
+FAKE_DOCKER_BIN = os.path.join(BENCH_ROOT, 'fake_docker')
+SCALING_SIZES_DEF = (10, 100, 1000)
+SCALING_REPEAT_DEF = 3
+SCALING_RUNTIME_IMAGES_DEF = 20
+SCALING_GROUP_SIZE_DEF = 5
+SCALING_SCRIPTS_DEF = 10
+#Growth faster than N to this power between two sizes fails the check
+SCALING_MAX_EXPONENT_DEF = 1.3
+#Times are rounded up to this many seconds before comparing them, so that
+#noise in very fast functions isn't mistaken for growth
+SCALING_TIME_FLOOR = 0.01
+SCALING_BAR_WIDTH = 50
+
+###-- Functions --###
+def op_load_config(components):
+    """
+    Load the project's config from disk
+    """
+    del components
+    get_config(force_reload=True)
+
+def op_get_components(components):
+    """
+    List the project's components
+    """
+    del components
+    get_components()
+
+def op_get_ordinal_sorting(components):
+    """
+    Sort the project's components by their ordinals
+    """
+    get_ordinal_sorting(components, devlab_bench.CONFIG['components'])
+
+def op_get_needed_images(components):
+    """
+    Work out which images the components need
+    """
+    get_needed_images(components=list(components))
+
+def op_status(components):
+    """
+    Get the status of every component
+    """
+    del components
+    get_status()
+
+#The functions that are measured, in order
+SCALING_OPERATIONS = (
+    ('load config', op_load_config),
+    ('get_components', op_get_components),
+    ('get_ordinal_sorting', op_get_ordinal_sorting),
+    ('get_needed_images', op_get_needed_images),
+    ('status', op_status)
+)
+
+def get_last_modified(docker_file):
+    """
+    Get the value of the 'last_modified' label of a Dockerfile
+
+    Args:
+        docker_file: str, path to the Dockerfile
+
+    Returns:
+        str, or None if it doesn't have the label
+    """
+    with open(docker_file) as dfile:
+        match = re.search(r'^LABEL\s+"?last_modified"?=(\S+)', dfile.read(), re.MULTILINE)
+    if match:
+        return match.group(1).strip('"')
+    return None
+
+def seed_engine(state_path, config, proj_root):
+    """
+    Write the fake engine's state file, as if the project had been built and
+    brought up, so that big projects don't have to be brought up one engine
+    call at a time
+
+    Args:
+        state_path: str, path to the fake engine's state file
+        config: dict, of the project, as returned by generate_config
+        proj_root: str, path to the project
+    """
+    filter_key, _, filter_value = config['project_filter'].partition('=')
+    labels = {
+        'com.lab.type': 'devlab',
+        'com.lab.project': proj_root,
+        filter_key: filter_value
+    }
+    state = {
+        'containers': {},
+        'images': {},
+        'networks': {}
+    }
+    for image_name, image_config in devlab_bench.IMAGES.items():
+        state['images']['{}:{}'.format(image_name, image_config['tag'])] = {
+            'id': 'base{}'.format(len(state['images'])),
+            'labels': dict(labels, last_modified=get_last_modified(os.path.join(devlab_bench.DEVLAB_ROOT, image_config['docker_file'])))
+        }
+    for image_name, image_config in config['runtime_images'].items():
+        state['images']['{}:{}'.format(image_name, image_config['tag'])] = {
+            'id': 'runtime{}'.format(len(state['images'])),
+            'labels': dict(labels, last_modified=str(GEN_LAST_MODIFIED))
+        }
+    for comp_num, (comp_name, comp_config) in enumerate(sorted(config['components'].items())):
+        image = comp_config['image']
+        if ':' not in image:
+            image = '{}:latest'.format(image)
+        state['images'].setdefault(image, {'id': 'external{}'.format(len(state['images'])), 'labels': {}})
+        ports = {}
+        for port in comp_config.get('ports', []):
+            host_port, cont_port = port.split(':')[-2:]
+            ports['{}/tcp'.format(cont_port)] = [{'HostIp': '', 'HostPort': host_port}]
+        state['containers']['{}-devlab'.format(comp_name)] = {
+            'id': '{:012x}'.format(comp_num),
+            'image': image,
+            'labels': dict(labels),
+            'running': True,
+            'ports': ports,
+            'network': 'bridge',
+            'restarts': 0,
+            'created': comp_num
+        }
+    with open(state_path, 'w') as state_file:
+        json.dump(state, state_file)
+
+def count_calls(call_log_path):
+    """
+    Count the calls in the fake engine's call log
+
+    Args:
+        call_log_path: str, path to the call log
+
+    Returns:
+        int
+    """
+    if not os.path.isfile(call_log_path):
+        return 0
+    with open(call_log_path) as call_log:
+        return sum(1 for line in call_log if line.strip())
+
+def measure_size(size, project_args, repeat, work_dir):
+    """
+    Measure the operations for a project of one size
+
+    Args:
+        size: int, the number of components
+        project_args: dict, of the other arguments to generate_config
+        repeat: int, how many times to run each operation. The fastest run
+            is kept
+        work_dir: str, path to the directory to create the project in
+
+    Returns:
+        dict, of the names of the operations, to dicts with their 'time'
+        and engine 'calls'
+    """
+    proj_root = os.path.join(work_dir, 'n{}'.format(size))
+    config = generate_config('n{}'.format(size), components=size, **project_args)
+    write_project(proj_root, config)
+    state_path = os.path.join(work_dir, 'n{}.engine.json'.format(size))
+    call_log_path = os.path.join(work_dir, 'n{}.calls.log'.format(size))
+    seed_engine(state_path, config, proj_root)
+    os.environ['FAKE_DOCKER_STATE'] = state_path
+    os.environ['FAKE_DOCKER_CALL_LOG'] = call_log_path
+    devlab_bench.PROJ_ROOT = proj_root
+    devlab_bench.CONFIG = {}
+    get_config(force_reload=True)
+    devlab_bench.helpers.docker.DOCKER = get_project_docker_helper()
+    os.chdir(proj_root)
+    components = get_components()
+    results = {}
+    for op_name, op_func in SCALING_OPERATIONS:
+        times = []
+        calls = None
+        for _ in range(repeat):
+            calls_before = count_calls(call_log_path)
+            start = time.time()
+            op_func(components)
+            times.append(time.time() - start)
+            if calls is None:
+                calls = count_calls(call_log_path) - calls_before
+        results[op_name] = {
+            'time': min(times),
+            'calls': calls
+        }
+    return results
+
+def get_exponent(size_a, value_a, size_b, value_b, floor):
+    """
+    Get the exponent of the growth of a value between two sizes, as in:
+    value_b / value_a = (size_b / size_a) ^ exponent
+
+    Args:
+        size_a: int, the smaller size
+        value_a: float, the value at size_a
+        size_b: int, the larger size
+        value_b: float, the value at size_b
+        floor: float, values are rounded up to this
+
+    Returns:
+        float
+    """
+    return math.log(max(value_b, floor) / max(value_a, floor)) / math.log(float(size_b) / size_a)
+
+def check_scaling(sizes, results, max_exponent=SCALING_MAX_EXPONENT_DEF):
+    """
+    Find the operations whose time or engine calls grew faster than
+    N^max_exponent between two consecutive sizes
+
+    Args:
+        sizes: list of int, sorted
+        results: dict, of the sizes, to the results of measure_size
+        max_exponent: float, the largest allowed exponent
+
+    Returns:
+        list of str, describing each superlinear growth
+    """
+    failures = []
+    for op_name, _ in SCALING_OPERATIONS:
+        for size_a, size_b in zip(sizes, sizes[1:]):
+            for key, floor, unit in (('time', SCALING_TIME_FLOOR, 's'), ('calls', 1, ' calls')):
+                value_a = results[size_a][op_name][key]
+                value_b = results[size_b][op_name][key]
+                exponent = get_exponent(size_a, value_a, size_b, value_b, floor)
+                if exponent > max_exponent:
+                    failures.append("SUPERLINEAR: '{}' {} grew as N^{:.2f} from N={} ({:g}{}) to N={} ({:g}{})".format(
+                        op_name, key, exponent, size_a, value_a, unit, size_b, value_b, unit
+                    ))
+    return failures
+
+def print_results(sizes, results):
+    """
+    Print a table of the results, with log scaled bars of the time each
+    operation took
+
+    Args:
+        sizes: list of int, sorted
+        results: dict, of the sizes, to the results of measure_size
+    """
+    header = {
+        'operation': 'Operation',
+        'size': 'N',
+        'time': 'Time',
+        'calls': 'Engine calls',
+        'exponent': 'Growth',
+        'bar': 'Time (log scale)'
+    }
+    header_format = "| {operation:^20} | {size:^6} | {time:^9} | {calls:^12} | {exponent:^8} | {bar:^50} |"
+    row_format = "| {operation:20} | {size:>6} | {time:>9} | {calls:>12} | {exponent:>8} | {bar:50} |"
+    table_width = len(header_format.format(**header))
+    table_bar = '{{:-<{}}}'.format(table_width)
+    table = [
+        table_bar.format(''),
+        header_format.format(**header),
+        table_bar.format('')
+    ]
+    max_time = max(results[size][op_name]['time'] for size in sizes for op_name, _ in SCALING_OPERATIONS)
+    log_range = max(math.log10(max(max_time, SCALING_TIME_FLOOR) / (SCALING_TIME_FLOOR / 10)), 1)
+    for op_name, _ in SCALING_OPERATIONS:
+        prev_size = None
+        for size in sizes:
+            result = results[size][op_name]
+            exponent = ''
+            if prev_size:
+                exponent = 'N^{:.2f}'.format(get_exponent(prev_size, results[prev_size][op_name]['time'], size, result['time'], SCALING_TIME_FLOOR))
+            bar_len = int(SCALING_BAR_WIDTH * math.log10(max(result['time'], SCALING_TIME_FLOOR / 10) / (SCALING_TIME_FLOOR / 10)) / log_range)
+            table.append(row_format.format(
+                operation=op_name if not prev_size else '',
+                size=size,
+                time='{:.4f}s'.format(result['time']),
+                calls=result['calls'],
+                exponent=exponent,
+                bar='#' * max(bar_len, 1)
+            ))
+            prev_size = size
+    table.append(table_bar.format(''))
+    print('\n## SCALING ##')
+    print('\n'.join(table))
+
+def plot_results(sizes, results, path):
+    """
+    Plot the time and engine calls of the operations against N, on log
+    scales, to an image file
+
+    Args:
+        sizes: list of int, sorted
+        results: dict, of the sizes, to the results of measure_size
+        path: str, path to the image file to write
+    """
+    fig, (time_ax, calls_ax) = pyplot.subplots(1, 2, figsize=(12, 5))
+    for op_name, _ in SCALING_OPERATIONS:
+        time_ax.plot(sizes, [results[size][op_name]['time'] for size in sizes], marker='o', label=op_name)
+        calls_ax.plot(sizes, [max(results[size][op_name]['calls'], 0.5) for size in sizes], marker='o', label=op_name)
+    for axis, ylabel in ((time_ax, 'Time (s)'), (calls_ax, 'Engine calls')):
+        axis.set_xscale('log')
+        axis.set_yscale('log')
+        axis.set_xlabel('Components (N)')
+        axis.set_ylabel(ylabel)
+        axis.grid(True, which='both', alpha=0.3)
+    time_ax.legend()
+    fig.tight_layout()
+    fig.savefig(path)
+
+def main():
+    """
+    Parse the arguments and run the scaling check
+    """
+    parser = argparse.ArgumentParser(description='Check how devlab\'s orchestration logic scales with the number of components')
+    parser.add_argument('--sizes', '-n', type=int, nargs='+', default=list(SCALING_SIZES_DEF), help='Numbers of components to measure. DEFAULT: {}'.format(' '.join(str(size) for size in SCALING_SIZES_DEF)))
+    parser.add_argument('--runtime-images', '-m', type=int, default=SCALING_RUNTIME_IMAGES_DEF, help='Number of runtime images in the projects. DEFAULT: {}'.format(SCALING_RUNTIME_IMAGES_DEF))
+    parser.add_argument('--group-size', '-g', type=int, default=SCALING_GROUP_SIZE_DEF, help='Number of components in each ordinal group. DEFAULT: {}'.format(SCALING_GROUP_SIZE_DEF))
+    parser.add_argument('--scripts', '-s', type=int, default=SCALING_SCRIPTS_DEF, help='Number of scripts per component. DEFAULT: {}'.format(SCALING_SCRIPTS_DEF))
+    parser.add_argument('--repeat', '-r', type=int, default=SCALING_REPEAT_DEF, help='How many times to run each operation. The fastest run is kept. DEFAULT: {}'.format(SCALING_REPEAT_DEF))
+    parser.add_argument('--max-exponent', '-e', type=float, default=SCALING_MAX_EXPONENT_DEF, help='Fail if time or engine calls grow faster than N to this power between two sizes. DEFAULT: {}'.format(SCALING_MAX_EXPONENT_DEF))
+    parser.add_argument('--json', '-j', default=None, help='Write the results to this file')
+    parser.add_argument('--plot', '-p', default=None, help='Plot the results to this image file. Needs matplotlib')
+    parser.add_argument('--log-level', '-l', default='error', help='Log level of devlab\'s logging. DEFAULT: error')
+    args = parser.parse_args()
+    if args.plot and not PLOT_SUPPORT:
+        print("Plotting needs the 'matplotlib' python module, which is NOT installed")
+        sys.exit(1)
+    logging_init(level=args.log_level)
+    logging.getLogger().setLevel(getattr(logging, args.log_level.upper()))
+    os.environ[DOCKER_BIN_ENV] = FAKE_DOCKER_BIN
+    os.environ.pop('FAKE_DOCKER_LATENCY', None)
+    sizes = sorted(set(args.sizes))
+    project_args = {
+        'runtime_images': args.runtime_images,
+        'scripts': args.scripts
+    }
+    work_dir = tempfile.mkdtemp(prefix='devlab-scaling-')
+    results = {}
+    try:
+        for size in sizes:
+            sys.stderr.write('Measuring N={}\n'.format(size))
+            results[size] = measure_size(size, dict(project_args, groups=max(1, size // args.group_size)), args.repeat, work_dir)
+    finally:
+        os.chdir(BENCH_ROOT)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print_results(sizes, results)
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({'settings': dict(project_args, group_size=args.group_size, repeat=args.repeat), 'results': results}, json_file, indent=4, sort_keys=True)
+    if args.plot:
+        plot_results(sizes, results, args.plot)
+    failures = check_scaling(sizes, results, max_exponent=args.max_exponent)
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
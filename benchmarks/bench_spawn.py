@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Benchmark how much it costs Command to start a process, which adds up over
+the hundreds of short engine calls an action can make.
+
+Every case runs a trivial command many times through Command, the way devlab
+runs the engine (looking for the binary in a tuple of paths) and host scripts
+(with use_shell), and reports the microseconds per spawn next to the cost of
+running the same command with subprocess directly. Looking up the engine's
+binary in its paths is timed on its own too. Results can be saved with --json
+and a later run, on another commit, checked against them with --compare.
+
+Example:
+    ./benchmarks/bench_spawn.py --json before.json
+    ./benchmarks/bench_spawn.py --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+
+BENCH_ROOT = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_ROOT))
+
+from devlab_bench.helpers.command import Command #pylint: disable=wrong-import-position
+from devlab_bench.helpers.docker import DOCKER_BIN_PATHS #pylint: disable=wrong-import-position
+
+SPAWN_CALLS_DEF = 200
+SPAWN_REPEAT_DEF = 3
+#A case has regressed if a spawn got this many times slower, after scaling
+#the baseline by how fast subprocess itself ran
+SPAWN_MAX_RATIO_DEF = 1.5
+
+###-- Functions --###
+def get_engine_paths(binary):
+    """
+    Get paths to look for an engine binary in, where it is only found in the
+    last one, like on a machine where the engine isn't in the first of
+    DOCKER_BIN_PATHS
+
+    Args:
+        binary: str, path to the binary that stands in for the engine
+
+    Returns:
+        tuple
+    """
+    return tuple('/nonexistent{}'.format(path) for path in DOCKER_BIN_PATHS) + (binary,)
+
+def get_cases():
+    """
+    Get the benchmarks
+
+    Returns:
+        list of tuples like: (name, function to time, function doing the same
+        with subprocess directly, or None)
+    """
+    true_bin = shutil.which('true')
+    uname_bin = shutil.which('uname')
+    engine_paths = get_engine_paths(true_bin)
+    raw_true = lambda: subprocess.run([true_bin], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
+    return [
+        ('Command(path)', lambda: Command(true_bin).run(), raw_true),
+        ('Command(engine paths)', lambda: Command(engine_paths).run(), raw_true),
+        ('Command(use_shell)', lambda: Command('uname', args=['-s'], use_shell=True).run(), lambda: subprocess.run([uname_bin, '-s'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)),
+        ('_precheck(engine paths)', lambda: Command(engine_paths)._precheck(), None) #pylint: disable=protected-access
+    ]
+
+def time_calls(func, calls, repeat):
+    """
+    Time calls to a function
+
+    Args:
+        func: function to call
+        calls: int, how many times to call it for each repeat
+        repeat: int, how many repeats to time
+
+    Returns:
+        float, of the fastest microseconds per call of all the repeats
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        timings.append((time.perf_counter() - start) * 1000000 / calls)
+    return min(timings)
+
+def get_commit():
+    """
+    Get the commit that devlab is checked out at, so that results can be told
+    apart
+
+    Returns:
+        str, or None if it isn't a git checkout
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_ROOT, stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(name_filter=None, calls=SPAWN_CALLS_DEF, repeat=SPAWN_REPEAT_DEF):
+    """
+    Run the benchmarks
+
+    Args:
+        name_filter: str, only run the cases with this in their names
+        calls: int, how many spawns to time for each repeat
+        repeat: int, how many repeats to time
+
+    Returns:
+        dict, of the names of the cases, to dicts of their results
+    """
+    results = {}
+    for name, func, raw_func in get_cases():
+        if name_filter and name_filter not in name:
+            continue
+        func()
+        results[name] = {
+            'us': time_calls(func, calls, repeat),
+            'raw_us': None if raw_func is None else time_calls(raw_func, calls, repeat)
+        }
+        sys.stderr.write('{}: {:.1f}us\n'.format(name, results[name]['us']))
+    return results
+
+def get_scaled_baseline(result, base_result):
+    """
+    Get the microseconds per call of a baseline, scaled by how much faster or
+    slower subprocess itself ran than when the baseline was run
+
+    Args:
+        result: dict, of the results of a case
+        base_result: dict, of the results of the same case in the baseline
+
+    Returns:
+        float
+    """
+    if result['raw_us'] and base_result.get('raw_us'):
+        return base_result['us'] * result['raw_us'] / base_result['raw_us']
+    return base_result['us']
+
+def print_results(results, baseline=None):
+    """
+    Print a table of the results, in the same style as devlab's tables
+
+    Args:
+        results: dict, as returned by run_benchmarks
+        baseline: dict, of the results of an earlier run to show next to
+            them
+    """
+    header = {
+        'name': 'Case',
+        'us': 'us/call',
+        'raw_us': 'subprocess us',
+        'overhead': 'Overhead',
+        'baseline': 'Baseline us*',
+        'ratio': 'Ratio'
+    }
+    header_format = "| {name:^24} | {us:^9} | {raw_us:^13} | {overhead:^8} | {baseline:^12} | {ratio:^6} |"
+    row_format = "| {name:24} | {us:>9} | {raw_us:>13} | {overhead:>8} | {baseline:>12} | {ratio:>6} |"
+    table_width = len(header_format.format(**header))
+    table_bar = '{{:-<{}}}'.format(table_width)
+    table = [
+        table_bar.format(''),
+        header_format.format(**header),
+        table_bar.format('')
+    ]
+    for name, result in results.items():
+        base_result = (baseline or {}).get(name, None)
+        table.append(row_format.format(
+            name=name,
+            us='{:,.1f}'.format(result['us']),
+            raw_us='' if result['raw_us'] is None else '{:,.1f}'.format(result['raw_us']),
+            overhead='' if result['raw_us'] is None else '{:.2f}x'.format(result['us'] / result['raw_us']),
+            baseline='' if base_result is None else '{:,.1f}'.format(get_scaled_baseline(result, base_result)),
+            ratio='' if base_result is None else '{:.2f}x'.format(result['us'] / get_scaled_baseline(result, base_result))
+        ))
+    table.append(table_bar.format(''))
+    print('\n## SPAWN BENCHMARKS ##')
+    print('\n'.join(table))
+    if baseline:
+        print('* Scaled by how fast subprocess ran the same command, compared to when the baseline was run')
+
+def compare_results(results, baseline, max_ratio=SPAWN_MAX_RATIO_DEF):
+    """
+    Compare results with a baseline, and print the cases that regressed
+
+    Args:
+        results: dict, as returned by run_benchmarks
+        baseline: dict, of the results of the baseline
+        max_ratio: float, how many times slower a case can get, after
+            scaling the baseline
+
+    Returns:
+        int, the number of cases that regressed
+    """
+    regressed = 0
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base_us = get_scaled_baseline(result, baseline[name])
+        if result['us'] > base_us * max_ratio:
+            print("REGRESSED: '{}' took {:,.1f}us per call, up from {:,.1f}us (scaled)".format(name, result['us'], base_us))
+            regressed += 1
+    return regressed
+
+def main():
+    """
+    Parse the arguments and run the benchmarks
+    """
+    parser = argparse.ArgumentParser(description='Benchmark how much it costs Command to start a process')
+    parser.add_argument('--filter', '-f', default=None, help='Only run the cases with this in their names')
+    parser.add_argument('--calls', '-n', type=int, default=SPAWN_CALLS_DEF, help='How many spawns to time for each repeat. DEFAULT: {}'.format(SPAWN_CALLS_DEF))
+    parser.add_argument('--repeat', '-r', type=int, default=SPAWN_REPEAT_DEF, help='How many times to time each case. DEFAULT: {}'.format(SPAWN_REPEAT_DEF))
+    parser.add_argument('--json', '-j', default=None, help='Write the results to this file, which can be used with --compare')
+    parser.add_argument('--compare', '-C', default=None, help='Compare the results with a file written by --json, and exit non-zero if any case regressed')
+    parser.add_argument('--max-ratio', type=float, default=SPAWN_MAX_RATIO_DEF, help='With --compare, how many times slower a case can get before it has regressed. DEFAULT: {}'.format(SPAWN_MAX_RATIO_DEF))
+    args = parser.parse_args()
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+    results = run_benchmarks(name_filter=args.filter, calls=args.calls, repeat=args.repeat)
+    print_results(results, baseline=baseline)
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({
+                'commit': get_commit(),
+                'python': platform.python_version(),
+                'results': results
+            }, json_file, indent=4, sort_keys=True)
+    if baseline and compare_results(results, baseline, max_ratio=args.max_ratio):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
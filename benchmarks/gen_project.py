@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Generate synthetic devlab projects, with as many components, runtime images,
+ordinal groups and scripts as needed to see how devlab scales with the size
+of a project.
+
+Example:
+    ./benchmarks/gen_project.py /tmp/big_project --components 1000 --runtime-images 20 --groups 50 --scripts 10
+"""
+import argparse
+import json
+import os
+
+GEN_COMPONENTS_DEF = 10
+GEN_RUNTIME_IMAGES_DEF = 2
+GEN_GROUPS_DEF = 3
+GEN_SCRIPTS_DEF = 2
+#Every this many components publishes a port
+GEN_PORTS_EVERY_DEF = 2
+GEN_PORT_BASE = 20000
+GEN_EXTERNAL_IMAGE = 'postgres:15'
+GEN_LAST_MODIFIED = 1713305264
+
+###-- Functions --###
+def get_component_name(comp_num):
+    """
+    Get the name of a generated component
+
+    Args:
+        comp_num: int, the number of the component
+
+    Returns:
+        str
+    """
+    return 'comp{:04d}'.format(comp_num)
+
+def get_runtime_image_name(image_num):
+    """
+    Get the name of a generated runtime image
+
+    Args:
+        image_num: int, the number of the image
+
+    Returns:
+        str
+    """
+    return 'rt_image_{:03d}'.format(image_num)
+
+def generate_config(name, components=GEN_COMPONENTS_DEF, runtime_images=GEN_RUNTIME_IMAGES_DEF, groups=GEN_GROUPS_DEF, scripts=GEN_SCRIPTS_DEF, ports_every=GEN_PORTS_EVERY_DEF):
+    """
+    Generate the config of a synthetic project.
+
+    Components are split into consecutive ordinal groups, so with many groups
+    the project is brought up in many sequential steps. Their images cycle
+    through the runtime images, devlab's helper image and an external image,
+    and their scripts cycle through running in the component's container, in
+    the previous component's container, and in helper containers of the
+    runtime images, so that the images are also needed as reverse
+    dependencies of scripts
+
+    Args:
+        name: str, name of the project, used in its project_filter
+        components: int, the number of components
+        runtime_images: int, the number of runtime images
+        groups: int, the number of ordinal groups
+        scripts: int, the number of scripts each component runs when it is
+            provisioned
+        ports_every: int, every this many components publishes a port. 0
+            means that no component does
+
+    Returns:
+        dict
+    """
+    groups = max(1, min(groups, components))
+    config = {
+        'paths': {
+            'component_persistence': 'persistent_data',
+            'reset_full': ['persistent_data']
+        },
+        'domain': 'bench.lab',
+        'project_filter': 'lab.bench.project={}'.format(name),
+        'wizard_enabled': False,
+        'components': {},
+        'runtime_images': {}
+    }
+    for image_num in range(runtime_images):
+        config['runtime_images'][get_runtime_image_name(image_num)] = {
+            'tag': 'latest',
+            'docker_file': 'docker/{}.Dockerfile'.format(get_runtime_image_name(image_num)),
+            'ordinal': {
+                'group': 0,
+                'number': image_num
+            }
+        }
+    images = [get_runtime_image_name(image_num) for image_num in range(runtime_images)] + ['devlab_helper', GEN_EXTERNAL_IMAGE]
+    for comp_num in range(components):
+        comp_name = get_component_name(comp_num)
+        comp_scripts = []
+        for script_num in range(scripts):
+            if script_num % 3 == 1 and comp_num:
+                comp_scripts.append('running_container|{}-devlab: /bin/true {} {}'.format(get_component_name(comp_num - 1), comp_name, script_num))
+            elif script_num % 3 == 2 and runtime_images:
+                comp_scripts.append('helper_container|{}: SCRIPT_NUM={} /bin/true {}'.format(get_runtime_image_name((comp_num + script_num) % runtime_images), script_num, comp_name))
+            else:
+                comp_scripts.append('/bin/true {} {}'.format(comp_name, script_num))
+        comp_config = {
+            'image': images[comp_num % len(images)],
+            'enabled': True,
+            'env': {
+                'COMPONENT': comp_name
+            },
+            'scripts': comp_scripts,
+            'reset_paths': [
+                'data/'
+            ],
+            'ordinal': {
+                'group': comp_num * groups // components,
+                'number': comp_num
+            }
+        }
+        if ports_every and not comp_num % ports_every:
+            comp_config['ports'] = ['{}:80'.format(GEN_PORT_BASE + comp_num)]
+        config['components'][comp_name] = comp_config
+    return config
+
+def write_project(path, config):
+    """
+    Write a generated project's config, and the Dockerfiles of its runtime
+    images
+
+    Args:
+        path: str, path to the directory to write the project to. It is
+            created if it doesn't exist
+        config: dict, as returned by generate_config
+    """
+    for image_name, image_config in config['runtime_images'].items():
+        docker_file = os.path.join(path, image_config['docker_file'])
+        if not os.path.isdir(os.path.dirname(docker_file)):
+            os.makedirs(os.path.dirname(docker_file))
+        with open(docker_file, 'w') as dfile:
+            dfile.write('FROM devlab_base:latest\nLABEL "last_modified"={}\nLABEL "com.lab.image"="{}"\n'.format(GEN_LAST_MODIFIED, image_name))
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    with open(os.path.join(path, 'DevlabConfig.json'), 'w') as config_file:
+        json.dump(config, config_file, indent=4)
+
+def main():
+    """
+    Parse the arguments and generate the project
+    """
+    parser = argparse.ArgumentParser(description='Generate a synthetic devlab project')
+    parser.add_argument('path', help='Directory to write the project to')
+    parser.add_argument('--components', '-n', type=int, default=GEN_COMPONENTS_DEF, help='Number of components. DEFAULT: {}'.format(GEN_COMPONENTS_DEF))
+    parser.add_argument('--runtime-images', '-m', type=int, default=GEN_RUNTIME_IMAGES_DEF, help='Number of runtime images. DEFAULT: {}'.format(GEN_RUNTIME_IMAGES_DEF))
+    parser.add_argument('--groups', '-g', type=int, default=GEN_GROUPS_DEF, help='Number of ordinal groups. DEFAULT: {}'.format(GEN_GROUPS_DEF))
+    parser.add_argument('--scripts', '-s', type=int, default=GEN_SCRIPTS_DEF, help='Number of scripts per component. DEFAULT: {}'.format(GEN_SCRIPTS_DEF))
+    parser.add_argument('--ports-every', '-p', type=int, default=GEN_PORTS_EVERY_DEF, help='Every this many components publishes a port. 0 means none do. DEFAULT: {}'.format(GEN_PORTS_EVERY_DEF))
+    args = parser.parse_args()
+    config = generate_config(
+        os.path.basename(os.path.abspath(args.path)),
+        components=args.components,
+        runtime_images=args.runtime_images,
+        groups=args.groups,
+        scripts=args.scripts,
+        ports_every=args.ports_every
+    )
+    write_project(args.path, config)
+
+if __name__ == '__main__':
+    main()
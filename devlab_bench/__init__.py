@@ -43,7 +43,8 @@ CONFIG_DEF = {
     'reprovisionable_components': [],
     'runtime_images': {},
     'paths': {},
-    'disable_buildkit': False
+    'disable_buildkit': False,
+    'snapshot_keep': 5
 }
 LOGGING_LEVELS = {
     'debug': logging.DEBUG,
@@ -55,3 +56,4 @@ LOGGING_LEVELS = {
 }
 PROJ_ROOT = get_proj_root()
 UP_ENV_FILE = '{}/{}/devlab_up.env'.format(PROJ_ROOT, '.')
+LOCK_TIMEOUT = 60
@@ -1,26 +1,38 @@
 """
 Initialize the different action types available
 """
+import devlab_bench.actions.agent
+import devlab_bench.actions.bench
 import devlab_bench.actions.build
 import devlab_bench.actions.down
 import devlab_bench.actions.global_restart
 import devlab_bench.actions.global_status
+import devlab_bench.actions.history
+import devlab_bench.actions.logs
+import devlab_bench.actions.metrics
 import devlab_bench.actions.restart
 import devlab_bench.actions.reset
 import devlab_bench.actions.shell
+import devlab_bench.actions.snapshots
 import devlab_bench.actions.status
 import devlab_bench.actions.up
 import devlab_bench.actions.upgrade
 import devlab_bench.actions.update
 
 __all__ = [
+    'agent',
+    'bench',
     'build',
     'down',
     'global_restart',
     'global_status',
+    'history',
+    'logs',
+    'metrics',
     'restart',
     'reset',
     'shell',
+    'snapshots',
     'status',
     'up',
     'update'
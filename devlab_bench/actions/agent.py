@@ -0,0 +1,801 @@
+"""
+Things dealing with the 'agent' action
+
+The agent is a long-lived process that keeps around the things that every
+devlab command would otherwise have to set up from scratch: the imported
+modules, each project's parsed config, its DockerHelper (which checks the
+engine when it is created) and the list of the project's containers.
+
+The devlab command hands its arguments, environment, working directory and
+stdin/stdout/stderr to the agent over a unix socket. The agent forks a child
+for each request, which runs the command directly on the client's file
+descriptors, so output streams straight to the client's terminal and
+interactive shells work as usual. When no agent is running, the devlab command
+runs everything itself.
+
+Cached container lists are dropped whenever 'docker events' reports a change
+to a container, and whenever a command that changed containers finishes. If
+'docker events' isn't available, nothing is cached.
+
+The agent can also serve the output of the 'metrics' action over HTTP, for
+every project it has run a command for, so that Prometheus can scrape it. Each
+scrape is handled in a child process, from the agent's cached containers.
+"""
+import array
+import errno
+import io
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import time
+import traceback
+
+import devlab_bench
+import devlab_bench.helpers
+import devlab_bench.helpers.command
+import devlab_bench.helpers.common
+import devlab_bench.helpers.docker
+from devlab_bench.helpers.command import Command
+from devlab_bench.helpers.common import get_config, get_proj_root
+from devlab_bench.actions.metrics import METRICS_HEALTH_AGE_DEF, collect_metrics, get_metric_families
+from devlab_bench.helpers.docker import DOCKER_HELPERS, DockerHelper, get_project_docker_helper
+from devlab_bench.helpers.metrics import OPENMETRICS_CONTENT_TYPE, format_openmetrics
+
+AGENT_SOCKET_ENV = 'DEVLAB_AGENT_SOCKET'
+AGENT_SOCKET_DEF = '~/.devlab/agent.sock'
+AGENT_LOG_FILE = 'agent.log'
+AGENT_MAX_REQUEST = 16 * 1024 * 1024
+AGENT_REQUEST_TIMEOUT = 5
+AGENT_START_TIMEOUT = 5
+AGENT_STD_FDS = 3
+AGENT_METRICS_PATH = '/metrics'
+AGENT_METRICS_MAX_REQUEST = 65536
+#Content type for scrapers that don't ask for OpenMetrics
+AGENT_METRICS_TEXT_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+PROJECTS = {}
+RUNNING = True
+
+def action(socket_path=None, detach=False, stop=False, metrics_listen=None, entrypoint=None, **kwargs):
+    """
+    Run, or stop, the devlab agent
+
+    Args:
+        socket_path: str, path of the unix socket to listen on. Default is
+            $DEVLAB_AGENT_SOCKET or AGENT_SOCKET_DEF
+        detach: bool, whether to run the agent in the background
+        stop: bool, whether to stop the running agent instead
+        metrics_listen: str, address and port to serve metrics over HTTP on,
+            like '127.0.0.1:9595'. Default is to not serve metrics
+        entrypoint: function, that runs a devlab command. It is passed the
+            list of arguments and returns the exit code
+    """
+    ignored_args = kwargs
+    log = logging.getLogger('Agent')
+    socket_path = get_agent_socket(socket_path)
+    if stop:
+        reply = send_request({'op': 'stop'}, socket_path)
+        if reply is None:
+            log.info("No devlab agent is running on: %s", socket_path)
+            sys.exit(0)
+        log.info("Stopped devlab agent: %s", ' '.join(reply[1:]))
+        sys.exit(0)
+    reply = send_request({'op': 'ping'}, socket_path)
+    if reply is not None:
+        log.error("A devlab agent is already running on: %s with pid: %s", socket_path, ' '.join(reply[1:]))
+        sys.exit(1)
+    metrics_address = None
+    if metrics_listen:
+        metrics_address = parse_listen_address(metrics_listen)
+        if metrics_address is None:
+            log.error("Invalid address to serve metrics on: '%s'. It should look like: '127.0.0.1:9595'", metrics_listen)
+            sys.exit(1)
+    socket_dir = os.path.dirname(socket_path)
+    if not os.path.isdir(socket_dir):
+        os.makedirs(socket_dir, 0o700)
+    if detach:
+        log_path = '{}/{}'.format(socket_dir, AGENT_LOG_FILE)
+        agent_pid = os.fork()
+        if agent_pid != 0:
+            os.waitpid(agent_pid, 0)
+            deadline = time.time() + AGENT_START_TIMEOUT
+            while time.time() < deadline:
+                reply = send_request({'op': 'ping'}, socket_path)
+                if reply is not None:
+                    log.info("Started devlab agent on: %s with pid: %s. Logging to: %s", socket_path, ' '.join(reply[1:]), log_path)
+                    sys.exit(0)
+                time.sleep(0.05)
+            log.error("The devlab agent didn't start. See: %s", log_path)
+            sys.exit(1)
+        #Detach from the terminal and from this process
+        os.setsid()
+        if os.fork() != 0:
+            os._exit(0) #pylint: disable=protected-access
+        log_fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(log_fd, 1)
+        os.dup2(log_fd, 2)
+        os.close(devnull)
+        os.close(log_fd)
+        try:
+            serve(socket_path, entrypoint, metrics_address=metrics_address, logger=log)
+        finally:
+            os._exit(0) #pylint: disable=protected-access
+    serve(socket_path, entrypoint, metrics_address=metrics_address, logger=log)
+    sys.exit(0)
+
+def get_agent_socket(socket_path=None):
+    """
+    Get the path of the agent's unix socket
+
+    Args:
+        socket_path: str, path to use instead of the default
+
+    Returns:
+        str
+    """
+    if not socket_path:
+        socket_path = os.environ.get(AGENT_SOCKET_ENV, AGENT_SOCKET_DEF)
+    return os.path.abspath(os.path.expanduser(socket_path))
+
+def parse_listen_address(listen):
+    """
+    Parse an address and port to listen on
+
+    Args:
+        listen: str, like '127.0.0.1:9595', '[::1]:9595' or ':9595' (for all
+            addresses)
+
+    Returns:
+        tuple of the address and port, or None if it isn't valid
+    """
+    address, _, port = listen.rpartition(':')
+    try:
+        port = int(port)
+    except ValueError:
+        return None
+    if not 0 < port < 65536:
+        return None
+    return (address.strip('[]'), port)
+
+def send_request(request, socket_path):
+    """
+    Send a request that doesn't run a command ('ping' or 'stop') to the agent
+
+    Args:
+        request: dict, of the request
+        socket_path: str, path of the agent's unix socket
+
+    Returns:
+        list of the words in the agent's reply, or None if no agent is running
+    """
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.settimeout(AGENT_REQUEST_TIMEOUT)
+    try:
+        conn.connect(socket_path)
+        payload = json.dumps(request).encode('utf-8')
+        conn.sendall(struct.pack('!I', len(payload)) + payload)
+        reply = conn.makefile('r').readline().split()
+    except (OSError, socket.timeout):
+        return None
+    finally:
+        conn.close()
+    if not reply or reply[0] != 'ok':
+        return None
+    return reply
+
+def get_peer_uid(conn):
+    """
+    Get the uid of the process on the other end of a unix socket
+
+    Args:
+        conn: socket, the connection
+
+    Returns:
+        int, or None if the platform doesn't support looking it up
+    """
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    return struct.unpack('3i', creds)[1]
+
+def recv_request(conn):
+    """
+    Read a request from a client, along with any file descriptors it passed
+
+    Args:
+        conn: socket, the client's connection
+
+    Returns:
+        tuple where:
+            First Element is a dict of the request
+            Second Element is a list of the file descriptors that were passed
+
+    Raises:
+        ValueError if the request is invalid
+    """
+    fds = array.array('i')
+    msg, ancdata = conn.recvmsg(65536, socket.CMSG_SPACE(AGENT_STD_FDS * fds.itemsize))[:2]
+    for cmsg_level, cmsg_type, cmsg_data in ancdata:
+        if cmsg_level == socket.SOL_SOCKET and cmsg_type == socket.SCM_RIGHTS:
+            fds.frombytes(cmsg_data[:len(cmsg_data) - (len(cmsg_data) % fds.itemsize)])
+    fds = list(fds)
+    #Unlike the ones python opens, file descriptors received over a socket are
+    #inheritable. The commands of a request must only get the ones that are
+    #put in place of its stdin, stdout and stderr
+    for fdn in fds:
+        os.set_inheritable(fdn, False)
+    try:
+        if len(msg) < 4:
+            raise ValueError('Incomplete request')
+        size = struct.unpack('!I', msg[:4])[0]
+        if size > AGENT_MAX_REQUEST:
+            raise ValueError('Request is too large')
+        data = msg[4:]
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise ValueError('Incomplete request')
+            data += chunk
+        return (json.loads(data.decode('utf-8')), fds)
+    except (OSError, ValueError):
+        for fdn in fds:
+            os.close(fdn)
+        raise
+
+def get_config_signature(proj_root):
+    """
+    Get a signature of a project's config files, that changes whenever any of
+    them are changed
+
+    Args:
+        proj_root: str, path to the project's root
+
+    Returns:
+        tuple
+    """
+    signature = []
+    for cfile_dir in (proj_root, '{}/defaults'.format(proj_root)):
+        for cfile_name in devlab_bench.CONFIG_FILE_NAMES:
+            try:
+                cfile_stat = os.stat('{}/{}'.format(cfile_dir, cfile_name))
+            except OSError:
+                continue
+            signature.append((cfile_dir, cfile_name, cfile_stat.st_mtime_ns, cfile_stat.st_size))
+    return tuple(signature)
+
+def prepare_project(cwd, events_running, logger=None):
+    """
+    Make sure the config and DockerHelper of the project that a request is for
+    are loaded and up to date, so that the request's child process inherits
+    them
+
+    Args:
+        cwd: str, the working directory of the client
+        events_running: bool, whether 'docker events' is being followed, which
+            is needed for caching the project's containers
+        logger: Logger object to use for log messages
+
+    Returns:
+        dict of the project's details, or None if the directory isn't part of
+        a project that can be prepared ahead of time
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Agent')
+    try:
+        proj_root = get_proj_root(cwd)
+    except SystemExit:
+        return None
+    if not proj_root:
+        return None
+    config_sig = get_config_signature(proj_root)
+    project = PROJECTS.get(proj_root, None)
+    if not project or project['config_sig'] != config_sig:
+        log.debug("Loading config for project: %s", proj_root)
+        devlab_bench.PROJ_ROOT = proj_root
+        try:
+            config = get_config(force_reload=True)
+        except SystemExit:
+            return None
+        if not config['components'] and 'foreground_component' not in config:
+            return None
+        DOCKER_HELPERS.pop(proj_root, None)
+        try:
+            get_project_docker_helper()
+        except SystemExit:
+            log.error("Failed setting up a DockerHelper for project: %s", proj_root)
+            return None
+        project = {
+            'root': proj_root,
+            'config': config,
+            'config_sig': config_sig,
+            'up_env_file': devlab_bench.UP_ENV_FILE,
+            'running': set()
+        }
+        PROJECTS[proj_root] = project
+    docker_helper = DOCKER_HELPERS[proj_root]
+    if events_running:
+        if docker_helper.cache is None:
+            docker_helper.enable_cache()
+        #Keep the project's list of containers warm
+        docker_helper.get_containers()
+    else:
+        docker_helper.disable_cache()
+    return project
+
+def handle_event(line, logger=None):
+    """
+    Drop cached container details after a 'docker events' event
+
+    Args:
+        line: bytes, of the event in JSON
+        logger: Logger object to use for log messages
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Agent')
+    try:
+        event = json.loads(line.decode('utf-8'))
+        project = event.get('Actor', {}).get('Attributes', {}).get('com.lab.project', None)
+    except (AttributeError, ValueError):
+        project = None
+    if project in DOCKER_HELPERS:
+        log.debug("Container event for project: %s", project)
+        DOCKER_HELPERS[project].clear_cache()
+        return
+    for docker_helper in DOCKER_HELPERS.values():
+        docker_helper.clear_cache()
+
+def reset_process_state(request):
+    """
+    Set up a request's child process to look like a devlab command that was
+    started by the client
+
+    Args:
+        request: dict, of the request
+    """
+    os.environ.clear()
+    os.environ.update(request['env'])
+    os.umask(request['umask'])
+    os.chdir(request['cwd'])
+    sys.stdin = io.TextIOWrapper(io.FileIO(0, 'r', closefd=False))
+    sys.stdout = io.TextIOWrapper(io.FileIO(1, 'w', closefd=False), line_buffering=True)
+    sys.stderr = io.TextIOWrapper(io.FileIO(2, 'w', closefd=False), line_buffering=True)
+    isatty = sys.stdout.isatty()
+    devlab_bench.ISATTY = isatty
+    devlab_bench.helpers.ISATTY = isatty
+    devlab_bench.helpers.common.ISATTY = isatty
+    devlab_bench.helpers.command.ISATTY = isatty
+    for signum in (signal.SIGTERM, signal.SIGHUP, signal.SIGCHLD):
+        signal.signal(signum, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    #Let logging_init set logging up again for the client's terminal
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    for l_name, l_level in devlab_bench.LOGGING_LEVELS.items():
+        if l_level != logging.NOTSET:
+            logging.addLevelName(l_level, l_name.upper())
+
+def run_request(conn, request, fds, project, entrypoint):
+    """
+    Body of a request's child process. Runs the command on the client's file
+    descriptors, and reports its exit code back to the client. This never
+    returns
+
+    Args:
+        conn: socket, the client's connection
+        request: dict, of the request
+        fds: list, of the client's stdin, stdout and stderr
+        project: dict, of the project's details as returned by
+            prepare_project, or None
+        entrypoint: function, that runs a devlab command
+    """
+    exit_code = 0
+    try:
+        os.setpgid(0, 0)
+        for idx, fdn in enumerate(fds):
+            os.dup2(fdn, idx)
+            os.close(fdn)
+        reset_process_state(request)
+        devlab_bench.helpers.docker.DOCKER = None
+        #The command saves the latency of its own docker operations
+        for project_helper in DOCKER_HELPERS.values():
+            project_helper.latency = {}
+        docker_helper = None
+        cache_generation = None
+        if project:
+            devlab_bench.PROJ_ROOT = project['root']
+            devlab_bench.CONFIG = project['config']
+            devlab_bench.UP_ENV_FILE = project['up_env_file']
+            docker_helper = DOCKER_HELPERS[project['root']]
+            if project['running']:
+                #Other commands for the project are still running, and may be
+                #changing its containers
+                docker_helper.clear_cache()
+            cache_generation = docker_helper.cache_generation
+        else:
+            devlab_bench.PROJ_ROOT = get_proj_root()
+            devlab_bench.CONFIG = {}
+        conn.sendall('pid {}\n'.format(os.getpid()).encode('utf-8'))
+        try:
+            cmd_rc = entrypoint(request['argv'])
+        except SystemExit as exc:
+            if exc.code is None:
+                cmd_rc = 0
+            elif isinstance(exc.code, int):
+                cmd_rc = exc.code
+            else:
+                sys.stderr.write('{}\n'.format(exc.code))
+                cmd_rc = 1
+        except KeyboardInterrupt:
+            cmd_rc = 130
+        except Exception: #pylint: disable=broad-except
+            traceback.print_exc()
+            cmd_rc = 1
+        sys.stdout.flush()
+        sys.stderr.flush()
+        conn.sendall('rc {}\n'.format(cmd_rc).encode('utf-8'))
+        #Tell the agent whether this command changed the project's containers
+        if docker_helper and docker_helper.cache_generation != cache_generation:
+            exit_code = 1
+    except Exception: #pylint: disable=broad-except
+        exit_code = 1
+    finally:
+        os._exit(exit_code) #pylint: disable=protected-access
+
+def handle_connection(conn, listeners, events_proc, children, entrypoint, logger=None):
+    """
+    Handle a request from a client
+
+    Args:
+        conn: socket, the client's connection
+        listeners: list, of the agent's listening sockets, which the child
+            closes
+        events_proc: subprocess.Popen, of 'docker events', or None
+        children: dict, of the pids of running requests and the project
+            roots they are for
+        entrypoint: function, that runs a devlab command
+        logger: Logger object to use for log messages
+    """
+    global RUNNING #pylint: disable=global-statement
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Agent')
+    conn.settimeout(AGENT_REQUEST_TIMEOUT)
+    fds = []
+    try:
+        peer_uid = get_peer_uid(conn)
+        if peer_uid is not None and peer_uid != os.geteuid():
+            log.warning("Refusing request from uid: %s", peer_uid)
+            return
+        request, fds = recv_request(conn)
+        if request.get('op') == 'ping':
+            conn.sendall('ok {}\n'.format(os.getpid()).encode('utf-8'))
+            return
+        if request.get('op') == 'stop':
+            log.info("Stopping")
+            conn.sendall('ok {}\n'.format(os.getpid()).encode('utf-8'))
+            RUNNING = False
+            return
+        if len(fds) != AGENT_STD_FDS:
+            conn.sendall(b'refused Missing stdin/stdout/stderr\n')
+            return
+        if request.get('devlab') != os.path.realpath(entrypoint.__code__.co_filename):
+            conn.sendall('refused Agent is running: {}\n'.format(os.path.realpath(entrypoint.__code__.co_filename)).encode('utf-8'))
+            return
+        log.debug("Running: %s in: %s", request['argv'], request['cwd'])
+        project = prepare_project(request['cwd'], events_running=events_proc is not None, logger=log)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        conn.settimeout(None)
+        child_pid = os.fork()
+        if child_pid == 0:
+            for listener in listeners:
+                listener.close()
+            if events_proc:
+                events_proc.stdout.close()
+            run_request(conn, request, fds, project, entrypoint)
+        children[child_pid] = project['root'] if project else None
+        if project:
+            project['running'].add(child_pid)
+    except (OSError, ValueError, socket.timeout) as exc:
+        log.warning("Failed handling request: %s", exc)
+    finally:
+        for fdn in fds:
+            os.close(fdn)
+        conn.close()
+
+def handle_metrics_connection(conn, listeners, events_proc, children, logger=None):
+    """
+    Handle a scrape of the agent's metrics, in a child process, so that slow
+    status scripts don't hold up the agent
+
+    Args:
+        conn: socket, the scraper's connection
+        listeners: list, of the agent's listening sockets, which the child
+            closes
+        events_proc: subprocess.Popen, of 'docker events', or None
+        children: dict, of the pids of running requests and the project
+            roots they are for
+        logger: Logger object to use for log messages
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Agent')
+    if events_proc:
+        #Warm the cached containers, so that the next scrape's child doesn't
+        #have to ask the engine for them again
+        for proj_root in PROJECTS:
+            docker_helper = DOCKER_HELPERS[proj_root]
+            containers = docker_helper.get_containers()[1]
+            docker_helper.inspect_containers([container['name'] for container in containers if isinstance(container, dict)])
+    sys.stdout.flush()
+    sys.stderr.flush()
+    try:
+        child_pid = os.fork()
+    except OSError as exc:
+        log.warning("Failed handling metrics request: %s", exc)
+        conn.close()
+        return
+    if child_pid == 0:
+        exit_code = 0
+        try:
+            for listener in listeners:
+                listener.close()
+            if events_proc:
+                events_proc.stdout.close()
+            for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+                signal.signal(signum, signal.SIG_DFL)
+            serve_metrics(conn, logger=log)
+        except Exception: #pylint: disable=broad-except
+            log.warning("Failed handling metrics request: %s", traceback.format_exc())
+            exit_code = 1
+        finally:
+            os._exit(exit_code) #pylint: disable=protected-access
+    children[child_pid] = None
+    conn.close()
+
+def serve_metrics(conn, logger=None):
+    """
+    Body of a metrics scrape's child process. Reads the HTTP request, and
+    replies with the metrics of every project the agent knows about
+
+    Args:
+        conn: socket, the scraper's connection
+        logger: Logger object to use for log messages
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Agent')
+    conn.settimeout(AGENT_REQUEST_TIMEOUT)
+    request = b''
+    while b'\r\n\r\n' not in request and b'\n\n' not in request:
+        chunk = conn.recv(4096)
+        if not chunk or len(request) > AGENT_METRICS_MAX_REQUEST:
+            return
+        request += chunk
+    request_lines = request.decode('latin-1').splitlines()
+    try:
+        method, path = request_lines[0].split()[:2]
+    except ValueError:
+        method, path = (None, None)
+    headers = {}
+    for header in request_lines[1:]:
+        if ':' in header:
+            header_name, header_value = header.split(':', 1)
+            headers[header_name.strip().lower()] = header_value.strip()
+    if method not in ('GET', 'HEAD'):
+        send_http_reply(conn, '405 Method Not Allowed', 'text/plain; charset=utf-8', 'Only GET is supported\n')
+        return
+    if path.split('?')[0] != AGENT_METRICS_PATH:
+        send_http_reply(conn, '404 Not Found', 'text/plain; charset=utf-8', 'Metrics are served on: {}\n'.format(AGENT_METRICS_PATH))
+        return
+    families = get_metric_families()
+    for proj_root in sorted(PROJECTS):
+        project = PROJECTS[proj_root]
+        devlab_bench.PROJ_ROOT = project['root']
+        devlab_bench.CONFIG = project['config']
+        devlab_bench.UP_ENV_FILE = project['up_env_file']
+        devlab_bench.helpers.docker.DOCKER = DOCKER_HELPERS[proj_root]
+        try:
+            collect_metrics(families, max_health_age=METRICS_HEALTH_AGE_DEF, logger=log)
+        except (Exception, SystemExit) as exc: #pylint: disable=broad-except
+            log.warning("Failed collecting metrics for project: %s: %s", proj_root, exc)
+    if 'application/openmetrics-text' in headers.get('accept', ''):
+        content_type = OPENMETRICS_CONTENT_TYPE
+    else:
+        content_type = AGENT_METRICS_TEXT_CONTENT_TYPE
+    send_http_reply(conn, '200 OK', content_type, format_openmetrics(families), head=method == 'HEAD')
+
+def send_http_reply(conn, status, content_type, body, head=False):
+    """
+    Send an HTTP reply, and close the connection
+
+    Args:
+        conn: socket, the client's connection
+        status: str, the status, like '200 OK'
+        content_type: str, the content type of the body
+        body: str, the body
+        head: bool, whether to leave the body out, for a HEAD request
+    """
+    body = body.encode('utf-8')
+    reply = 'HTTP/1.0 {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: close\r\n\r\n'.format(status, content_type, len(body)).encode('utf-8')
+    if not head:
+        reply += body
+    conn.sendall(reply)
+    conn.close()
+
+def reap_children(children, logger=None):
+    """
+    Clean up after requests that have finished, dropping the cached containers
+    of their projects if they changed any
+
+    Args:
+        children: dict, of the pids of running requests and the project roots
+            they are for
+        logger: Logger object to use for log messages
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Agent')
+    for child_pid in list(children):
+        try:
+            wait_pid, wait_status = os.waitpid(child_pid, os.WNOHANG)
+        except OSError as exc:
+            if exc.errno != errno.ECHILD:
+                raise
+            wait_pid, wait_status = (child_pid, 0)
+        if wait_pid == 0:
+            continue
+        proj_root = children.pop(child_pid)
+        if proj_root in PROJECTS:
+            PROJECTS[proj_root]['running'].discard(child_pid)
+        if proj_root in DOCKER_HELPERS and wait_status != 0:
+            log.debug("Request: %s changed containers of project: %s", child_pid, proj_root)
+            DOCKER_HELPERS[proj_root].clear_cache()
+
+def start_events(logger=None):
+    """
+    Start following container events from the engine
+
+    Args:
+        logger: Logger object to use for log messages
+
+    Returns:
+        subprocess.Popen, or None if the events can't be followed
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Agent')
+    docker_bin = Command(DockerHelper(skip_checks=True).docker_bin_paths)._precheck() #pylint: disable=protected-access
+    if docker_bin[0] != 0:
+        return None
+    try:
+        return subprocess.Popen(
+            [docker_bin[1], 'events', '--format', '{{json .}}', '--filter', 'type=container'],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+    except OSError as exc:
+        log.warning("Can't follow container events, so containers won't be cached: %s", exc)
+        return None
+
+def serve(socket_path, entrypoint, metrics_address=None, logger=None):
+    """
+    Listen for, and handle requests until told to stop
+
+    Args:
+        socket_path: str, path of the unix socket to listen on
+        entrypoint: function, that runs a devlab command
+        metrics_address: tuple, of the address and port to serve metrics over
+            HTTP on, or None
+        logger: Logger object to use for log messages
+    """
+    global RUNNING #pylint: disable=global-statement
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Agent')
+    def stop_serving(signum, frame):
+        """
+        Stop the agent on SIGTERM/SIGINT
+        """
+        global RUNNING #pylint: disable=global-statement
+        ignored_args = (signum, frame)
+        RUNNING = False
+    signal.signal(signal.SIGTERM, stop_serving)
+    signal.signal(signal.SIGINT, stop_serving)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)
+    try:
+        listener.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    listener.listen(64)
+    metrics_listener = None
+    if metrics_address:
+        metrics_listener = socket.socket(socket.AF_INET6 if ':' in metrics_address[0] else socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            metrics_listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            metrics_listener.bind(metrics_address)
+            metrics_listener.listen(16)
+        except OSError as exc:
+            log.error("Can't serve metrics on: %s:%s: %s", metrics_address[0], metrics_address[1], exc)
+            metrics_listener.close()
+            listener.close()
+            os.remove(socket_path)
+            return
+        log.info("Serving metrics on: http://%s:%s%s", metrics_address[0] or '0.0.0.0', metrics_address[1], AGENT_METRICS_PATH)
+    listeners = [listener]
+    if metrics_listener:
+        listeners.append(metrics_listener)
+    events_proc = start_events(logger=log)
+    events_buf = b''
+    children = {}
+    log.info("Listening on: %s with pid: %s", socket_path, os.getpid())
+    try:
+        while RUNNING:
+            read_list = list(listeners)
+            if events_proc:
+                read_list.append(events_proc.stdout)
+            try:
+                ready = select.select(read_list, [], [], 0.5)[0]
+            except (OSError, select.error) as exc:
+                if exc.args[0] == errno.EINTR:
+                    continue
+                raise
+            reap_children(children, logger=log)
+            if events_proc and events_proc.stdout in ready:
+                data = os.read(events_proc.stdout.fileno(), 65536)
+                if not data:
+                    log.warning("Stopped receiving container events, so containers won't be cached anymore")
+                    events_proc.wait()
+                    events_proc = None
+                    for docker_helper in DOCKER_HELPERS.values():
+                        docker_helper.disable_cache()
+                events_buf += data
+                while b'\n' in events_buf:
+                    line, events_buf = events_buf.split(b'\n', 1)
+                    handle_event(line, logger=log)
+            if listener in ready:
+                try:
+                    conn = listener.accept()[0]
+                except OSError:
+                    continue
+                handle_connection(conn, listeners, events_proc, children, entrypoint, logger=log)
+            if metrics_listener and metrics_listener in ready:
+                try:
+                    conn = metrics_listener.accept()[0]
+                except OSError:
+                    continue
+                handle_metrics_connection(conn, listeners, events_proc, children, logger=log)
+    finally:
+        listener.close()
+        if metrics_listener:
+            metrics_listener.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        if events_proc:
+            events_proc.terminate()
+            events_proc.wait()
+    log.info("Stopped")
@@ -0,0 +1,507 @@
+"""
+Things dealing with the 'bench' action
+"""
+import datetime
+import json
+import logging
+import sys
+import threading
+import time
+
+import devlab_bench
+import devlab_bench.actions.down
+import devlab_bench.actions.reset
+import devlab_bench.actions.up
+import devlab_bench.helpers.docker
+import devlab_bench.helpers.trace
+from devlab_bench.actions.history import HISTORY_REGRESSION_MIN, HISTORY_REGRESSION_RATIO, percentile, print_table
+from devlab_bench.actions.status import check_health
+from devlab_bench.helpers.common import get_components, get_config, get_primary_ip, unnest_list
+from devlab_bench.helpers.docker import parse_docker_local_ports
+from devlab_bench.helpers.history import get_config_hash
+from devlab_bench.helpers.locks import component_locks
+from devlab_bench.helpers.trace import get_spans, span, start_tracing
+
+BENCH_VERSION = 1
+BENCH_CYCLES_DEF = 3
+BENCH_HEALTH_TIMEOUT_DEF = 120
+BENCH_HEALTH_INTERVAL_DEF = 0.5
+BENCH_PERCENTILES = (50, 95)
+#The phases of every cycle, in the order they are run
+BENCH_PHASES = ('reset', 'cold up', 'down', 'warm up')
+BENCH_UP_PHASES = ('cold up', 'warm up')
+BENCH_METRICS = ('running', 'healthy')
+#Spans that end when a component's container or process has been started
+RUNNING_SPANS = ('run container', 'start container', 'start host component')
+
+###-- Classes --###
+class UpTimer(object):
+    """
+    Times how long it takes for each component to be running and to be
+    healthy, while the components are being brought up
+    """
+    def __init__(self, components, config, health_timeout=BENCH_HEALTH_TIMEOUT_DEF, health_interval=BENCH_HEALTH_INTERVAL_DEF, logger=None):
+        """
+        Initialize the UpTimer Object
+
+        Args:
+            components: list, of the components being brought up
+            config: dict, of the project's config
+            health_timeout: float, how many seconds to keep checking the
+                health of components after they have all been brought up
+            health_interval: float, how many seconds to wait between checks
+                of the health of components
+            logger: Logger object to use for log messages
+        """
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger('UpTimer')
+        #Failing health checks are expected while components are starting
+        self.health_log = logging.getLogger('{}.Health'.format(self.log.name))
+        if not self.log.isEnabledFor(logging.DEBUG):
+            self.health_log.setLevel(logging.ERROR)
+        self.components = components
+        self.config = config
+        self.health_timeout = health_timeout
+        self.health_interval = health_interval
+        self.host_ip = get_primary_ip()
+        self.start = None
+        self.up_end = None
+        self.span_idx = 0
+        self.thread = None
+        self.timings = {}
+    def __enter__(self):
+        self.span_idx = len(get_spans())
+        self.start = time.time()
+        self.up_end = None
+        self.timings = {}
+        for comp in self.components:
+            self.timings[comp] = {
+                'running': None,
+                'healthy': None
+            }
+        self.thread = threading.Thread(target=self._poll, name='bench-health')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.health_timeout = 0
+        self.up_end = time.time()
+        self.thread.join()
+        for comp in self.components:
+            if self.timings[comp]['running'] is None:
+                self.log.warning("Component: '%s' was never started while it was being brought up", comp)
+            elif self.timings[comp]['healthy'] is None and self.has_health_check(comp) and exc_type is None:
+                self.log.warning("Component: '%s' wasn't healthy %ss after all components were brought up", comp, self.health_timeout)
+    def has_health_check(self, comp):
+        """
+        Determine if a component's health can be checked, which needs either
+        a status_script or ports
+
+        Args:
+            comp: str, name of the component
+
+        Returns:
+            bool
+        """
+        comp_config = self.config['components'][comp]
+        return bool(comp_config.get('status_script', None) or comp_config.get('ports', None))
+    def _update_running(self):
+        """
+        Find the components that have been started since the last time, from
+        the trace spans of starting them
+        """
+        spans = get_spans()
+        for trace_span in spans[self.span_idx:]:
+            comp = trace_span['args'].get('component', None)
+            if trace_span['name'] in RUNNING_SPANS and comp in self.timings and self.timings[comp]['running'] is None:
+                self.timings[comp]['running'] = (trace_span['ts'] + trace_span['dur']) / 1000000.0 - self.start
+        self.span_idx = len(spans)
+    def _check_health(self, comp):
+        """
+        Check if a running component is healthy
+
+        Args:
+            comp: str, name of the component
+
+        Returns:
+            bool
+        """
+        comp_config = self.config['components'][comp]
+        local_ports = [parse_docker_local_ports(port) for port in comp_config.get('ports', [])]
+        format_fillers = {
+            'container_name': '{}-devlab'.format(comp),
+            'host_ip': self.host_ip,
+            'local_port': (local_ports or [''])[0].split('(')[0]
+        }
+        return check_health(comp, comp_config, format_fillers['container_name'], format_fillers, logger=self.health_log)['health'] == 'healthy'
+    def _poll(self):
+        """
+        Keep checking the health of the components that are running, until
+        they are all healthy, or until health_timeout after they have all
+        been brought up
+        """
+        while True:
+            up_end = self.up_end
+            self._update_running()
+            waiting = False
+            for comp in self.components:
+                if self.timings[comp]['healthy'] is not None or not self.has_health_check(comp):
+                    continue
+                waiting = True
+                if self.timings[comp]['running'] is None:
+                    continue
+                if self._check_health(comp):
+                    self.timings[comp]['healthy'] = time.time() - self.start
+                    self.log.debug("Component: '%s' is healthy after %.2fs", comp, self.timings[comp]['healthy'])
+            if up_end is not None and (not waiting or time.time() > up_end + self.health_timeout):
+                break
+            time.sleep(self.health_interval)
+
+###-- Functions --###
+def action(components='*', cycles=BENCH_CYCLES_DEF, output=None, compare=None, health_timeout=BENCH_HEALTH_TIMEOUT_DEF, health_interval=BENCH_HEALTH_INTERVAL_DEF, **kwargs):
+    """
+    Benchmark how long it takes to bring up the project's components, by
+    running cycles of resetting them (so they are missing), bringing them up
+    cold, bringing them down (so they are stopped) and bringing them up warm
+
+    Args:
+        components: list of components to benchmark, this can also be the
+            string '*' for all
+        cycles: int, how many cycles to run
+        output: str, path of the file to write the results to, as JSON.
+            DEFAULT: a new timestamped file in the project's persistence
+            directory
+        compare: str, path of the results of an earlier benchmark to compare
+            these results to
+        health_timeout: float, how many seconds to keep checking the health
+            of components after they have all been brought up
+        health_interval: float, how many seconds to wait between checks of
+            the health of components
+
+    Returns:
+        None
+    """
+    ignored_args = kwargs
+    log = logging.getLogger('Bench')
+    config = get_config()
+    if isinstance(components, str):
+        components = [components]
+    unnest_list(components)
+    if '*' in components:
+        components_to_bench = get_components(filter_list=components)
+    else:
+        components_to_bench = list(components)
+    if 'foreground_component' in config and config['foreground_component']['name'] in components_to_bench:
+        log.info("Skipping foreground component: '%s' as it doesn't run in the background", config['foreground_component']['name'])
+        components_to_bench.remove(config['foreground_component']['name'])
+    if not components_to_bench:
+        log.error("No components to benchmark")
+        sys.exit(1)
+    previous = None
+    if compare:
+        try:
+            with open(compare) as compare_file:
+                previous = json.load(compare_file)
+        except (IOError, OSError, ValueError) as exc:
+            log.error("Failed loading the results to compare with from: '%s': %s", compare, exc)
+            sys.exit(1)
+    if not output:
+        output = '{}/{}/devlab_bench-{}.json'.format(
+            devlab_bench.PROJ_ROOT,
+            config['paths'].get('component_persistence', ''),
+            datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        )
+    #Components are started when the spans of starting them end
+    if devlab_bench.helpers.trace.TRACER is None:
+        start_tracing(None, name='devlab bench', logger=log)
+    results = {
+        'version': BENCH_VERSION,
+        'started': time.time(),
+        'duration': None,
+        'components': components_to_bench,
+        'cycles': 0,
+        'error': None,
+        'config_hash': get_config_hash(),
+        'engine_version': devlab_bench.helpers.docker.DOCKER.get_engine_version(),
+        'phases': {},
+        'timings': {}
+    }
+    for phase in BENCH_PHASES:
+        results['phases'][phase] = []
+    for comp in components_to_bench:
+        results['timings'][comp] = {}
+        for phase in BENCH_UP_PHASES:
+            results['timings'][comp][phase] = {}
+            for metric in BENCH_METRICS:
+                results['timings'][comp][phase][metric] = []
+    log.warning("Benchmarking will reset the components: %s, %s time(s)", ', '.join(components_to_bench), cycles)
+    #Nothing else can work on the components between the phases of a cycle
+    with component_locks(components_to_bench, logger=log):
+        for cycle in range(1, cycles + 1):
+            log.info("Starting cycle: %s of %s", cycle, cycles)
+            try:
+                run_cycle(components_to_bench, config, results, health_timeout=health_timeout, health_interval=health_interval, logger=log)
+            except SystemExit as exc:
+                results['error'] = "Cycle: {} failed with exit code: {}".format(cycle, exc.code)
+                log.error("%s, stopping the benchmark", results['error'])
+                break
+            results['cycles'] = cycle
+    results['duration'] = time.time() - results['started']
+    results['summary'] = summarize(results)
+    try:
+        with open(output, 'w') as output_file:
+            json.dump(results, output_file, indent=4, sort_keys=True)
+        log.info("Wrote the results of the benchmark to: '%s'", output)
+    except (IOError, OSError) as exc:
+        log.error("Failed writing the results of the benchmark to: '%s': %s", output, exc)
+    print_results(results)
+    if previous:
+        print_compare(previous, results)
+    if results['error']:
+        sys.exit(1)
+
+def run_cycle(components, config, results, health_timeout=BENCH_HEALTH_TIMEOUT_DEF, health_interval=BENCH_HEALTH_INTERVAL_DEF, logger=None):
+    """
+    Run one cycle of the benchmark, adding how long each phase took to the
+    results
+
+    Args:
+        components: list, of the components to benchmark
+        config: dict, of the project's config
+        results: dict, of the benchmark's results so far
+        health_timeout: float, how many seconds to keep checking the health
+            of components after they have all been brought up
+        health_interval: float, how many seconds to wait between checks of
+            the health of components
+        logger: Logger object to use for log messages
+
+    Raises:
+        SystemExit if any of the phases failed
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Bench')
+    for phase in BENCH_PHASES:
+        log.info("Running phase: '%s'", phase)
+        timer = None
+        with span('bench: {}'.format(phase)):
+            phase_start = time.time()
+            if phase == 'reset':
+                devlab_bench.actions.reset.action(targets=list(components))
+            elif phase == 'down':
+                devlab_bench.actions.down.action(components=list(components))
+            else:
+                with UpTimer(components, config, health_timeout=health_timeout, health_interval=health_interval, logger=log) as timer:
+                    devlab_bench.actions.up.action(components=list(components))
+            phase_duration = time.time() - phase_start
+        results['phases'][phase].append(phase_duration)
+        log.info("Phase: '%s' took %.2fs", phase, phase_duration)
+        if timer is not None:
+            for comp in components:
+                for metric in BENCH_METRICS:
+                    if timer.timings[comp][metric] is not None:
+                        results['timings'][comp][phase][metric].append(timer.timings[comp][metric])
+
+def get_stats(values):
+    """
+    Get the percentiles and the max of a list of durations
+
+    Args:
+        values: list of float
+
+    Returns:
+        dict, with 'p50', 'p95' etc... and 'max', or None if there are no
+        values
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    stats = {
+        'max': values[-1]
+    }
+    for pct in BENCH_PERCENTILES:
+        stats['p{}'.format(pct)] = percentile(values, pct)
+    return stats
+
+def summarize(results):
+    """
+    Summarize the durations in the results of a benchmark with their
+    percentiles
+
+    Args:
+        results: dict, of the benchmark's results
+
+    Returns:
+        dict, with the 'phases' and the 'timings' of each component, like
+        the results but with the dicts returned by get_stats instead of the
+        lists of durations
+    """
+    summary = {
+        'phases': {},
+        'timings': {}
+    }
+    for phase, durations in results['phases'].items():
+        summary['phases'][phase] = get_stats(durations)
+    for comp, comp_timings in results['timings'].items():
+        summary['timings'][comp] = {}
+        for phase, metrics in comp_timings.items():
+            summary['timings'][comp][phase] = {}
+            for metric, durations in metrics.items():
+                summary['timings'][comp][phase][metric] = get_stats(durations)
+    return summary
+
+def format_stat(stats, key):
+    """
+    Format a statistic for a table
+
+    Args:
+        stats: dict, as returned by get_stats, or None
+        key: str, of the statistic, like 'p50'
+
+    Returns:
+        str
+    """
+    if not stats:
+        return '-'
+    return '{:.2f}s'.format(stats[key])
+
+def print_results(results):
+    """
+    Print tables of how long each phase took, and how long each component
+    took to be running and healthy
+
+    Args:
+        results: dict, of the benchmark's results, with its 'summary'
+    """
+    rows = []
+    for phase in BENCH_PHASES:
+        stats = results['summary']['phases'][phase]
+        rows.append({
+            'phase': phase,
+            'runs': len(results['phases'][phase]),
+            'p50': format_stat(stats, 'p50'),
+            'p95': format_stat(stats, 'p95'),
+            'max': format_stat(stats, 'max')
+        })
+    print_table(
+        'BENCH PHASES over {} cycle(s)'.format(results['cycles']),
+        {
+            'phase': 'Phase',
+            'runs': 'Runs',
+            'p50': 'p50',
+            'p95': 'p95',
+            'max': 'Max'
+        },
+        "| {phase:^10} | {runs:^5} | {p50:^9} | {p95:^9} | {max:^9} |",
+        "| {phase:10} | {runs:>5} | {p50:>9} | {p95:>9} | {max:>9} |",
+        rows
+    )
+    rows = []
+    for comp in results['components']:
+        for phase in BENCH_UP_PHASES:
+            running = results['summary']['timings'][comp][phase]['running']
+            healthy = results['summary']['timings'][comp][phase]['healthy']
+            rows.append({
+                'component': comp,
+                'phase': phase,
+                'run_p50': format_stat(running, 'p50'),
+                'run_p95': format_stat(running, 'p95'),
+                'run_max': format_stat(running, 'max'),
+                'health_p50': format_stat(healthy, 'p50'),
+                'health_p95': format_stat(healthy, 'p95'),
+                'health_max': format_stat(healthy, 'max')
+            })
+    print_table(
+        'BENCH COMPONENTS: time to running / time to healthy',
+        {
+            'component': 'Component',
+            'phase': 'Phase',
+            'run_p50': 'Run p50',
+            'run_p95': 'Run p95',
+            'run_max': 'Run max',
+            'health_p50': 'Health p50',
+            'health_p95': 'Health p95',
+            'health_max': 'Health max'
+        },
+        "| {component:^20} | {phase:^8} | {run_p50:^9} | {run_p95:^9} | {run_max:^9} | {health_p50:^10} | {health_p95:^10} | {health_max:^10} |",
+        "| {component:20} | {phase:8} | {run_p50:>9} | {run_p95:>9} | {run_max:>9} | {health_p50:>10} | {health_p95:>10} | {health_max:>10} |",
+        rows
+    )
+
+def print_compare(previous, results):
+    """
+    Print a comparison of the median durations of an earlier benchmark with
+    those of this one
+
+    Args:
+        previous: dict, of the results of the earlier benchmark
+        results: dict, of the results of this benchmark
+    """
+    if previous.get('config_hash') != results['config_hash']:
+        print("Config hash changed: '{}' -> '{}'".format(previous.get('config_hash'), results['config_hash']))
+    if previous.get('engine_version') != results['engine_version']:
+        print("Engine version changed: '{}' -> '{}'".format(previous.get('engine_version'), results['engine_version']))
+    medians = []
+    for phase in BENCH_PHASES:
+        medians.append((
+            '(project)',
+            phase,
+            'total',
+            (previous.get('summary', {}).get('phases', {}).get(phase) or {}).get('p50', None),
+            (results['summary']['phases'][phase] or {}).get('p50', None)
+        ))
+    for comp in results['components']:
+        for phase in BENCH_UP_PHASES:
+            for metric in BENCH_METRICS:
+                medians.append((
+                    comp,
+                    phase,
+                    metric,
+                    (previous.get('summary', {}).get('timings', {}).get(comp, {}).get(phase, {}).get(metric) or {}).get('p50', None),
+                    (results['summary']['timings'][comp][phase][metric] or {}).get('p50', None)
+                ))
+    rows = []
+    regressed = 0
+    for comp, phase, metric, dur_a, dur_b in medians:
+        if dur_a is None and dur_b is None:
+            continue
+        result = ''
+        if dur_a is None:
+            result = 'new'
+        elif dur_b is None:
+            result = 'gone'
+        elif dur_b >= dur_a * HISTORY_REGRESSION_RATIO and dur_b - dur_a >= HISTORY_REGRESSION_MIN:
+            result = 'REGRESSED'
+            regressed += 1
+        elif dur_a >= dur_b * HISTORY_REGRESSION_RATIO and dur_a - dur_b >= HISTORY_REGRESSION_MIN:
+            result = 'improved'
+        rows.append({
+            'component': comp,
+            'phase': phase,
+            'metric': metric,
+            'dur_a': '' if dur_a is None else '{:.2f}s'.format(dur_a),
+            'dur_b': '' if dur_b is None else '{:.2f}s'.format(dur_b),
+            'ratio': '{:.2f}x'.format(dur_b / dur_a) if dur_a and dur_b is not None else '',
+            'result': result
+        })
+    print_table(
+        'BENCH COMPARE: p50 before / after',
+        {
+            'component': 'Component',
+            'phase': 'Phase',
+            'metric': 'Metric',
+            'dur_a': 'Before',
+            'dur_b': 'After',
+            'ratio': 'Ratio',
+            'result': 'Result'
+        },
+        "| {component:^20} | {phase:^8} | {metric:^7} | {dur_a:^9} | {dur_b:^9} | {ratio:^8} | {result:^10} |",
+        "| {component:20} | {phase:8} | {metric:7} | {dur_a:>9} | {dur_b:>9} | {ratio:>8} | {result:10} |",
+        rows
+    )
+    if regressed:
+        print('{} median(s) regressed'.format(regressed))
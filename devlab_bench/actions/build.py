@@ -10,6 +10,7 @@ import devlab_bench
 import devlab_bench.helpers.docker
 from devlab_bench.helpers.common import get_config, get_ordinal_sorting
 from devlab_bench.helpers.docker import docker_obj_status, DockerHelper, get_needed_images
+from devlab_bench.helpers.trace import span
 
 def action(images='*', clean=False, no_cache=False, pull=False, skip_pull_images=None, **kwargs):
     """
@@ -167,7 +168,8 @@ def action(images='*', clean=False, no_cache=False, pull=False, skip_pull_images
         image_args['docker_file'] = image_args['docker_file_full_path']
         del image_args['docker_file_full_path']
         log.debug("image: '%s' context='%s' log_output='%s' other_args='%s'", image, image_context, log_output, image_args)
-        bld_res = docker_helper_obj.build_image(image, context=image_context, log_output=log_output, network=config['network']['name'], disable_build_kit=config['disable_buildkit'], logger=logging.getLogger('Build-{}'.format(image)), **image_args)
+        with span('build image', image=image_n_tag):
+            bld_res = docker_helper_obj.build_image(image, context=image_context, log_output=log_output, network=config['network']['name'], disable_build_kit=config['disable_buildkit'], logger=logging.getLogger('Build-{}'.format(image)), **image_args)
         if bld_res[0] != 0:
             log.error("Failed building image: '%s' Aborting...", image)
             abort = True
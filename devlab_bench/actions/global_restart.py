@@ -1,18 +1,40 @@
 """
 Things dealing with the 'global_restart' action
 """
-import sys
 import logging
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import devlab_bench
+import devlab_bench.actions.restart
+from devlab_bench.exceptions import DevlabLockError
 from devlab_bench.helpers.common import get_config
-from devlab_bench.helpers.docker import DockerHelper
-def action(**kwargs):
+from devlab_bench.helpers.docker import DockerHelper, get_project_docker_helper
+
+GLOBAL_RESTART_JOBS_DEF = 4
+
+def action(jobs=GLOBAL_RESTART_JOBS_DEF, log_dir=None, update_images=False, log_level='info', lock_timeout=None, **kwargs):
     """
-    Restart all containers spun up with devlab across all environments
+    Restart all containers spun up with devlab across all environments. Each
+    project is restarted in its own worker process, so that projects can be
+    restarted at the same time
+
+    Args:
+        jobs: int, the maximum number of projects to restart at the same time
+        log_dir: str, directory to write the log of each project's restart to.
+            Default is a new temporary directory
+        update_images: bool, whether or not to try and update images that
+            components rely upon
+        log_level: str, the log level to use for the logs of each project
+        lock_timeout: float, seconds to wait for other devlab commands working
+            on the same components. Default is devlab_bench.LOCK_TIMEOUT
     """
+    ignored_args = kwargs
     log = logging.getLogger('Global-Restart')
-    restart_args = kwargs
     global_devlab_docker = DockerHelper(
         filter_label='com.lab.type=devlab'
     )
@@ -22,7 +44,6 @@ def action(**kwargs):
     for cont in containers:
         cont_name = cont['name']
         comp_name = cont_name
-        comp_logger = logging.getLogger('{}-{}'.format(log.name, cont_name))
         details = global_devlab_docker.inspect_container(cont_name)[0]
         labels = details['Config']['Labels']
         container_project = None
@@ -41,22 +62,173 @@ def action(**kwargs):
             project_map[container_project] = {
                 'components': [comp_name]
             }
-    for project in project_map:
-        restart_args['components'] = []
-        comp_logger.info('Performing restarts for project at path: %s', project)
-        comp_logger.debug('Project components to restart: "%s"', ','.join(project_map[project]['components']))
-        #Switch to other Devlab env:
+    if not project_map:
+        log.info("No devlab projects found with containers to restart")
+        sys.exit(0)
+    if not log_dir:
+        log_dir = tempfile.mkdtemp(prefix='devlab-global-restart-')
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+    jobs = max(1, min(jobs, len(project_map)))
+    log.info("Restarting %s project(s), %s at a time. Logs for each project are in: %s", len(project_map), jobs, log_dir)
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {}
+        for project in project_map:
+            log_file = '{}/{}.log'.format(log_dir, re.sub('[^A-Za-z0-9_.-]+', '_', project.strip('/')))
+            log.debug('Project components to restart for project: "%s": "%s"', project, ','.join(project_map[project]['components']))
+            future = pool.submit(
+                restart_project,
+                project=project,
+                components=project_map[project]['components'],
+                log_file=log_file,
+                log_level=log_level,
+                update_images=update_images,
+                lock_timeout=lock_timeout
+            )
+            futures[future] = {
+                'project': project,
+                'components': project_map[project]['components'],
+                'log_file': log_file
+            }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as exc: #pylint: disable=broad-except
+                result = dict(futures[future])
+                result.update({
+                    'rc': 1,
+                    'duration': 0,
+                    'error': 'Worker process failed: {}'.format(exc)
+                })
+            if result['rc'] == 0:
+                log.info("Finished restarting project: %s in %.1fs", result['project'], result['duration'])
+            else:
+                log.error("Failed restarting project: %s: %s. See: %s", result['project'], result['error'], result['log_file'])
+            results.append(result)
+    print_summary(results)
+    if any(result['rc'] != 0 for result in results):
+        sys.exit(1)
+    sys.exit(0)
+
+def restart_project(project, components, log_file, log_level='info', update_images=False, lock_timeout=None):
+    """
+    Restart the components of a single project. This runs inside of a worker
+    process, which sets up its own project context and sends all of its
+    output to log_file
+
+    Args:
+        project: str, path to the root of the project
+        components: list of str, the components to restart
+        log_file: str, path of the file to write the log and output to
+        log_level: str, the log level to use
+        update_images: bool, whether or not to try and update images that
+            components rely upon
+        lock_timeout: float, seconds to wait for other devlab commands working
+            on the same components
+
+    Returns:
+        dict with the keys:
+            'project': The project's path
+            'components': The components that were restarted
+            'log_file': The path to the log file
+            'rc': 0 if the restart was successful
+            'duration': How long the restart took in seconds
+            'error': str, of the error if the restart failed
+    """
+    start_time = time.time()
+    result = {
+        'project': project,
+        'components': components,
+        'log_file': log_file,
+        'rc': 0,
+        'duration': 0,
+        'error': ''
+    }
+    #Send everything, including output from commands, to the project's log
+    log_fd = os.open(log_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.dup2(log_fd, 1)
+    os.dup2(log_fd, 2)
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    log_handler = logging.StreamHandler(sys.stderr)
+    log_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    root_logger.addHandler(log_handler)
+    root_logger.setLevel(devlab_bench.LOGGING_LEVELS[log_level.lower()])
+    #Drop any ANSI coloring of the level names, as this goes to a file
+    for l_name, l_level in devlab_bench.LOGGING_LEVELS.items():
+        if l_level != logging.NOTSET:
+            logging.addLevelName(l_level, l_name.upper())
+    log =logging.getLogger('Global-Restart-{}'.format(os.path.basename(project)))
+    log.info('Performing restarts for project at path: %s', project)
+    try:
+        #Set up this worker's devlab context for the project
         devlab_bench.PROJ_ROOT = project
+        devlab_bench.UP_ENV_FILE = '{}/{}/devlab_up.env'.format(project, '.')
+        if lock_timeout is not None:
+            devlab_bench.LOCK_TIMEOUT = lock_timeout
+        os.chdir(project)
         devlab_bench.CONFIG = get_config(force_reload=True)
-        devlab_bench.helpers.docker.DOCKER = DockerHelper(
-            labels=[
-                'com.lab.type=devlab',
-                'com.lab.project={}'.format(project),
-                devlab_bench.CONFIG['project_filter']
-            ]
+        devlab_bench.helpers.docker.DOCKER = get_project_docker_helper()
+        devlab_bench.actions.restart.action(
+            components=components,
+            update_images=update_images,
+            logger=logging.getLogger('{}-Restart'.format(log.name))
         )
-        #Customize the components to pass to the restart action
-        restart_args['components'] = project_map[project]['components']
-        #Execute the restart action
-        devlab_bench.actions.restart.action(logger=logging.getLogger('{}-{}'.format(comp_logger.name, 'Restart')), **restart_args)
-    sys.exit(0)
+    except SystemExit as exc:
+        if exc.code:
+            result['rc'] = exc.code if isinstance(exc.code, int) else 1
+            result['error'] = 'Exited with: {}'.format(exc.code)
+    except DevlabLockError as exc:
+        log.error("%s", exc)
+        result['rc'] = 1
+        result['error'] = str(exc)
+    except Exception as exc: #pylint: disable=broad-except
+        log.exception("Unexpected error restarting project: %s", project)
+        result['rc'] = 1
+        result['error'] = str(exc)
+    result['duration'] = time.time() - start_time
+    log.info('Finished restarts for project at path: %s, rc: %s', project, result['rc'])
+    for handler in root_logger.handlers:
+        handler.flush()
+    return result
+
+def print_summary(results):
+    """
+    Print a table summarizing the restart of each project
+
+    Args:
+        results: list of dicts, as returned by restart_project
+    """
+    summary_header = {
+        'project': 'Project',
+        'components': 'Components',
+        'result': 'Result',
+        'duration': 'Duration',
+        'log_file': 'Log'
+    }
+    summary_header_format = "| {project:^40} | {components:^10} | {result:^8} | {duration:^9} | {log_file:^60} |"
+    summary_row_format = "| {project:40} | {components:^10} | {result:8} | {duration:>9} | {log_file:60} |"
+    summary_width = len(summary_header_format.format(**summary_header))
+    summary_table_bar = '{{:-<{}}}'.format(summary_width)
+    summary_table = [
+        summary_table_bar.format(''),
+        summary_header_format.format(**summary_header),
+        summary_table_bar.format('')
+    ]
+    for result in sorted(results, key=lambda res: res['project']):
+        summary_table.append(
+            summary_row_format.format(
+                project=result['project'],
+                components=len(result['components']),
+                result='ok' if result['rc'] == 0 else 'failed',
+                duration='{:.1f}s'.format(result['duration']),
+                log_file=result['log_file']
+            )
+        )
+    summary_table.append(summary_table_bar.format(''))
+    print('\n## GLOBAL RESTART ##')
+    print('\n'.join(summary_table))
@@ -0,0 +1,258 @@
+"""
+Things dealing with the 'history' action
+"""
+import datetime
+import logging
+import sys
+
+from devlab_bench.helpers.history import PROJECT_COMPONENT, TOTAL_PHASE, get_history_store
+
+HISTORY_LIMIT_DEF = 20
+HISTORY_PERCENTILES = (50, 90, 95)
+#A phase has regressed if it got this many times slower, and by at least HISTORY_REGRESSION_MIN seconds
+HISTORY_REGRESSION_RATIO = 1.5
+HISTORY_REGRESSION_MIN = 0.5
+
+def action(history_action=None, limit=HISTORY_LIMIT_DEF, stats=False, compare=None, **kwargs):
+    """
+    List the runs recorded in the project's history, show percentiles of how
+    long each component and phase took, or compare two runs
+
+    Args:
+        history_action: str, only look at runs of this action, like 'up'
+        limit: int, the maximum number of runs to list, or to calculate the
+            percentiles over
+        stats: bool, whether to show percentiles of the durations of each
+            component and phase
+        compare: list, of the ids of two runs to compare. If the list is
+            empty, then the two most recent runs of the action are compared
+    """
+    ignored_args = kwargs
+    log = logging.getLogger('History')
+    history = get_history_store()
+    try:
+        if compare is not None:
+            if len(compare) not in (0, 2):
+                log.error("--compare takes either no runs, or two runs to compare")
+                sys.exit(1)
+            if compare:
+                runs = [history.get_run(run_id) for run_id in compare]
+                for run_id, run in zip(compare, runs):
+                    if run is None:
+                        log.error("Run: %s isn't in the project's history", run_id)
+                        sys.exit(1)
+            else:
+                runs = [history.get_run(run['id']) for run in reversed(history.get_runs(action=history_action or 'up', limit=2))]
+                if len(runs) < 2:
+                    log.error("There aren't two runs of the '%s' action in the project's history to compare", history_action or 'up')
+                    sys.exit(1)
+            print_compare(runs[0], runs[1])
+        elif stats:
+            runs = history.get_runs(action=history_action or 'up', limit=limit)
+            if not runs:
+                log.info("No runs of the '%s' action have been recorded in the project's history", history_action or 'up')
+                return
+            print_stats(history_action or 'up', runs, history.get_phases([run['id'] for run in runs]))
+        else:
+            runs = history.get_runs(action=history_action, limit=limit)
+            if not runs:
+                log.info("No runs have been recorded in the project's history")
+                return
+            print_runs(runs)
+    finally:
+        history.close()
+
+def format_time(epoch):
+    """
+    Format an epoch time for display
+
+    Args:
+        epoch: float, the time
+
+    Returns:
+        str
+    """
+    return datetime.datetime.fromtimestamp(epoch).strftime('%Y-%m-%d %H:%M:%S')
+
+def percentile(values, pct):
+    """
+    Get a percentile of a list of values, using the nearest rank
+
+    Args:
+        values: list of float, sorted
+        pct: int, the percentile to get
+
+    Returns:
+        float
+    """
+    rank = int(round(pct / 100.0 * len(values) + 0.5)) - 1
+    return values[max(0, min(rank, len(values) - 1))]
+
+def print_table(title, header, header_format, row_format, rows):
+    """
+    Print a table in the same style as the other devlab tables
+
+    Args:
+        title: str, title of the table
+        header: dict, of the column headers
+        header_format: str, format for the header row
+        row_format: str, format for the other rows
+        rows: list of dicts, of the rows
+    """
+    table_width = len(header_format.format(**header))
+    table_bar = '{{:-<{}}}'.format(table_width)
+    table = [
+        table_bar.format(''),
+        header_format.format(**header),
+        table_bar.format('')
+    ]
+    for row in rows:
+        table.append(row_format.format(**row))
+    table.append(table_bar.format(''))
+    print('\n## {} ##'.format(title))
+    print('\n'.join(table))
+
+def print_runs(runs):
+    """
+    Print a table of runs
+
+    Args:
+        runs: list of dicts, as returned by HistoryStore.get_runs
+    """
+    rows = []
+    for run in runs:
+        rows.append({
+            'id': run['id'],
+            'started': format_time(run['started']),
+            'action': run['action'],
+            'duration': '{:.1f}s'.format(run['duration']),
+            'rc': run['rc'],
+            'components': ','.join(run['components']),
+            'images': len(run['images_built']) + len(run['images_pulled']),
+            'config': run['config_hash'][:8] if run['config_hash'] else ''
+        })
+    print_table(
+        'HISTORY',
+        {
+            'id': 'Run',
+            'started': 'Started',
+            'action': 'Action',
+            'duration': 'Duration',
+            'rc': 'RC',
+            'components': 'Components',
+            'images': 'Images',
+            'config': 'Config'
+        },
+        "| {id:^6} | {started:^19} | {action:^8} | {duration:^9} | {rc:^4} | {components:^40} | {images:^6} | {config:^8} |",
+        "| {id:>6} | {started:19} | {action:8} | {duration:>9} | {rc:>4} | {components:40} | {images:>6} | {config:8} |",
+        rows
+    )
+
+def print_stats(history_action, runs, phases):
+    """
+    Print a table of the percentiles of the durations of each component and
+    phase over runs
+
+    Args:
+        history_action: str, the action the runs are for
+        runs: list of dicts, as returned by HistoryStore.get_runs
+        phases: dict, as returned by HistoryStore.get_phases
+    """
+    durations = {}
+    for run in runs:
+        if run['rc'] != 0:
+            continue
+        for comp_phase, duration in phases[run['id']].items():
+            durations.setdefault(comp_phase, []).append(duration)
+    rows = []
+    for (component, phase) in sorted(durations, key=lambda comp_phase: (comp_phase[0], comp_phase[1] != TOTAL_PHASE, comp_phase[1])):
+        values = sorted(durations[(component, phase)])
+        row = {
+            'component': component if component != PROJECT_COMPONENT else '(project)',
+            'phase': phase,
+            'runs': len(values),
+            'max': '{:.2f}s'.format(values[-1])
+        }
+        for pct in HISTORY_PERCENTILES:
+            row['p{}'.format(pct)] = '{:.2f}s'.format(percentile(values, pct))
+        rows.append(row)
+    print_table(
+        "HISTORY STATS: '{}' over the last {} successful run(s)".format(history_action, len([run for run in runs if run['rc'] == 0])),
+        {
+            'component': 'Component',
+            'phase': 'Phase',
+            'runs': 'Runs',
+            'p50': 'p50',
+            'p90': 'p90',
+            'p95': 'p95',
+            'max': 'Max'
+        },
+        "| {component:^20} | {phase:^30} | {runs:^5} | {p50:^9} | {p90:^9} | {p95:^9} | {max:^9} |",
+        "| {component:20} | {phase:30} | {runs:>5} | {p50:>9} | {p90:>9} | {p95:>9} | {max:>9} |",
+        rows
+    )
+
+def print_compare(run_a, run_b):
+    """
+    Print a comparison of how long each component and phase took in two
+    runs, and what changed between them that could explain it
+
+    Args:
+        run_a: dict, of the older run, as returned by HistoryStore.get_run
+        run_b: dict, of the newer run, as returned by HistoryStore.get_run
+    """
+    print("Comparing run: {} ('{}' at {}) with run: {} ('{}' at {})".format(
+        run_a['id'],
+        run_a['action'],
+        format_time(run_a['started']),
+        run_b['id'],
+        run_b['action'],
+        format_time(run_b['started'])
+    ))
+    for key, name in (('config_hash', 'Config hash'), ('devlab_version', 'Devlab version'), ('engine_version', 'Engine version')):
+        if run_a[key] != run_b[key]:
+            print("  {} changed: '{}' -> '{}'".format(name, run_a[key], run_b[key]))
+    for key, name in (('images_built', 'Images built'), ('images_pulled', 'Images pulled')):
+        if run_b[key]:
+            print("  {} in run {}: {}".format(name, run_b['id'], ', '.join(run_b[key])))
+    rows = []
+    regressed = 0
+    comp_phases = set(run_a['phases']) | set(run_b['phases'])
+    for (component, phase) in sorted(comp_phases, key=lambda comp_phase: (comp_phase[0], comp_phase[1] != TOTAL_PHASE, comp_phase[1])):
+        dur_a = run_a['phases'].get((component, phase), None)
+        dur_b = run_b['phases'].get((component, phase), None)
+        result = ''
+        if dur_a is None:
+            result = 'new'
+        elif dur_b is None:
+            result = 'gone'
+        elif dur_b >= dur_a * HISTORY_REGRESSION_RATIO and dur_b - dur_a >= HISTORY_REGRESSION_MIN:
+            result = 'REGRESSED'
+            if phase != TOTAL_PHASE:
+                regressed += 1
+        elif dur_a >= dur_b * HISTORY_REGRESSION_RATIO and dur_a - dur_b >= HISTORY_REGRESSION_MIN:
+            result = 'improved'
+        rows.append({
+            'component': component if component != PROJECT_COMPONENT else '(project)',
+            'phase': phase,
+            'dur_a': '' if dur_a is None else '{:.2f}s'.format(dur_a),
+            'dur_b': '' if dur_b is None else '{:.2f}s'.format(dur_b),
+            'ratio': '{:.2f}x'.format(dur_b / dur_a) if dur_a and dur_b is not None else '',
+            'result': result
+        })
+    print_table(
+        'HISTORY COMPARE',
+        {
+            'component': 'Component',
+            'phase': 'Phase',
+            'dur_a': 'Run {}'.format(run_a['id']),
+            'dur_b': 'Run {}'.format(run_b['id']),
+            'ratio': 'Ratio',
+            'result': 'Result'
+        },
+        "| {component:^20} | {phase:^30} | {dur_a:^9} | {dur_b:^9} | {ratio:^8} | {result:^10} |",
+        "| {component:20} | {phase:30} | {dur_a:>9} | {dur_b:>9} | {ratio:>8} | {result:10} |",
+        rows
+    )
+    if regressed:
+        print('{} phase(s) regressed'.format(regressed))
@@ -0,0 +1,402 @@
+"""
+Things dealing with the 'logs' action
+
+The logs of every selected component are read by their own threads, from
+'docker logs' for containers, and from the supervisor's log files for 'type:
+host' components. Each stream has a small bounded queue, so a slow terminal
+applies back pressure instead of letting the logs pile up in memory, and a
+noisy component can only ever fill up its own queue. The main thread merges
+the streams by timestamp, waiting briefly for quieter streams when following
+so that lines from different components come out in the right order.
+"""
+import calendar
+import heapq
+import logging
+import os
+import queue
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import devlab_bench.helpers.common
+import devlab_bench.helpers.docker
+from devlab_bench.helpers.command import Command
+from devlab_bench.helpers.common import get_components, get_config, unnest_list
+from devlab_bench.helpers.supervisor import HOST_LOG_BACKUPS, get_host_log_path
+
+LOGS_QUEUE_MAX = 1000
+LOGS_MERGE_WINDOW = 0.25
+LOGS_FILE_POLL = 0.25
+#Bytes of a log line to read at once. Longer lines are split into pieces of
+#this size, so that one runaway line can't use up all of the memory
+LOGS_LINE_MAX = 65536
+LOGS_COLORS = (36, 32, 33, 35, 34, 31, 96, 92, 93, 95, 94, 91)
+LOGS_SINCE_UNITS = {
+    '': 1,
+    's': 1,
+    'm': 60,
+    'h': 3600,
+    'd': 86400
+}
+
+###-- Classes --###
+class LogStream(object):
+    """
+    A stream of log lines from a component, read into a bounded queue by a
+    background thread
+    """
+    def __init__(self, comp, name, reader, *reader_args):
+        """
+        Initialize the LogStream Object
+
+        Args:
+            comp: str, name of the component
+            name: str, name of the stream, like 'stdout' or 'stderr'
+            reader: function, that yields tuples of (timestamp, line)
+            reader_args: the arguments to pass to reader
+        """
+        self.comp = comp
+        self.name = name
+        self.lines = queue.Queue(maxsize=LOGS_QUEUE_MAX)
+        self.done = False
+        self.reader = reader
+        self.reader_args = reader_args
+        self.thread = None
+    def start(self, wakeup):
+        """
+        Start the thread reading the stream
+
+        Args:
+            wakeup: threading.Event, set whenever a new line has been queued
+        """
+        self.thread = threading.Thread(target=self._read, args=(wakeup,))
+        self.thread.daemon = True
+        self.thread.start()
+    def _read(self, wakeup):
+        """
+        Body of the reading thread. A None is queued once the stream ends
+        """
+        try:
+            for line in self.reader(*self.reader_args):
+                self.lines.put(line)
+                wakeup.set()
+        finally:
+            self.lines.put(None)
+            wakeup.set()
+
+###-- Functions --###
+def action(components='*', follow=False, since=None, **kwargs):
+    """
+    Show the logs of components, merged by time
+
+    Args:
+        components: list of the components to show the logs of
+        follow: bool, whether to keep following the logs for new lines
+        since: str, only show lines since this long ago (like '10m') or since
+            this timestamp (like '2020-01-02T15:04:05')
+    """
+    ignored_args = kwargs
+    log = logging.getLogger('Logs')
+    config = get_config()
+    if isinstance(components, str):
+        components = [components]
+    unnest_list(components)
+    if '*' in components:
+        components = get_components(filter_list=components)
+    since_ts = None
+    if since:
+        since_ts = parse_since(since)
+        if since_ts is None:
+            log.error("Invalid value for --since: '%s'. Use a duration like: '10m' or a timestamp like: '2020-01-02T15:04:05'", since)
+            sys.exit(1)
+    containers = devlab_bench.helpers.docker.DOCKER.get_containers()[1]
+    container_names = [container['name'] for container in containers]
+    docker_bin = Command(devlab_bench.helpers.docker.DOCKER.docker_bin_paths)._precheck() #pylint: disable=protected-access
+    streams = []
+    procs = []
+    for comp in sorted(set(components)):
+        if 'foreground_component' in config and comp == config['foreground_component']['name']:
+            comp_type = config['foreground_component'].get('type', 'container')
+        else:
+            comp_type = config['components'].get(comp, {}).get('type', 'container')
+        if comp_type == 'host':
+            streams.append(LogStream(comp, 'log', read_host_log, get_host_log_path(comp), follow, since_ts))
+            continue
+        container_name = '{}-devlab'.format(comp)
+        if container_name not in container_names:
+            log.warning("Container: %s doesn't exist for component: %s, skipping it", container_name, comp)
+            continue
+        logs_args = [docker_bin[1], 'logs', '--timestamps']
+        if follow:
+            logs_args.append('--follow')
+        if since:
+            logs_args += ['--since', since]
+        logs_args.append(container_name)
+        log.debug("Running command: '%s'", ' '.join(logs_args))
+        proc = subprocess.Popen(logs_args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        procs.append(proc)
+        streams.append(LogStream(comp, 'stdout', read_docker_log, proc.stdout))
+        streams.append(LogStream(comp, 'stderr', read_docker_log, proc.stderr))
+    if not streams:
+        log.error("No logs found for components: %s", ', '.join(components))
+        sys.exit(1)
+    try:
+        merge_streams(streams, follow, get_prefixes(set(stream.comp for stream in streams)))
+    except KeyboardInterrupt:
+        #Ctrl-C is also sent to 'docker logs', so don't get interrupted again while it exits
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+    finally:
+        for proc in procs:
+            if proc.poll() is None:
+                proc.terminate()
+                proc.wait()
+        sys.stdout.flush()
+
+def get_prefixes(components):
+    """
+    Get the prefixes for the lines of each component, colored if the output
+    is going to a terminal
+
+    Args:
+        components: iterable of str, the names of the components
+
+    Returns:
+        dict, of the prefix for each component
+    """
+    width = max([len(comp) for comp in components])
+    prefixes = {}
+    for idx, comp in enumerate(sorted(components)):
+        prefix = '{:<{}} | '.format(comp, width)
+        if devlab_bench.helpers.common.ISATTY:
+            prefix = '\033[{}m{}\033[0m'.format(LOGS_COLORS[idx % len(LOGS_COLORS)], prefix)
+        prefixes[comp] = prefix
+    return prefixes
+
+def merge_streams(streams, follow, prefixes):
+    """
+    Write the lines of the streams to stdout, merged by their timestamps.
+    A line is written once every stream has a line to compare it with. When
+    following, a line is also written once it has waited LOGS_MERGE_WINDOW
+    for the streams that don't, so that a quiet stream can't hold up the
+    others
+
+    Args:
+        streams: list of LogStream, the streams to merge
+        follow: bool, whether the streams are being followed
+        prefixes: dict, of the prefix for the lines of each component
+    """
+    wakeup = threading.Event()
+    for stream in streams:
+        stream.start(wakeup)
+    heap = []
+    waiting = list(streams)
+    seq = 0
+    out = sys.stdout
+    while True:
+        wakeup.clear()
+        for stream in list(waiting):
+            try:
+                line = stream.lines.get_nowait()
+            except queue.Empty:
+                continue
+            waiting.remove(stream)
+            if line is None:
+                stream.done = True
+                continue
+            seq += 1
+            heapq.heappush(heap, (line[0], seq, time.time(), stream, line[1]))
+        if not heap:
+            if not waiting:
+                break
+            out.flush()
+            wakeup.wait(LOGS_MERGE_WINDOW)
+            continue
+        #Only the oldest line can be written, and only once every stream has
+        #a line to compare it with, or when following, once it has waited long enough
+        if waiting and (not follow or time.time() - heap[0][2] < LOGS_MERGE_WINDOW):
+            out.flush()
+            wakeup.wait(max(0.01, LOGS_MERGE_WINDOW - (time.time() - heap[0][2])) if follow else LOGS_MERGE_WINDOW)
+            continue
+        stream, line = heapq.heappop(heap)[3:]
+        out.write('{}{}\n'.format(prefixes[stream.comp], line))
+        if not stream.done:
+            waiting.append(stream)
+
+def parse_since(since):
+    """
+    Parse the value of --since
+
+    Args:
+        since: str, either a duration like '10m', '2h' or '30' (seconds), or
+            a timestamp like '2020-01-02T15:04:05' or '2020-01-02 15:04:05'
+            in local time
+
+    Returns:
+        float, of the epoch time, or None if it isn't valid
+    """
+    since_match = re.match(r'^([0-9]+(?:\.[0-9]+)?)([smhd]?)$', since)
+    if since_match:
+        return time.time() - float(since_match.group(1)) * LOGS_SINCE_UNITS[since_match.group(2)]
+    for since_format in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return time.mktime(time.strptime(since, since_format))
+        except ValueError:
+            continue
+    return None
+
+def parse_docker_timestamp(timestamp):
+    """
+    Parse a timestamp from 'docker logs --timestamps', like:
+    '2020-01-02T15:04:05.123456789Z'
+
+    Args:
+        timestamp: str, the timestamp
+
+    Returns:
+        float, of the epoch time, or None if it can't be parsed
+    """
+    ts_match = re.match(r'^([0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2})(\.[0-9]+)?(Z|[+-][0-9]{2}:?[0-9]{2})$', timestamp)
+    if not ts_match:
+        return None
+    epoch = calendar.timegm(time.strptime(ts_match.group(1), '%Y-%m-%dT%H:%M:%S'))
+    if ts_match.group(2):
+        epoch += float('0{}'.format(ts_match.group(2)[:10]))
+    if ts_match.group(3) != 'Z':
+        offset = ts_match.group(3).replace(':', '')
+        offset_secs = int(offset[1:3]) * 3600 + int(offset[3:5]) * 60
+        if offset[0] == '+':
+            epoch -= offset_secs
+        else:
+            epoch += offset_secs
+    return epoch
+
+def read_docker_log(pipe):
+    """
+    Read the lines of a 'docker logs --timestamps' pipe. Lines longer than
+    LOGS_LINE_MAX are split, and the pieces after the first one have the
+    time of the line they are part of
+
+    Args:
+        pipe: file object, of the pipe
+
+    Yields:
+        tuple of (timestamp, line)
+    """
+    last_ts = 0
+    continued = False
+    for raw_line in iter(lambda: pipe.readline(LOGS_LINE_MAX), b''):
+        if continued and not raw_line.strip(b'\r\n'):
+            #The rest of a line that was exactly LOGS_LINE_MAX long
+            continued = False
+            continue
+        line = raw_line.decode('utf-8', 'replace').rstrip('\r\n')
+        if continued:
+            line_ts = last_ts
+        else:
+            line_split = line.split(' ', 1)
+            line_ts = parse_docker_timestamp(line_split[0])
+            if line_ts is None:
+                line_ts = last_ts
+            else:
+                line = line_split[1] if len(line_split) > 1 else ''
+        continued = not raw_line.endswith(b'\n')
+        last_ts = line_ts
+        yield (line_ts, line)
+
+def parse_host_log_line(line, last_ts):
+    """
+    Parse a line from a host component's log file, which start with the time
+    in the format of: '2020-01-02 15:04:05,123 - '. Lines without a time use
+    the time of the line before them
+
+    Args:
+        line: str, the line
+        last_ts: float, the time of the previous line
+
+    Returns:
+        tuple of (timestamp, line)
+    """
+    if len(line) > 26 and line[23:26] == ' - ':
+        try:
+            line_ts = time.mktime(time.strptime(line[:19], '%Y-%m-%d %H:%M:%S')) + int(line[20:23]) / 1000.0
+            return (line_ts, line[26:])
+        except ValueError:
+            pass
+    return (last_ts, line)
+
+def read_host_log(log_path, follow=False, since_ts=None):
+    """
+    Read the lines of a host component's log file, starting with the rotated
+    backups of it. When following, the file is reopened when it is rotated.
+    Lines longer than LOGS_LINE_MAX are split, like in read_docker_log
+
+    Args:
+        log_path: str, path to the log file
+        follow: bool, whether to keep following the log for new lines
+        since_ts: float, skip lines from before this epoch time
+
+    Yields:
+        tuple of (timestamp, line)
+    """
+    last_ts = 0
+    log_paths = ['{}.{}'.format(log_path, backup) for backup in range(HOST_LOG_BACKUPS, 0, -1)] + [log_path]
+    for cur_path in log_paths:
+        try:
+            log_file = open(cur_path, 'rb')
+        except (IOError, OSError):
+            if cur_path != log_path or not follow:
+                continue
+            log_file = None
+        partial = b''
+        continued = False
+        rotated = False
+        while True:
+            chunk = log_file.readline(LOGS_LINE_MAX - len(partial)) if log_file else b''
+            if chunk:
+                partial += chunk
+                if not partial.endswith(b'\n') and len(partial) < LOGS_LINE_MAX:
+                    continue
+                if continued and not partial.strip(b'\r\n'):
+                    #The rest of a line that was exactly LOGS_LINE_MAX long
+                    partial = b''
+                    continued = False
+                    continue
+                line = partial.decode('utf-8', 'replace').rstrip('\r\n')
+                if continued:
+                    line_ts = last_ts
+                else:
+                    line_ts, line = parse_host_log_line(line, last_ts)
+                continued = not partial.endswith(b'\n')
+                partial = b''
+                last_ts = line_ts
+                if since_ts is None or line_ts >= since_ts:
+                    yield (line_ts, line)
+                continue
+            if cur_path != log_path or not follow:
+                break
+            if rotated:
+                #Everything in the old file has been read, so start over with the new one
+                log_file.close()
+                log_file = None
+                rotated = False
+            else:
+                time.sleep(LOGS_FILE_POLL)
+            try:
+                cur_stat = os.stat(log_path)
+                if log_file is None:
+                    log_file = open(log_path, 'rb')
+                elif os.fstat(log_file.fileno()).st_ino != cur_stat.st_ino or log_file.tell() > cur_stat.st_size:
+                    rotated = True
+            except (IOError, OSError):
+                continue
+        if partial:
+            line = partial.decode('utf-8', 'replace').rstrip('\r\n')
+            if continued:
+                yield (last_ts, line)
+            else:
+                yield parse_host_log_line(line, last_ts)
+        if log_file:
+            log_file.close()
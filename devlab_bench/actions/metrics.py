@@ -0,0 +1,114 @@
+"""
+Things dealing with the 'metrics' action
+"""
+import logging
+import os
+import sys
+
+import devlab_bench
+import devlab_bench.helpers.docker
+from devlab_bench.actions.status import get_status
+from devlab_bench.helpers.history import get_history_store
+from devlab_bench.helpers.metrics import MetricFamily, format_openmetrics, get_docker_latency, get_textfile_name, save_docker_latency, write_textfile
+
+#How old, in seconds, the saved health of a component can be before its
+#status_script is run again
+METRICS_HEALTH_AGE_DEF = 60
+COMPONENT_STATES = ('up', 'stopped', 'missing')
+
+def action(textfile_dir=None, max_health_age=METRICS_HEALTH_AGE_DEF, **kwargs):
+    """
+    Output metrics about the project's components and the latency of its
+    docker operations, in the OpenMetrics text format
+
+    Args:
+        textfile_dir: str, path to a node_exporter textfile directory to
+            write the metrics to, instead of to stdout
+        max_health_age: int, how old, in seconds, the saved health of a
+            component can be before it is checked again
+    """
+    ignored_args = kwargs
+    log = logging.getLogger('Metrics')
+    families = get_metric_families()
+    collect_metrics(families, max_health_age=max_health_age, logger=log)
+    metrics_text = format_openmetrics(families)
+    if textfile_dir:
+        if not os.path.isdir(textfile_dir):
+            log.error("Textfile directory: '%s' doesn't exist", textfile_dir)
+            sys.exit(1)
+        metrics_path = write_textfile(metrics_text, textfile_dir, get_textfile_name())
+        log.debug("Wrote metrics to: '%s'", metrics_path)
+        return
+    sys.stdout.write(metrics_text)
+
+def get_metric_families():
+    """
+    Get the (empty) families of the metrics that devlab reports
+
+    Returns:
+        list of MetricFamily objects
+    """
+    return [
+        MetricFamily('devlab_component_state', 'gauge', 'Whether the component is in the state, which is one of: {}'.format(', '.join(COMPONENT_STATES))),
+        MetricFamily('devlab_component_health', 'gauge', 'Health of a running component, as reported by its status_script, or by checking its ports'),
+        MetricFamily('devlab_component_health_checked_timestamp_seconds', 'gauge', 'When the health of a running component was last checked'),
+        MetricFamily('devlab_component_last_up_duration_seconds', 'gauge', 'How long bringing up the component took, in the last successful up that included it'),
+        MetricFamily('devlab_container_restarts', 'counter', 'Number of times the engine has restarted the component\'s container'),
+        MetricFamily('devlab_docker_operation_duration_seconds', 'histogram', 'How long calls to the docker engine took, by DockerHelper operation')
+    ]
+
+def collect_metrics(families, max_health_age=METRICS_HEALTH_AGE_DEF, logger=None):
+    """
+    Add samples for the current project to metric families. The project's
+    containers come from the DockerHelper, and are cached in a long running
+    process like the devlab agent, and components' health is only checked
+    again once it is older than max_health_age
+
+    Args:
+        families: list of MetricFamily objects, as returned by
+            get_metric_families
+        max_health_age: int, how old, in seconds, the saved health of a
+            component can be before it is checked again
+        logger: Logger object to use for log messages
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Metrics')
+    families = dict((family.name, family) for family in families)
+    project = devlab_bench.PROJ_ROOT
+    docker_helper = devlab_bench.helpers.docker.DOCKER
+    status = get_status(max_health_age=max_health_age, logger=log)
+    containers = set(status['containers'])
+    to_inspect = []
+    for comp_status in status['components']:
+        labels = {
+            'project': project,
+            'component': comp_status['component']
+        }
+        for comp_state in COMPONENT_STATES:
+            families['devlab_component_state'].add(int(comp_status['status'] == comp_state), state=comp_state, type=comp_status['type'], **labels)
+        if comp_status['status'] == 'up':
+            families['devlab_component_health'].add(1, health=comp_status['health'], **labels)
+            families['devlab_component_health_checked_timestamp_seconds'].add(comp_status['health_checked'], **labels)
+        if '{}-devlab'.format(comp_status['component']) in containers:
+            to_inspect.append('{}-devlab'.format(comp_status['component']))
+    for container, inspect_data in sorted(docker_helper.inspect_containers(to_inspect).items()):
+        families['devlab_container_restarts'].add(
+            inspect_data[0].get('RestartCount', 0),
+            suffix='_total',
+            project=project,
+            component=container[0:len(container)-7]
+        )
+    history = get_history_store()
+    try:
+        last_durations = history.get_last_durations('up')
+    finally:
+        history.close()
+    for comp_status in status['components']:
+        if comp_status['component'] in last_durations:
+            families['devlab_component_last_up_duration_seconds'].add(last_durations[comp_status['component']], project=project, component=comp_status['component'])
+    #Include the calls made while collecting these metrics
+    save_docker_latency(docker_helper, logger=log)
+    for operation, histogram in sorted(get_docker_latency().items()):
+        families['devlab_docker_operation_duration_seconds'].add_histogram(histogram, project=project, operation=operation)
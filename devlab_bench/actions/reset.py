@@ -3,12 +3,17 @@ Things dealing with the 'up' action
 """
 import logging
 import os
-import shutil
 import sys
 
 import devlab_bench.helpers.docker
 from devlab_bench.helpers import text_input
 from devlab_bench.helpers.common import get_components, get_config, get_ordinal_sorting, unnest_list
+from devlab_bench.helpers.locks import component_lock, project_lock
+from devlab_bench.helpers.persistence import drop_layer, get_layer_mode, remove_layers
+from devlab_bench.helpers.snapshot import list_snapshots, remove_snapshot
+from devlab_bench.helpers.state import get_state_store
+from devlab_bench.helpers.trace import span
+from devlab_bench.helpers.trash import move_to_trash, start_purge
 
 def action(targets='*', reset_wizard=False, full=False, **kwargs):
     """
@@ -43,55 +48,6 @@ def action(targets='*', reset_wizard=False, full=False, **kwargs):
     if not config['components'] and not foreground_comp_name:
         log.error("No components have been configured. Try running with the 'up' action or the 'wizard' script directly")
         sys.exit(1)
-    if 'linux' in sys.platform.lower():
-        if os.geteuid() != 0:
-            log.info("Executing reset command from inside of a container")
-            cargs = []
-            cur_args = list(sys.argv[1:])
-            while cur_args:
-                arg = cur_args.pop(0)
-                #Ignore any previously passed project root
-                if arg.startswith('-'):
-                    if arg in ['-P', '--project-root']:
-                        cur_args.pop(0)
-                        continue
-                    cargs.append("'{}'".format(arg))
-                    if arg not in ['-v', '--version', '-h', '--help']:
-                        cargs.append("'{}'".format(cur_args.pop(0)))
-                else:
-                    #This indicates that we've reached the 'action'
-                    break
-            cargs.append('reset')
-            if reset_wizard:
-                cargs.append('--reset-wizard')
-            if full:
-                cargs.append('--full')
-            if isinstance(targets, list):
-                for carg in targets:
-                    cargs.append("'{}'".format(carg))
-            else:
-                cargs.append("'{}'".format(targets))
-            script_ret = devlab_bench.helpers.docker.DOCKER.run_container(
-                image='devlab_helper:latest',
-                name='devlab-reset',
-                network=config['network']['name'],
-                mounts=[
-                    '{}:/devlab'.format(devlab_bench.PROJ_ROOT),
-                    '{}/devlab:/usr/bin/devlab'.format(devlab_bench.DEVLAB_ROOT),
-                    '{}/devlab_bench:/usr/bin/devlab_bench'.format(devlab_bench.DEVLAB_ROOT),
-                    '/var/run/docker.sock:/var/run/docker.sock'
-                ],
-                run_opts=['--rm', '--workdir', '/devlab'],
-                background=False,
-                interactive=True,
-                cmd='/usr/bin/devlab -P /devlab {}'.format(' '.join(cargs)),
-                ignore_nonzero_rc=True,
-                logger=log
-            )
-            if script_ret[0] != 0:
-                log.error('Execution of devlab reset command inside of container failed')
-                sys.exit(1)
-            return
     if set(all_components) != set(components_to_reset):
         if full:
             log.error("You have passed specific components, in addition to --full. When using --full, ALL components are assumed")
@@ -134,106 +90,119 @@ def action(targets='*', reset_wizard=False, full=False, **kwargs):
             log.warning("Aborting!")
             sys.exit(1)
     components_to_reset.reverse()
+    trash_errors = {}
     for comp in components_to_reset:
+        trash_paths = []
         reset_wizard_files = reset_wizard
         if comp == 'devlab':
             continue
-        if comp == foreground_comp_name:
-            log.info("Resetting files for foreground component: %s", foreground_comp_name)
-            comp_config = config['foreground_component']
-            comp_config['enabled'] = True
-        else:
-            comp_config = config['components'][comp]
-        if comp_config['enabled']:
-            devlab_bench.actions.down.action(components=[comp], rm=True)
-        else:
-            # Always reset wizard files for components that are disabled
-            reset_wizard_files = True
-        if reset_wizard_files:
-            log.info("Resetting wizard related files for component: '%s'", comp)
+        with span('component: {}'.format(comp), component=comp), component_lock(comp, logger=log):
+            if comp == foreground_comp_name:
+                log.info("Resetting files for foreground component: %s", foreground_comp_name)
+                comp_config = config['foreground_component']
+                comp_config['enabled'] = True
+            else:
+                comp_config = config['components'][comp]
+            if comp_config['enabled']:
+                devlab_bench.actions.down.action(components=[comp], rm=True)
+            else:
+                # Always reset wizard files for components that are disabled
+                reset_wizard_files = True
+            layer_dropped = False
+            if get_layer_mode(comp) and not full:
+                layer_dropped = drop_layer(comp, logger=log)
+                if not layer_dropped:
+                    log.warning("Failed resetting component: '%s' to its seed persistence layer, removing its 'reset_paths' instead", comp)
+            #Let 'up' know that the component's data is the provisioned seed,
+            #so that its provisioning scripts aren't run again on top of it
+            if layer_dropped:
+                get_state_store().set('seed_restored', True, scope=comp)
+            else:
+                get_state_store().delete('seed_restored', scope=comp)
+            if reset_wizard_files:
+                log.info("Resetting wizard related files for component: '%s'", comp)
+                try:
+                    for wpath in config['paths']['component_persistence_wizard_paths']:
+                        full_path = '{PROJ_ROOT}/{comp_pers}/{component}/{path}'.format(
+                            PROJ_ROOT=devlab_bench.PROJ_ROOT,
+                            comp_pers=config['paths']['component_persistence'],
+                            component=comp,
+                            path=wpath
+                        ).replace('..', '')
+                        log.debug("Looking to see if wizard related path exists: '%s'", full_path)
+                        if os.path.lexists(full_path):
+                            trash_paths.append(full_path)
+                except KeyError:
+                    pass
+            if layer_dropped:
+                log.debug("Skipping 'reset_paths' for component: '%s' as it was reset to its seed persistence layer", comp)
+            else:
+                log.info("Resetting files for component: '%s'", comp)
+                try:
+                    for rpath in comp_config['reset_paths']:
+                        full_path = '{PROJ_ROOT}/{comp_pers}/{component}/{path}'.format(
+                            PROJ_ROOT=devlab_bench.PROJ_ROOT,
+                            comp_pers=config['paths']['component_persistence'],
+                            component=comp,
+                            path=rpath
+                        ).replace('..', '')
+                        log.debug("Looking to see if path exists: '%s'", full_path)
+                        if os.path.lexists(full_path):
+                            trash_paths.append(full_path)
+                except KeyError:
+                    pass
+            if full:
+                log.info("Resetting 'full' reset files for component '%s'", comp)
+                remove_layers(comp, logger=log)
+                try:
+                    for fpath in comp_config['reset_full']:
+                        full_path = '{PROJ_ROOT}/{comp_pers}/{component}/{path}'.format(
+                            PROJ_ROOT=devlab_bench.PROJ_ROOT,
+                            comp_pers=config['paths']['component_persistence'],
+                            component=comp,
+                            path=fpath
+                        ).replace('..', '')
+                        if os.path.lexists(full_path):
+                            trash_paths.append(full_path)
+                except KeyError:
+                    pass
+            trash_errors.update(move_to_trash(trash_paths, logger=log))
+    with project_lock(logger=log):
+        trash_paths = []
+        if 'devlab' in components_to_reset:
+            log.info("Resetting devlab specific files")
             try:
-                for wpath in config['paths']['component_persistence_wizard_paths']:
-                    full_path = '{PROJ_ROOT}/{comp_pers}/{component}/{path}'.format(
+                for rpath in config['paths']['reset_paths']:
+                    full_path = '{PROJ_ROOT}/{path}'.format(
                         PROJ_ROOT=devlab_bench.PROJ_ROOT,
-                        comp_pers=config['paths']['component_persistence'],
-                        component=comp,
-                        path=wpath
+                        path=rpath
                     ).replace('..', '')
-                    log.debug("Looking to see if wizard related path exists: '%s'", full_path)
-                    if os.path.isfile(full_path):
-                        os.remove(full_path)
-                    if os.path.isdir(full_path):
-                        shutil.rmtree(full_path)
+                    log.debug("Looking to see if path exists: '%s'", full_path)
+                    if os.path.lexists(full_path):
+                        trash_paths.append(full_path)
             except KeyError:
                 pass
-        log.info("Resetting files for component: '%s'", comp)
-        try:
-            for rpath in comp_config['reset_paths']:
-                full_path = '{PROJ_ROOT}/{comp_pers}/{component}/{path}'.format(
-                    PROJ_ROOT=devlab_bench.PROJ_ROOT,
-                    comp_pers=config['paths']['component_persistence'],
-                    component=comp,
-                    path=rpath
-                ).replace('..', '')
-                log.debug("Looking to see if path exists: '%s'", full_path)
-                if os.path.isfile(full_path):
-                    log.debug("Removing file: '%s'", full_path)
-                    os.remove(full_path)
-                if os.path.isdir(full_path):
-                    log.debug("Removing directory: '%s'", full_path)
-                    shutil.rmtree(full_path)
-        except KeyError:
-            pass
         if full:
-            log.info("Resetting 'full' reset files for component '%s'", comp)
+            log.info("Resetting paths for 'full' reset")
             try:
-                for fpath in comp_config['reset_full']:
-                    full_path = '{PROJ_ROOT}/{comp_pers}/{component}/{path}'.format(
+                for fpath in config['paths']['reset_full']:
+                    full_path = '{PROJ_ROOT}/{path}'.format(
                         PROJ_ROOT=devlab_bench.PROJ_ROOT,
-                        comp_pers=config['paths']['component_persistence'],
-                        component=comp,
                         path=fpath
                     ).replace('..', '')
-                    if os.path.isdir(full_path):
-                        log.debug("Removing directory: '%s'", full_path)
-                        shutil.rmtree(full_path)
-                    if os.path.isfile(full_path):
-                        log.debug("Removing file: '%s'", full_path)
-                        os.remove(full_path)
+                    if os.path.lexists(full_path):
+                        trash_paths.append(full_path)
             except KeyError:
                 pass
-    if 'devlab' in components_to_reset:
-        log.info("Resetting devlab specific files")
-        try:
-            for rpath in config['paths']['reset_paths']:
-                full_path = '{PROJ_ROOT}/{path}'.format(
-                    PROJ_ROOT=devlab_bench.PROJ_ROOT,
-                    path=rpath
-                ).replace('..', '')
-                log.debug("Looking to see if path exists: '%s'", full_path)
-                if os.path.isfile(full_path):
-                    log.debug("Removing file: '%s'", full_path)
-                    os.remove(full_path)
-                if os.path.isdir(full_path):
-                    log.debug("Removing directory: '%s'", full_path)
-                    shutil.rmtree(full_path)
-        except KeyError:
-            pass
-    if full:
-        log.info("Resetting paths for 'full' reset")
-        try:
-            for fpath in config['paths']['reset_full']:
-                full_path = '{PROJ_ROOT}/{path}'.format(
-                    PROJ_ROOT=devlab_bench.PROJ_ROOT,
-                    path=fpath
-                ).replace('..', '')
-                if os.path.isdir(full_path):
-                    shutil.rmtree(full_path)
-                if os.path.isfile(full_path):
-                    log.debug("Removing file: '%s'", full_path)
-                    os.remove(full_path)
-        except KeyError:
-            pass
+            log.info("Removing post-provision snapshots")
+            for snap in list_snapshots():
+                remove_snapshot(snap['image'], logger=log)
+        trash_errors.update(move_to_trash(trash_paths, logger=log))
+    #Everything being reset has been moved out of the way, so the rest can be
+    #removed in the background
+    start_purge(logger=log)
+    if trash_errors:
+        sys.exit(1)
 
 def get_reset_components(filter_list):
     """
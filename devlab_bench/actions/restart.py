@@ -6,6 +6,7 @@ import logging
 import devlab_bench.actions.down
 import devlab_bench.actions.up
 from devlab_bench.helpers.common import get_components, unnest_list
+from devlab_bench.helpers.locks import component_locks
 def action(components='*', logger=None, update_images=False, **kwargs):
     """
     Restart components by bringing them down and then back up again
@@ -30,7 +31,10 @@ def action(components='*', logger=None, update_images=False, **kwargs):
         components_to_restart = components
     if update_images:
         rm = True
-    log.info("Bringing components DOWN")
-    devlab_bench.actions.down.action(components=components_to_restart, rm=rm)
-    log.info("Bringing components UP")
-    devlab_bench.actions.up.action(components=components_to_restart, update_images=update_images)
+    #Hold the components' locks between bringing them down and up, so nothing
+    #else can sneak in while they are down
+    with component_locks(components_to_restart, logger=log):
+        log.info("Bringing components DOWN")
+        devlab_bench.actions.down.action(components=components_to_restart, rm=rm)
+        log.info("Bringing components UP")
+        devlab_bench.actions.up.action(components=components_to_restart, update_images=update_images)
@@ -1,14 +1,18 @@
 """
 Things dealing with the 'up' action
 """
+import functools
 import logging
 import sys
 
 import devlab_bench.helpers.docker
+from devlab_bench.helpers.command import CommandPool
 from devlab_bench.helpers.docker import check_custom_registry, parse_docker_image_string
 from devlab_bench.helpers.common import get_config, get_shell_components, script_runner, unnest_list
 
-def action(components='*', adhoc_image=None, adhoc_name=None, command=None, user=None, **kwargs):
+SHELL_PARALLEL_DEF = 1
+
+def action(components='*', adhoc_image=None, adhoc_name=None, command=None, user=None, parallel=SHELL_PARALLEL_DEF, **kwargs):
     """
     Execute a shell or a command inside of a component
 
@@ -17,9 +21,12 @@ def action(components='*', adhoc_image=None, adhoc_name=None, command=None, user
         adhoc_name: string of the name to use for the container's name
         components: string or list of the component(s) to shell or execute
             a command on. If more than one component is specified then run the
-            command on them sequentially
+            command on them sequentially, unless parallel is more than 1
         command: string of the command to run. Optional. Default=None
         user: string of the user to execute the shell command as
+        parallel: int, the maximum number of components to run the command
+            on at the same time. Interactive shells are always run one at a
+            time. Default=1
     Returns:
         None
     """
@@ -37,6 +44,18 @@ def action(components='*', adhoc_image=None, adhoc_name=None, command=None, user
     config = get_config()
     #Remove duplicates
     components_dst = list(sorted(set(components_dst)))
+    containers_dict = {}
+    if [component for component in components_dst if component != 'adhoc']:
+        log.debug("Getting current list of containers")
+        containers = devlab_bench.helpers.docker.DOCKER.get_containers()[1]
+        for container in containers:
+            containers_dict[container['name']] = container
+        log.debug("Current list of containers: '%s'", ', '.join(containers_dict.keys()))
+    if parallel > 1 and len(components_dst) > 1:
+        if command:
+            run_parallel(components_dst, command, containers_dict, parallel, adhoc_image=adhoc_image, adhoc_name=adhoc_name, user=user, logger=log)
+            return
+        log.warning("Interactive shells can't be run in parallel, running them one at a time")
     for component in components_dst:
         if not command:
             try:
@@ -45,13 +64,6 @@ def action(components='*', adhoc_image=None, adhoc_name=None, command=None, user
                 command = '/bin/bash'
         ignore_nonzero_rc = bool(command.endswith('/bin/bash') or command.endswith('/bin/sh'))
         if component != 'adhoc':
-            log.debug("Getting current list of containers")
-            containers = devlab_bench.helpers.docker.DOCKER.get_containers()[1]
-            containers_dict = {}
-            for container in containers:
-                containers_dict[container['name']] = container
-            container_names = [cntr['name'] for cntr in containers]
-            log.debug("Current list of containers: '%s'", ', '.join(container_names))
             try:
                 if 'up' not in containers_dict['{}-devlab'.format(component)]['status'].lower():
                     log.error("Component: %s is not currently running. Aborting", component)
@@ -59,27 +71,193 @@ def action(components='*', adhoc_image=None, adhoc_name=None, command=None, user
             except KeyError:
                 log.error("Container %s-devlab doesn't currently exist for component: %s. Try doing an 'up' action first? Aborting", component, component)
         else:
-            if not (command.startswith('helper_container|') or command.startswith('running_container|')):
-                log.debug("Building adhoc command...")
-                adhoc_image_parsed = parse_docker_image_string(adhoc_image)
-                log.debug("Adhoc image tag: %s", adhoc_image_parsed['tag'])
-                if adhoc_image_parsed['host']:
-                    adhoc_image_parsed['host'] += '/'
-                    adhoc_config = {
-                        'components': {
-                            'adhoc': {
-                                'image': adhoc_image
-                            }
-                        }
-                    }
-                    if check_custom_registry(['adhoc'], adhoc_config, logger=log):
-                        log.error("Please make sure you have logged into needed custom docker registries")
-                        sys.exit(1)
-                else:
-                    adhoc_image_parsed['host'] = ''
-                if not adhoc_name:
-                    adhoc_name = adhoc_image_parsed['bare_image']
-                    adhoc_name = '{}-adhoc'.format(adhoc_name.replace('/', '_').strip('_'))
-                command = 'helper_container|{host}{bare_image}^{tag}^{adhoc_name}: {command}'.format(adhoc_name=adhoc_name, command=command, **adhoc_image_parsed)
-                log.debug("Built adhoc command: '%s'", command)
+            command = get_adhoc_command(command, adhoc_image, adhoc_name, logger=log)
         script_runner(command, '{}-devlab'.format(component), log=log, ignore_nonzero_rc=ignore_nonzero_rc, user=user)
+
+def get_adhoc_command(command, adhoc_image, adhoc_name=None, logger=None):
+    """
+    Build the script runner command for running a command in an adhoc
+    container
+
+    Args:
+        command: str, the command to run
+        adhoc_image: str, the image to use for the adhoc container
+        adhoc_name: str, the name to use for the container. Default is based
+            on the image's name
+        logger: Logger object to use for log messages
+
+    Returns:
+        str
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger("Shell")
+    if command.startswith('helper_container|') or command.startswith('running_container|'):
+        return command
+    log.debug("Building adhoc command...")
+    adhoc_image_parsed = parse_docker_image_string(adhoc_image)
+    log.debug("Adhoc image tag: %s", adhoc_image_parsed['tag'])
+    if adhoc_image_parsed['host']:
+        adhoc_image_parsed['host'] += '/'
+        adhoc_config = {
+            'components': {
+                'adhoc': {
+                    'image': adhoc_image
+                }
+            }
+        }
+        if check_custom_registry(['adhoc'], adhoc_config, logger=log):
+            log.error("Please make sure you have logged into needed custom docker registries")
+            sys.exit(1)
+    else:
+        adhoc_image_parsed['host'] = ''
+    if not adhoc_name:
+        adhoc_name = adhoc_image_parsed['bare_image']
+        adhoc_name = '{}-adhoc'.format(adhoc_name.replace('/', '_').strip('_'))
+    command = 'helper_container|{host}{bare_image}^{tag}^{adhoc_name}: {command}'.format(adhoc_name=adhoc_name, command=command, **adhoc_image_parsed)
+    log.debug("Built adhoc command: '%s'", command)
+    return command
+
+def get_output_logger(component, prefix_width, level):
+    """
+    Get a logger that writes the output of a command to stdout/stderr, with
+    every line prefixed with the component's name, so that the output of
+    commands running at the same time can be told apart
+
+    Args:
+        component: str, name of the component
+        prefix_width: int, width to pad the component's name to
+        level: int, the log level of the logger
+
+    Returns:
+        Logger
+    """
+    comp_log = logging.getLogger('Shell-{}'.format(component))
+    comp_log.propagate = False
+    comp_log.setLevel(level)
+    for handler in list(comp_log.handlers):
+        comp_log.removeHandler(handler)
+    formatter = logging.Formatter('{:<{}} | %(message)s'.format(component, prefix_width))
+    #Output from the command's stdout is logged as info, and from its stderr as warning
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    stdout_handler.addFilter(lambda record: record.levelno < logging.WARNING)
+    stdout_handler.setFormatter(formatter)
+    stderr_handler = logging.StreamHandler(sys.stderr)
+    stderr_handler.setLevel(logging.WARNING)
+    stderr_handler.setFormatter(formatter)
+    comp_log.addHandler(stdout_handler)
+    comp_log.addHandler(stderr_handler)
+    return comp_log
+
+def run_parallel(components, command, containers_dict, jobs, adhoc_image=None, adhoc_name=None, user=None, logger=None):
+    """
+    Run a non-interactive command on multiple components at the same time,
+    print a summary of the result for each component, and exit with the
+    highest return code of the commands
+
+    Args:
+        components: list of str, the components to run the command on
+        command: str, the command to run
+        containers_dict: dict, of the project's containers, keyed by the
+            container's name
+        jobs: int, the maximum number of components to run the command on at
+            the same time
+        adhoc_image: str, the image to use for the 'adhoc' component
+        adhoc_name: str, the container name to use for the 'adhoc' component
+        user: str, the user to execute the command as
+        logger: Logger object to use for log messages
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger("Shell")
+    results = []
+    to_run = {}
+    for component in components:
+        if component == 'adhoc':
+            to_run[component] = get_adhoc_command(command, adhoc_image, adhoc_name, logger=log)
+            continue
+        container = containers_dict.get('{}-devlab'.format(component), None)
+        if container is None:
+            error = "Container {}-devlab doesn't currently exist".format(component)
+        elif 'up' not in container['status'].lower():
+            error = 'Component is not currently running'
+        else:
+            to_run[component] = command
+            continue
+        log.error("Component: %s: %s. Skipping", component, error)
+        results.append({
+            'component': component,
+            'rc': 1,
+            'duration': 0,
+            'error': error
+        })
+    prefix_width = max([len(component) for component in components])
+    level = log.getEffectiveLevel()
+    jobs = max(1, min(jobs, len(to_run)))
+    log.info("Running command: '%s' on %s component(s), %s at a time", command, len(to_run), jobs)
+    pool = CommandPool(max_workers=jobs, logger=log)
+    for component in sorted(to_run):
+        #Output is written as it arrives, prefixed with the component's name
+        pool.submit(component, functools.partial(
+            script_runner,
+            to_run[component],
+            '{}-devlab'.format(component),
+            log=get_output_logger(component, prefix_width, level),
+            ignore_nonzero_rc=True,
+            interactive=False,
+            log_output=True,
+            user=user
+        ))
+    for result in pool.run():
+        results.append({
+            'component': result['name'],
+            'rc': result['rc'],
+            'duration': result['duration'],
+            'error': result['error']
+        })
+    print_summary(results)
+    agg_rc = 0
+    for result in results:
+        if result['rc'] != 0:
+            agg_rc = max(agg_rc, result['rc'] if result['rc'] > 0 else 1)
+    sys.exit(agg_rc)
+
+def print_summary(results):
+    """
+    Print a table summarizing the result of the command on each component
+
+    Args:
+        results: list of dicts, with the keys: 'component', 'rc', 'duration'
+            and 'error'
+    """
+    summary_header = {
+        'component': 'Component',
+        'result': 'Result',
+        'rc': 'RC',
+        'duration': 'Duration',
+        'error': 'Error'
+    }
+    summary_header_format = "| {component:^25} | {result:^8} | {rc:^4} | {duration:^9} | {error:^40} |"
+    summary_row_format = "| {component:25} | {result:8} | {rc:>4} | {duration:>9} | {error:40} |"
+    summary_width = len(summary_header_format.format(**summary_header))
+    summary_table_bar = '{{:-<{}}}'.format(summary_width)
+    summary_table = [
+        summary_table_bar.format(''),
+        summary_header_format.format(**summary_header),
+        summary_table_bar.format('')
+    ]
+    for result in sorted(results, key=lambda res: res['component']):
+        summary_table.append(
+            summary_row_format.format(
+                component=result['component'],
+                result='ok' if result['rc'] == 0 else 'failed',
+                rc=result['rc'],
+                duration='{:.1f}s'.format(result['duration']),
+                error=result['error'] or ''
+            )
+        )
+    summary_table.append(summary_table_bar.format(''))
+    print('\n## SHELL ##')
+    print('\n'.join(summary_table))
@@ -0,0 +1,81 @@
+"""
+Things dealing with the 'snapshots' action
+"""
+import logging
+import sys
+import time
+
+from devlab_bench.helpers.common import get_config, unnest_list
+from devlab_bench.helpers.snapshot import gc_snapshots, get_snapshot_image, get_snapshot_key, list_snapshots, remove_snapshot
+
+def action(components='*', remove=False, prune=False, keep=None, **kwargs):
+    """
+    List, remove, or garbage collect the post-provision snapshots of components
+
+    Args:
+        components: list of components to work on, this can also be the
+            string '*' for all
+        remove: bool, whether to remove the snapshots of the components
+        prune: bool, whether to remove the least recently used snapshots that
+            are over the limit set by 'snapshot_keep' in the config
+        keep: int, override the limit of snapshots to keep when pruning
+
+    Returns:
+        None
+    """
+    ignored_args = kwargs
+    log = logging.getLogger("Snapshots")
+    config = get_config()
+    if isinstance(components, str):
+        components = [components]
+    unnest_list(components)
+    if '*' in components:
+        components = list(config['components'].keys())
+    snapshots = [snap for snap in list_snapshots() if snap['component'] in components]
+    if remove:
+        errors = False
+        for snap in snapshots:
+            if not remove_snapshot(snap['image'], logger=log):
+                errors = True
+        if errors:
+            sys.exit(1)
+        return
+    if prune:
+        removed = gc_snapshots(keep=keep, logger=log)
+        log.info("Removed %s snapshot(s)", len(removed))
+        return
+    current_images = {}
+    for comp in components:
+        comp_config = config['components'].get(comp, {})
+        if not comp_config.get('snapshot_after_provision', False) or comp_config.get('type', 'container') != 'container':
+            continue
+        current_images[comp] = get_snapshot_image(comp, get_snapshot_key(comp, comp_config, logger=log))
+    snap_header = {
+        'component': 'Component',
+        'image': 'Snapshot Image',
+        'current': 'Current',
+        'created': 'Created',
+        'last_used': 'Last Used'
+    }
+    snap_header_format = "| {component:^16} | {image:^48} | {current:^7} | {created:^19} | {last_used:^19} |"
+    snap_row_format = "| {component:16} | {image:48} | {current:^7} | {created:19} | {last_used:19} |"
+    snap_width = len(snap_header_format.format(**snap_header))
+    snap_table_bar = '{{:-<{}}}'.format(snap_width)
+    snap_table = [
+        snap_table_bar.format(''),
+        snap_header_format.format(**snap_header),
+        snap_table_bar.format('')
+    ]
+    for snap in snapshots:
+        snap_table.append(
+            snap_row_format.format(
+                component=snap['component'],
+                image=snap['image'],
+                current='yes' if current_images.get(snap['component']) == snap['image'] else 'no',
+                created=time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snap['created'])),
+                last_used=time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snap['last_used']))
+            )
+        )
+    snap_table.append(snap_table_bar.format(''))
+    print('\n## SNAPSHOTS ##')
+    print('\n'.join(snap_table))
@@ -3,12 +3,18 @@ Things dealing with the 'status' action
 """
 import json
 import logging
-import os
 import sys
+import time
 
 import devlab_bench.helpers.docker
 from devlab_bench.helpers.docker import parse_docker_local_ports
-from devlab_bench.helpers.common import get_components, get_config, get_env_from_file, get_primary_ip, get_ordinal_sorting, port_check, script_runner
+from devlab_bench.helpers.common import get_components, get_config, get_primary_ip, get_ordinal_sorting, port_check, script_runner
+from devlab_bench.helpers.locks import describe_holders, get_held_locks
+from devlab_bench.helpers.state import get_state_store
+from devlab_bench.helpers.supervisor import host_component_running
+from devlab_bench.helpers.trash import get_trash_size, human_size
+
+STATUS_HEALTH_KEY = 'health'
 
 def action(**kwargs):
     """
@@ -16,6 +22,115 @@ def action(**kwargs):
     """
     ignored_args = kwargs
     log = logging.getLogger("Status")
+    status = get_status(logger=log)
+    if not status['components']:
+        if status['containers']:
+            log.warning("Found orphaned containers: %s", ', '.join(status['containers']))
+            log.warning("It is recommended that you run: 'docker rm -f %s'", ' '.join(status['containers']))
+        else:
+            log.info("No components have been configured. Try running with the 'up' action or the 'wizard' script directly")
+        sys.exit(1)
+    if status['orphaned']:
+        log.warning("There are orphaned containers: '%s'", ', '.join(status['orphaned']))
+        log.warning("It is recommended that you run: 'docker rm -f %s'", ' '.join(status['orphaned']))
+    log.debug("Building tables")
+    status_table = []
+    links_table = []
+    #Generate Header for Status table
+    status_header = {
+        'component': 'Component',
+        'container_name': 'Container Name',
+        'status': 'Status',
+        'health': 'Health',
+        'local_port': 'Docker exposed'
+    }
+    status_header_format = "| {component:^16} | {container_name:^22} | {status:^8} | {health:^20} | {local_port:^14} |"
+    status_row_format = "| {component:16} | {container_name:22} | {status:8} | {health:^20} | {local_port:14} |"
+    status_width = len(status_header_format.format(**status_header))
+    status_table_bar = '{{:-<{}}}'.format(status_width)
+    status_table.append(status_table_bar.format(''))
+    status_table.append(status_header_format.format(**status_header))
+    status_table.append(status_table_bar.format(''))
+    #Generate Header for Links table
+    links_header = {
+        'component': 'Component',
+        'link': 'Link(s)',
+        'comment': 'Comment'
+    }
+    links_header_format = "| {component:^16} | {link:^40} | {comment:^65} |"
+    links_row_format = "| {component:16} | {link:40} | {comment:65} |"
+    links_width = len(links_header_format.format(**links_header))
+    links_table_bar = '{{:-<{}}}'.format(links_width)
+    links_table.append(links_table_bar.format(''))
+    links_table.append(links_header_format.format(**links_header))
+    links_table.append(links_table_bar.format(''))
+    #Print rows
+    for comp_status in status['components']:
+        status_table.append(
+            status_row_format.format(
+                component=comp_status['component'],
+                container_name=comp_status['container_name'],
+                status=comp_status['status'],
+                health=comp_status['health'],
+                local_port=(comp_status['local_ports'] or [''])[0]
+            )
+        )
+        for local_port in comp_status['local_ports'][1:]:
+            status_table.append(status_row_format.format(component='', container_name='', status='', health='', local_port=local_port))
+        first_link = True
+        for link in comp_status['links']:
+            if first_link:
+                links_table.append(links_row_format.format(component=comp_status['component'], **link))
+                first_link = False
+            else:
+                links_table.append(links_row_format.format(component='', **link))
+    #Generate Footers
+    status_table.append(status_table_bar.format(''))
+    links_table.append(links_table_bar.format(''))
+    print('\n## COMPONENT STATUS ##')
+    print('\n'.join(status_table))
+    print('')
+    if len(links_table) > 4:
+        print('## LINKS ##')
+        print('\n'.join(links_table))
+    trash_size, trash_entries = get_trash_size()
+    if trash_entries:
+        print('')
+        print('Pending reclaim from reset: {} in {} path(s)'.format(human_size(trash_size), trash_entries))
+    held_locks = get_held_locks()
+    if held_locks:
+        print('')
+        for lock_name in sorted(held_locks):
+            print("Lock: '{}' is held by: {}".format(lock_name, describe_holders(held_locks[lock_name])))
+
+def get_status(max_health_age=None, logger=None):
+    """
+    Get the status of each of the project's components, and the health and
+    links of the ones that are running. The health of a component is checked
+    by running its status_script, or by checking that its ports are open, and
+    the result is saved in the project's state
+
+    Args:
+        max_health_age: int, when set, the saved health of a component is
+            used instead of checking it again, as long as it was checked no
+            more than this many seconds ago
+        logger: Logger object to use for log messages
+
+    Returns:
+        dict with the keys:
+            'components': list of dicts, for each configured component in
+                order, with the keys: 'component', 'type', 'container_name',
+                'status' ('up', 'stopped' or 'missing'), 'health',
+                'health_checked' (the epoch time the health was checked, or
+                None), 'local_ports' and 'links'
+            'containers': list of the names of the project's containers
+            'orphaned': list of the components that have containers, but
+                aren't configured
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger("Status")
     config = get_config()
     foreground_comp_name = None
     if 'foreground_component' in config:
@@ -37,13 +152,13 @@ def action(**kwargs):
             components = get_ordinal_sorting(cur_components, config['components'])
     except KeyError:
         components = []
+    status = {
+        'components': [],
+        'containers': container_names,
+        'orphaned': []
+    }
     if not components:
-        if container_names:
-            log.warning("Found orphaned containers: %s", ', '.join(container_names))
-            log.warning("It is recommended that you run: 'docker rm -f %s'", ' '.join(container_names))
-        else:
-            log.info("No components have been configured. Try running with the 'up' action or the 'wizard' script directly")
-        sys.exit(1)
+        return status
     existing_components = list(
         name[0:len(name)-7] for name in list(
             filter(
@@ -53,9 +168,7 @@ def action(**kwargs):
     )
     running_components = list()
     stopped_components = list()
-    missing_components = list()
-    if os.path.isfile(devlab_bench.UP_ENV_FILE):
-        up_env = get_env_from_file(devlab_bench.UP_ENV_FILE)
+    state = get_state_store()
     for comp in components:
         if comp == foreground_comp_name:
             comp_type = config['foreground_component'].get('type', 'container')
@@ -64,19 +177,14 @@ def action(**kwargs):
             comp_type = config['components'][comp].get('type', 'container')
             comp_config = config['components'][comp]
         if comp_type == 'host':
-            if up_env.get('{}_PID'.format(comp.upper()), None):
-                comp_pid = up_env.get('{}_PID'.format(comp.upper()), None)
+            comp_pid = state.get('pid', scope=comp)
+            if comp_pid:
                 comp_config['pid'] = comp_pid
-                if comp_pid:
-                    log.debug('Found pid in devlab up environemnt file for comp: %s, pid: %s', comp, comp_pid)
-                    try:
-                        os.kill(int(comp_pid), 0)
-                    except OSError:
-                        stopped_components.append(comp)
-                    else:
-                        running_components.append(comp)
+                log.debug('Found pid in devlab state for comp: %s, pid: %s', comp, comp_pid)
+                if host_component_running(comp_pid):
+                    running_components.append(comp)
                 else:
-                    missing_components.append(comp)
+                    stopped_components.append(comp)
             else:
                 stopped_components.append(comp)
         try:
@@ -85,150 +193,123 @@ def action(**kwargs):
             else:
                 stopped_components.append(comp)
         except KeyError:
-            missing_components.append(comp)
-    orphaned_components = list(set(existing_components) - set(components))
-    if orphaned_components:
-        log.warning("There are orphaned containers: '%s'", ', '.join(orphaned_components))
-        log.warning("It is recommended that you run: 'docker rm -f %s'", ' '.join(orphaned_components))
+            pass
+    status['orphaned'] = list(set(existing_components) - set(components))
     log.debug("Configured components: '%s'", ', '.join(components))
     log.debug("Current list of running devlab containers: '%s'", ', '.join(container_names))
     log.debug("Current list of all components that exist: '%s'", ', '.join(existing_components))
     log.debug("Current running components: '%s'", ', '.join(running_components))
-    log.debug("Building tables")
-    status_table = []
-    links_table = []
-    #Generate Header for Status table
-    status_header = {
-        'component': 'Component',
-        'container_name': 'Container Name',
-        'status': 'Status',
-        'health': 'Health',
-        'local_port': 'Docker exposed'
-    }
-    status_header_format = "| {component:^16} | {container_name:^22} | {status:^8} | {health:^20} | {local_port:^14} |"
-    status_row_format = "| {component:16} | {container_name:22} | {status:8} | {health:^20} | {local_port:14} |"
-    status_width = len(status_header_format.format(**status_header))
-    status_table_bar = '{{:-<{}}}'.format(status_width)
-    status_table.append(status_table_bar.format(''))
-    status_table.append(status_header_format.format(**status_header))
-    status_table.append(status_table_bar.format(''))
-    #Generate Header for Links table
-    links_header = {
-        'component': 'Component',
-        'link': 'Link(s)',
-        'comment': 'Comment'
-    }
-    links_header_format = "| {component:^16} | {link:^40} | {comment:^65} |"
-    links_row_format = "| {component:16} | {link:40} | {comment:65} |"
-    links_width = len(links_header_format.format(**links_header))
-    links_table_bar = '{{:-<{}}}'.format(links_width)
-    links_table.append(links_table_bar.format(''))
-    links_table.append(links_header_format.format(**links_header))
-    links_table.append(links_table_bar.format(''))
     host_ip = get_primary_ip()
-    #Print rows
     for comp in components:
-        status_row = {
+        comp_status = {
             'component': comp,
+            'type': None,
             'container_name': '',
+            'status': 'missing',
             'health': 'unknown',
-            'local_port': ''
+            'health_checked': None,
+            'local_ports': [],
+            'links': []
         }
         format_fillers = {
             'container_name': None,
             'host_ip': host_ip,
             'local_port': None
         }
-        status_dict = {}
-        status_ports = []
         if comp == foreground_comp_name:
-            comp_type = config['foreground_component'].get('type', 'container')
             comp_config = config['foreground_component']
         else:
-            comp_type = config['components'][comp].get('type', 'container')
             comp_config = config['components'][comp]
+        comp_status['type'] = comp_config.get('type', 'container')
         if comp in existing_components:
-            status_row['container_name'] = '{}-devlab'.format(comp)
-            format_fillers['container_name'] = status_row['container_name']
+            comp_status['container_name'] = '{}-devlab'.format(comp)
+            format_fillers['container_name'] = comp_status['container_name']
         if comp in running_components:
-            if comp_type == 'host':
-                status_row['container_name'] = 'N/A (pid={})'.format(comp_config.get('pid', '???'))
-            try:
-                first_port = True
-                for port in comp_config['ports']:
-                    local_port = parse_docker_local_ports(port)
-                    if first_port:
-                        status_row['local_port'] = local_port
-                        first_port = False
-                    else:
-                        status_ports.append({
-                            'component': '',
-                            'container_name': '',
-                            'health': '',
-                            'status': '',
-                            'local_port': local_port
-                        })
-            except KeyError:
-                status_row['local_port'] = ''
-            format_fillers['local_port'] = status_row['local_port'].split('(')[0]
-            status_row['status'] = 'up'
-            status_script = ''
-            try:
-                status_script = comp_config['status_script']
-                if status_script:
-                    log.debug("Found status script: '%s'", status_script)
-            except KeyError:
-                log.debug("Skipping status script for component: '%s' as none is defined", comp)
-                if format_fillers['local_port']:
-                    status_row['health'] = 'healthy'
-                    for port in comp_config['ports']:
-                        if 'udp' in port:
-                            continue
-                        port = parse_docker_local_ports(port)
-                        log.debug("Performing basic port check on '%s', port '%s', for health check", comp, port)
-                        if not port_check('127.0.0.1', format_fillers['local_port'].split('-')[0].split('(')[0]):
-                            log.warning("Basic port status check failed for '%s', port '%s'", comp, port)
-                            status_row['health'] = 'degraded'
-                        else:
-                            log.debug("Basic port status check successful for '%s', port '%s'", comp, port)
-            if status_script:
-                script_ret = script_runner(status_script, name=status_row['container_name'], interactive=False, log_output=False)
-                if script_ret[0] != 0:
-                    log.warning("Errors occurred executing status script for component: '%s' Skipping!!", comp)
-                else:
-                    try:
-                        status_dict = json.loads(' '.join(script_ret[1]))
-                    except json.decoder.JSONDecodeError:
-                        log.warning("Status script: '%s' did NOT return valid JSON for component: '%s', Skipping!!", status_script, comp)
-                try:
-                    status_row['health'] = status_dict['status']['health']
-                except KeyError:
-                    pass
-                try:
-                    first_link = True
-                    for link in status_dict['links']:
-                        #Fill in any values as results from links support string formatting
-                        link = {k: v.format(**format_fillers) for k, v in link.items()}
-                        if first_link:
-                            links_table.append(links_row_format.format(component=comp, **link))
-                            first_link = False
-                        else:
-                            links_table.append(links_row_format.format(component='', **link))
-                except KeyError:
-                    pass
+            if comp_status['type'] == 'host':
+                comp_status['container_name'] = 'N/A (pid={})'.format(comp_config.get('pid', '???'))
+            for port in comp_config.get('ports', []):
+                comp_status['local_ports'].append(parse_docker_local_ports(port))
+            format_fillers['local_port'] = (comp_status['local_ports'] or [''])[0].split('(')[0]
+            comp_status['status'] = 'up'
+            health = None
+            if max_health_age is not None:
+                health = state.get(STATUS_HEALTH_KEY, scope=comp)
+                if health and health['checked'] < time.time() - max_health_age:
+                    health = None
+            if health is None:
+                health = check_health(comp, comp_config, comp_status['container_name'], format_fillers, logger=log)
+                state.set(STATUS_HEALTH_KEY, health, scope=comp)
+            comp_status['health'] = health['health']
+            comp_status['health_checked'] = health['checked']
+            comp_status['links'] = health['links']
         elif comp in stopped_components:
-            status_row['status'] = 'stopped'
+            comp_status['status'] = 'stopped'
+        status['components'].append(comp_status)
+    return status
+
+def check_health(comp, comp_config, container_name, format_fillers, logger=None):
+    """
+    Check the health of a running component, by running its status_script,
+    or if it doesn't have one, by checking that its ports are open
+
+    Args:
+        comp: str, name of the component
+        comp_config: dict, of the component's config
+        container_name: str, name of the component's container
+        format_fillers: dict, of the values that the links returned by the
+            status script can be formatted with
+        logger: Logger object to use for log messages
+
+    Returns:
+        dict with the keys: 'health', 'links' and 'checked' (the epoch time
+        the health was checked)
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger("Status")
+    health = {
+        'health': 'unknown',
+        'links': [],
+        'checked': time.time()
+    }
+    status_dict = {}
+    status_script = ''
+    try:
+        status_script = comp_config['status_script']
+        if status_script:
+            log.debug("Found status script: '%s'", status_script)
+    except KeyError:
+        log.debug("Skipping status script for component: '%s' as none is defined", comp)
+        if format_fillers['local_port']:
+            health['health'] = 'healthy'
+            for port in comp_config['ports']:
+                if 'udp' in port:
+                    continue
+                port = parse_docker_local_ports(port)
+                log.debug("Performing basic port check on '%s', port '%s', for health check", comp, port)
+                if not port_check('127.0.0.1', format_fillers['local_port'].split('-')[0].split('(')[0]):
+                    log.warning("Basic port status check failed for '%s', port '%s'", comp, port)
+                    health['health'] = 'degraded'
+                else:
+                    log.debug("Basic port status check successful for '%s', port '%s'", comp, port)
+    if status_script:
+        script_ret = script_runner(status_script, name=container_name, interactive=False, log_output=False, component=comp, phase='status_script')
+        if script_ret[0] != 0:
+            log.warning("Errors occurred executing status script for component: '%s' Skipping!!", comp)
         else:
-            status_row['status'] = 'missing'
-        status_table.append(status_row_format.format(**status_row))
-        for status_port in status_ports:
-            status_table.append(status_row_format.format(**status_port))
-    #Generate Footers
-    status_table.append(status_table_bar.format(''))
-    links_table.append(links_table_bar.format(''))
-    print('\n## COMPONENT STATUS ##')
-    print('\n'.join(status_table))
-    print('')
-    if len(links_table) > 4:
-        print('## LINKS ##')
-        print('\n'.join(links_table))
+            try:
+                status_dict = json.loads(' '.join(script_ret[1]))
+            except json.decoder.JSONDecodeError:
+                log.warning("Status script: '%s' did NOT return valid JSON for component: '%s', Skipping!!", status_script, comp)
+        try:
+            health['health'] = status_dict['status']['health']
+        except KeyError:
+            pass
+        try:
+            for link in status_dict['links']:
+                #Fill in any values as results from links support string formatting
+                health['links'].append({k: v.format(**format_fillers) for k, v in link.items()})
+        except KeyError:
+            pass
+    return health
@@ -1,19 +1,29 @@
 """
 Things dealing with the 'up' action
 """
+import hashlib
 import json
 import logging
 import os
 import shlex
 import sys
+import time
 
 import devlab_bench
 import devlab_bench.actions.reset
 from devlab_bench.actions.update import update_component_images
+from devlab_bench.helpers.locks import component_lock
 from devlab_bench.helpers.docker import get_needed_images, docker_obj_status, check_custom_registry
-from devlab_bench.helpers.common import get_config, get_env_from_file, get_ordinal_sorting, get_shell_components, get_primary_ip, quote, save_env_file, script_runner, unnest_list
+from devlab_bench.helpers.common import get_config, get_ordinal_sorting, get_shell_components, get_primary_ip, quote, script_runner, unnest_list
+from devlab_bench.helpers.persistence import ensure_layer, get_layer_mode, seal_layer
+from devlab_bench.helpers.snapshot import create_snapshot, find_snapshot, get_snapshot_key
+from devlab_bench.helpers.state import get_state_store
+from devlab_bench.helpers.supervisor import host_component_running, start_host_component
+from devlab_bench.helpers.trace import span
+from devlab_bench.helpers.trash import human_size, start_purge
+from devlab_bench.helpers.usage import get_usage, start_accounting, stop_accounting, usage_scope
 
-def action(components='*', skip_provision=False, bind_to_host=False, keep_up_on_error=False, update_images=False, **kwargs): #pylint: disable=too-many-branches,too-many-statements
+def action(components='*', skip_provision=False, bind_to_host=False, keep_up_on_error=False, update_images=False, stats=False, **kwargs): #pylint: disable=too-many-branches,too-many-statements
     """
     This is responsible for the "up" action, intended to bring up different components
 
@@ -26,9 +36,13 @@ def action(components='*', skip_provision=False, bind_to_host=False, keep_up_on_
             work with the spun up components. Default=False
         update_images: bool, whether or not images should be updated with fresh
             layers etc... from docker repo/registry
+        stats: bool, whether to print a table of the resources used by the
+            commands and scripts run for each component, at the end
     Returns:
         None
     """
+    if stats:
+        start_accounting()
     up_env = {
         'HOST_IP': get_primary_ip(),
         'BIND_TO_HOST': bind_to_host
@@ -70,35 +84,43 @@ def action(components='*', skip_provision=False, bind_to_host=False, keep_up_on_
     log.debug("The following components will be started in this order: %s", ', '.join(components_to_run))
     if update_images:
         log.info("Looking for and updating images needed by components: %s", ','.join(components_to_run))
-        update_component_images(components=components_to_run, skip_base_images=True)
-    needed_images = get_needed_images()
+        with span('update images'):
+            update_component_images(components=components_to_run, skip_base_images=True)
+    with span('get_needed_images'):
+        needed_images = get_needed_images()
     if needed_images['base_images']['missing'] or needed_images['base_images']['needs_update']:
         base_to_build = needed_images['base_images']['missing'] + needed_images['base_images']['needs_update']
         log.debug("Images: '%s' not found in list of current images", base_to_build)
         if needed_images['base_images']['needs_update']:
             log.info("Found newer dockerfile(s), will update the following base images: %s", ','.join(needed_images['base_images']['needs_update']))
         log.info("Need to build some base images before trying to start containers")
-        devlab_bench.actions.build.action(images=base_to_build)
+        with span('build base images', images=base_to_build):
+            devlab_bench.actions.build.action(images=base_to_build)
     if config['network']['name']:
-        network_status = docker_obj_status(config['network']['name'], 'network', devlab_bench.helpers.docker.DOCKER, logger=log)[0]
-        if network_status['exists'] and not network_status['owned']:
-            if config['network']['name'] != 'host': #This is to allow a project to use the 'host' network
-                log.error("Conflicting custom network found! There is already a docker network defined with this name, but is not owned by this project")
-                sys.exit(1)
-        if not network_status['exists']:
-            log.info("Custom user network: '%s' not found. Creating", config['network']['name'])
-            devlab_bench.helpers.docker.DOCKER.create_network(**config['network'])
+        with span('network', network=config['network']['name']):
+            network_status = docker_obj_status(config['network']['name'], 'network', devlab_bench.helpers.docker.DOCKER, logger=log)[0]
+            if network_status['exists'] and not network_status['owned']:
+                if config['network']['name'] != 'host': #This is to allow a project to use the 'host' network
+                    log.error("Conflicting custom network found! There is already a docker network defined with this name, but is not owned by this project")
+                    sys.exit(1)
+            if not network_status['exists']:
+                log.info("Custom user network: '%s' not found. Creating", config['network']['name'])
+                devlab_bench.helpers.docker.DOCKER.create_network(**config['network'])
     if needed_images['runtime_images']['missing'] or needed_images['runtime_images']['needs_update']:
         runtime_to_build = needed_images['runtime_images']['missing'] + needed_images['runtime_images']['needs_update']
         log.debug("Runtime Images: '%s' not found in list of current images", runtime_to_build)
         log.info("Need to build some runtime images before trying to start containers")
         if needed_images['runtime_images']['needs_update']:
             log.info("Found newer dockerfile(s), will update the following runtime images: %s", ','.join(needed_images['runtime_images']['needs_update']))
-        devlab_bench.actions.build.action(images=runtime_to_build)
+        with span('build runtime images', images=runtime_to_build):
+            devlab_bench.actions.build.action(images=runtime_to_build)
+    #Pick back up purging anything left in the trash by an interrupted reset
+    start_purge(logger=log)
     if not os.path.isdir('{}/{}'.format(devlab_bench.PROJ_ROOT, config['paths']['component_persistence'])):
         os.mkdir('{}/{}'.format(devlab_bench.PROJ_ROOT, config['paths']['component_persistence']))
-    if os.path.isfile(devlab_bench.UP_ENV_FILE):
-        prev_env = get_env_from_file(devlab_bench.UP_ENV_FILE)
+    state = get_state_store()
+    prev_env = state.get_scope()
+    if 'HOST_IP' in prev_env and 'BIND_TO_HOST' in prev_env:
         cur_bind = up_env['BIND_TO_HOST']
         up_env.update(prev_env)
         if prev_env['BIND_TO_HOST'] != cur_bind:
@@ -113,48 +135,54 @@ def action(components='*', skip_provision=False, bind_to_host=False, keep_up_on_
             log.warning("Your host's IP Address has changed from: %s to %s. This means we must re-provision components", prev_primary_ip, primary_ip)
             force_reprov = True
     log.debug("Saving this devlab's environment")
-    save_env_file(up_env, devlab_bench.UP_ENV_FILE, force_upper_keys=True)
+    state.update(up_env)
     log.debug("Getting current list of containers")
     containers = devlab_bench.helpers.docker.DOCKER.get_containers()[1]
     container_names = [cntr['name'] for cntr in containers]
     # Check for any images that depend on custom registry and prompt if missing auth
-    if check_custom_registry(components_to_run, config, logger=log):
-        log.error("Please make sure you have logged into needed custom docker registries")
-        sys.exit(1)
+    with span('check registries'):
+        if check_custom_registry(components_to_run, config, logger=log):
+            log.error("Please make sure you have logged into needed custom docker registries")
+            sys.exit(1)
     log.debug("Current list of containers: '%s'", ', '.join(container_names))
     for comp in components_to_run:
         if comp == foreground_comp_name:
             continue
-        comp_cont_name = '{}-devlab'.format(comp)
-        cont_status = docker_obj_status(comp_cont_name, 'container', devlab_bench.helpers.docker.DOCKER, logger=log)[0]
-        if cont_status['exists'] and not cont_status['owned']:
-            log.error("Container: '%s' already exists, but is NOT owned by this project!", comp_cont_name)
-            errors += 1
-            break
-        if update_images:
-            if cont_status['exists']:
-                log.warning("Container: '%s' exists, and we just updated containers, You'll need to restart the container to USE the new image", comp)
-        if comp_cont_name in container_names:
-            #See if we should reprovision the existing container
-            for r_comp in reprovisionable_components:
-                if comp.startswith(r_comp):
-                    if force_reprov:
-                        log.warning("Removing and resetting data in existing container: '%s' as it needs to be reprovisioned", comp_cont_name)
-                        devlab_bench.actions.reset.action(comp)
-                        log.debug("Refreshing current list of containers")
-                        containers = devlab_bench.helpers.docker.DOCKER.get_containers()[1]
-        cup_ret = component_up(
-            name=comp,
-            comp_config=config['components'][comp],
-            skip_provision=skip_provision,
-            keep_up_on_error=keep_up_on_error,
-            current_containers=containers,
-            network=config['network']['name'],
-            logger=log
-        )
-        if not cup_ret:
-            errors += 1
-            break
+        with span('component: {}'.format(comp), component=comp), usage_scope(comp, 'up'), component_lock(comp, logger=log) as comp_lock:
+            if comp_lock.waited:
+                log.debug("Refreshing current list of containers after waiting for component: %s", comp)
+                containers = devlab_bench.helpers.docker.DOCKER.get_containers()[1]
+                container_names = [cntr['name'] for cntr in containers]
+            comp_cont_name = '{}-devlab'.format(comp)
+            cont_status = docker_obj_status(comp_cont_name, 'container', devlab_bench.helpers.docker.DOCKER, logger=log)[0]
+            if cont_status['exists'] and not cont_status['owned']:
+                log.error("Container: '%s' already exists, but is NOT owned by this project!", comp_cont_name)
+                errors += 1
+                break
+            if update_images:
+                if cont_status['exists']:
+                    log.warning("Container: '%s' exists, and we just updated containers, You'll need to restart the container to USE the new image", comp)
+            if comp_cont_name in container_names:
+                #See if we should reprovision the existing container
+                for r_comp in reprovisionable_components:
+                    if comp.startswith(r_comp):
+                        if force_reprov:
+                            log.warning("Removing and resetting data in existing container: '%s' as it needs to be reprovisioned", comp_cont_name)
+                            devlab_bench.actions.reset.action(comp)
+                            log.debug("Refreshing current list of containers")
+                            containers = devlab_bench.helpers.docker.DOCKER.get_containers()[1]
+            cup_ret = component_up(
+                name=comp,
+                comp_config=config['components'][comp],
+                skip_provision=skip_provision,
+                keep_up_on_error=keep_up_on_error,
+                current_containers=containers,
+                network=config['network']['name'],
+                logger=log
+            )
+            if not cup_ret:
+                errors += 1
+                break
     if errors == 0:
         if foreground_comp_name:
             if foreground_comp_name in components_to_run:
@@ -165,20 +193,24 @@ def action(components='*', skip_provision=False, bind_to_host=False, keep_up_on_
                 del comp_config['name']
                 #Start the component up
                 log.info("Starting the main foreground component: %s", foreground_comp_name)
-                fup_ret = component_up(
-                    name=foreground_comp_name,
-                    comp_config=comp_config,
-                    skip_provision=True,
-                    keep_up_on_error=keep_up_on_error,
-                    current_containers=containers,
-                    network=config['network']['name'],
-                    background=False,
-                    logger=log
-                )
+                with span('component: {}'.format(foreground_comp_name), component=foreground_comp_name), usage_scope(foreground_comp_name, 'up'), component_lock(foreground_comp_name, logger=log):
+                    fup_ret = component_up(
+                        name=foreground_comp_name,
+                        comp_config=comp_config,
+                        skip_provision=True,
+                        keep_up_on_error=keep_up_on_error,
+                        current_containers=containers,
+                        network=config['network']['name'],
+                        background=False,
+                        logger=log
+                    )
                 if not fup_ret:
                     errors += 1
                 devlab_bench.actions.down.action()
     if errors > 0:
+        if stats:
+            print_usage(get_usage())
+            stop_accounting()
         sys.exit(errors)
     if update_images:
         log.info("Cleaning up any dangling images")
@@ -187,6 +219,69 @@ def action(components='*', skip_provision=False, bind_to_host=False, keep_up_on_
             log.error("Failed cleaning(pruning) images")
         else:
             log.debug("Successfully cleaned up(pruned) images")
+    if stats:
+        print_usage(get_usage())
+        stop_accounting()
+
+def print_usage(usage):
+    """
+    Print a table of the resources used by the commands and scripts run for
+    each component, with a row for each phase and a total for the component
+
+    Args:
+        usage: list of dicts, as returned by get_usage()
+    """
+    usage_header = {
+        'component': 'Component',
+        'phase': 'Phase',
+        'commands': 'Cmds',
+        'wall': 'Wall',
+        'user': 'User CPU',
+        'sys': 'Sys CPU',
+        'max_rss': 'Max RSS',
+        'stdout': 'Stdout',
+        'stderr': 'Stderr'
+    }
+    usage_header_format = "| {component:^25} | {phase:^17} | {commands:^5} | {wall:^9} | {user:^9} | {sys:^9} | {max_rss:^9} | {stdout:^9} | {stderr:^9} |"
+    usage_row_format = "| {component:25} | {phase:17} | {commands:>5} | {wall:>9} | {user:>9} | {sys:>9} | {max_rss:>9} | {stdout:>9} | {stderr:>9} |"
+    usage_width = len(usage_header_format.format(**usage_header))
+    usage_table_bar = '{{:-<{}}}'.format(usage_width)
+    usage_table = [
+        usage_table_bar.format(''),
+        usage_header_format.format(**usage_header),
+        usage_table_bar.format('')
+    ]
+    by_component = {}
+    for totals in usage:
+        by_component.setdefault(totals['component'], []).append(totals)
+    for component, phases in by_component.items():
+        if len(phases) > 1:
+            comp_total = {
+                'phase': 'total',
+                'commands': sum(totals['commands'] for totals in phases),
+                'max_rss': max(totals['max_rss'] for totals in phases)
+            }
+            for stat in ('wall', 'user', 'sys', 'stdout_bytes', 'stderr_bytes'):
+                comp_total[stat] = sum(totals[stat] for totals in phases)
+            phases = phases + [comp_total]
+        for totals in phases:
+            usage_table.append(
+                usage_row_format.format(
+                    component=component or '(other commands)',
+                    phase=totals['phase'] or '',
+                    commands=totals['commands'],
+                    wall='{:.2f}s'.format(totals['wall']),
+                    user='{:.2f}s'.format(totals['user']),
+                    sys='{:.2f}s'.format(totals['sys']),
+                    max_rss=human_size(totals['max_rss']),
+                    stdout=human_size(totals['stdout_bytes']),
+                    stderr=human_size(totals['stderr_bytes'])
+                )
+            )
+    usage_table.append(usage_table_bar.format(''))
+    print('\n## UP RESOURCES ##')
+    print('\n'.join(usage_table))
+    print('* CPU and memory of scripts run inside of containers are those of the engine\'s client, not of the scripts')
 
 def component_up(name, comp_config, skip_provision=False, keep_up_on_error=False, current_containers=None, background=True, network=None, logger=None):
     """
@@ -197,10 +292,17 @@ def component_up(name, comp_config, skip_provision=False, keep_up_on_error=False
     containers_dict = {}
     comp_pid = None
     errors = False
+    new_container = False
+    from_snapshot = False
+    from_seed = False
+    snapshot_key = None
     if logger:
         log = logger
     else:
         log = logging.getLogger('component_up')
+    state = get_state_store()
+    start_time = time.time()
+    spec_hash = hashlib.sha256(json.dumps(comp_config, sort_keys=True).encode('utf-8')).hexdigest()
     comp_type = comp_config.get('type', 'container')
     if comp_type == 'container':
         log.debug("Component: '%s' is of type 'container'", comp)
@@ -214,58 +316,64 @@ def component_up(name, comp_config, skip_provision=False, keep_up_on_error=False
     elif comp_type == 'host':
         log.debug("Component: '%s' is of type 'host'", comp)
         #Look up to see if there is a PID for the 'host' component
-        if os.path.isfile(devlab_bench.UP_ENV_FILE):
-            log.debug("Found devlab_up.env file, loading vars from it for component '%s' to see if this 'host' type component has a PID", comp)
-            up_env = get_env_from_file(devlab_bench.UP_ENV_FILE)
-        comp_pid = int(up_env.get('{}_PID'.format(comp.upper()), False))
-        if up_env.get('{}_PID'.format(comp.upper()), None):
+        comp_pid = state.get('pid', scope=comp)
+        if comp_pid:
             log.debug("Found component PID: %s", comp_pid)
     else:
         log.error("Component: '%s' is of unknown type '%s'", comp, comp_type)
         return False
     while True:
         if comp_type == 'host':
-            if comp_pid:
-                try:
-                    os.kill(comp_pid, 0)
-                except OSError:
-                    log.debug("Component: %s is not active on pid: %s", comp, comp_pid)
-                else:
-                    log.info("Component: %s is already running. Skipping...", comp)
-                    break
-            else:
-                log.debug("Component: %s is not active", comp)
-                if 'pre_scripts' in comp_config:
+            if comp_pid and host_component_running(comp_pid):
+                log.info("Component: %s is already running. Skipping...", comp)
+                break
+            log.debug("Component: %s is not active", comp)
+            if 'pre_scripts' in comp_config:
+                with span('pre_scripts', component=comp):
                     for script in comp_config['pre_scripts']:
                         log.debug("Found Pre script: '%s'", script)
-                        script_ret = script_runner(script, name=comp_cont_name, log=log)
+                        script_ret = script_runner(script, name=comp_cont_name, log=log, component=comp, phase='pre_scripts')
                         if script_ret[0] != 0:
                             errors = True
                             break
-                    if errors:
-                        break
-            cmd_split = [quote(cmd_arg) for cmd_arg in shlex.split(comp_config['cmd'])]
-            run_cmd = devlab_bench.helpers.command.Command(
-                cmd_split[0],
-                args=cmd_split[1:],
-                use_shell=True,
-                logger=log,
-                interactive=not background,
-                ignore_nonzero_rc=False,
-            )
-            rstat, cpid = run_cmd.run_nowait()
-            if rstat == 0:
-                up_env['{}_PID'.format(comp.upper())] = cpid
-                save_env_file(up_env, devlab_bench.UP_ENV_FILE, force_upper_keys=True)
-                run_cmd.wait()
+                if errors:
+                    break
+            if background:
+                log.info("Starting component: %s", comp)
+                with span('start host component', component=comp):
+                    rstat, cpid = start_host_component(comp, comp_config['cmd'], logger=log)
+                if rstat != 0:
+                    errors = True
+                    break
+                state.set('pid', cpid, scope=comp)
+                new_container = True
+            else:
+                cmd_split = [quote(cmd_arg) for cmd_arg in shlex.split(comp_config['cmd'])]
+                run_cmd = devlab_bench.helpers.command.Command(
+                    cmd_split[0],
+                    args=cmd_split[1:],
+                    use_shell=True,
+                    logger=log,
+                    interactive=True,
+                    ignore_nonzero_rc=False,
+                )
+                rstat, cpid = run_cmd.run_nowait()
+                if rstat == 0:
+                    state.set('pid', cpid, scope=comp)
+                    run_cmd.wait()
         else:
+            if get_layer_mode(comp) and not ensure_layer(comp, logger=log):
+                log.error("Failed putting the persistence layers in place for component: %s. Aborting...", comp)
+                errors = True
+                break
             if comp_cont_name in container_names:
                 if 'up' in containers_dict[comp_cont_name]['status'].lower():
                     log.info("Component: %s is already running. Skipping...", comp)
                     break
                 else:
                     log.info("Component: %s has already been created, Starting container...", comp)
-                    devlab_bench.helpers.docker.DOCKER.start_container(comp_cont_name)
+                    with span('start container', component=comp):
+                        devlab_bench.helpers.docker.DOCKER.start_container(comp_cont_name)
                     new_container = False
             if new_container:
                 if 'mounts' in comp_config:
@@ -279,25 +387,36 @@ def component_up(name, comp_config, skip_provision=False, keep_up_on_error=False
                 if 'run_opts' not in comp_config:
                     comp_config['run_opts'] = list()
                 if 'pre_scripts' in comp_config:
-                    for script in comp_config['pre_scripts']:
-                        log.debug("Found Pre script: '%s'", script)
-                        script_ret = script_runner(script, name=comp_cont_name, interactive=True)
-                        if script_ret[0] != 0:
-                            errors = True
-                            break
+                    with span('pre_scripts', component=comp):
+                        for script in comp_config['pre_scripts']:
+                            log.debug("Found Pre script: '%s'", script)
+                            script_ret = script_runner(script, name=comp_cont_name, interactive=True, component=comp, phase='pre_scripts')
+                            if script_ret[0] != 0:
+                                errors = True
+                                break
                     if errors:
                         break
+                run_config = comp_config
+                if comp_config.get('snapshot_after_provision', False) and background and not skip_provision:
+                    snapshot_key = get_snapshot_key(comp, comp_config, logger=log)
+                    snapshot_image = find_snapshot(comp, snapshot_key, logger=log)
+                    if snapshot_image:
+                        log.info("Found post-provision snapshot: '%s' for component: %s, provisioning scripts will be skipped", snapshot_image, comp)
+                        run_config = dict(comp_config)
+                        run_config['image'] = snapshot_image
+                        from_snapshot = True
                 log.info("Starting component: %s", comp)
                 if not background:
                     comp_config['run_opts'].append('--rm')
-                run_ret = devlab_bench.helpers.docker.DOCKER.run_container(
-                    name=comp_cont_name,
-                    network=network,
-                    background=background,
-                    interactive=not background,
-                    log_output=False,
-                    **comp_config
-                )
+                with span('run container', component=comp, from_snapshot=from_snapshot):
+                    run_ret = devlab_bench.helpers.docker.DOCKER.run_container(
+                        name=comp_cont_name,
+                        network=network,
+                        background=background,
+                        interactive=not background,
+                        log_output=False,
+                        **run_config
+                    )
                 if run_ret[0] == 0:
                     log.debug("Successfully started component: '%s' as container: '%s'", comp, comp_cont_name)
                 else:
@@ -306,27 +425,52 @@ def component_up(name, comp_config, skip_provision=False, keep_up_on_error=False
                         devlab_bench.actions.down.action(components=[comp], rm=True)
                     errors = True
                     break
-        if new_container and not skip_provision and 'scripts' in comp_config:
-            for script in comp_config['scripts']:
-                log.debug("Found provisioning script: '%s'", script)
-                script_ret = script_runner(script, name=comp_cont_name, interactive=False, log_output=True)
-                if script_ret[0] != 0:
-                    if not keep_up_on_error:
-                        devlab_bench.actions.down.action(components=[comp], rm=True)
-                    errors = True
-                    break
+        if new_container and comp_type == 'container' and state.get('seed_restored', scope=comp):
+            state.delete('seed_restored', scope=comp)
+            if get_layer_mode(comp):
+                log.info("Component: %s was reset to its seed persistence layer, provisioning scripts will be skipped", comp)
+                from_seed = True
+        if new_container and not skip_provision and not from_snapshot and not from_seed and 'scripts' in comp_config:
+            with span('scripts', component=comp):
+                for script in comp_config['scripts']:
+                    log.debug("Found provisioning script: '%s'", script)
+                    script_ret = script_runner(script, name=comp_cont_name, interactive=False, log_output=True, component=comp, phase='scripts')
+                    if script_ret[0] != 0:
+                        if not keep_up_on_error:
+                            devlab_bench.actions.down.action(components=[comp], rm=True)
+                        errors = True
+                        break
             if errors:
                 if not keep_up_on_error:
                     devlab_bench.actions.down.action(components=[comp], rm=True)
                 break
+            if snapshot_key:
+                with span('snapshot', component=comp):
+                    if not create_snapshot(comp, snapshot_key, comp_cont_name, logger=log):
+                        log.warning("Component: %s will be fully provisioned again the next time its container is created", comp)
+        if new_container and not skip_provision and comp_type == 'container' and comp_config.get('persistence_layer') and background:
+            if not get_layer_mode(comp):
+                with span('seal persistence layer', component=comp):
+                    log.info("Stopping component: %s to capture its seed persistence layer", comp)
+                    devlab_bench.helpers.docker.DOCKER.stop_container(comp_cont_name)
+                    if not seal_layer(comp, comp_config['persistence_layer'], logger=log):
+                        log.warning("Component: %s will be reset by removing its 'reset_paths' instead of by dropping to its seed persistence layer", comp)
+                    devlab_bench.helpers.docker.DOCKER.start_container(comp_cont_name)
         if 'post_up_scripts' in comp_config and background:
-            for script in comp_config['post_up_scripts']:
-                log.debug("Found Post up script: '%s'", script)
-                script_ret = script_runner(script, name=comp_cont_name, interactive=False, log_output=True)
-                if script_ret[0] != 0:
-                    errors = True
-                    break
+            with span('post_up_scripts', component=comp):
+                for script in comp_config['post_up_scripts']:
+                    log.debug("Found Post up script: '%s'", script)
+                    script_ret = script_runner(script, name=comp_cont_name, interactive=False, log_output=True, component=comp, phase='post_up_scripts')
+                    if script_ret[0] != 0:
+                        errors = True
+                        break
             if errors:
                 break
         break
+    if new_container and not errors and background:
+        state.update({
+            'spec_hash': spec_hash,
+            'last_up': start_time,
+            'up_duration': time.time() - start_time
+        }, scope=comp)
     return not errors
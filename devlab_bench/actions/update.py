@@ -7,6 +7,7 @@ import sys
 import devlab_bench.helpers.docker
 import devlab_bench.actions.build
 from devlab_bench.helpers.docker import get_needed_images
+from devlab_bench.helpers.trace import span
 
 def action(components='*', skip_base_images=False, **kwargs):
     """
@@ -55,7 +56,8 @@ def update_component_images(components=None, skip_base_images=True, logger=None)
     devlab_bench.actions.build.action(int_images, skip_pull_images=base_images, clean=True, pull=True)
     for ext_image in ext_images:
         log.info("Pulling down any updates to image: '%s'", ext_image)
-        pi_res = devlab_bench.helpers.docker.DOCKER.pull_image(ext_image, log_output=log_output, logger=log)
+        with span('pull image', image=ext_image):
+            pi_res = devlab_bench.helpers.docker.DOCKER.pull_image(ext_image, log_output=log_output, logger=log)
         if pi_res[0] != 0:
             log.error("Failed pulling updates for image: %s", ext_image)
             sys.exit(1)
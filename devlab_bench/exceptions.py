@@ -12,3 +12,9 @@ class DevlabComponentError(Exception):
     Exception class for dealing with components
     """
     pass #pylint: disable=unnecessary-pass
+
+class DevlabLockError(Exception):
+    """
+    Exception class for locks that couldn't be acquired
+    """
+    pass #pylint: disable=unnecessary-pass
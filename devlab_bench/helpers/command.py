@@ -2,14 +2,71 @@
 Miscellaneous helpers in the form of classes and/or functions for getting stuff done
 """
 import fcntl
+import heapq
 import logging
 import os
+import queue
 import re
+import select
+import shutil
 import signal
 import subprocess
+import sys
+import threading
 import time
 from devlab_bench.exceptions import DevlabCommandError
 from devlab_bench.helpers.common import ISATTY, quote
+from devlab_bench.helpers.recording import get_recording
+from devlab_bench.helpers.trace import add_span, span
+from devlab_bench.helpers.usage import add_command_stats
+
+ANSI_ESCAPE = re.compile(r'\x1B\[[0-?]*[ -/]*[@-~]')
+NON_ASCII_BYTES = bytes(range(128, 256))
+#Output of commands is read in chunks of this many bytes
+OUTPUT_CHUNK_SIZE = 65536
+#How much output is read from each pipe, before checking if a command is hung
+OUTPUT_READ_MAX = 1048576
+#Seconds to wait for more output from a running command
+OUTPUT_POLL_INTERVAL = 0.01
+#Seconds to wait between checks on whether a command has exited, when it
+#can't be waited on with a pidfd, starting at the lower and doubling up to the
+#upper
+REAP_POLL_INTERVALS = (0.0005, 0.01)
+#Seconds to wait for a command to exit, once a stream of its output is closed
+STREAM_STOP_TIMEOUT = 5
+PIDFD_SUPPORT = hasattr(os, 'pidfd_open')
+#Before python 3.10, subprocess forks the child, unless it doesn't have to
+#close file descriptors, when it can use posix_spawn. From 3.10 on, it uses
+#vfork either way, which is faster than posix_spawn. Not closing them relies
+#on devlab never leaving a file descriptor inheritable that the command isn't
+#meant to get, like the ones that the agent receives from its clients
+SPAWN_CLOSE_FDS = sys.version_info >= (3, 10)
+#Executables that were found, keyed by the tuple of paths they were looked
+#for in, and by the name and PATH the shell would have looked for them with
+RESOLVED_PATHS = {}
+SHELL_PATHS = {}
+#Names of executables that the shell would run as they are, without
+#expanding or splitting anything in them
+SHELL_PLAIN_NAME = re.compile(r'^[\w@%+:,./-]+$', re.ASCII)
+#Names that the shell runs a builtin for, which can behave differently from
+#an executable of the same name, if there is one
+SHELL_BUILTINS = frozenset((
+    '.', ':', '[', 'alias', 'bg', 'break', 'cd', 'command', 'continue', 'echo',
+    'eval', 'exec', 'exit', 'export', 'false', 'fg', 'getopts', 'hash', 'jobs',
+    'kill', 'local', 'printf', 'pwd', 'read', 'readonly', 'return', 'set',
+    'shift', 'source', 'test', 'times', 'trap', 'true', 'type', 'ulimit',
+    'umask', 'unalias', 'unset', 'wait'
+))
+POOL_WORKERS_DEF = 4
+#Seconds between checks on the tasks of a CommandPool, for timeouts and the load
+POOL_POLL_INTERVAL = 0.1
+#Seconds to wait for the commands of a stopped task to exit, before killing them
+POOL_STOP_TIMEOUT = 5
+#Return codes of tasks that timed out and that were cancelled
+POOL_TIMEOUT_RC = 124
+POOL_CANCELLED_RC = 130
+#The task of a CommandPool that the current thread is running, if any
+POOL_TASK = threading.local()
 
 class Command(object):
     """
@@ -59,6 +116,15 @@ class Command(object):
         self.use_shell = use_shell
         self.ctime = time.time()
         self.proc = None
+        self.returncode = None
+        self.stopped = False
+        self._pending = {}
+        self._eof = set()
+        self._pidfd = None
+        self.etime = None
+        self.rusage = None
+        self.stdout_bytes = 0
+        self.stderr_bytes = 0
         if log_output and interactive:
             raise DevlabCommandError("ERROR: Setting both 'interactive' and 'log_output' to True won't work")
     def _precheck(self):
@@ -71,12 +137,19 @@ class Command(object):
                 First element is an integer... -1 mean failed. 0 means success
                 Second element is a message, or the path that was found
         """
+        recording = get_recording()
+        if recording and recording.replaying and recording.handles(self):
+            return (0, recording.engine_path)
         found_path = self.path
         if isinstance(self.path, (list, tuple, set)):
+            path_key = tuple(self.path)
+            if path_key in RESOLVED_PATHS:
+                return (0, RESOLVED_PATHS[path_key])
             in_path = False
             for found_path in self.path:
                 if os.access(found_path, os.X_OK):
                     in_path = True
+                    RESOLVED_PATHS[path_key] = found_path
                     break
             if not in_path:
                 if not os.path.isabs(found_path[0]) and self.use_shell:
@@ -94,6 +167,42 @@ class Command(object):
                     self.log.error("Can't find executable here: %s", self.path)
                 return (-1, "Error! Can't find executable here: {}".format(self.path))
         return (0, found_path)
+    def _get_direct_path(self, env):
+        """
+        Find the executable that the shell would run, when use_shell is set.
+        All of the arguments are quoted, so the shell only interprets the
+        name of the executable, and can be skipped if that is a plain path
+        or name that it would look up in the PATH
+
+        Args:
+            env: dict, of the environment variables the command is run with
+
+        Returns:
+            str, the path to the executable, or None if the shell is needed
+        """
+        name = self.real_path
+        if name in SHELL_BUILTINS or not SHELL_PLAIN_NAME.match(name):
+            return None
+        if '/' in name:
+            if os.path.isfile(name) and os.access(name, os.X_OK):
+                return name
+            return None
+        path_key = (name, env.get('PATH', os.defpath))
+        if path_key not in SHELL_PATHS:
+            found_path = shutil.which(name, path=path_key[1])
+            if not found_path:
+                return None
+            SHELL_PATHS[path_key] = found_path
+        return SHELL_PATHS[path_key]
+    def _forget_path(self):
+        """
+        Forget where the executable was found, like when it has been removed
+        since, so that it is looked for again next time
+        """
+        if isinstance(self.path, (list, tuple, set)):
+            RESOLVED_PATHS.pop(tuple(self.path), None)
+        for path_key in [path_key for path_key in SHELL_PATHS if path_key[0] == self.real_path]:
+            SHELL_PATHS.pop(path_key, None)
     def _sanitize_string(self, string_to_sanitize): #pylint: disable=no-self-use
         """
         Take a string that needs to be sanitized, and do the following things to it:
@@ -116,79 +225,220 @@ class Command(object):
                 sanitized += '\033[0m'
         else:
             #Remove ending escape from string
-            ansi_escape = re.compile(r'\x1B\[[0-?]*[ -/]*[@-~]')
-            sanitized = ansi_escape.sub('', sanitized)
+            sanitized = ANSI_ESCAPE.sub('', sanitized)
         #self.log.debug("Converted to: '{}'".format("%r" % sanitized))
         return sanitized
-    def _process_output(self, max_lines=100, flush=False):
-        line_count = 0
-        cur_check = 0
-        max_checks = 100
-        if flush:
-            for pipe in (self.proc.stdout, self.proc.stderr):
-                try:
-                    pipe.flush()
-                except AttributeError:
-                    pass
-        while cur_check <= max_checks or flush:
-            stdout_empty = False
-            stderr_empty = False
-            try:
-                stdout_line = None
-                stderr_line = None
-                if self.proc.stdout is not None:
-                    try:
-                        stdout_line = self._sanitize_string(self.proc.stdout.readline())
-                    except IOError:
-                        stdout_line = None
-                if self.proc.stderr is not None:
+    def _sanitize_lines(self, data): #pylint: disable=no-self-use
+        """
+        Sanitize a chunk of output, that is made up of whole lines, the same
+        way as _sanitize_string does for a single line, but decoding and
+        removing escape sequences once for the whole chunk
+
+        Args:
+            data: bytes, of the lines to sanitize
+        Returns
+            list of str, without the lines that are empty once sanitized
+        """
+        #Same as decoding with 'ignore', which is much slower once it finds a
+        #byte that isn't ascii
+        lines = [line.strip() for line in data.translate(None, NON_ASCII_BYTES).decode('ascii').split('\n')]
+        if ISATTY:
+            #Append ending escape sequence to the lines that have escapes
+            lines = ['{}\033[0m'.format(line) if '\033[' in line else line for line in lines]
+        elif b'\033[' in data:
+            #Escape sequences can't span lines, so they can all be removed at once
+            lines = ANSI_ESCAPE.sub('', '\n'.join(lines)).split('\n')
+        return [line for line in lines if line]
+    def _process_output(self, max_bytes=OUTPUT_READ_MAX, flush=False):
+        """
+        Read what the process has written to its stdout and stderr, in chunks,
+        and add the whole lines in them to self.stdout and self.stderr. A line
+        that hasn't been finished yet is kept until the rest of it is read
+
+        Args:
+            max_bytes: int, of how much to read from each pipe before giving
+                control back to wait(). Ignored when flushing
+            flush: bool, whether to keep reading until the process has ended
+                and nothing is left in the pipes, and to add the last line,
+                even if it doesn't end with a newline
+        """
+        while True:
+            got_data = False
+            for pipe, lines, log_func, counter in ((self.proc.stdout, self.stdout, self.log.info, 'stdout_bytes'), (self.proc.stderr, self.stderr, self.log.warning, 'stderr_bytes')):
+                if pipe is None:
+                    continue
+                fileno = pipe.fileno()
+                chunks = [self._pending.get(fileno, b'')]
+                read_bytes = 0
+                while flush or read_bytes < max_bytes:
                     try:
-                        stderr_line = self._sanitize_string(self.proc.stderr.readline())
-                    except IOError:
-                        stderr_line = None
-                if stdout_line:
-                    if self.log_output:
-                        self.log.info(stdout_line)
-                    self.stdout.append(stdout_line)
-                    line_count += 1
-                else:
-                    stdout_empty = True
-                if stderr_line:
-                    if self.log_output:
-                        self.log.warning(stderr_line)
-                    self.stderr.append(stderr_line)
-                    line_count += 1
-                else:
-                    stderr_empty = True
-                if not flush:
-                    #If both pipes are empty, then return/break out.
-                    if stdout_empty and stderr_empty:
+                        chunk = os.read(fileno, OUTPUT_CHUNK_SIZE)
+                    except BlockingIOError:
                         break
-                    #Even if there is still data in the pipes, return back control if max_lines is reached
-                    if line_count >= max_lines:
+                    except OSError:
+                        self._eof.add(fileno)
                         break
-                else:
-                    #No new lines from either pipe, and process has ended. Flush complete
-                    if (stdout_empty and stderr_empty) and self.proc.poll() is not None:
-                        #Get any non-newline separate content that is left
-                        if self.proc.stdout:
-                            stdout_dangle = self._sanitize_string(self.proc.stdout.read())
-                            if stdout_dangle:
-                                if self.log_output:
-                                    for stdout_dangle_line in stdout_dangle.splitlines():
-                                        self.log.info(stdout_dangle_line)
-                                self.stdout.append(stdout_dangle)
-                        if self.proc.stderr:
-                            stderr_dangle = self._sanitize_string(self.proc.stderr.read())
-                            if stderr_dangle:
-                                if self.log_output:
-                                    for stderr_dangle_line in stderr_dangle.splitlines():
-                                        self.log.warning(stderr_dangle_line)
-                                self.stderr.append(stderr_dangle)
+                    if not chunk:
+                        self._eof.add(fileno)
                         break
-            except OSError:
-                pass
-            cur_check += 1
+                    chunks.append(chunk)
+                    read_bytes += len(chunk)
+                got_data = got_data or read_bytes > 0
+                setattr(self, counter, getattr(self, counter) + read_bytes)
+                data = b''.join(chunks)
+                if flush and fileno in self._eof:
+                    self._pending[fileno] = b''
+                else:
+                    #Keep any unfinished line until the rest of it is read
+                    line_end = data.rfind(b'\n') + 1
+                    self._pending[fileno] = data[line_end:]
+                    data = data[:line_end]
+                if not data:
+                    continue
+                new_lines = self._sanitize_lines(data)
+                if new_lines:
+                    if self.log_output:
+                        #One log message per chunk, instead of per line
+                        log_func('\n'.join(new_lines))
+                    lines.extend(new_lines)
+            if not flush:
+                break
+            if not got_data and self._reap() is not None:
+                #Nothing new in either pipe, and process has ended. Add any
+                #line that didn't end with a newline
+                for pipe, lines, log_func in ((self.proc.stdout, self.stdout, self.log.info), (self.proc.stderr, self.stderr, self.log.warning)):
+                    if pipe is None:
+                        continue
+                    new_lines = self._sanitize_lines(self._pending.pop(pipe.fileno(), b''))
+                    if new_lines:
+                        if self.log_output:
+                            log_func('\n'.join(new_lines))
+                        lines.extend(new_lines)
+                break
+            if not got_data:
+                self._wait_for_output(OUTPUT_POLL_INTERVAL)
+    def _wait_for_output(self, timeout):
+        """
+        Wait until there is something to read from the process's stdout or
+        stderr, or it has exited once both are closed, or until the timeout,
+        whichever is first
+
+        Args:
+            timeout: float, of the seconds to wait at most
+        """
+        waiting_on = []
+        for pipe in (self.proc.stdout, self.proc.stderr):
+            if pipe is not None and pipe.fileno() not in self._eof:
+                waiting_on.append(pipe)
+        pidfd = self._get_pidfd()
+        if pidfd is not None:
+            waiting_on.append(pidfd)
+        if not waiting_on:
+            self._reap(timeout=timeout)
+            return
+        try:
+            select.select(waiting_on, [], [], timeout)
+        except (OSError, ValueError):
+            time.sleep(timeout)
+    def _get_pidfd(self):
+        """
+        Get a file descriptor that becomes readable as soon as the process
+        exits, so that waiting for it doesn't have to poll
+
+        Returns:
+            int, or None if the system doesn't support it
+        """
+        if self._pidfd is None:
+            self._pidfd = -1
+            if PIDFD_SUPPORT and self.proc.returncode is None:
+                try:
+                    self._pidfd = os.pidfd_open(self.proc.pid)
+                except OSError:
+                    pass
+        if self._pidfd < 0:
+            return None
+        return self._pidfd
+    def _close_pidfd(self):
+        """
+        Close the file descriptor from _get_pidfd, if there is one
+        """
+        if self._pidfd is not None and self._pidfd >= 0:
+            os.close(self._pidfd)
+        self._pidfd = -1
+    def _reap(self, timeout=0):
+        """
+        Reap the process if it has exited, with os.wait4() instead of
+        subprocess, so that the resources it used are known too
+
+        Args:
+            timeout: float, of the seconds to wait for the process to exit.
+                0 doesn't wait, and None waits for as long as it takes
+
+        Returns:
+            int, the return code of the process, or None if it is still
+            running
+        """
+        if self.proc.returncode is not None:
+            return self.proc.returncode
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        interval = REAP_POLL_INTERVALS[0]
+        while True:
+            try:
+                pid, status, rusage = os.wait4(self.proc.pid, 0 if timeout is None else os.WNOHANG)
+            except ChildProcessError:
+                #Something else reaped it, so what it used isn't known
+                return self.proc.poll()
+            if pid:
+                self.etime = time.time()
+                self.rusage = rusage
+                if os.WIFSIGNALED(status):
+                    self.proc.returncode = -os.WTERMSIG(status)
+                else:
+                    self.proc.returncode = os.WEXITSTATUS(status)
+                return self.proc.returncode
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            pidfd = self._get_pidfd()
+            if pidfd is not None:
+                select.select([pidfd], [], [], remaining)
+            else:
+                time.sleep(min(interval, remaining))
+                interval = min(interval * 2, REAP_POLL_INTERVALS[1])
+    def get_stats(self):
+        """
+        Get the resources that the process used, once it has finished. The CPU
+        times and memory are those of the process and the children it waited
+        for, so for a command run in a container by the engine's client, they
+        are the client's. On linux the peak memory is never less than
+        devlab's own, as it is carried over when the process is started
+
+        Returns:
+            dict like: {'wall': float of seconds, 'user': float of seconds of
+            user CPU time, 'sys': float of seconds of system CPU time,
+            'max_rss': int of the bytes of its peak resident memory,
+            'stdout_bytes': int, 'stderr_bytes': int}. The CPU times and
+            memory are None if the process was reaped by something else
+        """
+        etime = self.etime or time.time()
+        stats = {
+            'wall': etime - self.ctime,
+            'user': None,
+            'sys': None,
+            'max_rss': None,
+            'stdout_bytes': self.stdout_bytes,
+            'stderr_bytes': self.stderr_bytes
+        }
+        if self.rusage is not None:
+            stats['user'] = self.rusage.ru_utime
+            stats['sys'] = self.rusage.ru_stime
+            #ru_maxrss is in kilobytes on linux, but in bytes on macOS
+            stats['max_rss'] = self.rusage.ru_maxrss
+            if sys.platform != 'darwin':
+                stats['max_rss'] *= 1024
+        return stats
     def die(self, graceful=True):
         """
         Make any running process go away
@@ -201,16 +451,16 @@ class Command(object):
             if graceful:
                 self.proc.send_signal(signal.SIGINT)
                 wait_count = 0
-                while self.proc.poll() is None:
+                while self._reap() is None:
                     if wait_count >= 20:
                         self.proc.kill()
-                        self.proc.wait()
+                        self._reap(timeout=None)
                         break
                     time.sleep(1)
                     wait_count += 1
             else:
                 self.proc.kill()
-                self.proc.wait()
+                self._reap(timeout=None)
     def run_nowait(self):
         """
         Execute the command but don't execute the bits that wait for the process to complete
@@ -224,8 +474,10 @@ class Command(object):
         if precheck_res[0] < 0:
             return precheck_res
         self.real_path = precheck_res[1]
+        #Python's own file descriptors aren't inheritable, so they don't need
+        #closing in the child
         subprocess_args = {
-            'shell': self.use_shell
+            'close_fds': SPAWN_CLOSE_FDS
         }
         if not self.interactive:
             subprocess_args['stdout'] = subprocess.PIPE
@@ -243,16 +495,34 @@ class Command(object):
         # Quote them if use_shell is true
         cmd_str = ' '.join([self.real_path] + [quote(script_arg) for script_arg in strd_args])
         self.log.debug("Running command: '%s'", cmd_str)
-        self.ctime = time.time()
+        direct_path = None
         if self.use_shell:
-            self.proc = subprocess.Popen(cmd_str, **subprocess_args)
-        else:
-            self.proc = subprocess.Popen([self.real_path] + strd_args, **subprocess_args)
+            direct_path = self._get_direct_path(subprocess_args.get('env', os.environ))
+        self.ctime = time.time()
+        try:
+            if direct_path:
+                try:
+                    self.proc = subprocess.Popen([direct_path] + strd_args, **subprocess_args)
+                except OSError as exc:
+                    #Like scripts without a shebang, that only the shell can run
+                    self.log.debug("Couldn't run: '%s' without a shell, so running it with one: %s", direct_path, exc)
+                    self._forget_path()
+                    self.proc = subprocess.Popen(cmd_str, shell=True, **subprocess_args)
+            elif self.use_shell:
+                self.proc = subprocess.Popen(cmd_str, shell=True, **subprocess_args)
+            else:
+                self.proc = subprocess.Popen([self.real_path] + strd_args, **subprocess_args)
+        except OSError:
+            self._forget_path()
+            raise
         for strm in (self.proc.stdout, self.proc.stderr):
             if strm is not None:
                 fno = strm.fileno()
                 fl_nb = fcntl.fcntl(fno, fcntl.F_GETFL)
                 fcntl.fcntl(fno, fcntl.F_SETFL, fl_nb | os.O_NONBLOCK)
+        pool = getattr(POOL_TASK, 'pool', None)
+        if pool:
+            pool.add_command(POOL_TASK.task, self)
         return (0, self.proc.pid)
     def run(self):
         """
@@ -263,14 +533,34 @@ class Command(object):
                 First Element is the return code of the command
                 Second Element is either a list of strings OR a str (if split==false)
         """
-        run_ret = self.run_nowait()
-        if run_ret[0] != 0:
-            return run_ret
-        self.wait()
-        if self.proc.returncode > 0:
+        recording = get_recording()
+        if recording and not recording.handles(self):
+            recording = None
+        with span('Command', cat='command') as cmd_span:
+            if recording and recording.replaying:
+                returncode = recording.replay(self)
+                self.returncode = returncode
+                cmd_span.set(argv=[self.real_path] + self.args, rc=returncode, replayed=True)
+            else:
+                run_ret = self.run_nowait()
+                if run_ret[0] != 0:
+                    cmd_span.set(argv=[self.path] + self.args, rc=run_ret[0], error=run_ret[1])
+                    return run_ret
+                self.wait()
+                returncode = self.proc.returncode
+                self.returncode = returncode
+                if recording:
+                    recording.record(self, self.ctime, time.time() - self.ctime)
+                cmd_span.set(
+                    argv=[self.real_path] + self.args,
+                    pid=self.proc.pid,
+                    rc=returncode,
+                    **self._get_span_stats()
+                )
+        if returncode > 0:
             if not self.suppress_error_out:
                 if not self.ignore_nonzero_rc:
-                    self.log.error("Command did not exit with successful status code (%s): '%s %s'", self.proc.returncode, self.real_path, ' '.join(self.args))
+                    self.log.error("Command did not exit with successful status code (%s): '%s %s'", returncode, self.real_path, ' '.join(self.args))
                 if self.stdout and not self.log_output:
                     for line in self.stdout:
                         self.log.error(line)
@@ -290,42 +580,432 @@ class Command(object):
                 out = ''
         if not self.split:
             out = '\n'.join(out)
-        return (self.proc.returncode, out)
+        return (returncode, out)
+    def stream(self, keep_output=True):
+        """
+        Execute the command, and yield its lines of output as they arrive,
+        instead of once it has finished. The lines are sanitized the same way
+        as for run(), and the lines of stdout that were read at the same time
+        as lines of stderr come first. Stopping early, by breaking out of the
+        loop or closing the generator, stops the command. Once done,
+        self.returncode is the return code of the command
+
+        Args:
+            keep_output: bool, whether to also keep all the lines in
+                self.stdout and self.stderr, like run() does. Commands that
+                print a lot, or run until they are stopped, are better off
+                not keeping them
+
+        Yields:
+            tuple where:
+                First Element is the name of the stream: 'stdout' or 'stderr'
+                Second Element is the str of the line
+
+        Raises:
+            DevlabCommandError if the command is interactive, or couldn't be
+            started
+        """
+        if self.interactive:
+            raise DevlabCommandError("ERROR: The output of an 'interactive' command can't be streamed")
+        recording = get_recording()
+        if recording and not recording.handles(self):
+            recording = None
+        start = time.time()
+        if recording and recording.replaying:
+            self.returncode = recording.replay(self)
+            add_span('Command', start, time.time(), cat='command', argv=[self.real_path] + self.args, rc=self.returncode, replayed=True, streamed=True)
+            for stream_name in ('stdout', 'stderr'):
+                for line in list(getattr(self, stream_name)):
+                    yield (stream_name, line)
+            return
+        run_ret = self.run_nowait()
+        if run_ret[0] != 0:
+            add_span('Command', start, time.time(), cat='command', argv=[self.path] + self.args, rc=run_ret[0], error=run_ret[1])
+            raise DevlabCommandError(run_ret[1])
+        self.log.debug("Streaming the output of process (pid=%s)", self.proc.pid)
+        stopped = True
+        try:
+            while True:
+                running = self._reap() is None
+                seen = (len(self.stdout), len(self.stderr))
+                #Once the process has ended, flush out whatever is left
+                self._process_output(flush=not running)
+                for stream_name, lines, stream_seen in (('stdout', self.stdout, seen[0]), ('stderr', self.stderr, seen[1])):
+                    for line in lines[stream_seen:]:
+                        yield (stream_name, line)
+                    if not keep_output:
+                        del lines[stream_seen:]
+                if not running:
+                    stopped = False
+                    break
+                self._stop_if_hung()
+                self._wait_for_output(OUTPUT_POLL_INTERVAL)
+        finally:
+            self._close_pidfd()
+            if stopped:
+                self._stop()
+            elif self.stopped:
+                self._close_pipes()
+            else:
+                #This is needed so that the process can clean up its stdout/err pipes
+                self.proc.communicate()
+            self.returncode = self.proc.returncode
+            if recording:
+                recording.record(self, self.ctime, time.time() - self.ctime)
+            add_command_stats(self.get_stats())
+            add_span('Command', start, time.time(), cat='command', argv=[self.real_path] + self.args, pid=self.proc.pid, rc=self.returncode, streamed=True, stopped=stopped, **self._get_span_stats())
+        if self.returncode > 0 and not self.suppress_error_out and not self.ignore_nonzero_rc:
+            self.log.error("Command did not exit with successful status code (%s): '%s %s'", self.returncode, self.real_path, ' '.join(self.args))
+    def _stop(self):
+        """
+        Stop the running process, that is no longer needed, without waiting
+        for any of its output
+        """
+        self._close_pipes()
+        if self._reap() is not None:
+            return
+        self.log.debug("Stopping process (pid=%s), as its output is no longer needed", self.proc.pid)
+        self.proc.terminate()
+        if self._reap(timeout=STREAM_STOP_TIMEOUT) is None:
+            self.log.warning("Command: '%s'(pid=%s): Didn't stop, forcefully killing it", ' '.join([self.real_path] + self.args), self.proc.pid)
+            self.proc.kill()
+            self._reap(timeout=None)
+    def _close_pipes(self):
+        """
+        Close the process's stdout and stderr, without reading what is left
+        in them
+        """
+        for pipe in (self.proc.stdout, self.proc.stderr):
+            if pipe is not None:
+                pipe.close()
+    def terminate(self):
+        """
+        Stop the running process, from another thread than the one waiting
+        for it. Once it has exited, the output left in its pipes is read,
+        but anything it started, that still has them open, isn't waited for
+        """
+        self.stopped = True
+        #Reaping is left to the thread waiting for it
+        if self.proc.returncode is None:
+            self.proc.terminate()
+    def _stop_if_hung(self):
+        """
+        Stop the running process if it has been running for longer than
+        self.timeout, first gracefully, then forcefully
+
+        Returns:
+            bool, whether the process was hung
+        """
+        #hung means it ran for longer than self.timeout
+        if self.timeout <= 0 or time.time() - self.ctime <= self.timeout * 60:
+            return False
+        self.log.warning("Command: '%s'(pid=%s): appears to be hung, attempting to stop and/or kill it", ' '.join([self.real_path] + self.args), self.proc.pid)
+        #Like terminate(), the pipes are closed by the caller once the output
+        #left in them is read, instead of waiting on anything the process
+        #started that still has them open
+        self.terminate()
+        wait_count = 0
+        while self._reap() is None:
+            if wait_count >= 20:
+                self.log.warning("Command: '%s'(pid=%s): Didn't die, forcefully killing it", ' '.join([self.real_path] + self.args), self.proc.pid)
+                self.proc.kill()
+                self._reap(timeout=None)
+                break
+            time.sleep(1)
+            wait_count += 1
+        return True
     def wait(self):
         """
         Wait for the running process to finish running and process any output
         that the process has generated while waiting. This is also responsible
         for watching the process for any timeouts
         """
-        #Check every .1 seconds if the process is hung or not.
-        #hung means it waited longer than self.timeout
         self.log.debug("Watching process (pid=%s) for completion or if hung", self.proc.pid)
         try:
-            while self.proc.poll() is None:
-                cur_time = time.time()
+            while self._reap() is None:
                 #Write any error messages from the process using our logger
                 self._process_output()
                 #If our process has been running longer than self.timeout
                 #then we should see if it is hung or something
-                if self.timeout > 0:
-                    if cur_time - self.ctime > self.timeout * 60:
-                        self.log.warning("Command: '%s'(pid=%s): appears to be hung, attempting to stop and/or kill it", ' '.join([self.real_path] + self.args), self.proc.pid)
-                        self.proc.terminate()
-                        wait_count = 0
-                        while self.proc.poll() is None:
-                            if wait_count >= 20:
-                                self.log.warning("Command: '%s'(pid=%s): Didn't die, forcefully killing it", ' '.join([self.real_path] + self.args), self.proc.pid)
-                                self.proc.kill()
-                                self.proc.wait()
-                                self._process_output(flush=True)
-                                self.proc.communicate()
-                                break
-                            time.sleep(1)
-                            wait_count += 1
-                time.sleep(0.01)
+                self._stop_if_hung()
+                self._wait_for_output(OUTPUT_POLL_INTERVAL)
         except KeyboardInterrupt:
             self.proc.send_signal(signal.SIGTERM)
         #Write any remaining log messages in the pipe
         self._process_output(flush=True)
+        self._close_pidfd()
+        add_command_stats(self.get_stats())
+        if self.stopped:
+            self._close_pipes()
+            return
         #This is needed so that the process can clean up its stdout/err pipes
         self.proc.communicate()
+    def _get_span_stats(self):
+        """
+        Get the resources that the process used, as details for its span
+
+        Returns:
+            dict
+        """
+        stats = self.get_stats()
+        return {
+            'stdout_bytes': stats['stdout_bytes'],
+            'stderr_bytes': stats['stderr_bytes'],
+            'user_cpu': stats['user'],
+            'sys_cpu': stats['sys'],
+            'max_rss': stats['max_rss']
+        }
+
+class CommandPool(object):
+    """
+    Run many tasks at the same time, but no more than max_workers of them at
+    once, so that things like parallel execs or health checks don't start
+    hundreds of docker clients at the same time. A task is either a Command
+    object, or a function that returns a tuple like Command.run() does, like
+    script_runner. Any Command that a task runs can be stopped by the pool,
+    when the task times out or the pool is interrupted with Ctrl-C
+
+    Args:
+        max_workers: int, the maximum number of tasks to run at the same time
+        max_load: float, don't start more tasks while the 1 minute load
+            average per CPU is higher than this, unless nothing is running.
+            Default is to not look at the load
+        logger: Logger object to use for messages
+    """
+    def __init__(self, max_workers=POOL_WORKERS_DEF, max_load=None, logger=None):
+        """
+        Initialize the CommandPool object
+        """
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger('CommandPool')
+        self.max_workers = max(1, max_workers)
+        self.max_load = max_load
+        self.cancelled = False
+        self.lock = threading.Lock()
+        self.pending = []
+        self.running = {}
+        self.done = queue.Queue()
+        self.seq = 0
+    def submit(self, name, task, priority=0, timeout=None):
+        """
+        Add a task to run
+
+        Args:
+            name: str, name of the task, that its result is reported with
+            task: Command object, or a function that takes no arguments, and
+                returns a tuple like Command.run() does
+            priority: int, tasks with a higher priority are started first,
+                and tasks with the same priority in the order they were added
+            timeout: float, seconds after which the task is stopped. Default
+                is no timeout
+
+        Raises:
+            DevlabCommandError if the task is an interactive Command
+        """
+        if isinstance(task, Command) and task.interactive:
+            raise DevlabCommandError("ERROR: Interactive commands can't be run in a CommandPool")
+        heapq.heappush(self.pending, (-priority, self.seq, {
+            'name': name,
+            'task': task,
+            'timeout': timeout,
+            'commands': [],
+            'start': None,
+            'stopping': None,
+            'stop_reason': None
+        }))
+        self.seq += 1
+    def add_command(self, task, command):
+        """
+        Keep track of a Command that a task has started, so that it can be
+        stopped along with the task. This is called by Command itself
+
+        Args:
+            task: dict, of the task
+            command: Command object, that has been started
+        """
+        with self.lock:
+            task['commands'].append(command)
+            stopping = task['stopping'] is not None
+        if stopping:
+            command.terminate()
+    def _stop_task(self, task, reason):
+        """
+        Stop the commands of a running task
+
+        Args:
+            task: dict, of the task
+            reason: str, 'timeout' or 'cancelled'
+        """
+        with self.lock:
+            if task['stopping'] is not None:
+                return
+            task['stopping'] = time.time()
+            task['stop_reason'] = reason
+            commands = list(task['commands'])
+        for command in commands:
+            if command.proc.returncode is None:
+                self.log.debug("Stopping command: '%s'(pid=%s) of task: %s", ' '.join([command.real_path] + command.args), command.proc.pid, task['name'])
+                command.terminate()
+    def _kill_stopped(self):
+        """
+        Kill the commands of stopped tasks, that haven't exited in time
+        """
+        now = time.time()
+        for task in list(self.running.values()):
+            if task['stopping'] is None or now - task['stopping'] < POOL_STOP_TIMEOUT:
+                continue
+            with self.lock:
+                commands = list(task['commands'])
+            for command in commands:
+                if command.proc.returncode is None:
+                    self.log.warning("Command: '%s'(pid=%s): Didn't stop, forcefully killing it", ' '.join([command.real_path] + command.args), command.proc.pid)
+                    command.proc.kill()
+    def _run_task(self, task):
+        """
+        Run a task, in a thread of its own, and put its result on the queue
+        of finished tasks
+
+        Args:
+            task: dict, of the task
+        """
+        POOL_TASK.pool = self
+        POOL_TASK.task = task
+        result = {
+            'name': task['name'],
+            'status': 'ok',
+            'rc': 0,
+            'output': None,
+            'error': None,
+            'duration': 0
+        }
+        try:
+            if isinstance(task['task'], Command):
+                result['rc'], result['output'] = task['task'].run()
+            else:
+                result['rc'], result['output'] = task['task']()
+        except Exception as exc: #pylint: disable=broad-except
+            result['status'] = 'error'
+            result['rc'] = 1
+            result['error'] = 'Failed running command: {}'.format(exc)
+        finally:
+            POOL_TASK.pool = None
+            POOL_TASK.task = None
+        result['duration'] = time.time() - task['start']
+        if task['stop_reason'] == 'timeout':
+            result['status'] = 'timeout'
+            result['rc'] = POOL_TIMEOUT_RC
+            result['error'] = 'Timed out after {}s'.format(task['timeout'])
+        elif task['stop_reason'] == 'cancelled':
+            result['status'] = 'cancelled'
+            result['rc'] = POOL_CANCELLED_RC
+            result['error'] = 'Cancelled'
+        elif result['status'] == 'ok' and result['rc'] != 0:
+            result['status'] = 'failed'
+            if result['rc'] < 0 and isinstance(result['output'], str):
+                result['error'] = result['output']
+            else:
+                result['error'] = 'Exited with rc: {}'.format(result['rc'])
+        self.done.put((id(task), result))
+    def _overloaded(self):
+        """
+        Determine if the machine is too busy to start another task
+
+        Returns:
+            bool
+        """
+        if self.max_load is None or not self.running:
+            return False
+        try:
+            load = os.getloadavg()[0] / (os.cpu_count() or 1)
+        except (AttributeError, OSError):
+            self.log.debug("Can't get the load average of this machine, so not throttling on it")
+            self.max_load = None
+            return False
+        if load > self.max_load:
+            self.log.debug("Load average per CPU is: %.2f, which is over: %s, waiting to start more tasks", load, self.max_load)
+            return True
+        return False
+    def _start_tasks(self):
+        """
+        Start as many of the pending tasks as are allowed to run
+        """
+        while self.pending and len(self.running) < self.max_workers and not self._overloaded():
+            task = heapq.heappop(self.pending)[2]
+            task['start'] = time.time()
+            self.running[id(task)] = task
+            thread = threading.Thread(target=self._run_task, args=(task,), name='pool-{}'.format(task['name']))
+            thread.daemon = True
+            thread.start()
+    def _check_timeouts(self):
+        """
+        Stop the running tasks that have run longer than their timeouts
+        """
+        now = time.time()
+        for task in list(self.running.values()):
+            if task['timeout'] and task['stopping'] is None and now - task['start'] > task['timeout']:
+                self.log.warning("Task: %s has been running for longer than %ss, stopping it", task['name'], task['timeout'])
+                self._stop_task(task, 'timeout')
+    def cancel(self):
+        """
+        Stop all of the running tasks, and don't start any more. The tasks
+        that never started are reported as cancelled, without running them
+
+        Returns:
+            list of dicts, of the results of the tasks that never started
+        """
+        self.cancelled = True
+        results = []
+        while self.pending:
+            task = heapq.heappop(self.pending)[2]
+            results.append({
+                'name': task['name'],
+                'status': 'cancelled',
+                'rc': POOL_CANCELLED_RC,
+                'output': None,
+                'error': 'Cancelled',
+                'duration': 0
+            })
+        for task in list(self.running.values()):
+            self._stop_task(task, 'cancelled')
+        return results
+    def run(self):
+        """
+        Run all of the tasks that have been added, and wait for them to
+        finish. If interrupted with Ctrl-C, running commands are stopped, and
+        any task that didn't finish is reported as cancelled
+
+        Returns:
+            list of dicts, of the result of each task, in the order the tasks
+            finished, with the keys:
+                name: str, of the task
+                status: str, one of: 'ok', 'failed', 'error' (the task raised
+                    an exception), 'timeout' or 'cancelled'
+                rc: int, return code of the task
+                output: the second element of the tuple the task returned
+                error: str, of what went wrong, or None
+                duration: float, of the seconds the task ran for
+        """
+        results = []
+        while self.pending or self.running:
+            try:
+                if not self.cancelled:
+                    self._start_tasks()
+                    self._check_timeouts()
+                self._kill_stopped()
+                try:
+                    task_id, result = self.done.get(timeout=POOL_POLL_INTERVAL)
+                except queue.Empty:
+                    continue
+                del self.running[task_id]
+                results.append(result)
+            except KeyboardInterrupt:
+                if self.cancelled:
+                    self.log.warning("Interrupted again, killing %s running task(s)", len(self.running))
+                    for task in list(self.running.values()):
+                        task['stopping'] = 0
+                    continue
+                self.log.warning("Interrupted, stopping %s running task(s)", len(self.running))
+                results += self.cancel()
+        return results
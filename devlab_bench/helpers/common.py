@@ -15,6 +15,7 @@ from copy import deepcopy
 
 import devlab_bench #pylint: disable=cyclic-import
 from devlab_bench.exceptions import DevlabComponentError
+from devlab_bench.helpers.usage import usage_scope
 
 #Python2/3 compatibility
 try:
@@ -49,6 +50,9 @@ except ImportError:
     yaml = None
     YAML_SUPPORT = False
 
+HUMAN_KEYS_SPLIT = re.compile(r'(\d+)')
+HOSTNAME_DISALLOWED = re.compile(r"[^A-Z\d-]", re.IGNORECASE)
+
 #Check to see if we are attached to a TTY
 try:
     ISATTY = sys.stdout.isatty()
@@ -111,6 +115,8 @@ def get_components(filter_list=None, virtual_components=None, enabled_only=True,
                 if isinstance(filter_list[0], list):
                     filter_list = filter_list[0]
         log.debug("Comparing full list to filter_list: '%s'", ','.join(filter_list))
+        #This runs for every component and filter, so skip the debug logs quickly when they are off
+        debug = log.isEnabledFor(logging.DEBUG)
         for filt in filter_list:
             if virtual_components:
                 if filt in virtual_components:
@@ -118,21 +124,26 @@ def get_components(filter_list=None, virtual_components=None, enabled_only=True,
                     components.append(filt)
                     continue
             comp_found = False
+            #Match the glob against every component at once, instead of one fnmatch() per component
+            glob_matches = set(fnmatch.filter(all_components, filt))
             for a_comp in all_components:
-                log.debug("Checking component: %s against filter val: %s", a_comp, filt)
+                if debug:
+                    log.debug("Checking component: %s against filter val: %s", a_comp, filt)
                 if filt == a_comp:
-                    log.debug("Found exact match: %s == %s", filt, a_comp)
+                    if debug:
+                        log.debug("Found exact match: %s == %s", filt, a_comp)
                     comp_found = True
                     if len(filter_list) == 1:
                         components = [a_comp]
                         break
-                elif fnmatch.fnmatch(a_comp, filt):
+                elif a_comp in glob_matches:
                     comp_found = True
                 elif a_comp.startswith(filt):
                     comp_found = True
                 else:
                     continue
-                log.debug("Adding: '%s' component to filtered list", a_comp)
+                if debug:
+                    log.debug("Adding: '%s' component to filtered list", a_comp)
                 components.append(a_comp)
             if not comp_found:
                 raise DevlabComponentError("Unknown component: '{}'".format(filt))
@@ -247,7 +258,10 @@ def get_ordinal_sorting(components, config_components):
     ordinals = {}
     ordinal_sorted = []
     log = logging.getLogger('get_ordinal_sorting')
-    log.debug("Will be getting ordinal sorting for components: '%s'", ', '.join(components))
+    #Joining hundreds of components adds up, so only do it when the debug logs are on
+    debug = log.isEnabledFor(logging.DEBUG)
+    if debug:
+        log.debug("Will be getting ordinal sorting for components: '%s'", ', '.join(components))
     for comp in components:
         try:
             exists = config_components[comp]
@@ -266,11 +280,13 @@ def get_ordinal_sorting(components, config_components):
     log.debug("Ordinals found for components: %s", ordinals)
     #Get the list of ordinals, and human sort them
     ordinal_list = sorted(tuple(ordinals.keys()), key=human_keys)
-    log.debug("Sorted list of ordinals: '%s'", ', '.join(ordinal_list))
+    if debug:
+        log.debug("Sorted list of ordinals: '%s'", ', '.join(ordinal_list))
     #Generate the sorted list of components by the sorted ordinal
     for ordinal in ordinal_list:
         ordinal_sorted.append(ordinals[ordinal])
-    log.debug("Sorted components by ordinal: '%s'", ', '.join(ordinal_sorted))
+    if debug:
+        log.debug("Sorted components by ordinal: '%s'", ', '.join(ordinal_sorted))
     return ordinal_sorted
 
 def get_primary_ip():
@@ -361,14 +377,13 @@ def human_keys(astr):
 
     alist.sort(key=human_keys) sorts in human order
     """
-    keys = []
-    for elt in re.split(r'(\d+)', astr):
-        elt = elt.swapcase()
-        try:
-            elt = int(elt)
-        except ValueError:
-            pass
-        keys.append(elt)
+    #Splitting on a capturing group puts the runs of digits at the odd
+    #indexes, so only those need converting, and only the rest swapping
+    keys = HUMAN_KEYS_SPLIT.split(astr)
+    for idx in range(0, len(keys), 2):
+        keys[idx] = keys[idx].swapcase()
+    for idx in range(1, len(keys), 2):
+        keys[idx] = int(keys[idx])
     return keys
 
 def is_valid_hostname(hostname):
@@ -388,11 +403,10 @@ def is_valid_hostname(hostname):
         return True
     if hostname.endswith("."): # A single trailing dot is legal
         hostname = hostname[:-1] # strip exactly one dot from the right, if present
-    disallowed = re.compile(r"[^A-Z\d-]", re.IGNORECASE)
     return all( # Split by labels and verify individually
         (label and len(label) <= 63 # length is within proper range
          and not label.startswith("-") and not label.endswith("-") # no bordering hyphens
-         and not disallowed.search(label)) # contains only legal characters
+         and not HOSTNAME_DISALLOWED.search(label)) # contains only legal characters
         for label in hostname.split("."))
 
 def logging_init(level='info'):
@@ -491,7 +505,7 @@ def save_env_file(config_dict, dst_file, force_upper_keys=False):
                 val = '"{}"'.format(val)
             dfile.write('{}={}\n'.format(key, val))
 
-def script_runner(script, name, ignore_nonzero_rc=False, interactive=True, log_output=False, log=None, user=None):
+def script_runner(script, name, ignore_nonzero_rc=False, interactive=True, log_output=False, log=None, user=None, component=None, phase=None): #pylint: disable=too-many-arguments
     """
     This takes a delvab script string, and executes it inside containers
 
@@ -512,6 +526,11 @@ def script_runner(script, name, ignore_nonzero_rc=False, interactive=True, log_o
         ignore_nonzero_rc: bool indicating whether errors should create logs
         interactive: bool, whether to run in "interactive" mode or not
         log: Logger object that will be processing logs. Default=None
+        component: str, name of the component that the script belongs to,
+            which the resources it uses are added up for. Default=name
+        phase: str, name of the phase the script is run in, like 'scripts'.
+            Default=None, for the resources it uses to be added up with
+            whatever is running it
 
     Returns:
         tuple where:
@@ -520,6 +539,8 @@ def script_runner(script, name, ignore_nonzero_rc=False, interactive=True, log_o
     """
     if not log:
         log = logging.getLogger("ScriptRunner-{}".format(name))
+    if component is None:
+        component = name
     script_parse = script_runner_parse(script)
     cimg = script_parse['cimg']
     if script_parse['name']:
@@ -551,59 +572,60 @@ def script_runner(script, name, ignore_nonzero_rc=False, interactive=True, log_o
     log.debug("Full command, including environment variables: '%s'", script)
     script_split = script_stripped
     script_stripped = ' '.join(script_stripped)
-    if script_mode == 'helper_container':
-        script_run_opts.insert(0, '--rm')
-        ctag = 'latest'
-        if '^' in cimg:
-            cimg_split = cimg.split('^')
-            cimg = cimg_split[0]
-            if cimg_split[1]:
-                ctag = cimg_split[1]
-            name = cimg
-            if len(cimg_split) > 2:
-                name = cimg_split[2]
-            log.debug("Found tag: %s for image: %s. Container name will be: %s", ctag, cimg, name)
-        log.info("Executing command: '%s' inside of new container: '%s', using image: '%s:%s'", script_stripped, name, cimg, ctag)
-        script_ret = devlab_bench.helpers.docker.DOCKER.run_container(
-            image='{}:{}'.format(cimg, ctag),
-            name=name,
-            network=devlab_bench.CONFIG['network']['name'],
-            mounts=[
-                '{}:/devlab'.format(devlab_bench.PROJ_ROOT)
-            ],
-            env=env_map,
-            background=False,
-            interactive=interactive,
-            cmd=script_stripped,
-            ignore_nonzero_rc=ignore_nonzero_rc,
-            logger=log,
-            run_opts=script_run_opts,
-            log_output=log_output
-        )
-    elif script_mode == 'host':
-        log.info("Executing command: '%s' on local host", script_stripped)
-        script_ret = devlab_bench.helpers.command.Command(
-            script_split[0],
-            args=script_split[1:],
-            env=env_map,
-            use_shell=True,
-            logger=log,
-            log_output=log_output,
-            ignore_nonzero_rc=ignore_nonzero_rc,
-        ).run()
-    else:
-        log.info("Executing command: '%s' inside of container: %s", script_stripped, name)
-        script_ret = devlab_bench.helpers.docker.DOCKER.exec_cmd(
-            name=name,
-            background=False,
-            interactive=interactive,
-            env=env_map,
-            cmd=script_stripped,
-            ignore_nonzero_rc=ignore_nonzero_rc,
-            logger=log,
-            exec_opts=script_run_opts,
-            log_output=log_output
-        )
+    with usage_scope(component, phase):
+        if script_mode == 'helper_container':
+            script_run_opts.insert(0, '--rm')
+            ctag = 'latest'
+            if '^' in cimg:
+                cimg_split = cimg.split('^')
+                cimg = cimg_split[0]
+                if cimg_split[1]:
+                    ctag = cimg_split[1]
+                name = cimg
+                if len(cimg_split) > 2:
+                    name = cimg_split[2]
+                log.debug("Found tag: %s for image: %s. Container name will be: %s", ctag, cimg, name)
+            log.info("Executing command: '%s' inside of new container: '%s', using image: '%s:%s'", script_stripped, name, cimg, ctag)
+            script_ret = devlab_bench.helpers.docker.DOCKER.run_container(
+                image='{}:{}'.format(cimg, ctag),
+                name=name,
+                network=devlab_bench.CONFIG['network']['name'],
+                mounts=[
+                    '{}:/devlab'.format(devlab_bench.PROJ_ROOT)
+                ],
+                env=env_map,
+                background=False,
+                interactive=interactive,
+                cmd=script_stripped,
+                ignore_nonzero_rc=ignore_nonzero_rc,
+                logger=log,
+                run_opts=script_run_opts,
+                log_output=log_output
+            )
+        elif script_mode == 'host':
+            log.info("Executing command: '%s' on local host", script_stripped)
+            script_ret = devlab_bench.helpers.command.Command(
+                script_split[0],
+                args=script_split[1:],
+                env=env_map,
+                use_shell=True,
+                logger=log,
+                log_output=log_output,
+                ignore_nonzero_rc=ignore_nonzero_rc,
+            ).run()
+        else:
+            log.info("Executing command: '%s' inside of container: %s", script_stripped, name)
+            script_ret = devlab_bench.helpers.docker.DOCKER.exec_cmd(
+                name=name,
+                background=False,
+                interactive=interactive,
+                env=env_map,
+                cmd=script_stripped,
+                ignore_nonzero_rc=ignore_nonzero_rc,
+                logger=log,
+                exec_opts=script_run_opts,
+                log_output=log_output
+            )
     return script_ret
 
 def script_runner_parse(script):
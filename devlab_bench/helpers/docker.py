@@ -7,12 +7,29 @@ import os
 import re
 import shlex
 import sys
+import time
+from contextlib import contextmanager
+from copy import deepcopy
 
 import devlab_bench
 from devlab_bench.helpers.command import Command
 from devlab_bench.helpers.common import get_components, get_config, Path, is_valid_hostname
+from devlab_bench.helpers.metrics import Histogram
 
 DOCKER = None
+DOCKER_HELPERS = {}
+#Environment variable with the path to a docker binary to use instead of
+#looking in DOCKER_BIN_PATHS, like the fake engine used by the benchmarks
+DOCKER_BIN_ENV = 'DEVLAB_DOCKER_BIN'
+DOCKER_BIN_PATHS = (
+    '/usr/bin/docker',
+    '/usr/local/bin/docker',
+    '/usr/sbin/docker',
+    '/bin/docker',
+    '/opt/podman/bin/podman',
+    '/usr/bin/podman',
+    '/usr/local/bin/podman'
+)
 
 ###-- Classes --###
 class DockerHelper(object):
@@ -31,16 +48,11 @@ class DockerHelper(object):
                 the container name.
         """
         self.log = logging.getLogger('DockerHelper')
-        self.docker_bin_paths = (
-            '/usr/bin/docker',
-            '/usr/local/bin/docker',
-            '/usr/sbin/docker',
-            '/bin/docker',
-            '/opt/podman/bin/podman',
-            '/usr/bin/podman',
-            '/usr/local/bin/podman'
-        )
+        self.docker_bin_paths = get_docker_bin_paths()
         self.eng_is = 'unknown'
+        self.cache = None
+        self.cache_generation = 0
+        self.latency = {}
         self.filter_label = filter_label
         self.common_domain = common_domain
         self.opt_domainname = False
@@ -54,6 +66,43 @@ class DockerHelper(object):
             if 'docker' in path_check[1]:
                 self.eng_is = 'docker'
         self.log.debug("Docker engine type found is: %s", self.eng_is)
+    def enable_cache(self):
+        """
+        Start caching the results of get_containers and inspect_container.
+        The cache is dropped whenever this object changes a container, but
+        whoever enables it is responsible for calling clear_cache when
+        containers are changed by anything else (like the devlab agent does
+        by following 'docker events')
+        """
+        self.cache = {}
+    def disable_cache(self):
+        """
+        Stop caching the results of queries
+        """
+        self.cache = None
+    def clear_cache(self):
+        """
+        Drop all cached query results
+        """
+        if self.cache is not None:
+            self.cache.clear()
+            self.cache_generation += 1
+    @contextmanager
+    def _timed(self, operation):
+        """
+        Context manager for recording how long a call to the engine took in
+        the latency histogram of an operation
+
+        Args:
+            operation: str, name of the operation, like 'get_containers'
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            if operation not in self.latency:
+                self.latency[operation] = Histogram()
+            self.latency[operation].observe(time.time() - start)
     def _pre_check(self):
         """
         Checks to make sure the script is being run as the root user, or a
@@ -61,14 +110,16 @@ class DockerHelper(object):
 
         Returns None, but if access check fails, then exit
         """
-        dchk = Command(self.docker_bin_paths, ['ps'], logger=self.log).run()
+        with self._timed('pre_check'):
+            dchk = Command(self.docker_bin_paths, ['ps'], logger=self.log).run()
         if dchk[0] != 0:
             if os.geteuid() != 0:
                 self.log.error("Cannot talk to docker, maybe try again as the root user?")
             else:
                 self.log.error("Cannot talk to docker, maybe it isn't running?")
             sys.exit(1)
-        dchk = Command(self.docker_bin_paths, ['run', '--help'], logger=self.log, split=False).run()
+        with self._timed('pre_check'):
+            dchk = Command(self.docker_bin_paths, ['run', '--help'], logger=self.log, split=False).run()
         if '--domainname' in dchk[1]:
             self.opt_domainname = True
     def build_image(self, name, tag, context, docker_file, apply_filter_label=True, build_opts=None, disable_buildkit=False, logger=None, network=None, **kwargs):
@@ -128,17 +179,55 @@ class DockerHelper(object):
                         kwargs['env'].update({'DOCKER_BUILDKIT': "0"})
                     else:
                         kwargs['env'] = {'DOCKER_BUILDKIT': "0"}
-                cmd_ret = Command(
-                    self.docker_bin_paths,
-                    opts,
-                    stdin=stdin,
-                    logger=cmd_logger,
-                    **kwargs
-                ).run()
+                with self._timed('build_image'):
+                    cmd_ret = Command(
+                        self.docker_bin_paths,
+                        opts,
+                        stdin=stdin,
+                        logger=cmd_logger,
+                        **kwargs
+                    ).run()
                 return cmd_ret
         else:
             self.log.error("Cannot find docker_file: %s", docker_file)
         return (1, ['Cannot find docker_file: {}'.format(docker_file)])
+    def commit_container(self, name, image, labels=None):
+        """
+        Create a new image from a container's changes
+
+        Args:
+            name: str, Name of the container to commit
+            image: str, Name and tag of the image to create. ie: 'stuff:1.0'
+            labels: list, of additional labels in the format of 'key=value'
+                to apply to the new image (OPTIONAL)
+        Returns:
+            tuple where:
+                First Element is the return code from docker
+                Second Element is a list of strings of the output from docker
+        """
+        self.clear_cache()
+        opts = [
+            'commit'
+        ]
+        all_labels = list(self.labels or [])
+        if self.filter_label:
+            all_labels.append(self.filter_label)
+        if labels:
+            all_labels += labels
+        for label in all_labels:
+            label_split = label.split('=')
+            opts.append('--change=LABEL {}={}'.format(label_split[0], json.dumps('='.join(label_split[1:]))))
+        opts += [
+            name,
+            image
+        ]
+        with self._timed('commit_container'):
+            cmd_ret = Command(
+                self.docker_bin_paths,
+                opts,
+                logger=self.log
+            ).run()
+        return cmd_ret
     def create_network(self, name, cidr=None, gateway=None, ip_range=None, ipv6=False, driver_opts=None, subnet=None, device_name=None, driver='bridge'):
         """
         Create a docker network
@@ -189,11 +278,12 @@ class DockerHelper(object):
             opts.append('--opt')
             opts.append('com.docker.network.bridge.name={}'.format(device_name))
         opts.append(name)
-        cmd_ret = Command(
-            self.docker_bin_paths,
-            opts,
-            logger=self.log
-        ).run()
+        with self._timed('create_network'):
+            cmd_ret = Command(
+                self.docker_bin_paths,
+                opts,
+                logger=self.log
+            ).run()
         return cmd_ret
     def exec_cmd(self, name, cmd, background=False, interactive=True, ignore_nonzero_rc=False, logger=None, exec_opts=None, **kwargs):
         """
@@ -225,21 +315,23 @@ class DockerHelper(object):
         if background:
             opts.append("--detach")
         if interactive:
-            opts.append("-it")
+            #Only ask for a TTY when there is one, so that commands can also be run through a pipe
+            opts.append("-it" if sys.stdin.isatty() else "-i")
         if logger:
             cmd_logger = logger
         opts += [
             name
         ]
         opts += shlex.split(cmd)
-        cmd_ret = Command(
-            self.docker_bin_paths,
-            opts,
-            logger=cmd_logger,
-            interactive=interactive,
-            ignore_nonzero_rc=ignore_nonzero_rc,
-            **kwargs
-        ).run()
+        with self._timed('exec_cmd'):
+            cmd_ret = Command(
+                self.docker_bin_paths,
+                opts,
+                logger=cmd_logger,
+                interactive=interactive,
+                ignore_nonzero_rc=ignore_nonzero_rc,
+                **kwargs
+            ).run()
         return cmd_ret
     def get_containers(self, return_all=False):
         """
@@ -255,6 +347,8 @@ class DockerHelper(object):
                 Second Element is a list of dicts from docker if successful,
                     else a list of strings from the output of the command
         """
+        if self.cache is not None and ('containers', return_all) in self.cache:
+            return (0, deepcopy(self.cache[('containers', return_all)]))
         opts = [
             'ps',
             '-a'
@@ -264,11 +358,12 @@ class DockerHelper(object):
             opts.append('label={}'.format(self.filter_label))
         opts.append('--format')
         opts.append('{{.ID}},{{.Status}},{{.Names}}')
-        cmd_ret = Command(
-            self.docker_bin_paths,
-            opts,
-            logger=self.log
-        ).run()
+        with self._timed('get_containers'):
+            cmd_ret = Command(
+                self.docker_bin_paths,
+                opts,
+                logger=self.log
+            ).run()
         containers = []
         if cmd_ret[0] == 0:
             for cres in cmd_ret[1]:
@@ -278,15 +373,40 @@ class DockerHelper(object):
                     'name': name,
                     'status': status
                 })
+            if self.cache is not None:
+                self.cache[('containers', return_all)] = deepcopy(containers)
             return (cmd_ret[0], containers)
         return cmd_ret
-    def get_images(self, return_all=False):
+    def get_engine_version(self):
+        """
+        Get the version of the docker (or podman) engine
+
+        Returns:
+            str, of the version, or None if it couldn't be determined
+        """
+        with self._timed('get_engine_version'):
+            cmd_ret = Command(
+                self.docker_bin_paths,
+                [
+                    'version',
+                    '--format',
+                    '{{.Server.Version}}'
+                ],
+                logger=self.log,
+                suppress_error_out=True,
+                split=False
+            ).run()
+        if cmd_ret[0] != 0 or not cmd_ret[1]:
+            return None
+        return cmd_ret[1].strip()
+    def get_images(self, return_all=False, label=None):
         """
         List of images that docker has
 
         Args:
             return_all: bool, whether or not to return all images regardless of
                 the filter set.
+            label: str, an additional label to filter on (OPTIONAL)
 
         Returns:
             tuple where:
@@ -303,13 +423,17 @@ class DockerHelper(object):
         if self.filter_label and not return_all:
             opts.append('--filter')
             opts.append('label={}'.format(self.filter_label))
+        if label:
+            opts.append('--filter')
+            opts.append('label={}'.format(label))
         opts.append('--format')
         opts.append('{{.Repository}}:{{.Tag}}')
-        cmd_ret = Command(
-            self.docker_bin_paths,
-            opts,
-            logger=self.log
-        ).run()
+        with self._timed('get_images'):
+            cmd_ret = Command(
+                self.docker_bin_paths,
+                opts,
+                logger=self.log
+            ).run()
         if self.eng_is == 'podman':
             if cmd_ret[0] == 0:
                 self.log.debug('Normalizing podman specific image output to match docker\'s format')
@@ -349,11 +473,12 @@ class DockerHelper(object):
             opts.append('label={}'.format(self.filter_label))
         opts.append('--format')
         opts.append('{{.ID}},{{.Name}},{{.Driver}}')
-        cmd_ret = Command(
-            self.docker_bin_paths,
-            opts,
-            logger=self.log
-        ).run()
+        with self._timed('get_networks'):
+            cmd_ret = Command(
+                self.docker_bin_paths,
+                opts,
+                logger=self.log
+            ).run()
         networks = []
         if cmd_ret[0] == 0:
             for nres in cmd_ret[1]:
@@ -375,18 +500,72 @@ class DockerHelper(object):
         Return dict
         """
         ret = {}
-        cmd_ret = Command(
+        if self.cache is not None and ('inspect', container) in self.cache:
+            return deepcopy(self.cache[('inspect', container)])
+        with self._timed('inspect_container'):
+            cmd_ret = Command(
+                self.docker_bin_paths,
+                [
+                    'container',
+                    'inspect',
+                    container
+                ],
+                split=False,
+                logger=self.log
+            ).run()
+        if cmd_ret[0] == 0:
+            ret = json.loads(cmd_ret[1])
+            if self.cache is not None:
+                self.cache[('inspect', container)] = deepcopy(ret)
+        return ret
+    def inspect_containers(self, containers):
+        """
+        Grabs the inspection data (docker inspect) for multiple containers,
+        with a single call to the engine for the ones that aren't cached
+
+        Args:
+            containers: list of str, the containers you want to inspect
+
+        Returns:
+            dict, of the inspection data of each container that exists, keyed
+            by the container's name
+        """
+        ret = {}
+        to_inspect = []
+        for container in containers:
+            if self.cache is not None and ('inspect', container) in self.cache:
+                ret[container] = deepcopy(self.cache[('inspect', container)])
+            else:
+                to_inspect.append(container)
+        if not to_inspect:
+            return ret
+        #The engine exits non-zero if any of the containers don't exist, but
+        #still outputs the ones that do
+        inspect_cmd = Command(
             self.docker_bin_paths,
             [
                 'container',
-                'inspect',
-                container
-            ],
+                'inspect'
+            ] + to_inspect,
             split=False,
+            suppress_error_out=True,
             logger=self.log
-        ).run()
-        if cmd_ret[0] == 0:
-            ret = json.loads(cmd_ret[1])
+        )
+        with self._timed('inspect_containers'):
+            inspect_cmd.run()
+        try:
+            inspected = json.loads('\n'.join(inspect_cmd.stdout) or '[]')
+        except ValueError:
+            self.log.warning("Failed parsing the inspection data of containers: %s", ', '.join(to_inspect))
+            return ret
+        for inspect_data in inspected:
+            container = inspect_data.get('Name', '').lstrip('/')
+            if container not in to_inspect:
+                continue
+            #Keep the same format as inspect_container
+            ret[container] = [inspect_data]
+            if self.cache is not None:
+                self.cache[('inspect', container)] = deepcopy([inspect_data])
         return ret
     def inspect_image(self, image):
         """
@@ -398,16 +577,17 @@ class DockerHelper(object):
         Return dict
         """
         ret = {}
-        cmd_ret = Command(
-            self.docker_bin_paths,
-            [
-                'image',
-                'inspect',
-                image
-            ],
-            split=False,
-            logger=self.log
-        ).run()
+        with self._timed('inspect_image'):
+            cmd_ret = Command(
+                self.docker_bin_paths,
+                [
+                    'image',
+                    'inspect',
+                    image
+                ],
+                split=False,
+                logger=self.log
+            ).run()
         if cmd_ret[0] == 0:
             ret = json.loads(cmd_ret[1])
         return ret
@@ -428,11 +608,12 @@ class DockerHelper(object):
             opts.append('--filter')
             opts.append('label={}'.format(self.filter_label))
         opts.append('-f')
-        cmd_ret = Command(
-            self.docker_bin_paths,
-            opts,
-            logger=self.log
-        ).run()
+        with self._timed('prune_images'):
+            cmd_ret = Command(
+                self.docker_bin_paths,
+                opts,
+                logger=self.log
+            ).run()
         return cmd_ret
     def pull_image(self, image, **kwargs):
         """
@@ -454,11 +635,12 @@ class DockerHelper(object):
         opts.append(image)
         if 'logger' not in kwargs:
             kwargs['logger'] = self.log
-        cmd_ret = Command(
-            self.docker_bin_paths,
-            opts,
-            **kwargs
-        ).run()
+        with self._timed('pull_image'):
+            cmd_ret = Command(
+                self.docker_bin_paths,
+                opts,
+                **kwargs
+            ).run()
         return cmd_ret
     def rm_container(self, name, force=True):
         """
@@ -471,17 +653,19 @@ class DockerHelper(object):
                 First Element is the return code from docker
                 Second Element is a list of strings of the output from docker
         """
+        self.clear_cache()
         opts = [
             'rm'
         ]
         if force:
             opts.append('-f')
         opts.append(name)
-        cmd_ret = Command(
-            self.docker_bin_paths,
-            opts,
-            logger=self.log
-        ).run()
+        with self._timed('rm_container'):
+            cmd_ret = Command(
+                self.docker_bin_paths,
+                opts,
+                logger=self.log
+            ).run()
         return cmd_ret
     def rm_image(self, name):
         """
@@ -494,15 +678,16 @@ class DockerHelper(object):
                 First Element is the return code from docker
                 Second Element is a list of strings of the output from docker
         """
-        cmd_ret = Command(
-            self.docker_bin_paths,
-            [
-                'rmi',
-                '-f',
-                name
-            ],
-            logger=self.log
-        ).run()
+        with self._timed('rm_image'):
+            cmd_ret = Command(
+                self.docker_bin_paths,
+                [
+                    'rmi',
+                    '-f',
+                    name
+                ],
+                logger=self.log
+            ).run()
         return cmd_ret
     def run_container(self, image, name, network=None, ports=None, background=True, env=None, env_file=None, interactive=False, ignore_nonzero_rc=False, cmd=None, logger=None, mounts=None, systemd_support=False, systemd_tmpfs_args='', run_opts=None, **kwargs): #pylint: disable=too-many-arguments
         """
@@ -534,6 +719,7 @@ class DockerHelper(object):
                 First Element is the return code from docker
                 Second Element is a list of strings of the output from docker
         """
+        self.clear_cache()
         ignored_opts = kwargs
         opts = [
             'run',
@@ -576,7 +762,7 @@ class DockerHelper(object):
             for port in ports:
                 opts.append('--publish={}'.format(port))
         if interactive:
-            opts.append('-it')
+            opts.append('-it' if sys.stdin.isatty() else '-i')
         if logger:
             cmd_logger = logger
         opts += [
@@ -604,14 +790,15 @@ class DockerHelper(object):
         opts.append(image)
         if cmd:
             opts += shlex.split(cmd)
-        cmd_ret = Command(
-            self.docker_bin_paths,
-            opts,
-            logger=cmd_logger,
-            interactive=interactive,
-            ignore_nonzero_rc=ignore_nonzero_rc,
-            **kwargs
-        ).run()
+        with self._timed('run_container'):
+            cmd_ret = Command(
+                self.docker_bin_paths,
+                opts,
+                logger=cmd_logger,
+                interactive=interactive,
+                ignore_nonzero_rc=ignore_nonzero_rc,
+                **kwargs
+            ).run()
         return cmd_ret
     def start_container(self, name, ignore_nonzero_rc=False):
         """
@@ -625,15 +812,17 @@ class DockerHelper(object):
                 First Element is the return code from docker
                 Second Element is a list of strings of the output from docker
         """
-        cmd_ret = Command(
-            self.docker_bin_paths,
-            [
-                'start',
-                name
-            ],
-            ignore_nonzero_rc=ignore_nonzero_rc,
-            logger=self.log
-        ).run()
+        self.clear_cache()
+        with self._timed('start_container'):
+            cmd_ret = Command(
+                self.docker_bin_paths,
+                [
+                    'start',
+                    name
+                ],
+                ignore_nonzero_rc=ignore_nonzero_rc,
+                logger=self.log
+            ).run()
         return cmd_ret
     def stop_container(self, name):
         """
@@ -646,17 +835,51 @@ class DockerHelper(object):
                 First Element is the return code from docker
                 Second Element is a list of strings of the output from docker
         """
-        cmd_ret = Command(
-            self.docker_bin_paths,
-            [
-                'stop',
-                name
-            ],
-            logger=self.log
-        ).run()
+        self.clear_cache()
+        with self._timed('stop_container'):
+            cmd_ret = Command(
+                self.docker_bin_paths,
+                [
+                    'stop',
+                    name
+                ],
+                logger=self.log
+            ).run()
         return cmd_ret
 
 ###-- Functions --###
+def get_docker_bin_paths():
+    """
+    Get the paths to look for the docker binary in
+
+    Returns:
+        tuple
+    """
+    if os.environ.get(DOCKER_BIN_ENV):
+        return (os.environ[DOCKER_BIN_ENV],)
+    return DOCKER_BIN_PATHS
+
+def get_project_docker_helper():
+    """
+    Get the DockerHelper for the current project. Helpers are kept around per
+    project, so that a long running process (like the devlab agent) only has to
+    set one up once
+
+    Returns:
+        DockerHelper
+    """
+    if devlab_bench.PROJ_ROOT not in DOCKER_HELPERS:
+        config = get_config()
+        DOCKER_HELPERS[devlab_bench.PROJ_ROOT] = DockerHelper(
+            filter_label=config['project_filter'],
+            labels=[
+                'com.lab.type=devlab',
+                'com.lab.project={}'.format(devlab_bench.PROJ_ROOT)
+            ],
+            common_domain=config['domain']
+        )
+    return DOCKER_HELPERS[devlab_bench.PROJ_ROOT]
+
 def check_build_image_need_update(image, dockerfile, logger=None):
     """
     Determine if an image needs to be updated based on a dockerfile's
@@ -0,0 +1,368 @@
+"""
+History of the runs of devlab actions that change the project, like 'up' and
+'build', with how long each of their phases took.
+
+Every run of one of the HISTORY_ACTIONS is recorded in a small SQLite database
+in the project's persistence directory, built from the trace spans of the run
+(see devlab_bench.helpers.trace), along with what could explain a change in
+how long it took: the hash of the project's config, the versions of devlab
+and of the docker engine, and the images that were built or pulled.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+
+import devlab_bench
+import devlab_bench.helpers.docker
+from devlab_bench.helpers.common import get_config
+
+HISTORY_DB_FILE = 'devlab_history.db'
+HISTORY_ACTIONS = ('up', 'down', 'reset', 'build', 'update')
+HISTORY_KEEP = 500
+HISTORY_LOCK_TIMEOUT = 30
+#Phases that aren't specific to a component are recorded with this component
+PROJECT_COMPONENT = ''
+#Name of the phase with the total duration of a component, or of the run
+TOTAL_PHASE = 'total'
+
+###-- Classes --###
+class HistoryStore(object):
+    """
+    Store of the history of a project's runs, backed by SQLite
+    """
+    def __init__(self, path, timeout=HISTORY_LOCK_TIMEOUT, logger=None):
+        """
+        Initialize the HistoryStore Object
+
+        Args:
+            path: str, path to the SQLite database. It is created if it
+                doesn't exist
+            timeout: int, seconds to wait for another process's transaction
+                to finish before giving up
+            logger: Logger object to use for log messages
+        """
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger('HistoryStore')
+        self.path = path
+        history_dir = os.path.dirname(path)
+        if history_dir and not os.path.isdir(history_dir):
+            os.makedirs(history_dir)
+        self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('BEGIN IMMEDIATE')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS runs ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'action TEXT NOT NULL, '
+            'argv TEXT, '
+            'started REAL NOT NULL, '
+            'duration REAL NOT NULL, '
+            'rc INTEGER NOT NULL, '
+            'config_hash TEXT, '
+            'devlab_version TEXT, '
+            'engine_version TEXT, '
+            'components TEXT, '
+            'images_built TEXT, '
+            'images_pulled TEXT)'
+        )
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS phases ('
+            'run_id INTEGER NOT NULL, '
+            'component TEXT NOT NULL, '
+            'phase TEXT NOT NULL, '
+            'duration REAL NOT NULL, '
+            'PRIMARY KEY (run_id, component, phase))'
+        )
+        self.conn.execute('COMMIT')
+    def add_run(self, run):
+        """
+        Add a run to the history, dropping the oldest runs over HISTORY_KEEP
+
+        Args:
+            run: dict, of the run as returned by build_run
+
+        Returns:
+            int, the id of the run
+        """
+        cur = self.conn.cursor()
+        cur.execute('BEGIN IMMEDIATE')
+        try:
+            cur.execute(
+                'INSERT INTO runs (action, argv, started, duration, rc, config_hash, devlab_version, engine_version, components, images_built, images_pulled) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    run['action'],
+                    json.dumps(run['argv']),
+                    run['started'],
+                    run['duration'],
+                    run['rc'],
+                    run['config_hash'],
+                    run['devlab_version'],
+                    run['engine_version'],
+                    json.dumps(run['components']),
+                    json.dumps(run['images_built']),
+                    json.dumps(run['images_pulled'])
+                )
+            )
+            run_id = cur.lastrowid
+            cur.executemany(
+                'INSERT INTO phases (run_id, component, phase, duration) VALUES (?, ?, ?, ?)',
+                [(run_id, component, phase, duration) for (component, phase), duration in run['phases'].items()]
+            )
+            cur.execute('DELETE FROM phases WHERE run_id <= ?', (run_id - HISTORY_KEEP,))
+            cur.execute('DELETE FROM runs WHERE id <= ?', (run_id - HISTORY_KEEP,))
+        except BaseException:
+            cur.execute('ROLLBACK')
+            raise
+        cur.execute('COMMIT')
+        return run_id
+    def _run_from_row(self, row):
+        """
+        Convert a row of the runs table to a dict
+        """
+        return {
+            'id': row[0],
+            'action': row[1],
+            'argv': json.loads(row[2]),
+            'started': row[3],
+            'duration': row[4],
+            'rc': row[5],
+            'config_hash': row[6],
+            'devlab_version': row[7],
+            'engine_version': row[8],
+            'components': json.loads(row[9]),
+            'images_built': json.loads(row[10]),
+            'images_pulled': json.loads(row[11])
+        }
+    def get_runs(self, action=None, limit=None):
+        """
+        Get runs from the history, newest first
+
+        Args:
+            action: str, only get runs of this action
+            limit: int, the maximum number of runs to get
+
+        Returns:
+            list of dicts
+        """
+        query = 'SELECT id, action, argv, started, duration, rc, config_hash, devlab_version, engine_version, components, images_built, images_pulled FROM runs'
+        params = []
+        if action:
+            query += ' WHERE action=?'
+            params.append(action)
+        query += ' ORDER BY id DESC'
+        if limit:
+            query += ' LIMIT ?'
+            params.append(limit)
+        return [self._run_from_row(row) for row in self.conn.execute(query, params)]
+    def get_run(self, run_id):
+        """
+        Get a single run from the history, including its phases
+
+        Args:
+            run_id: int, the id of the run
+
+        Returns:
+            dict, or None if the run doesn't exist
+        """
+        row = self.conn.execute(
+            'SELECT id, action, argv, started, duration, rc, config_hash, devlab_version, engine_version, components, images_built, images_pulled FROM runs WHERE id=?',
+            (run_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        run = self._run_from_row(row)
+        run['phases'] = self.get_phases([run_id])[run_id]
+        return run
+    def get_phases(self, run_ids):
+        """
+        Get the phase durations of runs
+
+        Args:
+            run_ids: list of int, the ids of the runs
+
+        Returns:
+            dict, of the run ids, to dicts of (component, phase) to duration
+        """
+        phases = dict((run_id, {}) for run_id in run_ids)
+        if not run_ids:
+            return phases
+        rows = self.conn.execute(
+            'SELECT run_id, component, phase, duration FROM phases WHERE run_id IN ({})'.format(','.join('?' * len(run_ids))),
+            list(run_ids)
+        )
+        for run_id, component, phase, duration in rows:
+            phases[run_id][(component, phase)] = duration
+        return phases
+    def get_last_durations(self, action, phase=TOTAL_PHASE):
+        """
+        Get how long a phase took for each component, the last time that a
+        successful run of an action included it
+
+        Args:
+            action: str, the action, like 'up'
+            phase: str, the phase
+
+        Returns:
+            dict, of the components and the durations
+        """
+        rows = self.conn.execute(
+            'SELECT phases.component, phases.duration FROM phases JOIN runs ON runs.id = phases.run_id '
+            'WHERE runs.action=? AND runs.rc=0 AND phases.phase=? AND phases.component != ? ORDER BY runs.id',
+            (action, phase, PROJECT_COMPONENT)
+        )
+        return dict(rows)
+    def close(self):
+        """
+        Close the connection to the database
+        """
+        self.conn.close()
+
+###-- Functions --###
+def get_history_path():
+    """
+    Get the path to the project's history database
+
+    Returns:
+        str
+    """
+    config = get_config()
+    return '{}/{}/{}'.format(devlab_bench.PROJ_ROOT, config['paths'].get('component_persistence', ''), HISTORY_DB_FILE)
+
+def get_config_hash(config=None):
+    """
+    Get a hash of the project's loaded config, so that runs with different
+    configs can be told apart. Actions like 'up' change the loaded config as
+    they go, so it needs hashing before the action runs
+
+    Args:
+        config: dict, of the config to hash. Default=devlab_bench.CONFIG
+
+    Returns:
+        str
+    """
+    if config is None:
+        config = devlab_bench.CONFIG
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def get_history_store():
+    """
+    Get the HistoryStore for the current project
+
+    Returns:
+        HistoryStore
+    """
+    return HistoryStore(os.path.normpath(get_history_path()))
+
+def build_run(action, argv, spans, devlab_version, engine_version=None, config_hash=None):
+    """
+    Build the record of a run from its trace spans
+
+    Args:
+        action: str, name of the action that was run
+        argv: list, of the arguments devlab was run with
+        spans: list of dicts, of the trace events of the run, as returned
+            by devlab_bench.helpers.trace.get_spans
+        devlab_version: str, the version of devlab
+        engine_version: str, the version of the docker engine
+        config_hash: str, hash of the config as it was loaded before the
+            action ran, as returned by get_config_hash
+
+    Returns:
+        dict, or None if the action never ran
+    """
+    main_span = None
+    action_ran = False
+    phases = {}
+    components = set()
+    images_built = set()
+    images_pulled = set()
+    for trace_span in spans:
+        args = trace_span['args']
+        duration = trace_span['dur'] / 1000000.0
+        if trace_span['name'] == 'devlab':
+            main_span = trace_span
+            continue
+        if trace_span['name'] == 'action':
+            action_ran = True
+        if trace_span['cat'] != 'phase':
+            continue
+        if trace_span['name'] == 'build image':
+            images_built.add(args['image'])
+        elif trace_span['name'] == 'pull image':
+            images_pulled.add(args['image'])
+        component = args.get('component', PROJECT_COMPONENT)
+        phase = trace_span['name']
+        if component != PROJECT_COMPONENT:
+            components.add(component)
+            if phase.startswith('component: '):
+                phase = TOTAL_PHASE
+        phases[(component, phase)] = phases.get((component, phase), 0) + duration
+    if main_span is None or not action_ran:
+        return None
+    exit_code = main_span['args'].get('exit_code', 0)
+    if 'error' in main_span['args']:
+        rc = 1
+    elif exit_code is None:
+        rc = 0
+    elif isinstance(exit_code, int):
+        rc = exit_code
+    else:
+        rc = 1
+    duration = main_span['dur'] / 1000000.0
+    phases[(PROJECT_COMPONENT, TOTAL_PHASE)] = duration
+    return {
+        'action': action,
+        'argv': argv,
+        'started': main_span['ts'] / 1000000.0,
+        'duration': duration,
+        'rc': rc,
+        'config_hash': config_hash,
+        'devlab_version': devlab_version,
+        'engine_version': engine_version,
+        'components': sorted(components),
+        'images_built': sorted(images_built),
+        'images_pulled': sorted(images_pulled),
+        'phases': phases
+    }
+
+def record_run(action, argv, spans, devlab_version, config_hash=None, logger=None):
+    """
+    Record a run in the project's history. Failing to record a run never
+    fails the action, so errors are only logged
+
+    Args:
+        action: str, name of the action that was run
+        argv: list, of the arguments devlab was run with
+        spans: list of dicts, of the trace events of the run
+        devlab_version: str, the version of devlab
+        config_hash: str, hash of the config as it was loaded before the
+            action ran, as returned by get_config_hash
+        logger: Logger object to use for log messages
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('History')
+    if not devlab_bench.CONFIG or 'paths' not in devlab_bench.CONFIG or not devlab_bench.helpers.docker.DOCKER:
+        return
+    start = time.time()
+    run = build_run(action, argv, spans, devlab_version, engine_version=devlab_bench.helpers.docker.DOCKER.get_engine_version(), config_hash=config_hash)
+    if run is None:
+        return
+    try:
+        history = get_history_store()
+        try:
+            run_id = history.add_run(run)
+        finally:
+            history.close()
+    except (sqlite3.Error, IOError, OSError) as exc:
+        log.warning("Failed recording this run in the project's history: %s", exc)
+        return
+    log.debug("Recorded run: %s of action: %s in the project's history in %.3fs", run_id, action, time.time() - start)
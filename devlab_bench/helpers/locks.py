@@ -0,0 +1,292 @@
+"""
+Advisory locks, so that multiple devlab commands can safely run against the
+same project at the same time.
+
+Every component has its own lock, which is held while it is being brought
+up, down, restarted or reset, so commands against different components don't
+wait on each other. The 'project' lock is held while project wide files, like
+the config written by the wizard or the paths removed by a full reset, are
+being changed.
+
+Locks are flock()s on files in the project's lock directory, so they are
+released by the kernel if devlab dies while holding one. Locks are re-entrant
+within a process, as actions call each other (restart calls down and up, reset
+calls down etc...). While a lock is held, a small holder file records who is
+holding it, so that commands waiting on it can say what they are waiting for.
+"""
+import errno
+import fcntl
+import json
+import logging
+import os
+import socket
+import sys
+import time
+from contextlib import contextmanager
+
+import devlab_bench
+from devlab_bench.exceptions import DevlabLockError
+
+LOCK_DIR = '.devlab_locks'
+LOCK_POLL_MAX = 0.5
+PROJECT_LOCK = 'project'
+
+HELD_LOCKS = {}
+
+###-- Classes --###
+class Lock(object):
+    """
+    A re-entrant advisory lock on a project wide resource
+    """
+    def __init__(self, name, timeout=None, logger=None):
+        """
+        Initialize the Lock Object
+
+        Args:
+            name: str, name of the lock, like 'project' or 'component-db'
+            timeout: float, seconds to wait for the lock before giving up.
+                Default is devlab_bench.LOCK_TIMEOUT
+            logger: Logger object to use for log messages
+        """
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger('Lock')
+        if timeout is None:
+            timeout = devlab_bench.LOCK_TIMEOUT
+        self.name = name
+        self.timeout = timeout
+        self.path = '{}/{}.lock'.format(get_lock_dir(), name)
+        self.waited = False
+    def __enter__(self):
+        self.acquire()
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+    def acquire(self):
+        """
+        Acquire the lock, waiting for up to the lock's timeout if another
+        process holds it
+
+        Raises:
+            DevlabLockError if the lock couldn't be acquired in time
+        """
+        if self.path in HELD_LOCKS:
+            HELD_LOCKS[self.path]['count'] += 1
+            return
+        lock_dir = os.path.dirname(self.path)
+        if not os.path.isdir(lock_dir):
+            os.makedirs(lock_dir)
+        lock_fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        deadline = time.time() + self.timeout
+        poll_interval = 0.01
+        while True:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except (IOError, OSError) as exc:
+                if exc.errno not in (errno.EAGAIN, errno.EACCES):
+                    os.close(lock_fd)
+                    raise
+            if not self.waited:
+                self.log.info("Waiting for lock: '%s' held by: %s", self.name, describe_holders(get_holders(self.name)))
+                self.waited = True
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                os.close(lock_fd)
+                raise DevlabLockError(
+                    "Timed out after {}s waiting for lock: '{}' held by: {}".format(
+                        self.timeout,
+                        self.name,
+                        describe_holders(get_holders(self.name))
+                    )
+                )
+            time.sleep(min(poll_interval, remaining))
+            poll_interval = min(poll_interval * 2, LOCK_POLL_MAX)
+        holder_path = '{}.{}.holder'.format(self.path, os.getpid())
+        with open(holder_path, 'w') as holder_file:
+            json.dump(
+                {
+                    'pid': os.getpid(),
+                    'host': socket.gethostname(),
+                    'cmd': ' '.join(sys.argv),
+                    'since': time.time()
+                },
+                holder_file
+            )
+        HELD_LOCKS[self.path] = {
+            'fd': lock_fd,
+            'count': 1,
+            'holder_path': holder_path
+        }
+        self.log.debug("Acquired lock: '%s'", self.name)
+    def release(self):
+        """
+        Release the lock once it has been released as many times as it was
+        acquired
+        """
+        held = HELD_LOCKS.get(self.path, None)
+        if not held:
+            return
+        held['count'] -= 1
+        if held['count'] > 0:
+            return
+        del HELD_LOCKS[self.path]
+        try:
+            os.remove(held['holder_path'])
+        except OSError:
+            pass
+        fcntl.flock(held['fd'], fcntl.LOCK_UN)
+        os.close(held['fd'])
+        self.log.debug("Released lock: '%s'", self.name)
+
+###-- Functions --###
+def get_lock_dir():
+    """
+    Get the path to the project's lock directory
+
+    Returns:
+        str
+    """
+    return '{}/{}'.format(devlab_bench.PROJ_ROOT, LOCK_DIR)
+
+def get_holders(name):
+    """
+    Get the details of the processes holding a lock. Holder files left behind
+    by processes that no longer exist are ignored
+
+    Args:
+        name: str, name of the lock
+
+    Returns:
+        list of dicts with the keys: 'pid', 'host', 'cmd' and 'since'
+    """
+    holders = []
+    lock_dir = get_lock_dir()
+    prefix = '{}.lock.'.format(name)
+    try:
+        lock_files = os.listdir(lock_dir)
+    except OSError:
+        return holders
+    for lock_file in lock_files:
+        if not (lock_file.startswith(prefix) and lock_file.endswith('.holder')):
+            continue
+        try:
+            with open('{}/{}'.format(lock_dir, lock_file)) as holder_file:
+                holder = json.load(holder_file)
+        except (IOError, OSError, ValueError):
+            continue
+        if holder.get('host') == socket.gethostname():
+            try:
+                os.kill(holder['pid'], 0)
+            except OSError as exc:
+                if exc.errno == errno.ESRCH:
+                    continue
+        holders.append(holder)
+    return holders
+
+def get_held_locks():
+    """
+    Get all of the project's locks that are currently held
+
+    Returns:
+        dict, where the keys are the lock names and the values are lists of
+        holders as returned by get_holders
+    """
+    held_locks = {}
+    try:
+        lock_files = os.listdir(get_lock_dir())
+    except OSError:
+        return held_locks
+    for lock_file in lock_files:
+        if not lock_file.endswith('.lock'):
+            continue
+        name = lock_file[:-len('.lock')]
+        holders = get_holders(name)
+        if holders:
+            held_locks[name] = holders
+    return held_locks
+
+def describe_holders(holders):
+    """
+    Describe who is holding a lock in a human readable way
+
+    Args:
+        holders: list of dicts, as returned by get_holders
+
+    Returns:
+        str
+    """
+    if not holders:
+        return 'unknown'
+    return ', '.join(
+        "pid {} on {} ('{}') for {:.0f}s".format(
+            holder['pid'],
+            holder['host'],
+            holder['cmd'],
+            time.time() - holder['since']
+        ) for holder in holders
+    )
+
+def project_lock(timeout=None, logger=None):
+    """
+    Get the lock for changing project wide files
+
+    Args:
+        timeout: float, seconds to wait for the lock
+        logger: Logger object to use for log messages
+
+    Returns:
+        Lock
+    """
+    return Lock(PROJECT_LOCK, timeout=timeout, logger=logger)
+
+def component_lock(comp, timeout=None, logger=None):
+    """
+    Get the lock for changing the lifecycle of a component
+
+    Args:
+        comp: str, name of the component
+        timeout: float, seconds to wait for the lock
+        logger: Logger object to use for log messages
+
+    Returns:
+        Lock
+    """
+    return Lock('component-{}'.format(comp), timeout=timeout, logger=logger)
+
+@contextmanager
+def component_locks(components, timeout=None, logger=None):
+    """
+    Context manager for holding the locks of multiple components. The locks
+    are always acquired in the same order, so that two commands locking
+    overlapping components can't deadlock
+
+    Args:
+        components: list of str, names of the components
+        timeout: float, seconds to wait for each of the locks
+        logger: Logger object to use for log messages
+    """
+    locks = []
+    try:
+        for comp in sorted(set(components)):
+            lock = component_lock(comp, timeout=timeout, logger=logger)
+            lock.acquire()
+            locks.append(lock)
+        yield locks
+    finally:
+        for lock in reversed(locks):
+            lock.release()
+
+def close_inherited_locks():
+    """
+    Close the lock files inherited by a forked child process, without
+    releasing the parent's locks, so that a long running child (like a host
+    component's supervisor) doesn't keep them held after the parent is done
+    """
+    for held in HELD_LOCKS.values():
+        try:
+            os.close(held['fd'])
+        except OSError:
+            pass
+    HELD_LOCKS.clear()
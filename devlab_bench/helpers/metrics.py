@@ -0,0 +1,308 @@
+"""
+Metrics about a devlab project, in the OpenMetrics text format, so that they
+can be scraped by Prometheus or picked up by node_exporter's textfile
+collector.
+
+Every DockerHelper keeps histograms of how long its calls to the engine took.
+Each devlab command adds its histograms to the ones kept in the project's
+state store when it exits, so the histograms cover every command that has run
+for the project, not just the one that is reporting them.
+"""
+import bisect
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+
+import devlab_bench
+from devlab_bench.helpers.state import get_state_store
+
+#Upper bounds, in seconds, of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+LATENCY_STATE_KEY = 'docker_latency'
+OPENMETRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+TEXTFILE_SUFFIX = '.prom'
+
+###-- Classes --###
+class Histogram(object):
+    """
+    Histogram of observed values, with fixed buckets
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        Initialize the Histogram Object
+
+        Args:
+            buckets: tuple of float, the upper bounds of the buckets, in
+                increasing order. There is always an extra bucket for values
+                above the last one
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+    def observe(self, value):
+        """
+        Add a value to the histogram
+
+        Args:
+            value: float, the value to add
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+    def merge(self, other):
+        """
+        Add the values of another histogram to this one
+
+        Args:
+            other: Histogram, with the same buckets
+
+        Raises:
+            ValueError if the histograms have different buckets
+        """
+        if other.buckets != self.buckets:
+            raise ValueError('Histograms have different buckets')
+        self.counts = [count + other_count for count, other_count in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+    def to_dict(self):
+        """
+        Convert the histogram to a dict, that can be stored as JSON
+
+        Returns:
+            dict
+        """
+        return {
+            'buckets': list(self.buckets),
+            'counts': list(self.counts),
+            'sum': self.sum,
+            'count': self.count
+        }
+    @classmethod
+    def from_dict(cls, hist_dict):
+        """
+        Create a histogram from a dict returned by to_dict
+
+        Args:
+            hist_dict: dict, of the histogram
+
+        Returns:
+            Histogram
+        """
+        histogram = cls(buckets=hist_dict['buckets'])
+        if len(hist_dict['counts']) != len(histogram.counts):
+            raise ValueError('Histogram has the wrong number of counts')
+        histogram.counts = list(hist_dict['counts'])
+        histogram.sum = hist_dict['sum']
+        histogram.count = hist_dict['count']
+        return histogram
+
+class MetricFamily(object):
+    """
+    A family of metrics with the same name, type and help, and samples with
+    different labels
+    """
+    def __init__(self, name, metric_type, help_text):
+        """
+        Initialize the MetricFamily Object
+
+        Args:
+            name: str, name of the family
+            metric_type: str, the OpenMetrics type, like 'gauge', 'counter'
+                or 'histogram'
+            help_text: str, description of the metric
+        """
+        self.name = name
+        self.metric_type = metric_type
+        self.help_text = help_text
+        self.samples = []
+    def add(self, value, suffix='', **labels):
+        """
+        Add a sample to the family
+
+        Args:
+            value: int or float, the value of the sample
+            suffix: str, suffix to add to the family's name for the sample,
+                like '_total' or '_bucket'
+            labels: the labels of the sample
+        """
+        self.samples.append((suffix, labels, value))
+    def add_histogram(self, histogram, **labels):
+        """
+        Add the samples of a histogram to the family
+
+        Args:
+            histogram: Histogram, to add
+            labels: the labels of the histogram's samples
+        """
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            self.add(cumulative, suffix='_bucket', le=format_value(float(bound)), **labels)
+        self.add(histogram.count, suffix='_bucket', le='+Inf', **labels)
+        self.add(histogram.count, suffix='_count', **labels)
+        self.add(histogram.sum, suffix='_sum', **labels)
+    def format(self):
+        """
+        Format the family in the OpenMetrics text format
+
+        Returns:
+            list of str, of the lines of the family
+        """
+        lines = [
+            '# TYPE {} {}'.format(self.name, self.metric_type),
+            '# HELP {} {}'.format(self.name, escape_text(self.help_text))
+        ]
+        for suffix, labels, value in self.samples:
+            if labels:
+                label_str = ','.join('{}="{}"'.format(key, escape_text(str(labels[key]), quotes=True)) for key in sorted(labels))
+                lines.append('{}{}{{{}}} {}'.format(self.name, suffix, label_str, format_value(value)))
+            else:
+                lines.append('{}{} {}'.format(self.name, suffix, format_value(value)))
+        return lines
+
+###-- Functions --###
+def escape_text(text, quotes=False):
+    """
+    Escape text for a help line or label value
+
+    Args:
+        text: str, the text to escape
+        quotes: bool, whether to escape double quotes too
+
+    Returns:
+        str
+    """
+    text = text.replace('\\', '\\\\').replace('\n', '\\n')
+    if quotes:
+        text = text.replace('"', '\\"')
+    return text
+
+def format_value(value):
+    """
+    Format the value of a sample
+
+    Args:
+        value: int, float or bool
+
+    Returns:
+        str
+    """
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+def format_openmetrics(families):
+    """
+    Format metric families in the OpenMetrics text format. Families without
+    any samples are left out
+
+    Args:
+        families: list of MetricFamily objects
+
+    Returns:
+        str
+    """
+    lines = []
+    for family in families:
+        if family.samples:
+            lines.extend(family.format())
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+def get_docker_latency():
+    """
+    Get the latency histograms of the DockerHelper operations of all of the
+    commands that have run for the current project
+
+    Returns:
+        dict, of the names of the operations, and their Histogram
+    """
+    latency = {}
+    for operation, hist_dict in get_state_store().get(LATENCY_STATE_KEY, default={}).items():
+        try:
+            latency[operation] = Histogram.from_dict(hist_dict)
+        except (KeyError, TypeError, ValueError):
+            continue
+    return latency
+
+def save_docker_latency(docker_helper, logger=None):
+    """
+    Add the latency histograms of a DockerHelper to the ones kept for the
+    current project, and start its histograms over. Failing to save them
+    never fails the command, so errors are only logged
+
+    Args:
+        docker_helper: DockerHelper, whose histograms to save
+        logger: Logger object to use for log messages
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Metrics')
+    if not docker_helper.latency:
+        return
+    latency = docker_helper.latency
+    docker_helper.latency = {}
+    def add_latency(saved):
+        """
+        Add the histograms to the saved ones
+        """
+        saved = saved or {}
+        for operation, histogram in latency.items():
+            try:
+                saved_hist = Histogram.from_dict(saved[operation])
+                saved_hist.merge(histogram)
+            except (KeyError, TypeError, ValueError):
+                saved_hist = histogram
+            saved[operation] = saved_hist.to_dict()
+        return saved
+    try:
+        get_state_store().modify(LATENCY_STATE_KEY, add_latency)
+    except (sqlite3.Error, IOError, OSError) as exc:
+        log.warning("Failed saving the latency of docker operations: %s", exc)
+
+def get_textfile_name():
+    """
+    Get the name of the current project's file in a node_exporter textfile
+    directory. The name includes a hash of the project's root, so projects
+    with the same directory name don't overwrite each other
+
+    Returns:
+        str
+    """
+    return 'devlab_{}_{}{}'.format(
+        os.path.basename(devlab_bench.PROJ_ROOT.rstrip('/')) or 'root',
+        hashlib.sha1(devlab_bench.PROJ_ROOT.encode('utf-8')).hexdigest()[:8],
+        TEXTFILE_SUFFIX
+    )
+
+def write_textfile(text, textfile_dir, name):
+    """
+    Write metrics to a node_exporter textfile directory. The file is written
+    under a temporary name and then renamed, so that node_exporter never reads
+    a partially written file
+
+    Args:
+        text: str, of the metrics
+        textfile_dir: str, path to the directory
+        name: str, name of the file
+
+    Returns:
+        str, the path of the file
+    """
+    path = os.path.join(textfile_dir, name)
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=textfile_dir, prefix='.{}.'.format(name))
+    try:
+        with os.fdopen(tmp_fd, 'w') as tmp_file:
+            tmp_file.write(text)
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return path
@@ -0,0 +1,295 @@
+"""
+Helpers for managing copy-on-write persistence layers for components.
+
+A component with 'persistence_layer' set gets its persistence directory split
+into a read-only seed layer, which is captured once after the component is
+first provisioned, and the data the component writes afterwards. Resetting the
+component then only has to drop what was written on top of the seed:
+
+    overlay: The component's directory is an overlayfs mount of the seed
+        (lowerdir) and a per-run upper layer. Dropping the upper layer is
+        just a remount. This requires devlab to be running as root on Linux.
+    reflink: The component's directory is a reflink clone of the seed. On
+        filesystems that support it (btrfs, xfs, zfs, apfs...) cloning is
+        instant regardless of the data size. Other filesystems fall back to
+        a regular copy.
+"""
+import logging
+import os
+import platform
+import sys
+
+import devlab_bench
+from devlab_bench.helpers.command import Command
+from devlab_bench.helpers.common import get_config
+from devlab_bench.helpers.privileged import run_batch
+from devlab_bench.helpers.trash import move_to_trash, new_trash_batch
+
+LAYERS_DIR = '.devlab_layers'
+LAYER_MODES = ('overlay', 'reflink')
+
+###-- Functions --###
+def get_layer_paths(comp):
+    """
+    Get the paths used for a component's persistence layers
+
+    Args:
+        comp: str, name of the component
+
+    Returns:
+        dict with the keys:
+            'data': The component's persistence directory
+            'root': The directory holding all the layers for the component
+            'seed': The read-only seed (lower) layer
+            'upper': The per-run upper layer (overlay mode only)
+            'work': The overlayfs work directory (overlay mode only)
+            'mode_file': File recording the mode the seed was created with
+    """
+    config = get_config()
+    comp_pers = '{}/{}'.format(devlab_bench.PROJ_ROOT, config['paths']['component_persistence'])
+    layer_root = '{}/{}/{}'.format(comp_pers, LAYERS_DIR, comp)
+    return {
+        'data': '{}/{}'.format(comp_pers, comp),
+        'root': layer_root,
+        'seed': '{}/seed'.format(layer_root),
+        'upper': '{}/upper'.format(layer_root),
+        'work': '{}/work'.format(layer_root),
+        'mode_file': '{}/mode'.format(layer_root)
+    }
+
+def get_layer_mode(comp):
+    """
+    Get the mode that a component's seed layer was created with
+
+    Args:
+        comp: str, name of the component
+
+    Returns:
+        str, one of LAYER_MODES or None if the component has no seed layer yet
+    """
+    mode_file = get_layer_paths(comp)['mode_file']
+    if os.path.isfile(mode_file):
+        with open(mode_file) as mfile:
+            mode = mfile.read().strip()
+        if mode in LAYER_MODES:
+            return mode
+    return None
+
+def overlay_supported():
+    """
+    Determine if overlay persistence layers can be used by this process
+
+    Returns:
+        bool
+    """
+    return 'linux' in sys.platform.lower() and os.geteuid() == 0
+
+def clone_cmd(src, dst):
+    """
+    Generate the command for cloning the directory 'src' to 'dst' using
+    reflinks if the filesystem supports them, or a regular copy if not
+
+    Args:
+        src: str, path of the directory to clone
+        dst: str, path of the destination. This must not already exist
+
+    Returns:
+        list of str
+    """
+    if platform.system() == 'Darwin':
+        #APFS clonefile(2) support
+        return ['/bin/cp', '-c', '-R', '-p', src, dst]
+    return [
+        '/bin/sh',
+        '-c',
+        'cp -a --reflink=always "$0" "$1" 2>/dev/null || { rm -rf "$1" && cp -a "$0" "$1"; }',
+        src,
+        dst
+    ]
+
+def mount_overlay(comp, logger=None):
+    """
+    Mount the overlay for a component's persistence directory, if it isn't
+    already mounted
+
+    Args:
+        comp: str, name of the component
+        logger: Logger object to use for log messages
+
+    Returns:
+        bool, whether the overlay is mounted
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Persistence')
+    lpaths = get_layer_paths(comp)
+    if os.path.ismount(lpaths['data']):
+        return True
+    for ldir in (lpaths['data'], lpaths['upper'], lpaths['work']):
+        if not os.path.isdir(ldir):
+            os.makedirs(ldir)
+    log.debug("Mounting overlay persistence layers for component: %s", comp)
+    mnt_ret = Command(
+        'mount',
+        [
+            '-t', 'overlay', 'overlay',
+            '-o', 'lowerdir={seed},upperdir={upper},workdir={work}'.format(**lpaths),
+            lpaths['data']
+        ],
+        use_shell=True,
+        logger=log
+    ).run()
+    return mnt_ret[0] == 0
+
+def unmount_overlay(comp, logger=None):
+    """
+    Unmount the overlay of a component's persistence directory if it is
+    mounted
+
+    Args:
+        comp: str, name of the component
+        logger: Logger object to use for log messages
+
+    Returns:
+        bool, whether the persistence directory is no longer mounted
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Persistence')
+    lpaths = get_layer_paths(comp)
+    if not os.path.ismount(lpaths['data']):
+        return True
+    log.debug("Unmounting overlay persistence layers for component: %s", comp)
+    return Command('umount', [lpaths['data']], use_shell=True, logger=log).run()[0] == 0
+
+def ensure_layer(comp, logger=None):
+    """
+    Make sure that a component's persistence layers are in place before the
+    component is started. This is mostly for remounting overlays after a
+    reboot of the host
+
+    Args:
+        comp: str, name of the component
+        logger: Logger object to use for log messages
+
+    Returns:
+        bool, False if the layers could not be put in place
+    """
+    if get_layer_mode(comp) == 'overlay':
+        return mount_overlay(comp, logger=logger)
+    return True
+
+def seal_layer(comp, mode, logger=None):
+    """
+    Capture a component's current persistence directory as its read-only seed
+    layer. The component's container must be stopped while this happens
+
+    Args:
+        comp: str, name of the component
+        mode: str, one of LAYER_MODES
+        logger: Logger object to use for log messages
+
+    Returns:
+        bool, whether the seed layer was created
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Persistence')
+    lpaths = get_layer_paths(comp)
+    if mode not in LAYER_MODES:
+        log.error("Unknown persistence_layer: '%s' for component: %s. Valid values are: %s", mode, comp, ', '.join(LAYER_MODES))
+        return False
+    if mode == 'overlay' and not overlay_supported():
+        log.warning("Overlay persistence layers need devlab to run as root on Linux. Using 'reflink' layers for component: %s instead", comp)
+        mode = 'reflink'
+    if not os.path.isdir(lpaths['data']):
+        os.makedirs(lpaths['data'])
+    if not os.path.isdir(lpaths['root']):
+        os.makedirs(lpaths['root'])
+    log.info("Creating the seed persistence layer for component: %s", comp)
+    if mode == 'overlay':
+        os.rename(lpaths['data'], lpaths['seed'])
+        if not mount_overlay(comp, logger=log):
+            log.error("Failed mounting overlay persistence layers for component: %s", comp)
+            os.rename(lpaths['seed'], lpaths['data'])
+            return False
+    else:
+        clone_errors = run_batch([{'op': 'run', 'cmd': clone_cmd(lpaths['data'], lpaths['seed'])}], name=comp, logger=log)
+        if clone_errors:
+            log.error("Failed creating the seed persistence layer for component: %s", comp)
+            return False
+    with open(lpaths['mode_file'], 'w') as mfile:
+        mfile.write(mode)
+    return True
+
+def drop_layer(comp, logger=None):
+    """
+    Reset a component's persistence directory back to its seed layer, by
+    dropping everything that was written since the seed was created. The
+    component's container must be stopped while this happens
+
+    Args:
+        comp: str, name of the component
+        logger: Logger object to use for log messages
+
+    Returns:
+        bool, whether the persistence directory was reset
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Persistence')
+    lpaths = get_layer_paths(comp)
+    mode = get_layer_mode(comp)
+    log.info("Resetting component: %s to its seed persistence layer", comp)
+    if mode == 'overlay':
+        if not unmount_overlay(comp, logger=log):
+            log.error("Failed unmounting overlay persistence layers for component: %s", comp)
+            return False
+        if move_to_trash([lpaths['upper'], lpaths['work']], logger=log):
+            return False
+        return mount_overlay(comp, logger=log)
+    #Moving the old data into the trash and cloning the seed back is handed to
+    #the privileged helper as a single batch
+    drop_ops = []
+    if os.path.lexists(lpaths['data']):
+        drop_ops.append({'op': 'rename', 'src': lpaths['data'], 'dst': '{}/{}'.format(new_trash_batch(), comp)})
+    drop_ops.append({'op': 'run', 'cmd': clone_cmd(lpaths['seed'], lpaths['data'])})
+    drop_errors = run_batch(
+        drop_ops,
+        name=comp,
+        stop_on_error=True,
+        logger=log
+    )
+    for error in drop_errors.values():
+        log.error("Failed resetting the persistence directory of component: %s: %s", comp, error)
+    return not drop_errors
+
+def remove_layers(comp, logger=None):
+    """
+    Remove all of a component's persistence layers including the seed, so that
+    a new seed is captured the next time the component is provisioned
+
+    Args:
+        comp: str, name of the component
+        logger: Logger object to use for log messages
+
+    Returns:
+        bool, whether the layers were removed
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Persistence')
+    lpaths = get_layer_paths(comp)
+    if not os.path.isdir(lpaths['root']):
+        return True
+    log.info("Removing persistence layers for component: %s", comp)
+    if get_layer_mode(comp) == 'overlay':
+        if not unmount_overlay(comp, logger=log):
+            log.error("Failed unmounting overlay persistence layers for component: %s", comp)
+            return False
+    return not move_to_trash([lpaths['root']], logger=log)
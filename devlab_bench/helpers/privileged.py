@@ -0,0 +1,253 @@
+"""
+Helpers for modifying files that are owned by root inside of a project.
+
+Files written by containers are usually owned by root, so when devlab isn't
+running as root on Linux it can't remove them itself. Instead of re-running
+devlab inside of a container, the operations that need root are batched up and
+handed to a single short-lived devlab_helper container, while everything else
+keeps running in the calling process.
+
+Operations are dicts with one of the following formats:
+    {'op': 'remove', 'path': PATH}: Remove a file or directory
+    {'op': 'rename', 'src': PATH, 'dst': PATH}: Rename a file or directory
+    {'op': 'run', 'cmd': [ARG, ...]}: Run a command
+"""
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+
+import devlab_bench
+import devlab_bench.helpers.docker
+from devlab_bench.helpers.command import Command
+from devlab_bench.helpers.common import quote
+
+HELPER_IMAGE = 'devlab_helper:latest'
+HELPER_PROJ_ROOT = '/devlab'
+HELPER_LIB_DIR = '/usr/lib/devlab'
+HELPER_RESULT_PREFIX = 'DEVLAB_PRIVILEGED_RESULTS:'
+
+###-- Functions --###
+def needs_privileged():
+    """
+    Determine if operations on root owned files have to be handed to a helper
+    container
+
+    Returns:
+        bool
+    """
+    return 'linux' in sys.platform.lower() and os.geteuid() != 0
+
+def to_helper_path(path):
+    """
+    Convert a path in the project to where it is mounted in the helper
+    container
+
+    Args:
+        path: str, of the path to convert
+
+    Returns:
+        str of the converted path, or None if the path is outside of the project
+    """
+    path = os.path.normpath(path)
+    if path == devlab_bench.PROJ_ROOT:
+        return HELPER_PROJ_ROOT
+    if path.startswith('{}/'.format(devlab_bench.PROJ_ROOT)):
+        return '{}{}'.format(HELPER_PROJ_ROOT, path[len(devlab_bench.PROJ_ROOT):])
+    return None
+
+def op_path(operation):
+    """
+    Get the path an operation's errors should be reported against
+
+    Args:
+        operation: dict, of the operation
+
+    Returns:
+        str
+    """
+    if operation['op'] == 'rename':
+        return operation['src']
+    if operation['op'] == 'run':
+        return ' '.join(operation['cmd'])
+    return operation['path']
+
+def apply_ops(operations, stop_on_error=False):
+    """
+    Perform a list of operations in the current process
+
+    Args:
+        operations: list of dicts, of the operations to perform
+        stop_on_error: bool, whether to skip the rest of the operations after
+            one fails
+
+    Returns:
+        list, with an entry for every operation, which is None if it succeeded
+        or a str of the error if it didn't
+    """
+    results = []
+    for operation in operations:
+        if stop_on_error and any(results):
+            results.append('Skipped because of an earlier error')
+            continue
+        try:
+            if operation['op'] == 'remove':
+                if os.path.isdir(operation['path']) and not os.path.islink(operation['path']):
+                    shutil.rmtree(operation['path'])
+                elif os.path.lexists(operation['path']):
+                    os.remove(operation['path'])
+            elif operation['op'] == 'rename':
+                os.rename(operation['src'], operation['dst'])
+            elif operation['op'] == 'run':
+                proc = subprocess.Popen(operation['cmd'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                out = proc.communicate()[0]
+                if proc.returncode != 0:
+                    results.append('Exited with rc: {}: {}'.format(proc.returncode, out.decode('utf-8', 'replace').strip()))
+                    continue
+            else:
+                results.append("Unknown operation: '{}'".format(operation['op']))
+                continue
+        except (OSError, ValueError) as exc:
+            results.append(str(exc))
+            continue
+        results.append(None)
+    return results
+
+def helper_main():
+    """
+    Entry point used inside of the helper container. The operations are passed
+    as JSON in the first argument, and the results are written to stdout
+    """
+    batch = json.loads(sys.argv[1])
+    results = apply_ops(batch['operations'], stop_on_error=batch['stop_on_error'])
+    sys.stdout.write('{}{}\n'.format(HELPER_RESULT_PREFIX, json.dumps(results)))
+
+def run_batch(operations, name, stop_on_error=False, logger=None):
+    """
+    Perform a batch of operations on files that may be owned by root. If
+    devlab is running as root, or isn't on Linux, the operations are performed
+    directly, otherwise they are all handed to a single helper container with
+    the project's root mounted.
+
+    Args:
+        operations: list of dicts, of the operations to perform
+        name: str, used for naming the helper container
+        stop_on_error: bool, whether to skip the rest of the operations after
+            one fails
+        logger: Logger object to use for log messages
+
+    Returns:
+        dict, of the paths whose operation failed, where the values are the
+        error messages
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Privileged')
+    errors = {}
+    if not operations:
+        return errors
+    if not needs_privileged():
+        results = apply_ops(operations, stop_on_error=stop_on_error)
+        for idx, result in enumerate(results):
+            if result:
+                errors[op_path(operations[idx])] = result
+        return errors
+    helper_ops = []
+    helper_idx = []
+    for idx, operation in enumerate(operations):
+        helper_op = dict(operation)
+        if operation['op'] == 'run':
+            helper_op['cmd'] = [arg.replace(devlab_bench.PROJ_ROOT, HELPER_PROJ_ROOT) for arg in operation['cmd']]
+        else:
+            for key in ('path', 'src', 'dst'):
+                if key not in operation:
+                    continue
+                helper_op[key] = to_helper_path(operation[key])
+                if not helper_op[key]:
+                    errors[op_path(operation)] = "Path: '{}' is outside of the project's root".format(operation[key])
+                    break
+        if op_path(operation) in errors:
+            if stop_on_error:
+                break
+            continue
+        helper_ops.append(helper_op)
+        helper_idx.append(idx)
+    if not helper_ops:
+        return errors
+    log.debug("Running %s operation(s) inside of a helper container", len(helper_ops))
+    helper_ret = devlab_bench.helpers.docker.DOCKER.run_container(
+        image=HELPER_IMAGE,
+        name='devlab-privileged-{}-{}'.format(name, os.getpid()),
+        mounts=[
+            '{}:{}'.format(devlab_bench.PROJ_ROOT, HELPER_PROJ_ROOT),
+            '{}:{}/devlab_bench:ro'.format(devlab_bench.DEVLAB_BENCH_ROOT, HELPER_LIB_DIR)
+        ],
+        env={'PYTHONPATH': HELPER_LIB_DIR},
+        run_opts=['--rm', '--workdir', HELPER_LIB_DIR],
+        background=False,
+        interactive=False,
+        cmd=' '.join([
+            'python3',
+            '-c',
+            quote('from devlab_bench.helpers.privileged import helper_main; helper_main()'),
+            quote(json.dumps({'operations': helper_ops, 'stop_on_error': stop_on_error}))
+        ]),
+        ignore_nonzero_rc=True,
+        logger=log
+    )
+    results = None
+    for line in helper_ret[1]:
+        if line.startswith(HELPER_RESULT_PREFIX):
+            results = json.loads(line[len(HELPER_RESULT_PREFIX):])
+    if results is None:
+        log.error("Helper container failed to report results for its operations: %s", ' '.join(helper_ret[1]))
+        results = ['Helper container failed'] * len(helper_ops)
+    for idx, result in enumerate(results):
+        if result:
+            errors[op_path(operations[helper_idx[idx]])] = result
+    return errors
+
+def run_privileged(cmd, name, background=False, logger=None):
+    """
+    Run a command that needs to be able to modify files owned by root inside
+    of the project. If devlab is running as root, or isn't on Linux, the
+    command runs directly on the host, otherwise it runs inside of a
+    devlab_helper container with the project's root mounted.
+
+    Args:
+        cmd: list of str, the command and its arguments
+        name: str, used for naming the helper container
+        background: bool, whether to return without waiting for the command
+            to finish
+        logger: Logger object to use for log messages
+
+    Returns:
+        tuple where:
+            First Element is the return code of the command
+            Second Element is a list of str of the output
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Privileged')
+    if not needs_privileged():
+        if background:
+            subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+            return (0, [])
+        return Command(cmd[0], cmd[1:], logger=log).run()
+    cont_cmd = [arg.replace(devlab_bench.PROJ_ROOT, HELPER_PROJ_ROOT) for arg in cmd]
+    return devlab_bench.helpers.docker.DOCKER.run_container(
+        image=HELPER_IMAGE,
+        name='devlab-privileged-{}-{}'.format(name, os.getpid()),
+        mounts=[
+            '{}:{}'.format(devlab_bench.PROJ_ROOT, HELPER_PROJ_ROOT)
+        ],
+        run_opts=['--rm'],
+        background=background,
+        interactive=False,
+        cmd=' '.join([quote(arg) for arg in cont_cmd]),
+        logger=log
+    )
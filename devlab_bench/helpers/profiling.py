@@ -0,0 +1,428 @@
+"""
+Profiling of a devlab action, for attaching to performance bug reports.
+
+When profiling is enabled (with 'devlab --profile' or $DEVLAB_PROFILE), the
+action is run under cProfile and tracemalloc, and the time taken by each
+import and by every command run through Command is recorded. Everything is
+written to a new timestamped directory when devlab exits:
+
+    profile.pstats  - the cProfile stats, for pstats, snakeviz etc...
+    functions.txt   - functions sorted by cumulative time
+    imports.txt     - the time taken by each import, like 'python -X importtime'
+    memory.txt      - where the memory still allocated at the end came from
+    commands.txt    - the commands that were run, grouped by command
+    trace.json      - the trace of the run (see devlab_bench.helpers.trace)
+    summary.txt     - the top entries of each of the above, which is also
+                      printed when devlab exits
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+
+PROFILE_ENV = 'DEVLAB_PROFILE'
+PROFILE_DIR_DEF = '~/.devlab/profiles'
+PROFILE_TOP_DEF = 20
+PROFILE_TRACEMALLOC_FRAMES = 10
+PROFILER = None
+
+###-- Classes --###
+class Profiler(object):
+    """
+    Profiles a devlab action, and writes out the results
+    """
+    def __init__(self, profile_dir, top=PROFILE_TOP_DEF, import_times=None, logger=None):
+        """
+        Initialize the Profiler Object
+
+        Args:
+            profile_dir: str, path of the directory to write the results to.
+                It is created if it doesn't exist
+            top: int, the number of entries of each kind to include in the
+                summary
+            import_times: list of tuples, of the imports that have been timed
+                so far, like: (module, self_seconds, cumulative_seconds, depth)
+                in the order the imports finished. It can keep growing while
+                profiling
+            logger: Logger object to use for log messages
+        """
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger('Profiler')
+        self.profile_dir = profile_dir
+        self.top = top
+        self.import_times = import_times if import_times is not None else []
+        self.profile = cProfile.Profile()
+        self.start = None
+        self.end = None
+        self.cpu_start = None
+        self.cpu_end = None
+        self.memory_snapshot = None
+        self.memory_peak = 0
+    def start_profiling(self):
+        """
+        Start profiling
+        """
+        if not os.path.isdir(self.profile_dir):
+            os.makedirs(self.profile_dir)
+        self.start = time.time()
+        self.cpu_start = time.process_time()
+        tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+        self.profile.enable()
+    def stop_profiling(self):
+        """
+        Stop profiling
+        """
+        self.profile.disable()
+        self.end = time.time()
+        self.cpu_end = time.process_time()
+        self.memory_snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>')
+        ))
+        self.memory_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    def get_function_stats(self, top=None):
+        """
+        Get the functions that took the most time, as formatted by pstats
+
+        Args:
+            top: int, the number of functions to include. Default is all
+
+        Returns:
+            str
+        """
+        stats_out = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=stats_out)
+        stats.sort_stats('cumulative')
+        if top:
+            stats.print_stats(top)
+        else:
+            stats.print_stats()
+        return stats_out.getvalue()
+    def get_command_stats(self, spans):
+        """
+        Group the commands that were run by the command, and (sub)command
+        they ran, like 'docker ps'
+
+        Args:
+            spans: list of dicts, of the spans of the run, as returned by
+                devlab_bench.helpers.trace.get_spans
+
+        Returns:
+            list of dicts with the keys: 'command', 'count', 'total' and
+            'max', sorted by the total time
+        """
+        commands = {}
+        for cmd_span in spans:
+            if cmd_span['cat'] != 'command':
+                continue
+            argv = [str(arg) for arg in cmd_span['args'].get('argv', [])]
+            if not argv:
+                continue
+            cmd_name = os.path.basename(argv[0])
+            sub_cmds = [arg for arg in argv[1:] if not arg.startswith('-')]
+            if sub_cmds:
+                cmd_name = '{} {}'.format(cmd_name, sub_cmds[0])
+            duration = cmd_span['dur'] / 1000000.0
+            if cmd_name not in commands:
+                commands[cmd_name] = {
+                    'command': cmd_name,
+                    'count': 0,
+                    'total': 0.0,
+                    'max': 0.0
+                }
+            commands[cmd_name]['count'] += 1
+            commands[cmd_name]['total'] += duration
+            commands[cmd_name]['max'] = max(commands[cmd_name]['max'], duration)
+        return sorted(commands.values(), key=lambda cmd: cmd['total'], reverse=True)
+    def format_imports(self):
+        """
+        Format the time taken by each import, in the same layout as 'python -X
+        importtime'
+
+        Returns:
+            str
+        """
+        lines = ['import time: self [us] | cumulative | imported package']
+        for module, self_time, cumulative, depth in self.import_times:
+            lines.append('import time: {:>9} | {:>10} | {}{}'.format(int(self_time * 1000000), int(cumulative * 1000000), '  ' * depth, module))
+        return '\n'.join(lines) + '\n'
+    def format_memory(self, top=None):
+        """
+        Format where the memory that was still allocated at the end of the
+        run came from
+
+        Args:
+            top: int, the number of locations to include. Default is all
+
+        Returns:
+            str
+        """
+        lines = ['Peak traced memory: {:.1f} KiB'.format(self.memory_peak / 1024.0)]
+        for stat in self.memory_snapshot.statistics('traceback')[:top]:
+            lines.append('')
+            lines.append('{:.1f} KiB in {} block(s)'.format(stat.size / 1024.0, stat.count))
+            lines.extend(stat.traceback.format())
+        return '\n'.join(lines) + '\n'
+    def format_summary(self, spans):
+        """
+        Format a summary of the top entries of each kind of result
+
+        Args:
+            spans: list of dicts, of the spans of the run
+
+        Returns:
+            str
+        """
+        wall_time = self.end - self.start
+        commands = self.get_command_stats(spans)
+        cmd_total = sum(cmd['total'] for cmd in commands)
+        lines = [
+            '## PROFILE ##',
+            'Results: {}'.format(self.profile_dir),
+            'Wall time: {:.3f}s CPU time: {:.3f}s Peak traced memory: {:.1f} KiB'.format(wall_time, self.cpu_end - self.cpu_start, self.memory_peak / 1024.0),
+            'Commands run: {} taking: {:.3f}s ({:.0f}% of the wall time)'.format(
+                sum(cmd['count'] for cmd in commands),
+                cmd_total,
+                100.0 * cmd_total / wall_time if wall_time else 0
+            ),
+            'Imports timed: {} taking: {:.3f}s'.format(
+                len(self.import_times),
+                sum(imp[2] for imp in self.import_times if imp[3] == 0)
+            )
+        ]
+        lines += format_table(
+            'TOP {} COMMANDS BY TOTAL TIME'.format(self.top),
+            {
+                'command': 'Command',
+                'count': 'Count',
+                'total': 'Total',
+                'max': 'Max'
+            },
+            "| {command:^40} | {count:^7} | {total:^9} | {max:^9} |",
+            "| {command:40} | {count:>7} | {total:>9} | {max:>9} |",
+            [
+                {
+                    'command': cmd['command'][:40],
+                    'count': cmd['count'],
+                    'total': '{:.3f}s'.format(cmd['total']),
+                    'max': '{:.3f}s'.format(cmd['max'])
+                } for cmd in commands[:self.top]
+            ]
+        )
+        stats = pstats.Stats(self.profile)
+        functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+        lines += format_table(
+            'TOP {} FUNCTIONS BY CUMULATIVE TIME'.format(self.top),
+            {
+                'function': 'Function',
+                'calls': 'Calls',
+                'tottime': 'Own',
+                'cumtime': 'Cumulative'
+            },
+            "| {function:^70} | {calls:^9} | {tottime:^9} | {cumtime:^10} |",
+            "| {function:70} | {calls:>9} | {tottime:>9} | {cumtime:>10} |",
+            [
+                {
+                    'function': format_function(func)[-70:],
+                    'calls': func_stats[1],
+                    'tottime': '{:.3f}s'.format(func_stats[2]),
+                    'cumtime': '{:.3f}s'.format(func_stats[3])
+                } for func, func_stats in functions[:self.top]
+            ]
+        )
+        imports = sorted(self.import_times, key=lambda imp: imp[1], reverse=True)
+        lines += format_table(
+            'TOP {} IMPORTS BY OWN TIME'.format(self.top),
+            {
+                'module': 'Module',
+                'self': 'Own',
+                'cumulative': 'Cumulative'
+            },
+            "| {module:^50} | {self:^9} | {cumulative:^10} |",
+            "| {module:50} | {self:>9} | {cumulative:>10} |",
+            [
+                {
+                    'module': imp[0][:50],
+                    'self': '{:.3f}s'.format(imp[1]),
+                    'cumulative': '{:.3f}s'.format(imp[2])
+                } for imp in imports[:self.top]
+            ]
+        )
+        lines += format_table(
+            'TOP {} ALLOCATIONS STILL HELD AT EXIT'.format(self.top),
+            {
+                'location': 'Location',
+                'size': 'Size',
+                'count': 'Blocks'
+            },
+            "| {location:^70} | {size:^11} | {count:^8} |",
+            "| {location:70} | {size:>11} | {count:>8} |",
+            [
+                {
+                    'location': '{}:{}'.format(stat.traceback[0].filename, stat.traceback[0].lineno)[-70:],
+                    'size': '{:.1f} KiB'.format(stat.size / 1024.0),
+                    'count': stat.count
+                } for stat in self.memory_snapshot.statistics('lineno')[:self.top]
+            ]
+        )
+        return '\n'.join(lines) + '\n'
+    def write(self, spans):
+        """
+        Write the results to the profile directory
+
+        Args:
+            spans: list of dicts, of the spans of the run
+
+        Returns:
+            str, of the summary
+        """
+        self.profile.dump_stats(os.path.join(self.profile_dir, 'profile.pstats'))
+        commands = self.get_command_stats(spans)
+        cmd_lines = ['{:>7} {:>10} {:>10}  {}'.format('Count', 'Total', 'Max', 'Command')]
+        for cmd in commands:
+            cmd_lines.append('{:>7} {:>9.3f}s {:>9.3f}s  {}'.format(cmd['count'], cmd['total'], cmd['max'], cmd['command']))
+        summary = self.format_summary(spans)
+        for file_name, content in (
+                ('functions.txt', self.get_function_stats()),
+                ('imports.txt', self.format_imports()),
+                ('memory.txt', self.format_memory()),
+                ('commands.txt', '\n'.join(cmd_lines) + '\n'),
+                ('summary.txt', summary)
+            ):
+            with open(os.path.join(self.profile_dir, file_name), 'w') as out_file:
+                out_file.write(content)
+        return summary
+
+###-- Functions --###
+def format_function(func):
+    """
+    Format a function's key from pstats, like 'file.py:12(name)'
+
+    Args:
+        func: tuple, of the file name, line number and function name
+
+    Returns:
+        str
+    """
+    file_name, line_no, func_name = func
+    if file_name == '~':
+        return func_name
+    return '{}:{}({})'.format(file_name, line_no, func_name)
+
+def format_table(title, header, header_format, row_format, rows):
+    """
+    Format a table in the same style as the other devlab tables
+
+    Args:
+        title: str, title of the table
+        header: dict, of the column headers
+        header_format: str, format for the header row
+        row_format: str, format for the other rows
+        rows: list of dicts, of the rows
+
+    Returns:
+        list of str, of the lines of the table
+    """
+    table_width = len(header_format.format(**header))
+    table_bar = '{{:-<{}}}'.format(table_width)
+    table = [
+        '',
+        '## {} ##'.format(title),
+        table_bar.format(''),
+        header_format.format(**header),
+        table_bar.format('')
+    ]
+    for row in rows:
+        table.append(row_format.format(**row))
+    table.append(table_bar.format(''))
+    return table
+
+def get_profile_base_dir(profile=False, profile_dir=None):
+    """
+    Get the directory to create the profile's directory in, if profiling is
+    enabled by the --profile argument, or by $DEVLAB_PROFILE. $DEVLAB_PROFILE
+    can be set to '1' to use the default directory, or to a path
+
+    Args:
+        profile: bool, whether profiling was enabled with --profile
+        profile_dir: str, the directory passed with --profile-dir
+
+    Returns:
+        str, or None if profiling isn't enabled
+    """
+    profile_env = os.environ.get(PROFILE_ENV, '')
+    if profile_env in ('', '0') and not profile:
+        return None
+    if profile_dir:
+        return profile_dir
+    if profile_env.lower() in ('', '1', 'true', 'yes'):
+        return PROFILE_DIR_DEF
+    return profile_env
+
+def get_profile_dir(base_dir, action):
+    """
+    Get a new timestamped directory to write the results of profiling an
+    action to
+
+    Args:
+        base_dir: str, path of the directory to create it in
+        action: str, name of the action being profiled
+
+    Returns:
+        str
+    """
+    return os.path.join(
+        os.path.abspath(os.path.expanduser(base_dir)),
+        'devlab-{}-{}-{}'.format(action, time.strftime('%Y%m%d-%H%M%S'), os.getpid())
+    )
+
+def start_profiling(base_dir, action, top=PROFILE_TOP_DEF, import_times=None, logger=None):
+    """
+    Start profiling the action
+
+    Args:
+        base_dir: str, path of the directory to create the profile's
+            directory in
+        action: str, name of the action being profiled
+        top: int, the number of entries of each kind to include in the
+            summary
+        import_times: list of tuples, of the imports that have been timed
+        logger: Logger object to use for log messages
+
+    Returns:
+        str, the path of the profile's directory
+    """
+    global PROFILER #pylint: disable=global-statement
+    PROFILER = Profiler(get_profile_dir(base_dir, action), top=top, import_times=import_times, logger=logger)
+    PROFILER.start_profiling()
+    return PROFILER.profile_dir
+
+def stop_profiling(spans):
+    """
+    Stop profiling, write out the results, and print the summary to stderr
+
+    Args:
+        spans: list of dicts, of the spans of the run, as returned by
+            devlab_bench.helpers.trace.get_spans
+    """
+    global PROFILER #pylint: disable=global-statement
+    if PROFILER is None:
+        return
+    profiler = PROFILER
+    PROFILER = None
+    profiler.stop_profiling()
+    try:
+        summary = profiler.write(spans)
+    except (IOError, OSError) as exc:
+        profiler.log.error("Failed writing profile to: '%s': %s", profiler.profile_dir, exc)
+        return
+    sys.stderr.write(summary)
+    sys.stderr.flush()
@@ -0,0 +1,346 @@
+"""
+Recording and replaying of the calls that devlab makes to the docker engine.
+
+When recording, every engine call that is run through Command is written to a
+JSON lines file, with its arguments, output, return code and how long it
+took. When replaying, the engine isn't run at all, and every call is answered
+from a recording instead, either after as long as the call took when it was
+recorded, or instantly. That separates devlab's own overhead from the
+engine's, and lets a slow run from one machine be reproduced on another, so
+the project's root in arguments and output is replaced by a placeholder.
+"""
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+import devlab_bench
+
+RECORDING_VERSION = 1
+PROJ_ROOT_PLACEHOLDER = '{DEVLAB_PROJ_ROOT}'
+REPLAY_SPEEDS = ('recorded', 'instant')
+#Engine commands that have subcommands, like 'docker image pull'
+ENGINE_SUBCOMMANDS = ('container', 'image', 'network', 'volume', 'system')
+RECORDING = None
+
+###-- Classes --###
+class EngineRecording(object):
+    """
+    A recording of engine calls, that is either being written or replayed
+    """
+    def __init__(self, path, engine_paths, replay=False, speed='recorded', argv=None, logger=None):
+        """
+        Initialize the EngineRecording Object
+
+        Args:
+            path: str, path to the recording
+            engine_paths: tuple, of the paths that the engine's binary is
+                looked for in. Commands run with these paths are engine calls
+            replay: bool, whether to replay the recording, instead of writing
+                a new one
+            speed: str, one of REPLAY_SPEEDS. Whether replayed calls take as
+                long as they did when they were recorded, or no time at all
+            argv: list, of the arguments devlab was run with, which are
+                saved in a new recording
+            logger: Logger object to use for log messages
+
+        Raises:
+            IOError/OSError if the recording can't be opened
+            ValueError if the recording to replay isn't valid
+        """
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger('EngineRecording')
+        self.path = path
+        self.engine_paths = tuple(engine_paths)
+        self.replaying = replay
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.calls = []
+        self.by_args = {}
+        self.by_name = {}
+        self.used = set()
+        self.engine_path = self.engine_paths[0]
+        self.config_written = False
+        self.counts = {
+            'recorded': 0,
+            'replayed': 0,
+            'approximate': 0,
+            'missing': 0
+        }
+        if replay:
+            self.file = None
+            self._load()
+        else:
+            self.file = open(path, 'w')
+            self._write({
+                'type': 'header',
+                'version': RECORDING_VERSION,
+                'started': self.start,
+                'argv': argv or []
+            })
+    def _load(self):
+        """
+        Load the calls of a recording to replay
+        """
+        with open(self.path) as rec_file:
+            for line_num, line in enumerate(rec_file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    raise ValueError("Line {} of recording: '{}' isn't valid JSON".format(line_num, self.path))
+                if entry.get('type') == 'header' and entry.get('version') != RECORDING_VERSION:
+                    raise ValueError("Recording: '{}' is version: {}, but only version: {} is supported".format(self.path, entry.get('version'), RECORDING_VERSION))
+                if entry.get('type') != 'call':
+                    continue
+                if not self.calls:
+                    self.engine_path = entry['path']
+                call_idx = len(self.calls)
+                self.calls.append(entry)
+                self.by_args.setdefault(json.dumps(entry['args']), collections.deque()).append(call_idx)
+                self.by_name.setdefault(get_call_name(entry['args']), collections.deque()).append(call_idx)
+        self.log.debug("Loaded %s engine calls to replay from: '%s'", len(self.calls), self.path)
+    def _write(self, entry):
+        """
+        Write an entry to the recording
+        """
+        self.file.write('{}\n'.format(json.dumps(entry)))
+        self.file.flush()
+    def handles(self, command):
+        """
+        Determine if a command is an engine call
+
+        Args:
+            command: Command object
+
+        Returns:
+            bool
+        """
+        if isinstance(command.path, (list, tuple)):
+            return tuple(command.path) == self.engine_paths
+        return command.path in self.engine_paths
+    def record(self, command, start, duration):
+        """
+        Record an engine call that has finished running
+
+        Args:
+            command: Command object, of the call
+            start: float, epoch time the call started at
+            duration: float, seconds the call took
+        """
+        with self.lock:
+            if not self.config_written and devlab_bench.CONFIG:
+                self._write({
+                    'type': 'config',
+                    'config': normalize(devlab_bench.CONFIG),
+                    'files': get_project_files(devlab_bench.CONFIG)
+                })
+                self.config_written = True
+            self._write({
+                'type': 'call',
+                'path': command.real_path,
+                'args': normalize([str(arg) for arg in command.args]),
+                'rc': command.proc.returncode,
+                'stdout': normalize(command.stdout),
+                'stderr': normalize(command.stderr),
+                'interactive': command.interactive,
+                'start': start - self.start,
+                'duration': duration
+            })
+            self.counts['recorded'] += 1
+    def _take_call(self, args):
+        """
+        Find the recorded call to answer a call with. A call with the same
+        arguments is used if there is one, else the next call of the same
+        engine command, like 'ps' or 'image inspect'
+
+        Args:
+            args: list, of the call's normalized arguments
+
+        Returns:
+            tuple where:
+                First Element is the dict of the recorded call, or None
+                Second Element is a bool of whether the arguments matched
+        """
+        with self.lock:
+            for pool, pool_key in ((self.by_args, json.dumps(args)), (self.by_name, get_call_name(args))):
+                call_idxs = pool.get(pool_key, None)
+                while call_idxs:
+                    call_idx = call_idxs.popleft()
+                    if call_idx not in self.used:
+                        self.used.add(call_idx)
+                        return (self.calls[call_idx], pool is self.by_args)
+        return (None, False)
+    def replay(self, command):
+        """
+        Answer an engine call from the recording, filling in the command's
+        stdout and stderr as if it had run
+
+        Args:
+            command: Command object, of the call
+
+        Returns:
+            int, the return code of the call
+        """
+        args = normalize([str(arg) for arg in command.args])
+        command.real_path = self.engine_path
+        call, exact = self._take_call(args)
+        if call is None:
+            self.counts['missing'] += 1
+            self.log.error("There is no engine call left in the recording to answer: '%s %s'", self.engine_path, ' '.join(command.args))
+            command.stderr = ['No recorded engine call for: {}'.format(' '.join(args))]
+            return 1
+        if exact:
+            self.counts['replayed'] += 1
+        else:
+            self.counts['approximate'] += 1
+            self.log.debug("Replaying engine call: '%s' for: '%s'", ' '.join(call['args']), ' '.join(args))
+        if self.speed == 'recorded':
+            time.sleep(call['duration'])
+        command.stdout = denormalize(call['stdout'])
+        command.stderr = denormalize(call['stderr'])
+        if command.log_output:
+            for line in command.stdout:
+                command.log.info(line)
+            for line in command.stderr:
+                command.log.warning(line)
+        return call['rc']
+    def close(self):
+        """
+        Finish the recording, and log how it went
+        """
+        if self.file:
+            self.file.close()
+            self.file = None
+            self.log.debug("Recorded %s engine calls to: '%s'", self.counts['recorded'], self.path)
+            return
+        self.log.debug("Replayed %s engine calls exactly, and %s approximately", self.counts['replayed'], self.counts['approximate'])
+        if self.counts['approximate']:
+            self.log.warning("%s engine calls didn't match a recorded call exactly, so were answered with the next call of the same command", self.counts['approximate'])
+        if self.counts['missing']:
+            self.log.warning("%s engine calls couldn't be answered from the recording", self.counts['missing'])
+        self.log.debug("%s recorded engine calls were never made", len(self.calls) - len(self.used))
+
+###-- Functions --###
+def get_call_name(args):
+    """
+    Get the name of the engine command that a call is for, like 'ps' or
+    'image pull'
+
+    Args:
+        args: list, of the call's arguments
+
+    Returns:
+        str
+    """
+    if not args:
+        return ''
+    if args[0] in ENGINE_SUBCOMMANDS and len(args) > 1:
+        return '{} {}'.format(args[0], args[1])
+    return args[0]
+
+def get_project_files(config):
+    """
+    Get the contents of the files in the project that the config points to,
+    and that devlab reads, like the Dockerfiles of runtime images, so that a
+    recording has everything needed to replay it in a new directory
+
+    Args:
+        config: dict, of the project's config
+
+    Returns:
+        dict, of the paths relative to the project's root, and the contents
+    """
+    paths = [image_config.get('docker_file', '') for image_config in config.get('runtime_images', {}).values()]
+    for comp_config in list(config.get('components', {}).values()) + [config.get('foreground_component', {})]:
+        paths.append(comp_config.get('env_file', ''))
+    files = {}
+    for path in paths:
+        if not path or os.path.isabs(path):
+            continue
+        try:
+            with open(os.path.join(devlab_bench.PROJ_ROOT, path)) as proj_file:
+                files[path] = proj_file.read()
+        except (IOError, OSError, UnicodeDecodeError):
+            continue
+    return files
+
+def normalize(value):
+    """
+    Replace the project's root with PROJ_ROOT_PLACEHOLDER in a value that is
+    going into a recording
+
+    Args:
+        value: str, or list/dict of them
+
+    Returns:
+        the normalized value
+    """
+    if not devlab_bench.PROJ_ROOT:
+        return value
+    return json.loads(json.dumps(value).replace(json.dumps(devlab_bench.PROJ_ROOT)[1:-1], PROJ_ROOT_PLACEHOLDER))
+
+def denormalize(value):
+    """
+    Replace PROJ_ROOT_PLACEHOLDER with the project's root in a value that
+    came from a recording
+
+    Args:
+        value: str, or list/dict of them
+
+    Returns:
+        the denormalized value
+    """
+    return json.loads(json.dumps(value).replace(PROJ_ROOT_PLACEHOLDER, json.dumps(devlab_bench.PROJ_ROOT or '')[1:-1]))
+
+def get_recording():
+    """
+    Get the recording that is being written or replayed
+
+    Returns:
+        EngineRecording, or None
+    """
+    return RECORDING
+
+def start_recording(path, engine_paths, argv=None, logger=None):
+    """
+    Start recording engine calls
+
+    Args:
+        path: str, path to write the recording to
+        engine_paths: tuple, of the paths that the engine's binary is looked
+            for in
+        argv: list, of the arguments devlab was run with
+        logger: Logger object to use for log messages
+    """
+    global RECORDING #pylint: disable=global-statement
+    RECORDING = EngineRecording(path, engine_paths, argv=argv, logger=logger)
+
+def start_replay(path, engine_paths, speed='recorded', logger=None):
+    """
+    Start answering engine calls from a recording
+
+    Args:
+        path: str, path to the recording
+        engine_paths: tuple, of the paths that the engine's binary is looked
+            for in
+        speed: str, one of REPLAY_SPEEDS
+        logger: Logger object to use for log messages
+    """
+    global RECORDING #pylint: disable=global-statement
+    RECORDING = EngineRecording(path, engine_paths, replay=True, speed=speed, logger=logger)
+
+def stop_recording():
+    """
+    Stop recording or replaying engine calls
+    """
+    global RECORDING #pylint: disable=global-statement
+    if RECORDING:
+        RECORDING.close()
+        RECORDING = None
@@ -0,0 +1,392 @@
+"""
+Helpers for managing post-provision snapshots of components.
+
+A snapshot is an image committed from a component's container right after its
+provisioning 'scripts' have succeeded. It is keyed by a hash of the base image,
+the component's scripts and the inputs that are mounted into the container, so
+that the next time the component's container has to be created devlab can start
+it directly from the snapshot and skip the scripts.
+
+Snapshot images are named and labeled with a hash of the project's root, so
+that checkouts of the same project in different directories never start from,
+list or garbage collect each other's snapshots.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+import devlab_bench
+import devlab_bench.helpers.docker
+from devlab_bench.helpers.common import get_config
+from devlab_bench.helpers.docker import docker_obj_status
+from devlab_bench.helpers.locks import project_lock
+
+SNAPSHOT_LABEL = 'com.lab.snapshot'
+SNAPSHOT_IMAGE_PREFIX = 'devlab_snapshot_'
+SNAPSHOT_INDEX_FILE = 'devlab_snapshots.json'
+SNAPSHOT_KEEP_DEF = 5
+#Directories that should never be part of the fingerprint of mounted inputs
+SNAPSHOT_IGNORE_DIRS = ('.git', '.hg', '.svn', '__pycache__')
+
+###-- Functions --###
+def get_project_hash():
+    """
+    Generate the hash of the project's root, that the project's snapshots
+    are scoped to
+
+    Returns:
+        str, the first 12 characters of the hex digest
+    """
+    return hashlib.sha256(os.path.realpath(devlab_bench.PROJ_ROOT).encode('utf-8')).hexdigest()[:12]
+
+def get_snapshot_prefix():
+    """
+    Get the prefix of the names of the current project's snapshot images
+
+    Returns:
+        str
+    """
+    return '{}{}_'.format(SNAPSHOT_IMAGE_PREFIX, get_project_hash())
+
+def get_snapshot_image(comp, key):
+    """
+    Generate the image name and tag of a component's snapshot
+
+    Args:
+        comp: str, name of the component
+        key: str, the snapshot key generated by get_snapshot_key
+
+    Returns:
+        str, in the format IMAGE:TAG
+    """
+    return '{}{}:{}'.format(get_snapshot_prefix(), comp.lower(), key[:16])
+
+def get_snapshot_index_path():
+    """
+    Get the path to the file that keeps track of when snapshots were created
+    and last used
+
+    Returns:
+        str
+    """
+    config = get_config()
+    return '{}/{}/{}'.format(devlab_bench.PROJ_ROOT, config['paths'].get('component_persistence', ''), SNAPSHOT_INDEX_FILE)
+
+def get_snapshot_index():
+    """
+    Load the snapshot index
+
+    Returns:
+        dict, where the keys are the snapshot image names, and the values are
+        dicts with the keys: 'component', 'key', 'created', 'last_used'
+    """
+    index_path = get_snapshot_index_path()
+    if os.path.isfile(index_path):
+        with open(index_path) as ifile:
+            try:
+                return json.load(ifile)
+            except ValueError:
+                logging.getLogger('Snapshot').warning("Snapshot index: '%s' is corrupt, ignoring it", index_path)
+    return {}
+
+def save_snapshot_index(index):
+    """
+    Write out the snapshot index. It is written under a temporary name and
+    then renamed, so that it is never read partially written. Changes to the
+    index should be made holding the project lock, so that runs on other
+    components don't lose them
+
+    Args:
+        index: dict, of the snapshot index (See get_snapshot_index)
+    """
+    index_path = get_snapshot_index_path()
+    index_dir = os.path.dirname(index_path)
+    if not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=index_dir, prefix='.{}.'.format(SNAPSHOT_INDEX_FILE))
+    try:
+        with os.fdopen(tmp_fd, 'w') as ifile:
+            json.dump(index, ifile, indent=4, sort_keys=True)
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, index_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def get_mount_sources(comp_config):
+    """
+    Find the paths on the host that are mounted into a component
+
+    Args:
+        comp_config: dict, of the component's configuration
+
+    Returns:
+        list of str, of absolute paths
+    """
+    sources = []
+    for mount in comp_config.get('mounts', []):
+        src = mount.split(':')[0]
+        if not src.startswith('/'):
+            src = '{}/{}'.format(devlab_bench.PROJ_ROOT, src)
+        sources.append(os.path.normpath(src))
+    return sources
+
+def fingerprint_path(path, exclude=None):
+    """
+    Generate a fingerprint of a path using the name, size and modification time
+    of every file under it. The content of the files is not read, so this is
+    cheap even for larger trees.
+
+    Args:
+        path: str, the file or directory to fingerprint
+        exclude: list of str, absolute paths whose subtrees should be skipped
+
+    Returns:
+        str, hex digest of the fingerprint
+    """
+    fprint = hashlib.sha256()
+    exclude = [os.path.normpath(epath) for epath in exclude or []]
+    if os.path.isfile(path):
+        fstat = os.stat(path)
+        fprint.update('{}|{}|{}'.format(os.path.basename(path), fstat.st_size, fstat.st_mtime).encode('utf-8'))
+        return fprint.hexdigest()
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(
+            dname for dname in dirs if dname not in SNAPSHOT_IGNORE_DIRS and os.path.join(root, dname) not in exclude
+        )
+        for fname in sorted(files):
+            fpath = os.path.join(root, fname)
+            try:
+                fstat = os.lstat(fpath)
+            except OSError:
+                continue
+            fprint.update('{}|{}|{}\n'.format(os.path.relpath(fpath, path), fstat.st_size, fstat.st_mtime).encode('utf-8'))
+    return fprint.hexdigest()
+
+def get_snapshot_key(comp, comp_config, logger=None):
+    """
+    Generate the key for a component's snapshot. The key changes whenever the
+    base image, the provisioning scripts, the environment, or any of the inputs
+    mounted into the component change.
+
+    Mounted paths that live inside of the project's component_persistence
+    directory are considered to be outputs of the component, and are NOT part
+    of the key.
+
+    Args:
+        comp: str, name of the component
+        comp_config: dict, of the component's configuration
+        logger: Logger object to use for log messages
+
+    Returns:
+        str, hex digest of the key
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Snapshot')
+    config = get_config()
+    persistence_dir = os.path.normpath('{}/{}'.format(devlab_bench.PROJ_ROOT, config['paths'].get('component_persistence', '')))
+    image_id = comp_config['image']
+    image_details = devlab_bench.helpers.docker.DOCKER.inspect_image(comp_config['image'])
+    if image_details:
+        image_id = image_details[0]['Id']
+    key_parts = {
+        'component': comp,
+        'image_id': image_id,
+        'pre_scripts': comp_config.get('pre_scripts', []),
+        'scripts': comp_config.get('scripts', []),
+        'env': comp_config.get('env', {}),
+        'mounts': {}
+    }
+    for src in get_mount_sources(comp_config):
+        if src == persistence_dir or src.startswith('{}/'.format(persistence_dir)):
+            log.debug("Skipping persistent mount: '%s' when generating the snapshot key for component: %s", src, comp)
+            continue
+        if not os.path.exists(src):
+            key_parts['mounts'][src] = None
+            continue
+        key_parts['mounts'][src] = fingerprint_path(src, exclude=[persistence_dir])
+    key = hashlib.sha256(json.dumps(key_parts, sort_keys=True).encode('utf-8')).hexdigest()
+    log.debug("Snapshot key for component: %s is: %s", comp, key)
+    return key
+
+def find_snapshot(comp, key, logger=None):
+    """
+    Look for an existing snapshot for a component matching 'key'. If one is
+    found, it is marked as used for the sake of the LRU policy
+
+    Args:
+        comp: str, name of the component
+        key: str, the snapshot key generated by get_snapshot_key
+        logger: Logger object to use for log messages
+
+    Returns:
+        str of the snapshot image if found, else None
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Snapshot')
+    snap_image = get_snapshot_image(comp, key)
+    snap_status = docker_obj_status(snap_image, 'image', devlab_bench.helpers.docker.DOCKER, logger=log)[0]
+    if not snap_status['owned']:
+        log.debug("No snapshot: '%s' found for component: %s", snap_image, comp)
+        return None
+    with project_lock(logger=log):
+        index = get_snapshot_index()
+        index.setdefault(snap_image, {
+            'component': comp,
+            'key': key,
+            'created': time.time()
+        })
+        index[snap_image]['last_used'] = time.time()
+        save_snapshot_index(index)
+    return snap_image
+
+def create_snapshot(comp, key, container, logger=None):
+    """
+    Commit a component's container to a snapshot image, and invalidate any
+    other snapshots for the component
+
+    Args:
+        comp: str, name of the component
+        key: str, the snapshot key generated by get_snapshot_key
+        container: str, name of the container to commit
+        logger: Logger object to use for log messages
+
+    Returns:
+        bool, whether the snapshot was created successfully
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Snapshot')
+    snap_image = get_snapshot_image(comp, key)
+    log.info("Creating post-provision snapshot: '%s' for component: %s", snap_image, comp)
+    commit_ret = devlab_bench.helpers.docker.DOCKER.commit_container(
+        name=container,
+        image=snap_image,
+        labels=[
+            '{}=true'.format(SNAPSHOT_LABEL),
+            '{}.component={}'.format(SNAPSHOT_LABEL, comp),
+            '{}.key={}'.format(SNAPSHOT_LABEL, key),
+            '{}.project={}'.format(SNAPSHOT_LABEL, get_project_hash())
+        ]
+    )
+    if commit_ret[0] != 0:
+        log.error("Failed creating snapshot: '%s' for component: %s", snap_image, comp)
+        return False
+    with project_lock(logger=log):
+        index = get_snapshot_index()
+        index[snap_image] = {
+            'component': comp,
+            'key': key,
+            'created': time.time(),
+            'last_used': time.time()
+        }
+        save_snapshot_index(index)
+    invalidate_snapshots(comp, keep_key=key, logger=log)
+    gc_snapshots(logger=log)
+    return True
+
+def list_snapshots():
+    """
+    List the snapshots that exist for the current project
+
+    Returns:
+        list of dicts, sorted from most recently used to least with the keys:
+            'image', 'component', 'key', 'created', 'last_used'
+    """
+    index = get_snapshot_index()
+    snap_prefix = get_snapshot_prefix()
+    images_ret = devlab_bench.helpers.docker.DOCKER.get_images(label='{}.project={}'.format(SNAPSHOT_LABEL, get_project_hash()))
+    snapshots = []
+    if images_ret[0] != 0:
+        return snapshots
+    for snap_image in images_ret[1]:
+        if not snap_image.startswith(snap_prefix):
+            continue
+        snap_details = dict(index.get(snap_image, {}))
+        if 'component' not in snap_details:
+            snap_details['component'] = snap_image.split(':')[0][len(snap_prefix):]
+        snap_details.setdefault('key', snap_image.split(':')[-1])
+        snap_details.setdefault('created', 0)
+        snap_details.setdefault('last_used', snap_details['created'])
+        snap_details['image'] = snap_image
+        snapshots.append(snap_details)
+    snapshots.sort(key=lambda snap: snap['last_used'], reverse=True)
+    return snapshots
+
+def remove_snapshot(snap_image, logger=None):
+    """
+    Remove a snapshot image, and drop it from the index
+
+    Args:
+        snap_image: str, of the snapshot image to remove
+        logger: Logger object to use for log messages
+
+    Returns:
+        bool, whether the snapshot was removed successfully
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Snapshot')
+    log.info("Removing snapshot: '%s'", snap_image)
+    rm_ret = devlab_bench.helpers.docker.DOCKER.rm_image(snap_image)
+    if rm_ret[0] != 0:
+        log.error("Failed removing snapshot: '%s'", snap_image)
+        return False
+    with project_lock(logger=log):
+        index = get_snapshot_index()
+        if snap_image in index:
+            del index[snap_image]
+            save_snapshot_index(index)
+    return True
+
+def invalidate_snapshots(comp, keep_key=None, logger=None):
+    """
+    Remove all snapshots for a component, except for the one matching keep_key
+
+    Args:
+        comp: str, name of the component
+        keep_key: str, the snapshot key that is still valid (OPTIONAL)
+        logger: Logger object to use for log messages
+    """
+    for snap in list_snapshots():
+        if snap['component'] != comp:
+            continue
+        if keep_key and snap['image'] == get_snapshot_image(comp, keep_key):
+            continue
+        remove_snapshot(snap['image'], logger=logger)
+
+def gc_snapshots(keep=None, logger=None):
+    """
+    Remove the least recently used snapshots, so that at most 'keep' snapshots
+    are left for the project
+
+    Args:
+        keep: int, the number of snapshots to keep. Default is the
+            'snapshot_keep' value of the devlab config
+        logger: Logger object to use for log messages
+
+    Returns:
+        list of str, of the snapshot images that were removed
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Snapshot')
+    if keep is None:
+        keep = get_config().get('snapshot_keep', SNAPSHOT_KEEP_DEF)
+    removed = []
+    snapshots = list_snapshots()
+    for snap in snapshots[keep:]:
+        log.debug("Snapshot: '%s' was last used at: %s, and is over the limit of %s snapshots", snap['image'], snap['last_used'], keep)
+        if remove_snapshot(snap['image'], logger=log):
+            removed.append(snap['image'])
+    return removed
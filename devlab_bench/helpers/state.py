@@ -0,0 +1,241 @@
+"""
+Transactional store for the runtime state of a devlab project.
+
+The state is kept in a small SQLite database in the project's persistence
+directory, so that concurrent devlab commands only ever change the keys they
+are working on instead of rewriting all of the state. Values are stored as
+JSON, so they keep their types (ints, bools, dicts...) when read back.
+
+State is grouped into scopes. The 'project' scope holds project wide values
+like 'HOST_IP' and 'BIND_TO_HOST', and every component has a scope of its own
+name for things like its 'pid', 'spec_hash' and timings.
+"""
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+import devlab_bench
+from devlab_bench.helpers.common import get_config, get_env_from_file
+
+STATE_DB_FILE = 'devlab_state.db'
+STATE_LOCK_TIMEOUT = 30
+PROJECT_SCOPE = 'project'
+
+STATE_STORES = {}
+
+###-- Classes --###
+class StateStore(object):
+    """
+    Key/Value store for a project's runtime state, backed by SQLite
+    """
+    def __init__(self, path, timeout=STATE_LOCK_TIMEOUT, logger=None):
+        """
+        Initialize the StateStore Object
+
+        Args:
+            path: str, path to the SQLite database. It is created if it
+                doesn't exist
+            timeout: int, seconds to wait for another process's transaction
+                to finish before giving up
+            logger: Logger object to use for log messages
+        """
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger('StateStore')
+        self.path = path
+        state_dir = os.path.dirname(path)
+        if state_dir and not os.path.isdir(state_dir):
+            os.makedirs(state_dir)
+        self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.transaction() as cur:
+            cur.execute(
+                'CREATE TABLE IF NOT EXISTS state ('
+                'scope TEXT NOT NULL, '
+                'key TEXT NOT NULL, '
+                'value TEXT, '
+                'updated REAL NOT NULL, '
+                'PRIMARY KEY (scope, key))'
+            )
+            cur.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+    @contextmanager
+    def transaction(self):
+        """
+        Context manager for running statements in a single write transaction.
+        The transaction is committed when the block exits, or rolled back if
+        it raises an exception
+
+        Yields:
+            sqlite3.Cursor
+        """
+        cur = self.conn.cursor()
+        cur.execute('BEGIN IMMEDIATE')
+        try:
+            yield cur
+        except BaseException:
+            cur.execute('ROLLBACK')
+            raise
+        cur.execute('COMMIT')
+    def get(self, key, scope=PROJECT_SCOPE, default=None):
+        """
+        Get a value from the store
+
+        Args:
+            key: str, the key to look up
+            scope: str, the scope of the key
+            default: value to return if the key doesn't exist
+
+        Returns:
+            The value
+        """
+        row = self.conn.execute('SELECT value FROM state WHERE scope=? AND key=?', (scope, key)).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
+    def get_scope(self, scope=PROJECT_SCOPE):
+        """
+        Get all of the values of a scope
+
+        Args:
+            scope: str, the scope to get
+
+        Returns:
+            dict
+        """
+        return {
+            key: json.loads(value) for key, value in self.conn.execute('SELECT key, value FROM state WHERE scope=?', (scope,))
+        }
+    def set(self, key, value, scope=PROJECT_SCOPE):
+        """
+        Set a value in the store
+
+        Args:
+            key: str, the key to set
+            value: Any JSON serializable value
+            scope: str, the scope of the key
+        """
+        self.update({key: value}, scope=scope)
+    def update(self, values, scope=PROJECT_SCOPE):
+        """
+        Set multiple values of a scope in a single transaction
+
+        Args:
+            values: dict, of the keys and values to set
+            scope: str, the scope of the keys
+        """
+        now = time.time()
+        with self.transaction() as cur:
+            cur.executemany(
+                'INSERT OR REPLACE INTO state (scope, key, value, updated) VALUES (?, ?, ?, ?)',
+                [(scope, key, json.dumps(value), now) for key, value in values.items()]
+            )
+    def modify(self, key, modifier, scope=PROJECT_SCOPE, default=None):
+        """
+        Change a value in the store based on its current value, in a single
+        transaction, so that concurrent commands don't lose each other's
+        changes
+
+        Args:
+            key: str, the key to change
+            modifier: function, that is passed the current value (or default
+                if the key doesn't exist) and returns the new value
+            scope: str, the scope of the key
+            default: value to pass to modifier if the key doesn't exist
+
+        Returns:
+            The new value
+        """
+        with self.transaction() as cur:
+            row = cur.execute('SELECT value FROM state WHERE scope=? AND key=?', (scope, key)).fetchone()
+            value = modifier(default if row is None else json.loads(row[0]))
+            cur.execute(
+                'INSERT OR REPLACE INTO state (scope, key, value, updated) VALUES (?, ?, ?, ?)',
+                (scope, key, json.dumps(value), time.time())
+            )
+        return value
+    def delete(self, key, scope=PROJECT_SCOPE):
+        """
+        Remove a key from the store
+
+        Args:
+            key: str, the key to remove
+            scope: str, the scope of the key
+        """
+        with self.transaction() as cur:
+            cur.execute('DELETE FROM state WHERE scope=? AND key=?', (scope, key))
+    def migrate_env_file(self, env_file, components):
+        """
+        One-time import of the state from a devlab_up.env file written by
+        older versions of devlab. The env file is renamed afterwards so that
+        it isn't imported again
+
+        Args:
+            env_file: str, path to the env file
+            components: list of str, the names of the project's components,
+                used for finding the '<NAME>_PID' keys
+        """
+        if not os.path.isfile(env_file):
+            return
+        self.log.debug("Migrating project state from: '%s'", env_file)
+        up_env = get_env_from_file(env_file)
+        comp_keys = dict(('{}_PID'.format(comp.upper()), comp) for comp in components)
+        with self.transaction() as cur:
+            if cur.execute("SELECT value FROM meta WHERE key='migrated_env_file'").fetchone():
+                return
+            now = time.time()
+            for key, value in up_env.items():
+                if key in comp_keys:
+                    try:
+                        cur.execute(
+                            'INSERT OR REPLACE INTO state (scope, key, value, updated) VALUES (?, ?, ?, ?)',
+                            (comp_keys[key], 'pid', json.dumps(int(value)), now)
+                        )
+                    except ValueError:
+                        self.log.warning("Ignoring invalid pid: '%s' for component: %s in: '%s'", value, comp_keys[key], env_file)
+                    continue
+                cur.execute(
+                    'INSERT OR REPLACE INTO state (scope, key, value, updated) VALUES (?, ?, ?, ?)',
+                    (PROJECT_SCOPE, key, json.dumps(value), now)
+                )
+            cur.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_env_file', ?)", (env_file,))
+        os.rename(env_file, '{}.migrated'.format(env_file))
+    def close(self):
+        """
+        Close the connection to the database
+        """
+        self.conn.close()
+
+###-- Functions --###
+def get_state_path():
+    """
+    Get the path to the project's state database
+
+    Returns:
+        str
+    """
+    config = get_config()
+    return '{}/{}/{}'.format(devlab_bench.PROJ_ROOT, config['paths'].get('component_persistence', ''), STATE_DB_FILE)
+
+def get_state_store():
+    """
+    Get the StateStore for the current project, migrating the state of an
+    existing devlab_up.env file into it the first time
+
+    Returns:
+        StateStore
+    """
+    state_path = os.path.normpath(get_state_path())
+    if state_path not in STATE_STORES:
+        state = StateStore(state_path)
+        config = get_config()
+        components = list(config.get('components', {}).keys())
+        if 'foreground_component' in config:
+            components.append(config['foreground_component']['name'])
+        state.migrate_env_file(devlab_bench.UP_ENV_FILE, components)
+        STATE_STORES[state_path] = state
+    return STATE_STORES[state_path]
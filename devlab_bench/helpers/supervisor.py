@@ -0,0 +1,274 @@
+"""
+Helpers for supervising 'type: host' components.
+
+Each host component is started by a small detached supervisor process, which
+runs the component's command in its own process group and captures its
+stdout/stderr to a rotating log file under the project's persistence directory.
+Stopping a component signals its whole process group, and waits for it to exit
+using a pidfd where the platform supports it, so that components which exit
+promptly are stopped right away instead of after a fixed polling interval.
+"""
+import errno
+import logging
+import logging.handlers
+import os
+import select
+import shlex
+import signal
+import subprocess
+import time
+
+import devlab_bench
+from devlab_bench.helpers.common import get_config, quote
+from devlab_bench.helpers.locks import close_inherited_locks
+
+HOST_LOG_DIR = '.devlab_logs'
+HOST_LOG_MAX_BYTES = 10 * 1024 * 1024
+HOST_LOG_BACKUPS = 3
+STOP_GRACE_DEF = 5
+KILL_GRACE = 3
+
+###-- Functions --###
+def get_host_log_path(comp):
+    """
+    Get the path to the log file of a host component
+
+    Args:
+        comp: str, name of the component
+
+    Returns:
+        str
+    """
+    config = get_config()
+    return '{}/{}/{}/{}.log'.format(devlab_bench.PROJ_ROOT, config['paths'].get('component_persistence', ''), HOST_LOG_DIR, comp)
+
+def signal_host_component(pid, sig):
+    """
+    Send a signal to the process group of a host component. Components that
+    were started in the foreground aren't the leader of their own process
+    group, so those get the signal sent to just their pid
+
+    Args:
+        pid: int, pid of the component
+        sig: int, the signal to send. 0 just checks if the component exists
+
+    Raises:
+        OSError if the component isn't running
+    """
+    try:
+        os.killpg(pid, sig)
+    except OSError as exc:
+        if exc.errno != errno.ESRCH:
+            raise
+        os.kill(pid, sig)
+
+def _proc_stat(pid):
+    """
+    Read the state and process group of a process from /proc
+
+    Args:
+        pid: int or str, the pid of the process
+
+    Returns:
+        tuple of (state, pgid), or None if the process doesn't exist
+    """
+    try:
+        with open('/proc/{}/stat'.format(pid)) as stat_file:
+            #The command name can contain spaces, so split after it
+            stat = stat_file.read().rsplit(')', 1)[1].split()
+    except (IOError, OSError, IndexError):
+        return None
+    return (stat[0], int(stat[2]))
+
+def host_component_running(pid):
+    """
+    Determine if a host component, or any process in its process group, is
+    still running. Where /proc is available zombies are ignored, as they may
+    never get reaped if the init process doesn't reap orphans (like when devlab
+    runs inside of a container)
+
+    Args:
+        pid: int, pid of the component
+
+    Returns:
+        bool
+    """
+    try:
+        signal_host_component(pid, 0)
+    except OSError as exc:
+        return exc.errno == errno.EPERM
+    if not os.path.isdir('/proc/self'):
+        return True
+    for proc_pid in os.listdir('/proc'):
+        if not proc_pid.isdigit():
+            continue
+        proc_stat = _proc_stat(proc_pid)
+        if proc_stat and proc_stat[1] == pid and proc_stat[0] != 'Z':
+            return True
+    #Foreground components aren't the leader of their own process group
+    proc_stat = _proc_stat(pid)
+    return bool(proc_stat) and proc_stat[0] != 'Z'
+
+def _supervise(comp, cmd, log_path, pid_pipe):
+    """
+    Body of the supervisor process. Start the component's command in a new
+    process group, report its pid back through pid_pipe, and then copy its
+    output into the component's log until it exits
+
+    Args:
+        comp: str, name of the component
+        cmd: str, the command to run
+        log_path: str, path to the component's log file
+        pid_pipe: int, file descriptor to write the component's pid to
+    """
+    comp_log = logging.getLogger('HostComponent-{}'.format(comp))
+    comp_log.propagate = False
+    comp_log.setLevel(logging.INFO)
+    for handler in list(comp_log.handlers):
+        comp_log.removeHandler(handler)
+    log_handler = logging.handlers.RotatingFileHandler(log_path, maxBytes=HOST_LOG_MAX_BYTES, backupCount=HOST_LOG_BACKUPS)
+    log_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+    comp_log.addHandler(log_handler)
+    try:
+        proc = subprocess.Popen(
+            cmd,
+            shell=True,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True
+        )
+    except OSError as exc:
+        comp_log.info("devlab: Failed starting component: %s: %s", comp, exc)
+        os.close(pid_pipe)
+        return
+    comp_log.info("devlab: Started component: %s with pid: %s", comp, proc.pid)
+    os.write(pid_pipe, '{}\n'.format(proc.pid).encode('utf-8'))
+    os.close(pid_pipe)
+    for line in iter(proc.stdout.readline, b''):
+        comp_log.info("%s", line.decode('utf-8', 'replace').rstrip('\n'))
+    proc_rc = proc.wait()
+    comp_log.info("devlab: Component: %s exited with rc: %s", comp, proc_rc)
+    log_handler.close()
+
+def start_host_component(comp, cmd, logger=None):
+    """
+    Start a host component under a detached supervisor process
+
+    Args:
+        comp: str, name of the component
+        cmd: str, the component's command
+        logger: Logger object to use for log messages
+
+    Returns:
+        tuple where:
+            First Element is 0 if the component was started, -1 if not
+            Second Element is the pid of the component, which is also the id
+                of its process group
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Supervisor')
+    log_path = get_host_log_path(comp)
+    if not os.path.isdir(os.path.dirname(log_path)):
+        os.makedirs(os.path.dirname(log_path))
+    cmd_str = ' '.join([quote(cmd_arg) for cmd_arg in shlex.split(cmd)])
+    log.debug("Starting host component: %s with command: '%s', logging to: %s", comp, cmd_str, log_path)
+    read_fd, write_fd = os.pipe()
+    sup_pid = os.fork()
+    if sup_pid == 0:
+        #Detach the supervisor from the terminal and from this process
+        os.close(read_fd)
+        close_inherited_locks()
+        os.setsid()
+        if os.fork() != 0:
+            os._exit(0) #pylint: disable=protected-access
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fdn in (0, 1, 2):
+            os.dup2(devnull, fdn)
+        try:
+            _supervise(comp, cmd_str, log_path, write_fd)
+        finally:
+            os._exit(0) #pylint: disable=protected-access
+    os.close(write_fd)
+    os.waitpid(sup_pid, 0)
+    with os.fdopen(read_fd) as pid_file:
+        comp_pid = pid_file.read().strip()
+    if not comp_pid:
+        log.error("Failed starting host component: %s. See: %s", comp, log_path)
+        return (-1, None)
+    return (0, int(comp_pid))
+
+def wait_for_exit(pid, timeout):
+    """
+    Wait for a host component's process group to exit. This uses a pidfd to
+    be woken up as soon as the group's leader exits if the platform supports
+    it, and polls for any processes left in the group after that
+
+    Args:
+        pid: int, pid of the component, which is also its process group id
+        timeout: float, the number of seconds to wait
+
+    Returns:
+        bool, whether the process group exited within the timeout
+    """
+    deadline = time.time() + timeout
+    pid_fd = None
+    if hasattr(os, 'pidfd_open'):
+        try:
+            pid_fd = os.pidfd_open(pid)
+        except OSError:
+            pid_fd = None
+    if pid_fd is not None:
+        try:
+            poller = select.poll()
+            poller.register(pid_fd, select.POLLIN)
+            poller.poll(max(0, deadline - time.time()) * 1000)
+        finally:
+            os.close(pid_fd)
+    poll_interval = 0.01
+    while host_component_running(pid):
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        time.sleep(min(poll_interval, remaining))
+        poll_interval = min(poll_interval * 2, 0.25)
+    return True
+
+def stop_host_component(comp, pid, grace_period=STOP_GRACE_DEF, logger=None):
+    """
+    Stop a host component by sending SIGTERM to its process group, and
+    SIGKILL if it is still running after the grace period
+
+    Args:
+        comp: str, name of the component
+        pid: int, pid of the component, which is also its process group id
+        grace_period: float, the number of seconds to wait after SIGTERM
+        logger: Logger object to use for log messages
+
+    Returns:
+        bool, whether the component was stopped
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Supervisor')
+    log.info("Component: %s stopping pid: %s", comp, pid)
+    try:
+        signal_host_component(pid, signal.SIGTERM)
+    except OSError:
+        log.debug("Component: %s pid: %s stopped", comp, pid)
+        return True
+    if wait_for_exit(pid, grace_period):
+        log.debug("Component: %s pid: %s stopped", comp, pid)
+        return True
+    log.warning("Component: %s pid: %s still hasn't exited after %ss. Sending KILL signal", comp, pid, grace_period)
+    try:
+        signal_host_component(pid, signal.SIGKILL)
+    except OSError:
+        return True
+    if wait_for_exit(pid, KILL_GRACE):
+        return True
+    log.error("Component: %s pid: %s won't exit even after KILL signal... Aborting!", comp, pid)
+    return False
@@ -0,0 +1,235 @@
+"""
+Tracing of where the time goes while running a devlab action.
+
+Code wraps its phases in spans, which nest, and every Command that is run
+gets a span of its own. When tracing is enabled (with 'devlab --trace
+FILE'), the spans are written to FILE when devlab exits, in the Chrome
+trace event format, which can be opened in chrome://tracing or
+https://ui.perfetto.dev. When tracing isn't enabled span() returns a shared
+object that does nothing, so spans cost next to nothing.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+TRACER = None
+
+###-- Classes --###
+class Span(object):
+    """
+    A timed span of work, recorded by a Tracer when it ends
+    """
+    def __init__(self, tracer, name, cat, args):
+        """
+        Initialize the Span Object
+
+        Args:
+            tracer: Tracer, to record the span with
+            name: str, name of the span
+            cat: str, category of the span, like 'phase' or 'command'
+            args: dict, of details about the span
+        """
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start = None
+    def __enter__(self):
+        self.start = time.time()
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is SystemExit:
+            self.args['exit_code'] = exc_value.code
+        elif exc_type is not None:
+            self.args['error'] = '{}: {}'.format(exc_type.__name__, exc_value)
+        self.tracer.add_span(self.name, self.cat, self.start, time.time(), self.args)
+    def set(self, **args):
+        """
+        Add details to the span, like the results of the work it covers
+        """
+        self.args.update(args)
+
+class NullSpan(object):
+    """
+    A span that does nothing, for when tracing isn't enabled
+    """
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+    def set(self, **args):
+        """
+        Ignore any details
+        """
+        pass
+
+class Tracer(object):
+    """
+    Collects spans, and writes them out as Chrome trace events
+    """
+    def __init__(self, path, name='devlab', logger=None):
+        """
+        Initialize the Tracer Object
+
+        Args:
+            path: str, path of the file to write the trace to, or None to
+                only keep the spans in memory
+            name: str, name to show for this process in the trace
+            logger: Logger object to use for log messages
+        """
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger('Tracer')
+        self.path = path
+        self.name = name
+        self.pid = os.getpid()
+        self.events = []
+        self.threads = {}
+        self.lock = threading.Lock()
+    def _get_tid(self):
+        """
+        Get a small, stable id for the current thread
+        """
+        ident = threading.current_thread().ident
+        if ident not in self.threads:
+            self.threads[ident] = {
+                'tid': len(self.threads) + 1,
+                'name': threading.current_thread().name
+            }
+        return self.threads[ident]['tid']
+    def add_span(self, name, cat, start, end, args):
+        """
+        Record a finished span
+
+        Args:
+            name: str, name of the span
+            cat: str, category of the span
+            start: float, epoch time the span started
+            end: float, epoch time the span ended
+            args: dict, of details about the span
+        """
+        with self.lock:
+            self.events.append({
+                'name': name,
+                'cat': cat,
+                'ph': 'X',
+                'ts': int(start * 1000000),
+                'dur': int((end - start) * 1000000),
+                'pid': self.pid,
+                'tid': self._get_tid(),
+                'args': args
+            })
+    def write(self):
+        """
+        Write the trace to its file
+        """
+        if self.path is None:
+            return
+        with self.lock:
+            events = [{
+                'name': 'process_name',
+                'ph': 'M',
+                'pid': self.pid,
+                'args': {'name': self.name}
+            }]
+            for thread in self.threads.values():
+                events.append({
+                    'name': 'thread_name',
+                    'ph': 'M',
+                    'pid': self.pid,
+                    'tid': thread['tid'],
+                    'args': {'name': thread['name']}
+                })
+            events += sorted(self.events, key=lambda event: event['ts'])
+        try:
+            with open(self.path, 'w') as trace_file:
+                json.dump(
+                    {
+                        'traceEvents': events,
+                        'displayTimeUnit': 'ms',
+                        'otherData': {
+                            'argv': sys.argv
+                        }
+                    },
+                    trace_file,
+                    default=str
+                )
+        except (IOError, OSError) as exc:
+            self.log.error("Failed writing trace to: '%s': %s", self.path, exc)
+            return
+        self.log.info("Wrote trace of %s span(s) to: '%s'", len(self.events), self.path)
+
+NULL_SPAN = NullSpan()
+
+###-- Functions --###
+def span(name, cat='phase', **args):
+    """
+    Get a span, to use as a context manager around a unit of work
+
+    Args:
+        name: str, name of the span
+        cat: str, category of the span, like 'phase' or 'command'
+        args: details about the span
+
+    Returns:
+        Span, or NULL_SPAN if tracing isn't enabled
+    """
+    if TRACER is None:
+        return NULL_SPAN
+    return Span(TRACER, name, cat, args)
+
+def add_span(name, start, end, cat='phase', **args):
+    """
+    Record a span of work that has already finished, like work done before
+    tracing was started
+
+    Args:
+        name: str, name of the span
+        start: float, epoch time the span started
+        end: float, epoch time the span ended
+        cat: str, category of the span
+        args: details about the span
+    """
+    if TRACER is None:
+        return
+    TRACER.add_span(name, cat, start, end, args)
+
+def get_spans():
+    """
+    Get the spans that have been recorded so far
+
+    Returns:
+        list of dicts, of the spans as Chrome trace events
+    """
+    if TRACER is None:
+        return []
+    with TRACER.lock:
+        return list(TRACER.events)
+
+def start_tracing(path, name='devlab', logger=None):
+    """
+    Start recording spans
+
+    Args:
+        path: str, path of the file to write the trace to, or None to only
+            keep the spans in memory, like for recording the run's history
+        name: str, name to show for this process in the trace
+        logger: Logger object to use for log messages
+    """
+    global TRACER #pylint: disable=global-statement
+    TRACER = Tracer(path, name=name, logger=logger)
+
+def stop_tracing():
+    """
+    Stop recording spans, and write the trace to its file
+    """
+    global TRACER #pylint: disable=global-statement
+    if TRACER is None:
+        return
+    tracer = TRACER
+    TRACER = None
+    tracer.write()
@@ -0,0 +1,254 @@
+"""
+Helpers for removing files in the background.
+
+Instead of waiting for large directories to be recursively deleted, paths are
+atomically renamed into a per-project trash directory, which is then purged in
+the background. Because the rename happens right away, nothing that runs after
+it can see the old data.
+"""
+import errno
+import logging
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import devlab_bench
+from devlab_bench.helpers.locks import close_inherited_locks
+from devlab_bench.helpers.privileged import needs_privileged, run_batch, run_privileged
+
+TRASH_DIR = '.devlab_trash'
+PURGE_WORKERS = 8
+
+###-- Functions --###
+def get_trash_dir():
+    """
+    Get the path to the project's trash directory
+
+    Returns:
+        str
+    """
+    return '{}/{}'.format(devlab_bench.PROJ_ROOT, TRASH_DIR)
+
+def human_size(size):
+    """
+    Convert a number of bytes to a human readable string
+
+    Args:
+        size: int, number of bytes
+
+    Returns:
+        str
+    """
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return '{:.1f}{}'.format(size, unit)
+        size /= 1024.0
+    return '{:.1f}TB'.format(size)
+
+def get_trash_size():
+    """
+    Get the amount of data that is still waiting to be purged from the trash.
+    Directories that can't be read (like ones owned by root) are skipped, so
+    this can be lower than the real amount.
+
+    Returns:
+        tuple where:
+            First Element is the size in bytes
+            Second Element is the number of entries in the trash
+    """
+    trash_dir = get_trash_dir()
+    total = 0
+    entries = 0
+    if not os.path.isdir(trash_dir):
+        return (total, entries)
+    for batch in os.listdir(trash_dir):
+        batch_path = os.path.join(trash_dir, batch)
+        try:
+            entries += len(os.listdir(batch_path))
+        except OSError:
+            continue
+        for root, dirs, files in os.walk(batch_path):
+            for fname in files + dirs:
+                try:
+                    total += os.lstat(os.path.join(root, fname)).st_blocks * 512
+                except OSError:
+                    pass
+    return (total, entries)
+
+def new_trash_batch():
+    """
+    Create a new, empty batch directory in the project's trash directory
+
+    Returns:
+        str, of the path to the batch directory
+    """
+    trash_dir = get_trash_dir()
+    if not os.path.isdir(trash_dir):
+        os.makedirs(trash_dir)
+    return tempfile.mkdtemp(prefix='{}-'.format(int(time.time())), dir=trash_dir)
+
+def move_to_trash(paths, logger=None):
+    """
+    Atomically move paths into a new batch in the project's trash directory.
+    Paths that can't be renamed into the trash (for example because they are
+    on another filesystem) are removed in the foreground instead. Anything
+    that can't be moved or removed because it is owned by root is handed to a
+    single privileged helper as one batch.
+
+    Args:
+        paths: list of str, of the files and directories to remove
+        logger: Logger object to use for log messages
+
+    Returns:
+        dict, of the paths that could not be removed, where the values are the
+        error messages
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Trash')
+    errors = {}
+    privileged_ops = []
+    trash_dir = get_trash_dir()
+    batch_dir = None
+    for idx, path in enumerate(paths):
+        path = os.path.normpath(path)
+        if not os.path.lexists(path):
+            continue
+        if trash_dir.startswith('{}/'.format(path)):
+            log.debug("Skipping path: '%s' as it contains the trash directory", path)
+            continue
+        if not batch_dir:
+            batch_dir = new_trash_batch()
+        trash_path = '{}/{}-{}'.format(batch_dir, idx, os.path.basename(path))
+        log.debug("Moving path: '%s' to the trash", path)
+        try:
+            os.rename(path, trash_path)
+            continue
+        except OSError as exc:
+            if exc.errno in (errno.EACCES, errno.EPERM) and needs_privileged():
+                privileged_ops.append({'op': 'rename', 'src': path, 'dst': trash_path})
+                continue
+            if exc.errno not in (errno.EXDEV, errno.EBUSY):
+                errors[path] = str(exc)
+                continue
+        log.debug("Path: '%s' can't be moved to the trash, removing it now", path)
+        try:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError as exc:
+            if exc.errno in (errno.EACCES, errno.EPERM) and needs_privileged():
+                privileged_ops.append({'op': 'remove', 'path': path})
+                continue
+            errors[path] = str(exc)
+    if privileged_ops:
+        errors.update(run_batch(privileged_ops, name='trash', logger=log))
+    for path, error in errors.items():
+        log.error("Failed removing path: '%s': %s", path, error)
+    return errors
+
+def purge_trash(batches=None, workers=PURGE_WORKERS):
+    """
+    Remove everything in the project's trash directory using a pool of workers.
+    The subtrees of each directory in the trash are split up between the
+    workers, so that large directories are removed in parallel
+
+    Args:
+        batches: list of str, of the names of the batches in the trash to
+            purge. Default is all of them
+        workers: int, the number of removals to run at the same time
+    """
+    trash_dir = get_trash_dir()
+    if not os.path.isdir(trash_dir):
+        return
+    if batches is None:
+        batches = os.listdir(trash_dir)
+    batches = [os.path.join(trash_dir, batch) for batch in batches]
+    entries = []
+    for batch_path in batches:
+        try:
+            entries += [os.path.join(batch_path, entry) for entry in os.listdir(batch_path)]
+        except OSError:
+            continue
+    subtrees = []
+    for path in entries:
+        if os.path.isdir(path) and not os.path.islink(path):
+            try:
+                subtrees += [os.path.join(path, entry) for entry in os.listdir(path)]
+            except OSError:
+                pass
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(_remove_path, subtrees))
+        list(pool.map(_remove_path, entries))
+        list(pool.map(_remove_path, batches))
+    try:
+        os.rmdir(trash_dir)
+    except OSError:
+        pass
+
+def _remove_path(path):
+    """
+    Remove a file or directory, ignoring any errors
+
+    Args:
+        path: str, the path to remove
+    """
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def start_purge(logger=None):
+    """
+    Start purging the project's trash directory in the background. If devlab
+    is running as root, or isn't on Linux, a detached process purges the trash,
+    otherwise the files are likely owned by root, so a detached privileged
+    helper is started to purge them.
+
+    Args:
+        logger: Logger object to use for log messages
+    """
+    if logger:
+        log = logger
+    else:
+        log = logging.getLogger('Trash')
+    trash_dir = get_trash_dir()
+    if not os.path.isdir(trash_dir):
+        return
+    #Only the batches that exist now are purged, so that a reset running at the
+    #same time can safely keep moving things into the trash
+    batches = sorted(os.listdir(trash_dir))
+    if not batches:
+        return
+    if not needs_privileged():
+        log.debug("Purging trash: '%s' in the background", trash_dir)
+        purge_pid = os.fork()
+        if purge_pid != 0:
+            os.waitpid(purge_pid, 0)
+            return
+        #Detach from the terminal and the parent process
+        close_inherited_locks()
+        os.setsid()
+        if os.fork() != 0:
+            os._exit(0) #pylint: disable=protected-access
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fdn in (0, 1, 2):
+            os.dup2(devnull, fdn)
+        try:
+            purge_trash(batches=batches)
+        finally:
+            os._exit(0) #pylint: disable=protected-access
+    log.debug("Purging trash: '%s' in the background using a helper container", trash_dir)
+    run_privileged(
+        ['/bin/rm', '-rf'] + ['{}/{}'.format(trash_dir, batch) for batch in batches],
+        name='purge',
+        background=True,
+        logger=log
+    )
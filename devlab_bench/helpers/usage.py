@@ -0,0 +1,149 @@
+"""
+Accounting of the resources used by the commands that devlab runs.
+
+Every Command that finishes reports how long it ran, the user and system CPU
+time and the peak memory of its process, and how much it wrote to stdout and
+stderr. While accounting is enabled (like with 'devlab up --stats'), those
+are added up for the component and phase that ran the command, like a
+component's 'scripts', as set by usage_scope(). Commands that are run outside
+of any scope are added up under a component and phase of None. When
+accounting isn't enabled, add_command_stats() returns straight away.
+"""
+import threading
+
+USAGE = None
+#The component and phase that the current thread is running commands for
+USAGE_SCOPE = threading.local()
+#Stats of commands that are added up
+USAGE_STATS = ('wall', 'user', 'sys', 'stdout_bytes', 'stderr_bytes')
+
+###-- Classes --###
+class ResourceUsage(object):
+    """
+    Totals of the resources used by commands, for each component and phase
+    """
+    def __init__(self):
+        """
+        Initialize the ResourceUsage Object
+        """
+        self.lock = threading.Lock()
+        self.totals = {}
+        self.order = []
+    def add(self, component, phase, stats):
+        """
+        Add the stats of a command that has finished
+
+        Args:
+            component: str, name of the component the command was run for
+            phase: str, name of the phase the command was run in
+            stats: dict, as returned by Command.get_stats()
+        """
+        key = (component, phase)
+        with self.lock:
+            if key not in self.totals:
+                self.totals[key] = dict.fromkeys(USAGE_STATS, 0)
+                self.totals[key]['commands'] = 0
+                self.totals[key]['max_rss'] = 0
+                self.order.append(key)
+            totals = self.totals[key]
+            totals['commands'] += 1
+            for stat in USAGE_STATS:
+                totals[stat] += stats[stat] or 0
+            totals['max_rss'] = max(totals['max_rss'], stats['max_rss'] or 0)
+    def get(self):
+        """
+        Get the totals so far
+
+        Returns:
+            list of dicts, in the order that each component and phase first
+            finished a command, like: {'component': str, 'phase': str,
+            'commands': int, 'wall': float, 'user': float, 'sys': float,
+            'max_rss': int, 'stdout_bytes': int, 'stderr_bytes': int}
+        """
+        usage = []
+        with self.lock:
+            for component, phase in self.order:
+                totals = dict(self.totals[(component, phase)])
+                totals['component'] = component
+                totals['phase'] = phase
+                usage.append(totals)
+        return usage
+
+class UsageScope(object):
+    """
+    Attribute the commands that the current thread runs to a component and
+    phase, until the scope is exited. A phase of None leaves the current
+    scope as it is
+    """
+    def __init__(self, component, phase):
+        """
+        Initialize the UsageScope Object
+
+        Args:
+            component: str, name of the component
+            phase: str, name of the phase
+        """
+        self.scope = (component, phase)
+        self.outer = None
+    def __enter__(self):
+        self.outer = getattr(USAGE_SCOPE, 'scope', None)
+        if self.scope[1] is not None:
+            USAGE_SCOPE.scope = self.scope
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        USAGE_SCOPE.scope = self.outer
+
+###-- Functions --###
+def usage_scope(component, phase):
+    """
+    Get a context manager, that attributes the commands run inside of it to a
+    component and phase. Scopes nest, and the innermost one wins
+
+    Args:
+        component: str, name of the component
+        phase: str, name of the phase, like 'scripts', or None to leave the
+            current scope as it is
+
+    Returns:
+        UsageScope object
+    """
+    return UsageScope(component, phase)
+
+def add_command_stats(stats):
+    """
+    Add the stats of a command that has finished to the component and phase
+    it was run for, if accounting is enabled
+
+    Args:
+        stats: dict, as returned by Command.get_stats()
+    """
+    if USAGE is None:
+        return
+    component, phase = getattr(USAGE_SCOPE, 'scope', None) or (None, None)
+    USAGE.add(component, phase, stats)
+
+def get_usage():
+    """
+    Get the totals of the resources used so far
+
+    Returns:
+        list of dicts, as returned by ResourceUsage.get(), or an empty list
+        if accounting isn't enabled
+    """
+    if USAGE is None:
+        return []
+    return USAGE.get()
+
+def start_accounting():
+    """
+    Start adding up the resources used by commands
+    """
+    global USAGE #pylint: disable=global-statement
+    USAGE = ResourceUsage()
+
+def stop_accounting():
+    """
+    Stop adding up the resources used by commands
+    """
+    global USAGE #pylint: disable=global-statement
+    USAGE = None
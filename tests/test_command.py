@@ -0,0 +1,250 @@
+"""
+Tests for devlab_bench.helpers.command
+
+Run from the root of the repository with:
+    python -m pytest tests
+or:
+    python -m unittest discover tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import devlab_bench.helpers.command #pylint: disable=wrong-import-position
+from devlab_bench.helpers.command import OUTPUT_CHUNK_SIZE, POOL_CANCELLED_RC, POOL_STOP_TIMEOUT, POOL_TIMEOUT_RC, Command, CommandPool #pylint: disable=wrong-import-position
+
+###-- Classes --###
+class CommandOutputTests(unittest.TestCase):
+    """
+    The lines that Command returns, no matter how the output is read
+    """
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='devlab_test_')
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+    def cat(self, data, stream='stdout'):
+        """
+        Run 'cat' on a file holding 'data', and get the lines that Command
+        returned for it
+
+        Args:
+            data: bytes, to write to the file
+            stream: str, 'stdout' or 'stderr', of where the output goes
+
+        Returns:
+            list of str
+        """
+        path = os.path.join(self.work_dir, 'output')
+        with open(path, 'wb') as out_file:
+            out_file.write(data)
+        if stream == 'stderr':
+            cmd = Command('/bin/sh', ['-c', 'cat "$0" >&2', path], ignore_nonzero_rc=True)
+        else:
+            cmd = Command('/bin/cat', [path])
+        cmd.run()
+        return getattr(cmd, stream)
+    def test_blank_lines_dropped(self):
+        """
+        Lines that are empty or only whitespace are dropped
+        """
+        self.assertEqual(self.cat(b'a\n\n \t\nb\n'), ['a', 'b'])
+    def test_carriage_returns_stripped(self):
+        """
+        Lines that end with a carriage return and a newline don't keep either
+        """
+        self.assertEqual(self.cat(b'a\r\nb\r\n'), ['a', 'b'])
+    def test_last_line_without_newline(self):
+        """
+        The last line is kept, even if it doesn't end with a newline
+        """
+        self.assertEqual(self.cat(b'a\nb'), ['a', 'b'])
+    def test_non_ascii_dropped(self):
+        """
+        Bytes that aren't ascii are dropped
+        """
+        self.assertEqual(self.cat('café\n'.encode('utf-8')), ['caf'])
+    def test_stderr(self):
+        """
+        stderr is split into lines the same way as stdout
+        """
+        self.assertEqual(self.cat(b'a\n\nb', stream='stderr'), ['a', 'b'])
+    def test_ansi_removed_when_not_a_tty(self):
+        """
+        Escape sequences are removed when devlab isn't writing to a TTY
+        """
+        with mock.patch.object(devlab_bench.helpers.command, 'ISATTY', False):
+            self.assertEqual(self.cat(b'\033[0;31mred\033[0m plain\n\033[1m\033[0m\n'), ['red plain'])
+    def test_ansi_reset_when_a_tty(self):
+        """
+        Lines with escape sequences get a reset at the end on a TTY
+        """
+        with mock.patch.object(devlab_bench.helpers.command, 'ISATTY', True):
+            self.assertEqual(self.cat(b'\033[0;31mred\nplain\n'), ['\033[0;31mred\033[0m', 'plain'])
+    def test_lines_longer_than_a_chunk(self):
+        """
+        Lines that are read in more than one chunk are put back together
+        """
+        long_line = 'x' * (OUTPUT_CHUNK_SIZE * 3 + 7)
+        data = '{0}\r\n\n{0}\nshort\n{0}'.format(long_line).encode('ascii')
+        self.assertEqual(self.cat(data), [long_line, long_line, 'short', long_line])
+    def test_many_lines(self):
+        """
+        Lines that are read over many chunks are all returned in order
+        """
+        expected = ['[{:06d}] line'.format(line_num) for line_num in range(50000)]
+        self.assertEqual(self.cat('\n'.join(expected).encode('ascii')), expected)
+
+class CommandStreamTests(unittest.TestCase):
+    """
+    Streaming the output of a command, and stopping it early
+    """
+    def test_lines_as_they_arrive(self):
+        """
+        Lines are yielded while the command is still running
+        """
+        cmd = Command('/bin/sh', ['-c', 'echo first; sleep 30'])
+        start = time.time()
+        for stream_name, line in cmd.stream():
+            self.assertEqual((stream_name, line), ('stdout', 'first'))
+            break
+        self.assertLess(time.time() - start, 10)
+    def test_stdout_and_stderr(self):
+        """
+        Both streams are yielded, and kept like run() does
+        """
+        cmd = Command('/bin/sh', ['-c', 'echo out; echo err >&2; printf last'])
+        lines = list(cmd.stream())
+        self.assertEqual(sorted(lines), [('stderr', 'err'), ('stdout', 'last'), ('stdout', 'out')])
+        self.assertEqual(cmd.returncode, 0)
+        self.assertEqual(cmd.stdout, ['out', 'last'])
+        self.assertEqual(cmd.stderr, ['err'])
+    def test_keep_output(self):
+        """
+        Lines aren't kept when keep_output is False
+        """
+        cmd = Command('/bin/sh', ['-c', 'echo a; echo b'])
+        self.assertEqual(list(cmd.stream(keep_output=False)), [('stdout', 'a'), ('stdout', 'b')])
+        self.assertEqual(cmd.stdout, [])
+    def test_stop_early(self):
+        """
+        Closing the generator stops the command, and closes its pipes
+        """
+        cmd = Command('/bin/sh', ['-c', 'while true; do echo y; done'])
+        lines = cmd.stream(keep_output=False)
+        self.assertEqual(next(lines), ('stdout', 'y'))
+        start = time.time()
+        lines.close()
+        self.assertLess(time.time() - start, 10)
+        self.assertIsNotNone(cmd.proc.returncode)
+        self.assertIsNotNone(cmd.returncode)
+        self.assertTrue(cmd.proc.stdout.closed)
+        self.assertTrue(cmd.proc.stderr.closed)
+    def test_hung_command(self):
+        """
+        A command that runs longer than its timeout is stopped, without
+        waiting on anything it started that still has its pipes open
+        """
+        #The timeout is in minutes
+        cmd = Command('/bin/sh', ['-c', 'echo first; sleep 30'], timeout=0.001)
+        start = time.time()
+        self.assertEqual(list(cmd.stream()), [('stdout', 'first')])
+        self.assertLess(time.time() - start, 10)
+        self.assertLess(cmd.returncode, 0)
+        cmd = Command('/bin/sh', ['-c', 'echo first; sleep 30'], timeout=0.001)
+        start = time.time()
+        self.assertEqual(cmd.run()[1], ['first'])
+        self.assertLess(time.time() - start, 10)
+
+class CommandPoolTests(unittest.TestCase):
+    """
+    Running tasks in a CommandPool, and stopping them
+    """
+    def test_results(self):
+        """
+        Every task is reported with its status, rc and output
+        """
+        pool = CommandPool()
+        pool.submit('ok', Command('/bin/echo', ['hi']))
+        pool.submit('failed', Command('/bin/sh', ['-c', 'exit 3'], ignore_nonzero_rc=True))
+        pool.submit('func', lambda: (0, ['from func']))
+        pool.submit('error', lambda: 1 / 0)
+        results = {result['name']: result for result in pool.run()}
+        self.assertEqual(sorted(results), ['error', 'failed', 'func', 'ok'])
+        self.assertEqual((results['ok']['status'], results['ok']['rc'], results['ok']['output']), ('ok', 0, ['hi']))
+        self.assertEqual((results['failed']['status'], results['failed']['rc']), ('failed', 3))
+        self.assertEqual(results['func']['output'], ['from func'])
+        self.assertEqual((results['error']['status'], results['error']['rc']), ('error', 1))
+    def test_max_workers(self):
+        """
+        No more than max_workers tasks run at the same time, and tasks with a
+        higher priority are started first
+        """
+        lock = threading.Lock()
+        running = [0, 0]
+        started = []
+        def task(name):
+            """
+            Keep track of how many tasks are running at once
+            """
+            with lock:
+                started.append(name)
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return (0, name)
+        pool = CommandPool(max_workers=2)
+        for num in range(6):
+            pool.submit('task{}'.format(num), lambda num=num: task(num), priority=num % 2)
+        self.assertEqual(len(pool.run()), 6)
+        self.assertEqual(running[1], 2)
+        self.assertEqual(sorted(started[:3]), [1, 3, 5])
+    def test_timeout(self):
+        """
+        A task that runs longer than its timeout is stopped, along with the
+        commands that it started
+        """
+        pool = CommandPool()
+        pool.submit('command', Command('/bin/sleep', ['30']), timeout=0.2)
+        pool.submit('func', lambda: Command('/bin/sleep', ['30']).run(), timeout=0.2)
+        pool.submit('quick', Command('/bin/true'), timeout=10)
+        start = time.time()
+        results = {result['name']: result for result in pool.run()}
+        #Stopped when they timed out, instead of killed later on
+        self.assertLess(time.time() - start, POOL_STOP_TIMEOUT)
+        for name in ('command', 'func'):
+            self.assertEqual((results[name]['status'], results[name]['rc']), ('timeout', POOL_TIMEOUT_RC))
+        self.assertEqual(results['quick']['status'], 'ok')
+    def test_cancel(self):
+        """
+        Cancelling stops the running tasks, and reports the ones that never
+        started without running them
+        """
+        pool = CommandPool(max_workers=1)
+        pool.submit('running', Command('/bin/sleep', ['30']))
+        pool.submit('pending', Command('/bin/sleep', ['30']))
+        #The results of the tasks that never started are returned by cancel()
+        never_started = []
+        timer = threading.Timer(0.3, lambda: never_started.extend(pool.cancel()))
+        timer.start()
+        start = time.time()
+        try:
+            results = {result['name']: result for result in pool.run() + never_started}
+        finally:
+            timer.cancel()
+        self.assertLess(time.time() - start, POOL_STOP_TIMEOUT)
+        self.assertEqual(sorted(results), ['pending', 'running'])
+        for result in results.values():
+            self.assertEqual((result['status'], result['rc']), ('cancelled', POOL_CANCELLED_RC))
+        self.assertEqual(results['pending']['duration'], 0)
+
+if __name__ == '__main__':
+    unittest.main()